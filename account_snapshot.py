@@ -0,0 +1,124 @@
+import threading
+import time
+
+from config import ACCOUNT_SNAPSHOT_TTL_SECONDS
+
+
+class PositionDetails:
+    """
+    持倉查詢結果: 方向 (long/short/None)、數量字串、positionId 與未實現盈虧。
+
+    可依序解包為四個值，與原本的四元組用法相同。查詢失敗時 unrealized_pnl 為 None，確定無持倉時為 0.0；
+    這兩種情況共用 UNKNOWN_POSITION / FLAT_POSITION，無持倉的 tick 不建立新物件 (共用實例不可修改)。
+    """
+    __slots__ = ("side", "qty", "position_id", "unrealized_pnl")
+
+    def __init__(self, side, qty, position_id, unrealized_pnl):
+        self.side = side
+        self.qty = qty
+        self.position_id = position_id
+        self.unrealized_pnl = unrealized_pnl
+
+    def __iter__(self):
+        yield self.side
+        yield self.qty
+        yield self.position_id
+        yield self.unrealized_pnl
+
+    def __repr__(self):
+        return f"PositionDetails(side={self.side}, qty={self.qty}, position_id={self.position_id}, unrealized_pnl={self.unrealized_pnl})"
+
+
+FLAT_POSITION = PositionDetails(None, None, None, 0.0)
+UNKNOWN_POSITION = PositionDetails(None, None, None, None)
+
+
+class AccountSnapshot:
+    """
+    帳戶狀態 (餘額、持倉) 的短期快照。
+
+    同一個 tick 內的倉位計算、信號判斷與 Discord 通知共用同一份查詢結果：
+    在 ttl 秒內重複讀取直接返回快照，同時發生的讀取只會發出一次請求。
+    下單、設置或修改止盈止損後呼叫 invalidate()，下一次讀取即重新查詢；
+    失效前已發出、失效後才返回的查詢結果不會寫入快照。
+    """
+
+    def __init__(self, ttl=ACCOUNT_SNAPSHOT_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries = {}  # key -> (查詢時間, 世代, 值)
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._generation = 0  # 每次全部失效時加一
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _fresh(self, key, max_age):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] == self._generation and time.monotonic() - entry[0] <= max_age:
+            return entry
+        return None
+
+    def get(self, key, loader, max_age=None):
+        """
+        讀取快照中的 key，過期或已失效時呼叫 loader() 重新查詢。
+
+        參數:
+            loader: 無參數的查詢函數，返回 None 表示查詢失敗 (不寫入快照)
+            max_age (float): 可接受的最大快照年齡 (秒)，預設為 ttl；0 表示強制重新查詢
+        """
+        max_age = self.ttl if max_age is None else max_age
+        entry = self._fresh(key, max_age)
+        if entry is None:
+            with self._key_lock(key):
+                # 等待鎖期間其他執行緒可能已完成同一查詢
+                entry = self._fresh(key, max_age) if max_age > 0 else None
+                if entry is None:
+                    generation = self._generation
+                    self.misses += 1
+                    value = loader()
+                    if value is not None:
+                        with self._lock:
+                            if generation == self._generation:
+                                self._entries[key] = (time.monotonic(), generation, value)
+                    return value
+        self.hits += 1
+        return entry[2]
+
+    def invalidate(self, *keys):
+        """使指定 key (未指定時為全部) 失效"""
+        with self._lock:
+            self.invalidations += 1
+            if keys:
+                for key in keys:
+                    self._entries.pop(key, None)
+            else:
+                self._generation += 1
+                self._entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_account_snapshot(api_key, secret_key):
+    """取得 (或建立) 對應 API Key 的帳戶快照"""
+    key = (api_key, secret_key)
+    snapshot = _snapshots.get(key)
+    if snapshot is None:
+        with _snapshots_lock:
+            snapshot = _snapshots.get(key)
+            if snapshot is None:
+                snapshot = AccountSnapshot()
+                _snapshots[key] = snapshot
+    return snapshot
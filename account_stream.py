@@ -0,0 +1,340 @@
+"""
+WebSocket 帳戶串流: 訂閱 Bitunix 私有頻道 (持倉、訂單、餘額、止盈止損)，在記憶體中維持帳戶鏡像。
+
+* 登入簽名與 REST 相同的雙重 SHA256 (nonce + timestamp + apiKey，無參數)，之後訂閱 position/order/balance/tpsl。
+* 串流正常 (已登入、鏡像已由 REST 初始化、ACCOUNT_WS_STALE_SECONDS 內有訊息) 時，
+  持倉與餘額查詢直接讀取鏡像 (live_account_mirror)，tick 不再發出帳戶請求；否則呼叫端退回 REST。
+* 推送轉換為事件回呼: position_open / position_update / position_close / order_filled / tpsl / balance，
+  止損止盈在交易所觸發時會收到 position_close，不必等下一次輪詢。
+* 每次 (重新) 連線後與每 ACCOUNT_WS_RECONCILE_SECONDS 秒以 REST 校正鏡像: 校正開始後才由推送更新的項目保留推送值，
+  鏡像中有、REST 中已沒有的持倉視為遺漏的平倉，補發 position_close 事件。
+* 斷線後以指數退避 (含隨機抖動) 自動重連，與 market_stream 相同。
+"""
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+
+import metrics
+from config import (ACCOUNT_WS_URL, ACCOUNT_WS_PING_SECONDS, ACCOUNT_WS_STALE_SECONDS, MARKET_WS_RECONNECT_MAX_SECONDS,
+                    MARGIN_COIN)
+from bitunix_client import get_bitunix_client
+from account_snapshot import PositionDetails, FLAT_POSITION
+from bot_logger import get_logger
+
+log = get_logger("account_stream")
+
+CHANNELS = ("balance", "position", "order", "tpsl")
+_SIDES = {"LONG": "BUY", "SHORT": "SELL", "BUY": "BUY", "SELL": "SELL"}  # 推送使用 LONG/SHORT，REST 使用 BUY/SELL
+
+
+def ws_login_args(api_key, secret_key):
+    """私有頻道的登入參數 (timestamp 為秒)"""
+    nonce = uuid.uuid4().hex
+    timestamp = str(int(time.time()))
+    digest = hashlib.sha256((nonce + timestamp + api_key).encode("utf-8")).hexdigest()
+    sign = hashlib.sha256((digest + secret_key).encode("utf-8")).hexdigest()
+    return {"apiKey": api_key, "timestamp": timestamp, "nonce": nonce, "sign": sign}
+
+
+class AccountMirror:
+    """
+    帳戶狀態的記憶體鏡像 (推送與 REST 校正共用，所有讀寫以鎖保護)。
+
+    持倉以 REST get_pending_positions 的格式保存 (side 為 BUY/SELL)，
+    position_details() 的返回值與 trading_bot 的持倉查詢相同。
+    """
+
+    def __init__(self, margin_coin=MARGIN_COIN):
+        self.margin_coin = margin_coin
+        self.balance = None  # 保證金幣種的餘額字典 (available、margin ...)
+        self.balance_updated = 0.0
+        self.positions = {}  # positionId -> 持倉字典
+        self.position_updated = {}  # positionId -> 最後更新的 monotonic 時間
+        self.ready = False  # 已由 REST 初始化
+        self._lock = threading.Lock()
+
+    def available_balance(self):
+        with self._lock:
+            if not self.ready or self.balance is None:
+                return None
+            return float(self.balance.get("available", 0))
+
+    def position_details(self, symbol):
+        """返回 PositionDetails (方向, 數量字串, positionId, 未實現盈虧)；鏡像尚未初始化時返回 None"""
+        with self._lock:
+            if not self.ready:
+                return None
+            for position in self.positions.values():
+                if position.get("symbol") == symbol and float(position.get("qty") or 0) > 0:
+                    side = "long" if position.get("side") == "BUY" else "short"
+                    return PositionDetails(side, position.get("qty"), position.get("positionId"), float(position.get("unrealizedPNL") or 0.0))
+        return FLAT_POSITION
+
+    def apply_balance(self, data):
+        if data.get("coin", self.margin_coin) != self.margin_coin:
+            return False
+        with self._lock:
+            self.balance = dict(self.balance or {}, **data)
+            self.balance_updated = time.monotonic()
+        return True
+
+    def apply_position(self, data):
+        """套用持倉推送，返回事件類型 (position_open / position_update / position_close) 與合併後的持倉"""
+        position_id = data.get("positionId")
+        event = (data.get("event") or "UPDATE").upper()
+        position = dict(data, side=_SIDES.get(data.get("side"), data.get("side")))
+        with self._lock:
+            existing = self.positions.get(position_id)
+            if event == "CLOSE" or float(position.get("qty") or 0) <= 0:
+                self.positions.pop(position_id, None)
+                self.position_updated[position_id] = time.monotonic()
+                return "position_close", dict(existing or {}, **position)
+            self.positions[position_id] = dict(existing or {}, **position)
+            self.position_updated[position_id] = time.monotonic()
+            return ("position_update" if existing else "position_open"), self.positions[position_id]
+
+    def reconcile(self, balance, positions, started):
+        """
+        以 REST 結果校正鏡像 (started 之後才由推送更新的項目保留推送值)。
+        返回 (差異描述列表, 鏡像中有但 REST 已沒有的持倉列表)。
+        """
+        drift, vanished = [], []
+        rest = {p.get("positionId"): p for p in positions if float(p.get("qty") or 0) > 0}
+        with self._lock:
+            if balance is not None and self.balance_updated <= started:
+                if self.ready and self.balance is not None and str(self.balance.get("available")) != str(balance.get("available")):
+                    drift.append(f"餘額 {self.balance.get('available')} -> {balance.get('available')}")
+                self.balance = dict(balance)
+            for position_id, position in list(self.positions.items()):
+                if position_id not in rest and self.position_updated.get(position_id, 0.0) <= started:
+                    del self.positions[position_id]
+                    drift.append(f"持倉 {position_id} 已不存在")
+                    vanished.append(position)
+            for position_id, position in rest.items():
+                if self.position_updated.get(position_id, 0.0) > started:
+                    continue
+                existing = self.positions.get(position_id)
+                if existing is None and self.ready:
+                    drift.append(f"遺漏持倉 {position_id}")
+                elif existing is not None and existing.get("qty") != position.get("qty"):
+                    drift.append(f"持倉 {position_id} 數量 {existing.get('qty')} -> {position.get('qty')}")
+                self.positions[position_id] = dict(position)
+            if balance is not None:
+                self.ready = True
+        return drift, vanished
+
+
+class AccountStream:
+    """
+    單一 API Key 的私有頻道串流 (在自己的執行緒與事件迴圈中運行)。
+
+    事件回呼在串流執行緒 (校正時為校正執行緒) 中執行，應保持輕量。
+    """
+
+    def __init__(self, api_key, secret_key, url=ACCOUNT_WS_URL, margin_coin=MARGIN_COIN, ping_interval=ACCOUNT_WS_PING_SECONDS,
+                 stale_seconds=ACCOUNT_WS_STALE_SECONDS, reconnect_max=MARKET_WS_RECONNECT_MAX_SECONDS):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.url = url
+        self.mirror = AccountMirror(margin_coin)
+        self.ping_interval = ping_interval
+        self.stale_seconds = stale_seconds
+        self.reconnect_max = reconnect_max
+        self.connected = False
+        self.logged_in = False
+        self.last_message_time = 0.0
+        self.messages = 0
+        self.reconnects = 0
+        self.reconciles = 0
+        self._callbacks = []
+        self._reconcile_lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._ws = None
+        self._stop = threading.Event()
+        self._stop_async = None
+
+    def on_event(self, callback):
+        """註冊事件回呼: callback(kind, symbol, data)"""
+        self._callbacks.append(callback)
+
+    def is_live(self):
+        return (self.connected and self.logged_in and self.mirror.ready
+                and time.time() - self.last_message_time <= self.stale_seconds)
+
+    # === 執行緒控制 === #
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._thread_main, name="account-stream", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(self._request_stop)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _request_stop(self):
+        if self._stop_async is not None:
+            self._stop_async.set()
+        if self._ws is not None:
+            asyncio.ensure_future(self._ws.close())
+
+    def _thread_main(self):
+        asyncio.run(self._run())
+
+    # === 連線、登入與訂閱 === #
+    async def _run(self):
+        import aiohttp
+
+        self._loop = asyncio.get_running_loop()
+        self._stop_async = asyncio.Event()
+        backoff = 1.0
+        async with aiohttp.ClientSession() as session:
+            while not self._stop.is_set():
+                pinger = None
+                try:
+                    async with session.ws_connect(self.url, heartbeat=20, receive_timeout=self.stale_seconds) as ws:
+                        self._ws = ws
+                        self.connected = True
+                        await ws.send_str(json.dumps({"op": "login", "args": [ws_login_args(self.api_key, self.secret_key)]}))
+                        pinger = asyncio.ensure_future(self._ping_loop(ws))
+                        backoff = 1.0
+                        async for msg in ws:
+                            if msg.type == aiohttp.WSMsgType.TEXT:
+                                await self._handle_message(ws, msg.data)
+                            elif msg.type in (aiohttp.WSMsgType.ERROR, aiohttp.WSMsgType.CLOSED):
+                                break
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    log.warning("連線錯誤: %s", e)
+                finally:
+                    if pinger is not None:
+                        pinger.cancel()
+                    self.connected = False
+                    self.logged_in = False
+                    self._ws = None
+                if self._stop.is_set():
+                    break
+                self.reconnects += 1
+                delay = min(backoff, self.reconnect_max) * random.uniform(0.5, 1.0)
+                backoff *= 2
+                log.warning("連線中斷，%.1f 秒後重連 (第 %s 次)，期間持倉與餘額改由 REST 查詢", delay, self.reconnects)
+                try:
+                    await asyncio.wait_for(self._stop_async.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _ping_loop(self, ws):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await ws.send_str(json.dumps({"op": "ping", "ping": int(time.time())}))
+
+    # === 訊息處理 === #
+    async def _handle_message(self, ws, raw):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+        self.messages += 1
+        self.last_message_time = time.time()
+        op = message.get("op")
+        if op == "login":
+            result = message.get("data", {})
+            if (result.get("result") if isinstance(result, dict) else result) is True:
+                self.logged_in = True
+                await ws.send_str(json.dumps({"op": "subscribe", "args": [{"ch": ch} for ch in CHANNELS]}))
+                log.info("已登入並訂閱私有頻道: %s", ", ".join(CHANNELS))
+                # 斷線期間可能錯過推送，以 REST 重新初始化鏡像
+                self._loop.run_in_executor(None, self.reconcile)
+            else:
+                log.error("私有頻道登入失敗: %s", message)
+                await ws.close()
+            return
+        channel = message.get("ch")
+        if channel not in CHANNELS:
+            return  # pong 與訂閱回應
+        metrics.inc("account_ws_messages_total", channel=channel)
+        data = message.get("data") or {}
+        for item in data if isinstance(data, list) else [data]:
+            self._handle_push(channel, item)
+
+    def _handle_push(self, channel, data):
+        symbol = data.get("symbol")
+        if channel == "balance":
+            if self.mirror.apply_balance(data):
+                self._emit("balance", None, data)
+        elif channel == "position":
+            kind, position = self.mirror.apply_position(data)
+            if kind == "position_close":
+                log.info("%s 持倉 %s 已平倉 (已實現盈虧 %s)", symbol, position.get("positionId"), position.get("realizedPNL"))
+            self._emit(kind, symbol, position)
+        elif channel == "order":
+            if str(data.get("orderStatus", "")).upper() == "FILLED":
+                log.debug("%s 訂單 %s 已成交: %s", symbol, data.get("orderId"), data)
+                self._emit("order_filled", symbol, data)
+        elif channel == "tpsl":
+            log.info("%s 止盈止損訂單更新: %s", symbol, data)
+            self._emit("tpsl", symbol, data)
+
+    def _emit(self, kind, symbol, data):
+        for callback in self._callbacks:
+            try:
+                callback(kind, symbol, data)
+            except Exception as e:
+                log.exception("帳戶事件回呼錯誤: %s", e)
+
+    # === REST 校正 === #
+    def reconcile(self):
+        """以 REST 查詢餘額與全部持倉並校正鏡像，返回差異數 (查詢失敗時返回 None)"""
+        with self._reconcile_lock:
+            started = time.monotonic()
+            client = get_bitunix_client(self.api_key, self.secret_key)
+            try:
+                account = client.get("/api/v1/futures/account", {"marginCoin": self.mirror.margin_coin}).json()
+                positions = client.get("/api/v1/futures/position/get_pending_positions", {}).json()
+            except Exception as e:
+                log.error("REST 校正失敗: %s", e)
+                return None
+            if account.get("code") != 0 or positions.get("code") != 0:
+                log.error("REST 校正失敗: %s / %s", account.get("msg"), positions.get("msg"))
+                return None
+            drift, vanished = self.mirror.reconcile(account.get("data"), positions.get("data") or [], started)
+            self.reconciles += 1
+        if drift:
+            metrics.inc("account_ws_drift_total", len(drift))
+            log.warning("帳戶鏡像與 REST 不一致，已校正: %s", "; ".join(drift))
+        for position in vanished:
+            self._emit("position_close", position.get("symbol"), dict(position, event="CLOSE"))
+        return len(drift)
+
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def get_account_stream(api_key, secret_key):
+    """取得 (或建立，不啟動) 對應 API Key 的帳戶串流"""
+    key = (api_key, secret_key)
+    stream = _streams.get(key)
+    if stream is None:
+        with _streams_lock:
+            stream = _streams.get(key)
+            if stream is None:
+                stream = _streams[key] = AccountStream(api_key, secret_key)
+    return stream
+
+
+def live_account_mirror(api_key, secret_key):
+    """帳戶串流正常時返回其鏡像，未啟動或已中斷時返回 None (呼叫端改用 REST)"""
+    stream = _streams.get((api_key, secret_key))
+    if stream is not None and stream.is_live():
+        return stream.mirror
+    return None
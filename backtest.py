@@ -0,0 +1,310 @@
+"""
+向量化回測引擎: 以與 execute_trading_strategy 相同的進出場與風控規則重播歷史K線。
+
+規則 (以已收盤K線評估):
+    * 空手且 (RSI > RSI_BUY 或 收盤價 > 前 BREAKOUT_LOOKBACK 根最高價) 時以收盤價開多。
+    * RSI 進場: 固定止損 = 進場價 - ATR * STOP_MULT，止盈 = 進場價 + ATR * LIMIT_MULT。
+    * 突破進場: 初始止損 = 進場價 - ATR * STOP_MULT，之後每根收盤若 (收盤價 - ATR * STOP_MULT) 更高則上移止損。
+    * 持有多單且 RSI < EXIT_RSI 時以收盤價平倉。
+    * 止損/止盈於K線內觸發 (同根同時觸及時保守地視為先觸發止損)，跳空時以開盤價成交。
+實盤中的 START_DATE/END_DATE 時間過濾不套用，回測區間由輸入的K線決定。
+
+指標與信號整批向量化計算；狀態迴圈以二分搜尋直接跳到下一個進場點，持倉期間以純量迴圈逐根檢查，
+長時間持倉則改以 NumPy 視窗掃描找出出場K線，權益曲線最後以差分陣列一次展開，不逐列迭代 pandas。
+"""
+import time
+from bisect import bisect_left
+
+import numpy as np
+
+from config import RSI_BUY, RSI_LEN, EXIT_RSI, BREAKOUT_LOOKBACK, ATR_LEN, STOP_MULT, LIMIT_MULT, LEVERAGE, WALLET_PERCENTAGE, TRADING_PAIR, TIMEFRAME
+from indicators import batch_rsi, batch_atr, batch_highest_break
+
+DEFAULT_FEE_RATE = 0.0006  # 單邊手續費率 (市價單)
+DEFAULT_INITIAL_EQUITY = 1000.0  # 初始資金 (USDT)
+
+ENTRY_RSI = 0
+ENTRY_BREAKOUT = 1
+EXIT_STOP = 0
+EXIT_TAKE_PROFIT = 1
+EXIT_RSI_SIGNAL = 2
+EXIT_END_OF_DATA = 3
+ENTRY_TYPE_NAMES = {ENTRY_RSI: "rsi", ENTRY_BREAKOUT: "breakout"}
+EXIT_REASON_NAMES = {EXIT_STOP: "stop_loss", EXIT_TAKE_PROFIT: "take_profit", EXIT_RSI_SIGNAL: "exit_rsi", EXIT_END_OF_DATA: "end_of_data"}
+
+TRADE_DTYPE = np.dtype([
+    ("entry_idx", np.int64),
+    ("exit_idx", np.int64),
+    ("entry_time", np.int64),
+    ("exit_time", np.int64),
+    ("entry_type", np.int8),
+    ("exit_reason", np.int8),
+    ("entry_price", np.float64),
+    ("exit_price", np.float64),
+    ("qty", np.float64),
+    ("pnl", np.float64),
+    ("return_pct", np.float64),
+])
+
+_PER_BAR_SCAN_LIMIT = 64  # 持倉前段以純量迴圈逐根檢查，超過後改用向量掃描
+_INITIAL_SCAN_WINDOW = 256  # 向量掃描的起始視窗，找不到出場時倍增
+
+
+class BacktestResult:
+    """回測結果: trades 為結構化陣列 (TRADE_DTYPE)，equity 為逐根K線的按市值計價權益曲線"""
+    __slots__ = ("trades", "equity", "timestamps", "initial_equity", "elapsed")
+
+    def __init__(self, trades, equity, timestamps, initial_equity, elapsed):
+        self.trades = trades
+        self.equity = equity
+        self.timestamps = timestamps
+        self.initial_equity = initial_equity
+        self.elapsed = elapsed
+
+    def summary(self):
+        """回傳主要績效統計"""
+        trades = self.trades
+        equity = self.equity
+        n_trades = len(trades)
+        wins = int(np.count_nonzero(trades["pnl"] > 0))
+        gross_profit = float(trades["pnl"][trades["pnl"] > 0].sum())
+        gross_loss = float(-trades["pnl"][trades["pnl"] <= 0].sum())
+        peak = np.maximum.accumulate(equity) if len(equity) else equity
+        drawdown = float(np.max(1.0 - equity / peak)) if len(equity) else 0.0
+        final_equity = float(equity[-1]) if len(equity) else self.initial_equity
+        return {
+            "trades": n_trades,
+            "win_rate": wins / n_trades if n_trades else 0.0,
+            "total_return": final_equity / self.initial_equity - 1.0,
+            "final_equity": final_equity,
+            "profit_factor": gross_profit / gross_loss if gross_loss > 0 else float("inf") if gross_profit > 0 else 0.0,
+            "max_drawdown": drawdown,
+            "bars": len(equity),
+            "bars_per_second": len(equity) / self.elapsed if self.elapsed > 0 else float("inf"),
+        }
+
+    def trades_frame(self):
+        """將交易列表轉為 DataFrame (僅供檢視/輸出使用)"""
+        import pandas as pd
+        df = pd.DataFrame(self.trades)
+        df["entry_type"] = df["entry_type"].map(ENTRY_TYPE_NAMES)
+        df["exit_reason"] = df["exit_reason"].map(EXIT_REASON_NAMES)
+        df["entry_time"] = pd.to_datetime(df["entry_time"], unit="ms")
+        df["exit_time"] = pd.to_datetime(df["exit_time"], unit="ms")
+        return df
+
+
+def compute_backtest_indicators(ohlcv, rsi_len=RSI_LEN, atr_len=ATR_LEN, breakout_lookback=BREAKOUT_LOOKBACK):
+    """整批計算回測所需的 (rsi, atr, highest_break) 陣列"""
+    high, low, close = ohlcv[:, 2], ohlcv[:, 3], ohlcv[:, 4]
+    return batch_rsi(close, rsi_len), batch_atr(high, low, close, atr_len), batch_highest_break(high, breakout_lookback)
+
+
+def _scan_fixed_exit(low, high, exit_flag, start, stop_price, take_profit):
+    """找出固定止損/止盈持倉的出場K線，返回 (索引, 出場原因)，無出場時索引為 -1"""
+    n = len(low)
+    window = _INITIAL_SCAN_WINDOW
+    s = start
+    while s < n:
+        e = min(n, s + window)
+        stop_hit = low[s:e] <= stop_price
+        tp_hit = high[s:e] >= take_profit
+        hit = stop_hit | tp_hit | exit_flag[s:e]
+        if hit.any():
+            k = int(hit.argmax())
+            if stop_hit[k]:
+                return s + k, EXIT_STOP
+            if tp_hit[k]:
+                return s + k, EXIT_TAKE_PROFIT
+            return s + k, EXIT_RSI_SIGNAL
+        s = e
+        window *= 2
+    return -1, EXIT_END_OF_DATA
+
+
+def _scan_trailing_exit(low, trail, exit_flag, start, stop_price):
+    """找出移動止損持倉的出場K線，返回 (索引, 出場原因, 出場時的止損價)"""
+    n = len(low)
+    window = _INITIAL_SCAN_WINDOW
+    s = start
+    carry = stop_price
+    while s < n:
+        e = min(n, s + window)
+        # 第 j 根K線內有效的止損 = max(初始止損, 前一根為止所有 (收盤 - ATR*STOP_MULT))
+        candidates = np.empty(e - s)
+        candidates[0] = carry
+        candidates[1:] = trail[s:e - 1]
+        stops = np.fmax.accumulate(candidates)
+        stop_hit = low[s:e] <= stops
+        hit = stop_hit | exit_flag[s:e]
+        if hit.any():
+            k = int(hit.argmax())
+            return s + k, (EXIT_STOP if stop_hit[k] else EXIT_RSI_SIGNAL), float(stops[k])
+        carry = float(np.fmax(stops[-1], trail[e - 1]))
+        s = e
+        window *= 2
+    return -1, EXIT_END_OF_DATA, carry
+
+
+def run_backtest(ohlcv, rsi_buy=RSI_BUY, rsi_len=RSI_LEN, exit_rsi=EXIT_RSI, breakout_lookback=BREAKOUT_LOOKBACK,
+                 atr_len=ATR_LEN, stop_mult=STOP_MULT, limit_mult=LIMIT_MULT, leverage=LEVERAGE,
+                 wallet_percentage=WALLET_PERCENTAGE, initial_equity=DEFAULT_INITIAL_EQUITY,
+                 fee_rate=DEFAULT_FEE_RATE, indicators=None):
+    """
+    回測策略。
+
+    參數:
+        ohlcv (np.ndarray): K線陣列，欄位同 fetch_ohlcv (timestamp, open, high, low, close, volume)
+        indicators (tuple): 預先計算好的 (rsi, atr, highest_break)，參數掃描時可重用
+    返回:
+        BacktestResult
+    """
+    started = time.perf_counter()
+    ohlcv = np.asarray(ohlcv, dtype=np.float64)
+    timestamps = ohlcv[:, 0].astype(np.int64)
+    open_, high, low, close = ohlcv[:, 1], ohlcv[:, 2], ohlcv[:, 3], ohlcv[:, 4]
+    n = len(ohlcv)
+    if indicators is None:
+        indicators = compute_backtest_indicators(ohlcv, rsi_len, atr_len, breakout_lookback)
+    rsi, atr, highest_break = indicators
+
+    # 信號一次性向量化計算 (NaN 比較結果為 False，與實盤相同)
+    with np.errstate(invalid="ignore"):
+        rsi_entry = rsi > rsi_buy
+        breakout_entry = close > highest_break
+        exit_flag = rsi < exit_rsi
+    entry_idx = np.flatnonzero((rsi_entry | breakout_entry) & ~np.isnan(atr))
+    trail = close - atr * stop_mult
+
+    # 純量迴圈使用 Python list 取值，避免逐個存取 NumPy 元素的開銷
+    low_l, high_l, close_l, open_l = low.tolist(), high.tolist(), close.tolist(), open_.tolist()
+    atr_l, trail_l, exit_l, rsi_entry_l = atr.tolist(), trail.tolist(), exit_flag.tolist(), rsi_entry.tolist()
+    entry_list = entry_idx.tolist()
+
+    cols = ([], [], [], [], [], [], [], [])  # entry_idx, exit_idx, entry_type, exit_reason, entry_price, exit_price, qty, pnl
+    entry_is, exit_js, types, reasons, entry_prices, exit_prices, qtys, pnls = cols
+    cash_before = []
+    cash = initial_equity
+    cursor = 0  # 下一次可進場的最早索引
+    k = 0
+
+    while cash > 0:
+        k = bisect_left(entry_list, cursor, k)
+        if k >= len(entry_list):
+            break
+        i = entry_list[k]
+        entry_price = close_l[i]
+        qty = cash * wallet_percentage * leverage / entry_price
+        stop_price = entry_price - atr_l[i] * stop_mult
+        j = -1
+        if rsi_entry_l[i]:
+            entry_type = ENTRY_RSI
+            take_profit = entry_price + atr_l[i] * limit_mult
+            for j in range(i + 1, min(n, i + 1 + _PER_BAR_SCAN_LIMIT)):
+                if low_l[j] <= stop_price:
+                    reason = EXIT_STOP
+                    break
+                if high_l[j] >= take_profit:
+                    reason = EXIT_TAKE_PROFIT
+                    break
+                if exit_l[j]:
+                    reason = EXIT_RSI_SIGNAL
+                    break
+            else:
+                j, reason = _scan_fixed_exit(low, high, exit_flag, i + 1 + _PER_BAR_SCAN_LIMIT, stop_price, take_profit)
+        else:
+            entry_type = ENTRY_BREAKOUT
+            for j in range(i + 1, min(n, i + 1 + _PER_BAR_SCAN_LIMIT)):
+                if low_l[j] <= stop_price:
+                    reason = EXIT_STOP
+                    break
+                if exit_l[j]:
+                    reason = EXIT_RSI_SIGNAL
+                    break
+                if trail_l[j] > stop_price:
+                    stop_price = trail_l[j]
+            else:
+                j, reason, stop_price = _scan_trailing_exit(low, trail, exit_flag, i + 1 + _PER_BAR_SCAN_LIMIT, stop_price)
+
+        if j < 0 or j >= n:
+            reason = EXIT_END_OF_DATA
+        if reason == EXIT_STOP:
+            exit_price = min(open_l[j], stop_price)
+        elif reason == EXIT_TAKE_PROFIT:
+            exit_price = max(open_l[j], take_profit)
+        elif reason == EXIT_RSI_SIGNAL:
+            exit_price = close_l[j]
+        else:
+            j = n - 1
+            exit_price = close_l[j]
+
+        pnl = qty * (exit_price - entry_price) - (qty * entry_price + qty * exit_price) * fee_rate
+        entry_is.append(i)
+        exit_js.append(j)
+        types.append(entry_type)
+        reasons.append(reason)
+        entry_prices.append(entry_price)
+        exit_prices.append(exit_price)
+        qtys.append(qty)
+        pnls.append(pnl)
+        cash_before.append(cash)
+        cash += pnl
+        if j >= n - 1:
+            break
+        # 止損/止盈於K線內出場後，同根收盤即可再次進場；RSI 平倉則等到下一根
+        cursor = j if reason != EXIT_RSI_SIGNAL else j + 1
+
+    trades = np.empty(len(entry_is), dtype=TRADE_DTYPE)
+    for name, values in zip(("entry_idx", "exit_idx", "entry_type", "exit_reason", "entry_price", "exit_price", "qty", "pnl"), cols):
+        trades[name] = values
+    trades["entry_time"] = timestamps[trades["entry_idx"]]
+    trades["exit_time"] = timestamps[trades["exit_idx"]]
+    cash_before = np.asarray(cash_before, dtype=np.float64)
+    trades["return_pct"] = trades["pnl"] / cash_before if len(trades) else 0.0
+
+    # 權益曲線 (向量化): 持倉K線 = 進場前現金 - 進場手續費 + qty * (收盤 - 進場價)，空手K線 = 現金
+    # 以差分陣列標記每筆交易的起訖 (現金於出場K線加上盈虧)，再以 cumsum 展開成逐根的值
+    hold_offset = cash_before - trades["qty"] * trades["entry_price"] * (1 + fee_rate)
+    cash_diff = np.zeros(n + 1)
+    qty_diff = np.zeros(n + 1)
+    offset_diff = np.zeros(n + 1)
+    cash_diff[0] = initial_equity
+    np.add.at(cash_diff, trades["exit_idx"], trades["pnl"])
+    np.add.at(qty_diff, trades["entry_idx"], trades["qty"])
+    np.add.at(qty_diff, trades["exit_idx"], -trades["qty"])
+    np.add.at(offset_diff, trades["entry_idx"], hold_offset - cash_before)
+    np.add.at(offset_diff, trades["exit_idx"], cash_before - hold_offset)
+    equity = np.cumsum(cash_diff)[:n] + np.cumsum(offset_diff)[:n] + np.cumsum(qty_diff)[:n] * close
+    return BacktestResult(trades, equity, timestamps, initial_equity, time.perf_counter() - started)
+
+
+def load_history(trading_pair=TRADING_PAIR, timeframe=TIMEFRAME, days=365):
+    """
+    從本地歷史K線庫載入最近 days 天的已收盤K線 (庫中缺少的部分先從 Binance 並行下載)。
+    返回記憶體映射的唯讀陣列，欄位同 fetch_ohlcv，重複回測不再重新下載或解析。
+    """
+    from kline_history import KlineArchive
+
+    archive = KlineArchive(trading_pair, timeframe)
+    start = int(time.time() * 1000) - days * 86_400_000
+    archive.download(start)
+    return archive.load(start)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="以 config.py 的策略參數回測歷史K線")
+    parser.add_argument("--days", type=int, default=365, help="回測天數")
+    parser.add_argument("--fee", type=float, default=DEFAULT_FEE_RATE, help="單邊手續費率")
+    parser.add_argument("--trades-csv", help="輸出交易列表 CSV 的路徑")
+    args = parser.parse_args()
+
+    data = load_history(days=args.days)
+    print(f"已載入 {len(data)} 根 {TRADING_PAIR} {TIMEFRAME} K線")
+    result = run_backtest(data, fee_rate=args.fee)
+    for key, value in result.summary().items():
+        print(f"{key}: {value}")
+    if args.trades_csv:
+        result.trades_frame().to_csv(args.trades_csv, index=False)
+        print(f"交易列表已輸出至 {args.trades_csv}")
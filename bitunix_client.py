@@ -0,0 +1,206 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+from config import BITUNIX_BASE_URL, HTTP_TIMEOUT_SECONDS, HTTP_POOL_SIZE
+from rate_governor import endpoint_class as classify_endpoint, get_rate_governor
+from bot_logger import get_logger
+
+log = get_logger("bitunix")
+
+
+def serialize_body(body):
+    """將請求主體壓縮成 JSON 字串 (無空格)，簽名與發送共用同一份結果"""
+    if body is None:
+        return ""
+    if isinstance(body, (dict, list)):
+        return json.dumps(body, separators=(',', ':'), ensure_ascii=False)
+    return str(body)
+
+
+# 完全按照ccc.py中的get_signed_params函數實現
+def get_signed_params(api_key, secret_key, query_params: dict = None, body: dict = None, path: str = None, method: str = None):
+    """
+    按照 Bitunix 官方雙重 SHA256 簽名方式對請求參數進行簽名。
+
+    參數:
+        api_key (str): 用戶 API Key
+        secret_key (str): 用戶 Secret Key
+        query_params (dict): 查詢參數 (GET 方法)
+        body (dict, str or None): 請求 JSON 主體 (POST 方法)，若為 str 則視為已序列化的主體直接使用
+
+    返回:
+        headers (dict): 包含簽名所需的請求頭（api-key, sign, nonce, timestamp 等）
+    """
+    nonce = uuid.uuid4().hex
+    timestamp = str(int(time.time() * 1000))
+
+    # 構造 query string: 將參數按鍵名 ASCII 升序排序後，鍵名與鍵值依次拼接
+    if query_params:
+        params_str = {k: str(v) for k, v in query_params.items()}
+        sorted_items = sorted(params_str.items(), key=lambda x: x[0])
+        query_str = "".join([f"{k}{v}" for k, v in sorted_items])
+    else:
+        query_str = ""
+
+    # 構造 body string: 將 JSON 體壓縮成字符串 (無空格)
+    body_str = serialize_body(body)
+
+    # 根據 method 決定簽名內容
+    if method == "GET":
+        digest_input = nonce + timestamp + api_key + query_str
+    else:
+        digest_input = nonce + timestamp + api_key + body_str
+    # 第一次 SHA256
+    digest = hashlib.sha256(digest_input.encode('utf-8')).hexdigest()
+    # 第二次 SHA256
+    sign = hashlib.sha256((digest + secret_key).encode('utf-8')).hexdigest()
+
+    # 構造標頭
+    headers = {
+        "api-key": api_key,
+        "sign": sign,
+        "nonce": nonce,
+        "timestamp": timestamp,
+        "language": "en-US",
+        "Content-Type": "application/json"
+    }
+    return nonce, timestamp, sign, headers
+
+
+def _retry_after(response):
+    """429 回應的 Retry-After 秒數 (沒有或無法解析時返回 None)"""
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class BitunixClient:
+    """
+    共用的 Bitunix REST 客戶端。
+
+    以單一 requests.Session 維持 keep-alive 連線池，所有私有端點都經由
+    get_signed_params 簽名；POST 主體只序列化一次，簽名與發送使用同一份位元組。
+    所有請求 (不論來自哪個交易對) 都先依端點類別向共用的 RateGovernor 取得額度，
+    收到 429 時把 Retry-After 回報給治理器。
+    """
+
+    def __init__(self, api_key, secret_key, base_url=BITUNIX_BASE_URL, timeout=HTTP_TIMEOUT_SECONDS, pool_size=HTTP_POOL_SIZE, governor=None):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        # 只對連線階段失敗重試 (請求尚未送出，重送是安全的)，讀取逾時不重試以免重複下單；
+        # 帶 Retry-After 的 429/503 直接返回給呼叫端處理，不在 urllib3 內等待或拋出 RetryError
+        retry = Retry(total=2, connect=2, read=0, status=0, other=0, backoff_factor=0.1, allowed_methods=None,
+                      respect_retry_after_header=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Connection": "keep-alive"})
+        self.last_prewarm_time = 0.0
+        self.call_counts = Counter()  # "方法 路徑" -> 請求次數
+        self._counts_lock = threading.Lock()
+        self.governor = governor or get_rate_governor()
+
+    def _count(self, method, path, endpoint_class):
+        with self._counts_lock:
+            self.call_counts[f"{method} {path}"] += 1
+        self.governor.acquire(endpoint_class)
+
+    def _send(self, method, path, endpoint_class, timeout=None, **kwargs):
+        """發送請求並記錄各端點的 HTTP 狀態、連線重試次數與耗時；429 回報給速率治理器"""
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", timeout=timeout or self.timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            metrics.inc("bitunix_http_requests_total", endpoint=path, method=method, status="error")
+            raise
+        finally:
+            metrics.observe("bitunix_http_seconds", time.perf_counter() - start, endpoint=path)
+        metrics.inc("bitunix_http_requests_total", endpoint=path, method=method, status=str(response.status_code))
+        if response.status_code == 429:
+            self.governor.throttle(endpoint_class, _retry_after(response))
+        retries = getattr(response.raw, "retries", None)
+        if retries is not None and retries.history:
+            metrics.inc("bitunix_http_retries_total", len(retries.history), endpoint=path)
+        return response
+
+    def call_count_report(self, reset=False):
+        """返回各端點的請求次數 (依次數排序)，reset=True 時同時歸零"""
+        with self._counts_lock:
+            report = dict(self.call_counts.most_common())
+            if reset:
+                self.call_counts.clear()
+        return report
+
+    def get(self, path, params=None, signed=True, timeout=None, endpoint_class=None):
+        """
+        發送 GET 請求，signed=True 時對查詢參數簽名 (timeout 未指定時使用客戶端的預設逾時)。
+        endpoint_class 未指定時依路徑判斷；下單流程中的查詢可傳 "trade" 取得下單的優先權。
+        """
+        params = params or {}
+        endpoint_class = endpoint_class or classify_endpoint(path)
+        self._count("GET", path, endpoint_class)
+        headers = None
+        if signed:
+            _, _, _, headers = get_signed_params(self.api_key, self.secret_key, params, None, path, method="GET")
+        return self._send("GET", path, endpoint_class, timeout, params=params, headers=headers)
+
+    def post(self, path, body=None, timeout=None):
+        """發送已簽名的 POST 請求，主體只序列化一次"""
+        body_str = serialize_body(body)
+        endpoint_class = classify_endpoint(path)
+        self._count("POST", path, endpoint_class)
+        _, _, _, headers = get_signed_params(self.api_key, self.secret_key, {}, body_str, path, method="POST")
+        return self._send("POST", path, endpoint_class, timeout, data=body_str.encode('utf-8'), headers=headers)
+
+    def prewarm(self, symbol=None):
+        """預先建立 TCP+TLS 連線，讓收盤後的下單與止損請求直接重用連線"""
+        params = {"symbols": symbol} if symbol else {}
+        try:
+            self.get("/api/v1/futures/market/tickers", params, signed=False).close()
+            self.last_prewarm_time = time.time()
+            log.debug("已預熱連線池: %s", self.base_url)
+            return True
+        except requests.exceptions.RequestException as e:
+            log.warning("預熱連線失敗: %s", e)
+            return False
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_bitunix_client(api_key, secret_key):
+    """取得 (或建立) 對應 API Key 的共用客戶端，確保整個程序只維持一個連線池"""
+    key = (api_key, secret_key)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = BitunixClient(api_key, secret_key)
+                _clients[key] = client
+    return client
+
+
+def seconds_until_bar_close(timeframe, now=None):
+    """計算距離當前 K 線收盤還有多少秒"""
+    units = {"m": 60, "h": 3600, "d": 86400}
+    tf_seconds = int(timeframe[:-1]) * units[timeframe[-1]]
+    now = time.time() if now is None else now
+    return tf_seconds - (now % tf_seconds)
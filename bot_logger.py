@@ -0,0 +1,120 @@
+"""
+結構化日誌: 以子系統區分的 logger (bot.trade、bot.bitunix、bot.discord ...) 與非阻塞輸出。
+
+* 呼叫端只把記錄放進佇列 (QueueHandler)，格式化與寫入主控台/檔案由背景執行緒 (QueueListener) 負責，
+  交易 tick 不會因為主控台或磁碟 I/O 而停頓。
+* 日誌檔依大小輪替 (RotatingFileHandler)，LOG_FORMAT = "json" 時每行一筆 JSON 供日誌收集器解析。
+* 訊息使用 % 參數 (logger.debug("資料: %s", data))，等級未啟用時不會格式化；
+  需要額外計算的內容先以 logger.isEnabledFor(logging.DEBUG) 判斷。
+
+未呼叫 setup_logging() 時 (例如作為模組匯入)，logging 模組只輸出 WARNING 以上的記錄。
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+from config import LOG_LEVEL, LOG_CONSOLE, LOG_FILE, LOG_FORMAT, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_LEVELS
+
+ROOT_LOGGER = "bot"
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s [%(name)s] %(message)s"
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def get_logger(subsystem):
+    """返回子系統的 logger (名稱為 bot.<subsystem>)"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{subsystem}")
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    只在呼叫端合併訊息參數 (參數物件之後可能被修改)；時間、等級等欄位的格式化與例外堆疊的展開
+    都留給背景執行緒，不再像預設的 QueueHandler 在呼叫端複製記錄並完整格式化一次。
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """每筆記錄輸出為一行 JSON (時間、等級、子系統、訊息，以及 extra 傳入的 symbol 等欄位)"""
+    EXTRA_FIELDS = ("symbol", "endpoint", "stage")
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for field in self.EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _build_handlers(log_file, log_format, console):
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = []
+    if console:
+        handlers.append(logging.StreamHandler())
+    if log_file:
+        directory = os.path.dirname(log_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                                             encoding="utf-8", delay=True))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def setup_logging(level=LOG_LEVEL, log_file=LOG_FILE, log_format=LOG_FORMAT, console=LOG_CONSOLE, levels=LOG_LEVELS):
+    """
+    設定 bot.* logger 的等級與非阻塞輸出 (只生效一次，重複呼叫直接返回)。
+
+    參數:
+        level (str): 預設等級 ("DEBUG"、"INFO"、"WARNING" ...)
+        log_file (str): 日誌檔路徑，空白表示只輸出到主控台
+        log_format (str): "text" 或 "json"
+        levels (dict): 個別子系統的等級覆寫，例: {"discord": "DEBUG"}
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(level)
+        root.propagate = False
+        for subsystem, sub_level in (levels or {}).items():
+            get_logger(subsystem).setLevel(sub_level)
+        log_queue = queue.SimpleQueue()
+        root.handlers[:] = [_NonBlockingQueueHandler(log_queue)]
+        _listener = logging.handlers.QueueListener(log_queue, *_build_handlers(log_file, log_format, console),
+                                                   respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        return _listener
+
+
+def shutdown_logging():
+    """停止背景寫入執行緒並寫出佇列中剩餘的記錄"""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,304 @@
+"""
+多時間框架K線重新取樣: 只訂閱一個基礎時間框架 (例如 1m)，在本地增量產生 15m/1h/4h/1d 等較大時間框架的K線。
+
+* K線邊界與交易所一致: 以 UTC 紀元對齊 (開盤時間 = 時間戳 - 時間戳 % 時間框架)，1d 從 00:00 UTC 開始。
+* 每筆基礎K線推送 (含形成中K線的重複更新) 對每個時間框架都是 O(1): 已收盤的基礎K線累計在
+  BarAggregator 中，形成中的一根只在輸出時合併，不會重複計入成交量。
+* 產生的K線寫入該時間框架的 CandleStore (與 REST/串流使用同一份儲存)，並以與 MarketStream 相同的
+  callback(timeframe, store, row, closed) 通知訂閱者，指標與策略可依時間框架分別訂閱。
+* 基礎K線不連續 (斷線後回補、首次啟動) 時，以基礎儲存中的歷史重新計算；基礎儲存不足以涵蓋的
+  時間框架 (暖機或目前K線的開頭) 在背景以 REST 補一次，之後照常在本地維護。
+"""
+import threading
+
+import numpy as np
+
+from candle_store import get_candle_store, timeframe_to_ms
+from bot_logger import get_logger
+
+log = get_logger("resample")
+
+
+def bucket_start(timestamp, tf_ms):
+    """時間戳 (ms) 所屬K線的開盤時間"""
+    return timestamp - timestamp % tf_ms
+
+
+def resample_ohlcv(ohlcv, timeframe):
+    """
+    將依時間排序的基礎K線陣列 (欄位同 COLUMNS) 整批重新取樣為 timeframe 的K線。
+    開頭不完整的K線 (基礎K線沒有從開盤時間開始) 會被捨去；最後一根可能仍在形成中。
+    """
+    tf_ms = timeframe_to_ms(timeframe)
+    ohlcv = np.asarray(ohlcv, dtype=np.float64)
+    if len(ohlcv) == 0:
+        return np.empty((0, ohlcv.shape[1] if ohlcv.ndim == 2 else 6))
+    buckets = ohlcv[:, 0] - ohlcv[:, 0] % tf_ms
+    if ohlcv[0, 0] != buckets[0]:
+        first_full = np.searchsorted(buckets, buckets[0] + tf_ms)
+        ohlcv, buckets = ohlcv[first_full:], buckets[first_full:]
+        if len(ohlcv) == 0:
+            return np.empty((0, ohlcv.shape[1]))
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(ohlcv)] - 1
+    return np.column_stack([buckets[starts], ohlcv[starts, 1], np.maximum.reduceat(ohlcv[:, 2], starts),
+                            np.minimum.reduceat(ohlcv[:, 3], starts), ohlcv[ends, 4], np.add.reduceat(ohlcv[:, 5], starts)])
+
+
+class BarAggregator:
+    """
+    單一目標時間框架的增量聚合器。
+
+    已收盤的基礎K線併入 open/high/low/volume，形成中的基礎K線保存在 pending，輸出時才合併，
+    因此同一根基礎K線重複推送只會覆寫 pending。counted_through 之前 (含) 的基礎K線成交量已包含在
+    種子K線中 (由 REST 取得的目前K線)，只更新價格，不再累計成交量。
+    """
+    __slots__ = ("tf_ms", "base_ms", "bucket", "open", "high", "low", "close", "volume", "pending",
+                 "counted_through", "closed")
+
+    def __init__(self, tf_ms, base_ms):
+        self.tf_ms = tf_ms
+        self.base_ms = base_ms
+        self.bucket = None
+        self.pending = None  # 形成中的基礎K線 [ts, open, high, low, close, volume]
+        self.counted_through = -1
+        self.closed = False
+
+    def start(self, bucket, open_price, high=-np.inf, low=np.inf, close=None, volume=0.0, counted_through=-1):
+        self.bucket = bucket
+        self.open, self.high, self.low = open_price, high, low
+        self.close = open_price if close is None else close
+        self.volume = volume
+        self.pending = None
+        self.counted_through = counted_through
+        self.closed = False
+
+    def _commit(self, row):
+        if row[2] > self.high:
+            self.high = row[2]
+        if row[3] < self.low:
+            self.low = row[3]
+        self.close = row[4]
+        if row[0] > self.counted_through:
+            self.volume += row[5]
+
+    def row(self):
+        """目前K線的 [開盤時間, open, high, low, close, volume]"""
+        pending = self.pending
+        if pending is None:
+            return [float(self.bucket), self.open, self.high, self.low, self.close, self.volume]
+        volume = self.volume + (pending[5] if pending[0] > self.counted_through else 0.0)
+        return [float(self.bucket), self.open, max(self.high, pending[2]), min(self.low, pending[3]), pending[4], volume]
+
+    def add(self, row, closed):
+        """
+        餵入一根基礎K線 (同一時間戳可重複推送)。
+
+        返回:
+            list: 需要寫入與通知的 (目標K線, 是否收盤)；進入新的K線前，上一根未通知收盤的K線會先以收盤送出
+        """
+        ts = int(row[0])
+        bucket = bucket_start(ts, self.tf_ms)
+        events = []
+        if self.bucket is not None and (bucket < self.bucket or (self.pending is not None and ts < self.pending[0])):
+            return events  # 舊於目前狀態的推送
+        if self.bucket is None or bucket > self.bucket:
+            if self.bucket is not None and not self.closed:
+                events.append((self.row(), True))
+            self.start(bucket, row[1])
+        elif self.pending is not None and ts > self.pending[0]:
+            self._commit(self.pending)  # 上一根基礎K線沒有收到收盤推送，以最後的數值提交
+            self.pending = None
+        if closed:
+            self._commit(row)
+            self.pending = None
+        else:
+            self.pending = row
+        self.closed = closed and ts + self.base_ms >= bucket + self.tf_ms
+        events.append((self.row(), self.closed))
+        return events
+
+
+class CandleResampler:
+    """
+    以單一基礎時間框架的K線推送產生多個時間框架的K線。
+
+    參數:
+        base_timeframe (str): 訂閱的基礎時間框架，所有目標時間框架必須是它的整數倍
+        timeframes (list): 要產生的時間框架 (包含基礎時間框架時，基礎K線直接轉送給訂閱者)
+        stores (dict): 時間框架 -> CandleStore，預設使用 get_candle_store 的共用儲存
+        warmup (int): 基礎儲存不足以涵蓋時，以 REST 補齊的暖機K線數量
+        exchange: REST 回補使用的 ccxt 交易所實例，預設為 candle_store 的共用實例
+
+    將 on_base_candle 註冊為 MarketStream 的K線回呼即可: stream.on_candle(resampler.on_base_candle)
+    """
+
+    def __init__(self, trading_pair, base_timeframe, timeframes, stores=None, warmup=100, exchange=None):
+        self.trading_pair = trading_pair
+        self.base_timeframe = base_timeframe
+        self.base_ms = timeframe_to_ms(base_timeframe)
+        self.timeframes = [tf for tf in dict.fromkeys(timeframes) if tf != base_timeframe]
+        self.forward_base = base_timeframe in timeframes
+        for tf in self.timeframes:
+            tf_ms = timeframe_to_ms(tf)
+            if tf_ms < self.base_ms or tf_ms % self.base_ms:
+                raise ValueError(f"{tf} 不是基礎時間框架 {base_timeframe} 的整數倍，無法重新取樣")
+        stores = dict(stores or {})
+        for tf in self.timeframes + [base_timeframe]:
+            if stores.get(tf) is None:  # CandleStore 定義了 __len__，空的儲存為假值，不能用 or
+                stores[tf] = get_candle_store(trading_pair, tf)
+        self.stores = {tf: stores[tf] for tf in self.timeframes}
+        self.base_store = stores[base_timeframe]
+        self.warmup = warmup
+        self.exchange = exchange
+        self.resyncs = 0
+        self.backfills = 0
+        self._aggregators = {tf: None for tf in self.timeframes}  # None 表示尚未就緒 (等待重新計算或 REST 回補)
+        self._callbacks = []
+        self._last_base_ts = None
+        self._backfilling = set()
+        self._lock = threading.RLock()
+
+    def on_candle(self, callback, timeframes=None):
+        """註冊K線回呼: callback(timeframe, store, row, closed)；timeframes 指定只接收的時間框架 (預設全部)"""
+        self._callbacks.append((callback, None if timeframes is None else set(timeframes)))
+
+    def _emit(self, timeframe, store, row, closed):
+        for callback, timeframes in self._callbacks:
+            if timeframes is not None and timeframe not in timeframes:
+                continue
+            try:
+                callback(timeframe, store, row, closed)
+            except Exception as e:
+                log.exception("K線回呼錯誤: %s", e)
+
+    def on_base_candle(self, timeframe, store, row, closed):
+        """MarketStream 的K線回呼: 以基礎K線更新所有目標時間框架"""
+        if timeframe != self.base_timeframe:
+            return
+        with self._lock:
+            ts = int(row[0])
+            last = self._last_base_ts
+            if last is not None and ts < last:
+                return
+            if last is None or ts > last + self.base_ms:
+                # 首次推送或基礎K線不連續 (回補後只推送最後一根): 以基礎儲存重新計算
+                self._last_base_ts = ts
+                self.resync()
+            else:
+                self._last_base_ts = ts
+                for tf, aggregator in self._aggregators.items():
+                    if aggregator is not None:
+                        for bar, bar_closed in aggregator.add(row, closed):
+                            self._apply(tf, bar, bar_closed)
+                    elif ts % self.stores[tf].tf_ms == 0 and tf not in self._backfilling:
+                        # 尚未就緒的時間框架在新K線開始時再嘗試一次 (基礎K線已涵蓋整根K線)
+                        self.resync([tf])
+        if self.forward_base:
+            self._emit(timeframe, store, row, closed)
+
+    def _apply(self, tf, bar, closed):
+        store = self.stores[tf]
+        status = store.apply_stream_row(bar)
+        if status == "gap":
+            self._schedule_backfill(tf)
+            return
+        if status == "merged":
+            self._emit(tf, store, bar, closed)
+
+    # === 重新計算與回補 === #
+    def resync(self, timeframes=None):
+        """以基礎儲存的歷史重新計算目標時間框架，無法涵蓋時排程 REST 回補"""
+        with self._lock:
+            self.resyncs += 1
+            base = self.base_store.latest()
+            for tf in timeframes or self.timeframes:
+                self._aggregators[tf] = self._rebuild(tf, base)
+                if self._aggregators[tf] is None:
+                    self._schedule_backfill(tf)
+                else:
+                    store = self.stores[tf]
+                    self._emit(tf, store, store.latest(1)[0], False)
+
+    def _rebuild(self, tf, base):
+        """以基礎K線補齊目標儲存並建立聚合器；基礎K線不足以銜接或涵蓋目前K線時返回 None"""
+        store, tf_ms = self.stores[tf], timeframe_to_ms(tf)
+        if len(base) == 0:
+            return None
+        bars = resample_ohlcv(base, tf)
+        last_ts = store.last_timestamp
+        if len(bars):
+            if last_ts is not None:
+                bars = bars[bars[:, 0] >= last_ts]
+            # 空的儲存只在基礎K線足以暖機時直接填入，否則交給 REST 下載完整的暖機區間
+            if len(bars) and (bars[0, 0] <= last_ts + tf_ms if last_ts is not None else len(bars) >= self.warmup):
+                store.apply_rows(bars)
+        aggregator = BarAggregator(tf_ms, self.base_ms)
+        current = bucket_start(int(base[-1, 0]), tf_ms)
+        if store.last_timestamp != current:
+            return None
+        rows = base[base[:, 0] >= current]
+        if int(rows[0, 0]) == current:
+            # 基礎K線涵蓋目前K線的開頭: 精確重建 (最後一根視為形成中)
+            aggregator.start(current, float(rows[0, 1]))
+            for item in rows[:-1].tolist():
+                aggregator.add(item, True)
+            aggregator.add(rows[-1].tolist(), False)
+        else:
+            # 只有 REST 取得的目前K線: 以它作為種子，已計入的基礎K線不再累計成交量
+            ts, open_price, high, low, close, volume = store.latest(1)[0].tolist()
+            aggregator.start(current, open_price, high, low, close, volume, counted_through=int(base[-1, 0]))
+            aggregator.add(base[-1].tolist(), False)
+        return aggregator
+
+    def _schedule_backfill(self, tf):
+        if tf in self._backfilling:
+            return
+        self._backfilling.add(tf)
+        threading.Thread(target=self._backfill, args=(tf,), name=f"resample-backfill-{tf}", daemon=True).start()
+
+    def _backfill(self, tf):
+        store = self.stores[tf]
+        try:
+            store.update(exchange=self.exchange, warmup=self.warmup)
+            self.backfills += 1
+            log.info("%s %s 已以 REST 補齊 (%s 根)，之後由 %s 在本地產生", self.trading_pair, tf, len(store), self.base_timeframe)
+            self.resync([tf])
+        except Exception as e:
+            log.error("REST 回補 %s %s 失敗: %s", self.trading_pair, tf, e)
+        finally:
+            self._backfilling.discard(tf)
+
+
+if __name__ == "__main__":
+    # 以隨機 1m K線 (每根推送多次形成中的更新) 核對增量結果與整批重新取樣一致: python candle_resampler.py
+    from candle_store import CandleStore
+    from mock_market_ws import FakeExchange
+
+    rng = np.random.default_rng(7)
+    base_ms = timeframe_to_ms("1m")
+    n = 3 * 1440 + 37  # 三天多一點，最後一根日K線仍在形成中
+    start = 1735689600000 - 125 * base_ms  # 從 4h/1d 的中間開始，測試開頭不完整的K線
+    close = 2000 + np.cumsum(rng.normal(0, 1, n))
+    base = np.column_stack([start + np.arange(n) * float(base_ms), close, close + rng.uniform(0, 2, n),
+                            close - rng.uniform(0, 2, n), close + rng.normal(0, 0.5, n), rng.uniform(1, 10, n)])
+    targets = ["1m", "15m", "1h", "4h", "1d"]
+    stores = {tf: CandleStore("TEST/USDT", tf, capacity=5000, cache_dir=None) for tf in targets}
+    resampler = CandleResampler("TEST/USDT", "1m", targets, stores=stores, warmup=0, exchange=FakeExchange())
+    closes = {tf: 0 for tf in targets}
+    resampler.on_candle(lambda tf, s, row, closed: closes.__setitem__(tf, closes[tf] + closed))
+    for i, row in enumerate(base.tolist()):
+        stores["1m"].apply_rows([row])
+        for step in (0.3, 0.6):  # 形成中的更新: 部分成交量
+            partial = [row[0], row[1], row[1] + (row[2] - row[1]) * step, row[1] - (row[1] - row[3]) * step, row[4], row[5] * step]
+            resampler.on_base_candle("1m", stores["1m"], partial, False)
+        resampler.on_base_candle("1m", stores["1m"], row, i % 97 != 0)  # 偶爾缺少收盤推送
+    for tf in targets[1:]:
+        expected = resample_ohlcv(base, tf)
+        actual = stores[tf].latest()
+        assert np.array_equal(actual[:, 0], expected[:, 0]), tf
+        error = np.abs(actual - expected).max()
+        assert error < 1e-6, (tf, error)
+        print(f"{tf:>4}: {len(actual)} 根K線與整批重新取樣一致 (最大誤差 {error:.2e}，收盤通知 {closes[tf]} 次)")
+    assert closes["1d"] == 2 and closes["4h"] == len(resample_ohlcv(base, "4h")) - 1
+    print("多時間框架重新取樣測試通過")
@@ -0,0 +1,289 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from config import CANDLE_CACHE_DIR, CANDLE_STORE_CAPACITY
+from bot_logger import get_logger
+from rate_governor import get_rate_governor
+
+log = get_logger("candles")
+
+# 欄位順序與 ccxt fetch_ohlcv 一致
+COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+FETCH_PAGE_LIMIT = 1000  # 單次向交易所請求的最大K線數量
+
+_TIMEFRAME_UNITS_MS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000}
+
+
+def timeframe_to_ms(timeframe):
+    """將 '15m'、'4h'、'1d' 等時間框架轉換為毫秒"""
+    return int(timeframe[:-1]) * _TIMEFRAME_UNITS_MS[timeframe[-1]]
+
+
+_exchange = None
+_exchange_lock = threading.Lock()
+
+
+def get_exchange():
+    """共用的 ccxt Binance 實例，避免每次取K線都重新建立 (及重新載入市場資訊)"""
+    global _exchange
+    if _exchange is None:
+        with _exchange_lock:
+            if _exchange is None:
+                import ccxt
+                _exchange = ccxt.binance({"enableRateLimit": True})
+    return _exchange
+
+
+class CandleStore:
+    """
+    單一 (交易對, 時間框架) 的滾動K線儲存。
+
+    以預先配置的 NumPy 陣列保存最近 capacity 根K線 (欄位同 COLUMNS)，
+    每次只向交易所請求最後一根已存K線之後的數據：同一時間戳的K線 (形成中的K線) 直接原地覆寫，
+    較新的K線附加在尾端；發現缺口時自動回補，並將結果寫入磁碟，重啟後不必重新下載暖機區間。
+    """
+
+    def __init__(self, trading_pair, timeframe, capacity=CANDLE_STORE_CAPACITY, cache_dir=CANDLE_CACHE_DIR):
+        self.trading_pair = trading_pair
+        self.timeframe = timeframe
+        self.tf_ms = timeframe_to_ms(timeframe)
+        self.capacity = capacity
+        # 緩衝區為容量的兩倍，寫滿時才把最後 capacity 根搬回開頭，攤銷後附加為 O(1)
+        self._buf = np.zeros((capacity * 2, len(COLUMNS)), dtype=np.float64)
+        self._start = 0
+        self._end = 0
+        self._lock = threading.Lock()  # 保護緩衝區: 只在合併、讀取與存檔時持有，不跨越網路請求
+        self._update_lock = threading.Lock()  # 同一時間只有一個執行緒向交易所增量更新
+        self.cache_path = None
+        if cache_dir:
+            filename = f"{trading_pair.replace('/', '')}_{timeframe}.npy"
+            self.cache_path = os.path.join(cache_dir, filename)
+        self.last_update_time = 0.0
+        self.last_stream_time = 0.0  # 最近一次套用 WebSocket 推送的時間
+        self._unfillable_gaps = set()  # 交易所本身缺少數據的缺口，只嘗試回補一次
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def last_timestamp(self):
+        return int(self._buf[self._end - 1, 0]) if len(self) else None
+
+    def view(self, limit=None):
+        """回傳最近 limit 根K線的唯讀視圖 (不複製)"""
+        start = self._start if limit is None else max(self._start, self._end - limit)
+        arr = self._buf[start:self._end]
+        arr.flags.writeable = False
+        return arr
+
+    def latest(self, limit=None, out=None):
+        """
+        回傳最近 limit 根K線的副本。
+        提供 out (預先配置、列數不少於 limit 的陣列) 時複製到 out 並返回其前段視圖，每次呼叫不再配置新陣列；
+        返回的視圖在下一次以同一個 out 呼叫時會被覆寫。
+        """
+        with self._lock:
+            view = self.view(limit)
+            if out is None:
+                return view.copy()
+            n = min(len(view), len(out))
+            out[:n] = view[len(view) - n:]
+            return out[:n]
+
+    def _append(self, row):
+        if self._end == len(self._buf):
+            keep = min(self.capacity - 1, len(self))
+            self._buf[:keep] = self._buf[self._end - keep:self._end]
+            self._start, self._end = 0, keep
+        self._buf[self._end] = row
+        self._end += 1
+        if len(self) > self.capacity:
+            self._start += 1
+
+    def merge(self, rows):
+        """
+        合併K線數據 (需依時間排序)。
+
+        返回:
+            int: 新附加的K線數量 (原地更新形成中K線不計入)
+        """
+        appended = 0
+        for row in rows:
+            ts = int(row[0])
+            last_ts = self.last_timestamp
+            if last_ts is None or ts > last_ts:
+                self._append(row)
+                appended += 1
+            elif ts == last_ts:
+                # 形成中的K線: 原地更新 OHLCV
+                self._buf[self._end - 1] = row
+        return appended
+
+    def apply_stream_row(self, row):
+        """
+        套用 WebSocket 推送的單根K線 (形成中的K線原地更新，新K線附加)。
+
+        返回:
+            str: "merged" 已套用；"stale" 舊於儲存中的最後一根，忽略；
+                 "gap" 與儲存無法銜接 (儲存為空或中間缺少K線)，需以 REST 回補後再套用
+        """
+        ts = int(row[0])
+        with self._lock:
+            last_ts = self.last_timestamp
+            if last_ts is None or ts > last_ts + self.tf_ms:
+                return "gap"
+            if ts < last_ts:
+                return "stale"
+            if self.merge([row]):
+                self.save()  # 每根K線開始時寫入一次，重啟後不必重新下載
+            self.last_stream_time = time.time()
+            return "merged"
+
+    def apply_rows(self, rows):
+        """合併本地產生的K線 (例如由較小時間框架重新取樣)，視同串流推送；返回新附加的K線數量"""
+        with self._lock:
+            appended = self.merge(rows)
+            if appended:
+                self.save()
+            self.last_stream_time = time.time()
+            return appended
+
+    def is_streaming(self, max_age):
+        """最近 max_age 秒內是否收到 WebSocket 推送 (是時可直接使用儲存中的數據，不必輪詢 REST)"""
+        return time.time() - self.last_stream_time <= max_age
+
+    def find_gaps(self):
+        """找出儲存中缺少K線的區間，返回 [(缺口前最後時間戳, 缺口後第一個時間戳), ...]"""
+        ts = self.view()[:, 0]
+        if len(ts) < 2:
+            return []
+        idx = np.flatnonzero(np.diff(ts) > self.tf_ms)
+        return [(int(ts[i]), int(ts[i + 1])) for i in idx]
+
+    def _fetch(self, exchange, since, limit):
+        # Binance 行情不佔 Bitunix 的總預算，但與其他行情讀取共用 market 類別的額度
+        get_rate_governor().acquire("market", shared=False)
+        return exchange.fetch_ohlcv(self.trading_pair, timeframe=self.timeframe, since=since, limit=limit)
+
+    def _backfill(self, exchange, gap_start, gap_end):
+        """回補 (gap_start, gap_end) 之間缺少的K線，並重新排序整個儲存 (在鎖外下載，只在插入時持有鎖)"""
+        rows = []
+        since = gap_start + self.tf_ms
+        while since < gap_end:
+            batch = self._fetch(exchange, since, FETCH_PAGE_LIMIT)
+            batch = [r for r in batch if since <= r[0] < gap_end]
+            if not batch:
+                break
+            rows.extend(batch)
+            since = int(batch[-1][0]) + self.tf_ms
+        if rows:
+            with self._lock:
+                merged = np.concatenate([self.view(), np.asarray(rows, dtype=np.float64)])
+                _, unique_idx = np.unique(merged[:, 0], return_index=True)
+                merged = merged[unique_idx][-self.capacity:]
+                self._buf[:len(merged)] = merged
+                self._start, self._end = 0, len(merged)
+            log.info("已回補 %s %s 缺口 %s 根K線", self.trading_pair, self.timeframe, len(rows))
+        return len(rows)
+
+    def update(self, exchange=None, warmup=100):
+        """
+        向交易所增量更新K線。
+
+        參數:
+            exchange: ccxt 交易所實例，預設使用共用的 Binance 實例
+            warmup (int): 儲存為空或過舊時需要下載的暖機K線數量
+        返回:
+            int: 新附加的K線數量
+        """
+        exchange = exchange or get_exchange()
+        # 網路請求在 _lock 之外進行，等待交易所回應時 latest() 與 WebSocket 推送不會被阻塞
+        with self._update_lock:
+            with self._lock:
+                last_ts = self.last_timestamp
+            now_ms = int(time.time() * 1000)
+            if last_ts is None or now_ms - last_ts > self.tf_ms * self.capacity:
+                # 沒有可用的歷史: 直接下載暖機區間
+                rows = self._fetch(exchange, None, warmup)
+                with self._lock:
+                    self._start = self._end = 0
+                    appended = self.merge(rows)
+            else:
+                # 從最後一根 (可能仍在形成中) K線開始抓取，停機過久時逐頁追上
+                appended = 0
+                since = last_ts
+                while True:
+                    batch = self._fetch(exchange, since, FETCH_PAGE_LIMIT)
+                    with self._lock:
+                        appended += self.merge(batch)
+                    if len(batch) < FETCH_PAGE_LIMIT or int(batch[-1][0]) <= since:
+                        break
+                    since = int(batch[-1][0])
+            with self._lock:
+                gaps = self.find_gaps()
+            for gap in gaps:
+                if gap in self._unfillable_gaps:
+                    continue
+                log.warning("偵測到 %s %s K線缺口: %s -> %s", self.trading_pair, self.timeframe, gap[0], gap[1])
+                if self._backfill(exchange, *gap):
+                    appended += 1
+                else:
+                    self._unfillable_gaps.add(gap)
+            with self._lock:
+                self.last_update_time = time.time()
+                if appended:
+                    self.save()
+            return appended
+
+    def save(self):
+        """以原子替換方式寫入磁碟快取"""
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, self._buf[self._start:self._end])
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            log.error("寫入K線快取失敗: %s", e)
+
+    def load(self):
+        """從磁碟快取載入K線，返回載入的數量"""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return 0
+        try:
+            data = np.load(self.cache_path)
+        except (OSError, ValueError) as e:
+            log.error("讀取K線快取失敗: %s", e)
+            return 0
+        if data.ndim != 2 or data.shape[1] != len(COLUMNS):
+            log.warning("K線快取格式不符，忽略: %s", self.cache_path)
+            return 0
+        with self._lock:
+            data = data[-self.capacity:]
+            self._buf[:len(data)] = data
+            self._start, self._end = 0, len(data)
+        log.info("已從快取載入 %s 根 %s %s K線", len(data), self.trading_pair, self.timeframe)
+        return len(data)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_candle_store(trading_pair, timeframe):
+    """取得 (或建立並從磁碟載入) 指定交易對與時間框架的K線儲存"""
+    key = (trading_pair, timeframe)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = CandleStore(trading_pair, timeframe)
+                store.load()
+                _stores[key] = store
+    return store
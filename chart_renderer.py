@@ -0,0 +1,371 @@
+"""
+圖表渲染工作進程。
+
+K線圖在獨立的進程中以 Agg 後端繪製，交易 tick 只負責提交數據並立即返回。
+工作進程啟動時只解析一次中文字體與深色樣式，每種圖表 (策略圖 / 通道圖、一般 / 低解析度)
+只建立一次 Figure，之後的渲染只更新既有 artist 的數據；輸出的 PNG 以最後一根K線為鍵快取，
+同一根K線重複請求時直接使用快取結果。
+"""
+import io
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+import numpy as np
+
+import metrics
+from config import SYMBOL, TIMEFRAME, RSI_BUY, RSI_LEN, EXIT_RSI, ATR_LEN, CHART_DPI, CHART_LOW_RES, CHART_LOW_RES_DPI, CHART_LOW_RES_BARS, CHART_CACHE_SIZE
+from bot_logger import get_logger
+
+log = get_logger("chart")
+
+CHINESE_FONTS = ['SimHei', 'Microsoft YaHei', 'STSong', 'FangSong', 'Noto Sans CJK TC', 'WenQuanYi Zen Hei']
+
+# 類似幣安深色模式的配色 (與原 mplfinance binance_dark_style 相同)
+BINANCE_DARK = {
+    "up": "#3dc985",
+    "down": "#ef4f60",
+    "facecolor": "#1b1f24",
+    "figure_facecolor": "#161a1e",
+    "gridcolor": "#2c2e31",
+    "edgecolor": "#474d56",
+    "titlecolor": "red",
+}
+
+# 通道圖配色 (螢光綠/亮紅標註下單點)
+CHANNEL_COLORS = {"up": "#3dc985", "down": "#ef4f60", "upper": "#00FFFF", "lower": "#FFFF00", "middle": "#FF00FF",
+                  "long": "#39FF14", "short": "#FF1744"}
+
+
+# === 工作進程 === #
+_charts = {}  # (圖表種類, 是否低解析度) -> 已建立的圖表物件
+
+
+def _init_render_worker():
+    """工作進程初始化: 切換 Agg 後端並一次性設定字體與樣式"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib import font_manager
+
+    available = {f.name for f in font_manager.fontManager.ttflist}
+    fonts = [font for font in CHINESE_FONTS if font in available]
+    if fonts:
+        log.debug("使用字體: %s", fonts[0])
+    else:
+        log.warning("未找到支援中文的字體，圖表標題和標籤可能顯示亂碼。")
+        # 只提示一次，避免每次渲染都輸出缺字警告
+        warnings.filterwarnings("ignore", message="Glyph .* missing from font")
+    plt.style.use("dark_background")
+    plt.rcParams['font.sans-serif'] = fonts + list(plt.rcParams['font.sans-serif'])
+    plt.rcParams['axes.unicode_minus'] = False  # 解決座標軸負號顯示問題
+
+
+def _candle_geometry(ohlcv, width=0.6):
+    """以向量化方式產生蠟燭實體 (矩形頂點) 與影線 (線段)，x 座標為K線序號"""
+    n = len(ohlcv)
+    x = np.arange(n, dtype=np.float64)
+    o, h, l, c = ohlcv[:, 1], ohlcv[:, 2], ohlcv[:, 3], ohlcv[:, 4]
+    bottom = np.minimum(o, c)
+    top = np.maximum(o, c)
+    half = width / 2
+    bodies = np.empty((n, 4, 2))
+    bodies[:, 0, 0] = bodies[:, 1, 0] = x - half
+    bodies[:, 2, 0] = bodies[:, 3, 0] = x + half
+    bodies[:, 0, 1] = bodies[:, 3, 1] = bottom
+    bodies[:, 1, 1] = bodies[:, 2, 1] = top
+    wicks = np.empty((n, 2, 2))
+    wicks[:, :, 0] = x[:, None]
+    wicks[:, 0, 1] = l
+    wicks[:, 1, 1] = h
+    return bodies, wicks, c >= o
+
+
+class _CandleChart:
+    """含蠟燭圖主面板的可重用 Figure，子類別負責指標 artist"""
+
+    def __init__(self, low_res, figsize, panel_ratios, facecolor, axes_facecolor):
+        import matplotlib.pyplot as plt
+        from matplotlib.collections import LineCollection, PolyCollection
+        from matplotlib.ticker import FuncFormatter, MaxNLocator
+
+        self.low_res = low_res
+        self.dpi = CHART_LOW_RES_DPI if low_res else CHART_DPI
+        self.fig, axes = plt.subplots(len(panel_ratios), 1, sharex=True, figsize=figsize,
+                                      gridspec_kw={"height_ratios": panel_ratios}, facecolor=facecolor, squeeze=False)
+        self.axes = list(axes[:, 0])
+        self.timestamps = np.empty(0)
+        # 以K線序號為 x 座標 (與 mplfinance 相同，不顯示休市空白)，刻度標籤顯示時間
+        self.axes[-1].xaxis.set_major_locator(MaxNLocator(nbins=8, integer=True))
+        self.axes[-1].xaxis.set_major_formatter(FuncFormatter(self._format_time))
+        for ax in self.axes:
+            ax.set_facecolor(axes_facecolor)
+            ax.yaxis.tick_right()
+            ax.yaxis.set_label_position("right")
+        self.wicks = LineCollection([], linewidths=1.0)
+        self.bodies = PolyCollection([], linewidths=0.5)
+        self.axes[0].add_collection(self.wicks)
+        self.axes[0].add_collection(self.bodies)
+
+    def _format_time(self, value, _pos):
+        i = int(round(value))
+        if 0 <= i < len(self.timestamps):
+            return np.datetime64(int(self.timestamps[i]), "ms").astype("datetime64[m]").item().strftime("%m-%d %H:%M")
+        return ""
+
+    def _update_candles(self, ohlcv, up_color, down_color, *overlays):
+        """更新蠟燭 artist；overlays 為畫在主面板上的其他序列，納入價格軸範圍"""
+        bodies, wicks, rising = _candle_geometry(ohlcv)
+        colors = np.where(rising, up_color, down_color)
+        self.bodies.set_verts(bodies)
+        self.bodies.set_facecolors(colors)
+        self.bodies.set_edgecolors(colors)
+        self.wicks.set_segments(wicks)
+        self.wicks.set_colors(colors)
+        n = len(ohlcv)
+        self.axes[0].set_xlim(-1, n)
+        low, high = np.nanmin(ohlcv[:, 3]), np.nanmax(ohlcv[:, 2])
+        for series in overlays:
+            finite = series[np.isfinite(series)]
+            if len(finite):
+                low, high = min(low, finite.min()), max(high, finite.max())
+        pad = (high - low) * 0.05 or high * 0.01 or 1.0
+        self.axes[0].set_ylim(low - pad, high + pad)
+        self.timestamps = ohlcv[:, 0]
+
+    @staticmethod
+    def _autoscale_line(ax, *values):
+        finite = np.concatenate([v[np.isfinite(v)] for v in values])
+        if len(finite):
+            low, high = finite.min(), finite.max()
+            pad = (high - low) * 0.1 or 1.0
+            ax.set_ylim(low - pad, high + pad)
+
+    def to_png(self, savefig_kwargs=None):
+        buffer = io.BytesIO()
+        self.fig.savefig(buffer, format='png', dpi=self.dpi, facecolor=self.fig.get_facecolor(), **(savefig_kwargs or {}))
+        return buffer.getvalue()
+
+
+class _StrategyChart(_CandleChart):
+    """策略圖: K線 + RSI (含 RSI_BUY/EXIT_RSI 水平線) + ATR"""
+
+    def __init__(self, low_res):
+        from matplotlib.lines import Line2D
+
+        super().__init__(low_res, (12, 9) if not low_res else (8, 6), (6, 2, 2),
+                         BINANCE_DARK["figure_facecolor"], BINANCE_DARK["facecolor"])
+        price_ax, rsi_ax, atr_ax = self.axes
+        self.fig.suptitle(f'{SYMBOL} {TIMEFRAME} K線圖與指標', color=BINANCE_DARK["titlecolor"],
+                          fontsize="x-large", fontweight="semibold")
+        for ax in self.axes:
+            ax.grid(True, axis="y", color=BINANCE_DARK["gridcolor"], linestyle="--")
+            for spine in ax.spines.values():
+                spine.set_edgecolor(BINANCE_DARK["edgecolor"])
+        price_ax.set_ylabel('Price')
+        rsi_ax.set_ylabel('RSI')
+        atr_ax.set_ylabel('ATR')
+        self.rsi_line, = rsi_ax.plot([], [], color='blue', linewidth=1.2)
+        # 水平線只建立一次，之後不隨數據重建
+        rsi_ax.axhline(RSI_BUY, color='green', linestyle='dashed', linewidth=1.2)
+        rsi_ax.axhline(EXIT_RSI, color='red', linestyle='dashed', linewidth=1.2)
+        self.atr_line, = atr_ax.plot([], [], color='purple', linewidth=1.2)
+        rsi_ax.legend(handles=[
+            Line2D([0], [0], color='blue', lw=1.2, label=f'RSI ({RSI_LEN})'),
+            Line2D([0], [0], color='green', linestyle='dashed', lw=1.2, label=f'RSI Buy ({RSI_BUY})'),
+            Line2D([0], [0], color='red', linestyle='dashed', lw=1.2, label=f'RSI Sell ({EXIT_RSI})'),
+        ], loc='upper left', fontsize='small')
+        atr_ax.legend(handles=[Line2D([0], [0], color='purple', lw=1.2, label=f'ATR ({ATR_LEN})')],
+                      loc='upper left', fontsize='small')
+        self.fig.tight_layout()
+
+    def render(self, ohlcv, rsi, atr):
+        x = np.arange(len(ohlcv))
+        self._update_candles(ohlcv, BINANCE_DARK["up"], BINANCE_DARK["down"])
+        self.rsi_line.set_data(x, rsi)
+        self.atr_line.set_data(x, atr)
+        self._autoscale_line(self.axes[1], rsi, np.array([RSI_BUY, EXIT_RSI], dtype=np.float64))
+        self._autoscale_line(self.axes[2], atr)
+        return self.to_png()
+
+
+class _ChannelChart(_CandleChart):
+    """通道圖: K線 + 上/下/中軌 + 下單點標註"""
+
+    def __init__(self, low_res):
+        super().__init__(low_res, (16, 8) if not low_res else (10, 5), (1,), "black", "white")
+        ax = self.axes[0]
+        ax.set_title('通道指標蠟燭圖')
+        ax.set_ylabel('價格')
+        self.upper_line, = ax.plot([], [], color=CHANNEL_COLORS["upper"], linewidth=1.2)
+        self.lower_line, = ax.plot([], [], color=CHANNEL_COLORS["lower"], linewidth=1.2)
+        self.middle_line, = ax.plot([], [], color=CHANNEL_COLORS["middle"], linewidth=1.0, linestyle='dashed')
+        self.markers = {side: ax.scatter([], [], color=CHANNEL_COLORS[side], marker='^' if side == 'long' else 'v',
+                                         s=400, zorder=10, edgecolors='black', linewidths=2)
+                        for side in ("long", "short")}
+        self.annotations = []
+        self.fig.tight_layout()
+
+    def render(self, ohlcv, upper, lower, middle, order_points):
+        ax = self.axes[0]
+        x = np.arange(len(ohlcv))
+        self._update_candles(ohlcv, CHANNEL_COLORS["up"], CHANNEL_COLORS["down"], upper, lower, middle)
+        self.upper_line.set_data(x, upper)
+        self.lower_line.set_data(x, lower)
+        self.middle_line.set_data(x, middle)
+        for annotation in self.annotations:
+            annotation.remove()
+        self.annotations = []
+        points = {"long": [], "short": []}
+        for pt in order_points or ():
+            if 0 <= pt['idx'] < len(ohlcv):
+                side = 'long' if pt['side'] == 'long' else 'short'
+                points[side].append((pt['idx'], pt['price']))
+                color = CHANNEL_COLORS[side]
+                self.annotations.append(ax.annotate(
+                    f"{pt['side'].upper()}", (pt['idx'], pt['price']), textcoords="offset points",
+                    xytext=(0, -40 if side == 'long' else 40), ha='center', color=color, fontsize=16, fontweight='bold',
+                    bbox=dict(boxstyle='round,pad=0.4', fc='black', ec=color, lw=3, alpha=0.95),
+                    arrowprops=dict(arrowstyle='->', color=color, lw=3, alpha=0.8)))
+        for side, marker in self.markers.items():
+            marker.set_offsets(np.array(points[side], dtype=np.float64).reshape(-1, 2))
+        return self.to_png()
+
+
+_CHART_TYPES = {"strategy": _StrategyChart, "channel": _ChannelChart}
+
+
+def _render(kind, low_res, *args):
+    """在工作進程中渲染圖表並返回 PNG bytes"""
+    chart = _charts.get((kind, low_res))
+    if chart is None:
+        chart = _CHART_TYPES[kind](low_res)
+        _charts[(kind, low_res)] = chart
+    return chart.render(*args)
+
+
+# === 主進程 === #
+def _last_candle_key(ohlcv):
+    """快取鍵: 最後一根K線 (形成中的K線數值改變時重新渲染)"""
+    return (len(ohlcv),) + tuple(float(v) for v in ohlcv[-1, :5])
+
+
+class ChartRenderer:
+    """
+    將渲染工作提交到單一工作進程 (spawn 啟動，與主進程的執行緒互不影響)。
+
+    render_* 立即返回 Future；完成後以 PNG bytes 呼叫 callback (在結果執行緒中執行，
+    callback 應只做排入佇列之類的輕量工作)。同一根K線的相同圖表直接使用快取。
+    """
+
+    def __init__(self, low_res=CHART_LOW_RES, cache_size=CHART_CACHE_SIZE):
+        self.low_res = low_res
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=_init_render_worker)
+            return self._executor
+
+    def _submit(self, cache_key, callback, kind, low_res, *args):
+        with self._lock:
+            png = self._cache.get(cache_key)
+            if png is not None:
+                self._cache.move_to_end(cache_key)
+        if png is not None:
+            metrics.inc("chart_cache_hits_total", kind=kind)
+            future = Future()
+            future.set_result(png)
+        else:
+            submitted = time.perf_counter()
+            try:
+                future = self._get_executor().submit(_render, kind, low_res, *args)
+            except BrokenProcessPool:
+                # 工作進程異常結束時重建一次
+                with self._lock:
+                    self._executor = None
+                future = self._get_executor().submit(_render, kind, low_res, *args)
+            future.add_done_callback(lambda f: self._store(cache_key, f))
+            # 提交到完成 (含排隊與進程間傳輸)
+            future.add_done_callback(lambda f: metrics.observe(metrics.STAGE_METRIC, time.perf_counter() - submitted, stage="chart_render"))
+        if callback is not None:
+            future.add_done_callback(lambda f: _deliver(f, callback))
+        return future
+
+    def _store(self, cache_key, future):
+        if future.cancelled() or future.exception() is not None:
+            if isinstance(future.exception(), BrokenProcessPool):
+                with self._lock:
+                    self._executor = None
+            return
+        with self._lock:
+            self._cache[cache_key] = future.result()
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def render_strategy(self, ohlcv, rsi, atr, callback=None, low_res=None):
+        """渲染策略圖 (K線 + RSI + ATR)，ohlcv 欄位同 fetch_ohlcv"""
+        low_res = self.low_res if low_res is None else low_res
+        ohlcv, rsi, atr = _prepare(ohlcv, low_res, rsi, atr)
+        return self._submit(("strategy", low_res) + _last_candle_key(ohlcv), callback, "strategy", low_res, ohlcv, rsi, atr)
+
+    def render_channel(self, ohlcv, upper, lower, middle, order_points=None, callback=None, low_res=None):
+        """渲染通道圖 (K線 + 上/下/中軌 + 下單點標註)"""
+        low_res = self.low_res if low_res is None else low_res
+        total = len(ohlcv)
+        ohlcv, upper, lower, middle = _prepare(ohlcv, low_res, upper, lower, middle)
+        # 低解析度模式只保留最近的K線，下單點序號需同步平移
+        shift = total - len(ohlcv)
+        points = tuple((int(pt['idx']) - shift, float(pt['price']), pt['side']) for pt in order_points or ())
+        order_points = [{"idx": idx, "price": price, "side": side} for idx, price, side in points]
+        return self._submit(("channel", low_res, points) + _last_candle_key(ohlcv), callback,
+                            "channel", low_res, ohlcv, upper, lower, middle, order_points)
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def _prepare(ohlcv, low_res, *series):
+    """轉為連續的 float64 陣列 (減少跨進程序列化成本)，低解析度模式只保留最近 CHART_LOW_RES_BARS 根"""
+    start = max(0, len(ohlcv) - CHART_LOW_RES_BARS) if low_res else 0
+    arrays = [np.ascontiguousarray(np.asarray(ohlcv, dtype=np.float64)[start:, :5])]
+    arrays += [np.ascontiguousarray(np.asarray(s, dtype=np.float64)[start:]) for s in series]
+    return arrays
+
+
+def _deliver(future, callback):
+    try:
+        png = future.result()
+    except Exception as e:
+        log.exception("[Plotting] 圖表渲染失敗: %s", e)
+        return
+    try:
+        callback(png)
+    except Exception as e:
+        log.exception("[Plotting] 處理渲染結果失敗: %s", e)
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_chart_renderer():
+    """共用的圖表渲染器 (首次使用時才啟動工作進程)"""
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = ChartRenderer()
+    return _renderer
@@ -6,7 +6,7 @@ TRADING_PAIR = "ETH/USDT"  # 交易對
 SYMBOL = "ETHUSDT"  # 交易符號
 LEVERAGE = 8 # 槓桿
 WALLET_PERCENTAGE = 1 # 每次下單使用錢包的%數->0.40=錢包的40%
-LOOP_INTERVAL_SECONDS = 60  # 主循環執行間隔（秒）
+LOOP_INTERVAL_SECONDS = 60  # K線收盤之間輕量價格檢查 (移動止損/出場) 的間隔（秒），完整策略只在K線收盤後執行
 # 技術指標參數
 STOP_MULT = 1.0  # 停損倍數
 LIMIT_MULT = 5.0  # 限制倍數
@@ -17,4 +17,90 @@ BREAKOUT_LOOKBACK = 4 # 突破回看
 ATR_LEN = 12  # ATR 長度
 ATR_MULT = 3.5  # ATR 倍數
 TIMEFRAME = "4h"  # 時間框架
-QUANTITY_PRECISION = 4 # 交易數量四捨五入小數位數
\ No newline at end of file
+QUANTITY_PRECISION = 4 # 交易數量四捨五入小數位數
+# HTTP 連線設定
+BITUNIX_BASE_URL = "https://fapi.bitunix.com"  # Bitunix 合約 API 網址
+HTTP_TIMEOUT_SECONDS = (3.05, 10)  # (連線逾時, 讀取逾時) 秒
+HTTP_POOL_SIZE = 10  # keep-alive 連線池大小
+PREWARM_SECONDS_BEFORE_CLOSE = 90  # K線收盤前多少秒預熱連線
+# K線儲存設定
+CANDLE_CACHE_DIR = "candle_cache"  # K線磁碟快取資料夾 (重啟後免重新下載)
+CANDLE_STORE_CAPACITY = 1000  # 每個交易對/時間框架保留的K線數量
+HISTORY_DIR = "kline_history"  # 回測與研究用的長期歷史K線庫 (kline_history.py，可記憶體映射的欄式 .npy)
+HISTORY_DOWNLOAD_WORKERS = 4  # 並行下載歷史K線的執行緒數 (請求仍受 market 類別的速率額度限制)
+HISTORY_SEGMENT_PAGES = 20  # 每個下載區段 (續傳斷點) 包含的分頁數，每頁 1000 根K線
+IO_THREAD_POOL_SIZE = 8  # 每個 tick 並行讀取 (K線/持倉/餘額) 的執行緒數
+# Discord 通知設定
+DISCORD_BATCH_WINDOW_SECONDS = 1.0  # 合併通知的時間窗 (秒)，窗內的訊息以單次多 Embed 發送
+DISCORD_DEDUPE_WINDOW_SECONDS = 60  # 相同訊息在此秒數內只發送一次，其餘合併為重複次數
+DISCORD_DEDUPE_TYPES = ("error", "status_update")  # 只有這些類型的通知會去重；成交通知與 force_send 訊息永遠照發
+DISCORD_FLUSH_TIMEOUT_SECONDS = 10  # 關閉時等待通知送出的最長秒數
+# 圖表渲染設定
+CHART_DPI = 100  # 一般圖表解析度
+CHART_LOW_RES = False  # 低解析度模式 (較小的圖與較少的K線，渲染與上傳更快)
+CHART_LOW_RES_DPI = 60  # 低解析度模式的圖表解析度
+CHART_LOW_RES_BARS = 60  # 低解析度模式只繪製最近的K線數量
+CHART_CACHE_SIZE = 16  # 以最後一根K線為鍵的 PNG 快取數量
+# 帳戶快照設定
+ACCOUNT_SNAPSHOT_TTL_SECONDS = 5  # 餘額/持倉快照的有效秒數 (同一 tick 內共用，下單後立即失效)
+# WebSocket 行情設定
+MARKET_WS_ENABLED = True  # 以 WebSocket 接收K線與最新價，取代每分鐘輪詢
+MARKET_WS_URL = "wss://stream.binance.com:9443/ws"  # 與K線數據來源 (ccxt Binance) 相同的交易所
+MARKET_WS_STALE_SECONDS = 10  # 超過此秒數未收到推送即視為中斷，改回 REST 輪詢
+MARKET_WS_RECONNECT_MAX_SECONDS = 60  # 重連等待的最長秒數 (指數退避)
+MARKET_WS_MIN_WAKE_SECONDS = 5  # 串流觸發策略評估的最短間隔，避免頻繁查詢帳戶
+MARKET_WS_BASE_TIMEFRAME = None  # 設定 (例如 "1m") 時只訂閱這個時間框架，TIMEFRAME 與 RESAMPLE_TIMEFRAMES 的K線在本地重新取樣產生
+RESAMPLE_TIMEFRAMES = []  # 另外維護的時間框架 (例 ["1h", "1d"])，供多時間框架條件使用；設定基礎時間框架時不增加任何請求
+# WebSocket 帳戶串流設定 (Bitunix 私有頻道)
+ACCOUNT_WS_ENABLED = True  # 訂閱持倉/訂單/餘額推送，串流正常時持倉與餘額直接讀取記憶體鏡像，不再輪詢 REST
+ACCOUNT_WS_URL = "wss://fapi.bitunix.com/private/"  # Bitunix 合約私有頻道
+ACCOUNT_WS_PING_SECONDS = 15  # 應用層 ping 間隔 (Bitunix 要求客戶端定期 ping)
+ACCOUNT_WS_STALE_SECONDS = 45  # 超過此秒數未收到任何訊息 (含 pong) 即視為中斷，改回 REST 查詢
+ACCOUNT_WS_RECONCILE_SECONDS = 300  # 以 REST 校正鏡像的間隔 (秒)，修正遺漏的推送
+# 多交易對設定
+PORTFOLIO_SYMBOLS = []  # 同時交易的交易對及個別覆寫的設定 (空白時只交易上方的 SYMBOL)，例: [{"SYMBOL": "BTCUSDT", "LEVERAGE": 5}, {"SYMBOL": "SOLUSDT", "TIMEFRAME": "1h"}]
+PORTFOLIO_MAX_PARALLEL_TICKS = 8  # 同時執行 tick 的交易對數量
+BITUNIX_MAX_REQUESTS_PER_SECOND = 10  # 所有交易對共用的 REST 請求速率上限 (每秒)
+# 請求速率治理 (rate_governor)
+RATE_LIMITS = {"trade": (10, 10), "account": (10, 10), "market": (10, 10), "webhook": (0.5, 5)}  # 各端點類別的 (每秒請求數, 突發上限)，webhook 為 Discord
+RATE_PRIORITY_RESERVE = {"trade": 0, "account": 2, "market": 4}  # 共用 Bitunix 預算中低優先請求必須留下的令牌數 (下單為 0，永遠最優先)
+RATE_BACKOFF_MIN_FACTOR = 0.1  # 收到 429 後速率最多降到設定值的比例
+RATE_RECOVERY_PER_SECOND = 0.05  # 沒有 429 時每秒恢復的速率比例 (約 20 秒從一半恢復到全速)
+# 排程設定
+SCHEDULE_CLOSE_DELAY_SECONDS = 2  # K線收盤後延遲多少秒執行完整策略 (等待交易所完成收盤K線)
+SCHEDULE_JITTER_SECONDS = 15  # 週期任務的隨機抖動秒數 (錯開多個任務與多個程序的請求)
+BALANCE_CHECK_INTERVAL_SECONDS = 300  # 餘額檢查間隔（秒）
+# 監控指標設定
+METRICS_ENABLED = True  # 記錄各階段耗時、HTTP 狀態與重試次數
+METRICS_PORT = 9108  # Prometheus 指標端點 (http://127.0.0.1:9108/metrics)，0 表示不啟動
+METRICS_JSONL_PATH = ""  # 定期附加指標快照的 JSONL 檔案，空白表示不寫入
+METRICS_JSONL_INTERVAL_SECONDS = 60  # JSONL 快照間隔（秒）
+METRICS_JSONL_MAX_BYTES = 10 * 1024 * 1024  # JSONL 檔案超過此大小時輪替 (保留一份 .1 舊檔)
+# 日誌設定
+LOG_LEVEL = "INFO"  # 日誌等級 (DEBUG 會輸出完整的 API 響應與請求內容)
+LOG_LEVELS = {}  # 個別子系統的等級覆寫，例: {"discord": "DEBUG", "bitunix": "WARNING"}
+LOG_CONSOLE = True  # 輸出到主控台
+LOG_FILE = "logs/bot.log"  # 日誌檔路徑 (依大小輪替)，空白表示不寫入檔案
+LOG_FORMAT = "text"  # "text" 或 "json" (每行一筆 JSON，供日誌收集器解析)
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 日誌檔超過此大小時輪替
+LOG_BACKUP_COUNT = 5  # 保留的舊日誌檔數量
+# 狀態日誌設定
+JOURNAL_PATH = "state_journal.db"  # 持倉記憶 (進場類型、止損價、positionId) 與勝負統計的 SQLite 日誌 (取代 stats.json)
+JOURNAL_SYNCHRONOUS = "NORMAL"  # WAL 模式的同步等級: NORMAL 只在檢查點 fsync (程序崩潰不遺失)，FULL 每次提交都 fsync
+JOURNAL_CHECKPOINT_SECONDS = 60  # 最多每隔多少秒執行一次檢查點 (fsync)
+JOURNAL_SNAPSHOT_EVERY = 100  # 每個交易對每隔多少筆事件寫入一次狀態快照
+# 交易帳本設定
+LEDGER_PATH = "trade_ledger.db"  # 已平倉交易的本地帳本 (從 Bitunix 歷史持倉增量同步，含交易所端觸發的止盈止損)
+LEDGER_SYNC_INTERVAL_SECONDS = 900  # 定期同步歷史持倉的間隔（秒），平倉後也會立即同步
+LEDGER_SYNC_PAGE_SIZE = 100  # 每次請求的歷史持倉筆數
+LEDGER_SYNC_LOOKBACK_DAYS = 90  # 首次同步回溯的天數
+# 下單設定
+ORDER_MAX_ATTEMPTS = 3  # 下單請求的最多嘗試次數 (逾時或 5xx/429 時以同一個 clientId 重送，不會重複成交)
+ORDER_RETRY_BACKOFF_SECONDS = 0.25  # 重試的初始等待秒數 (每次加倍，另加隨機抖動)
+ORDER_TIMEOUT_SECONDS = (3.05, 5)  # 下單請求的 (連線逾時, 讀取逾時) 秒
+ORDER_POSITION_POLL_INTERVAL_SECONDS = 0.1  # 下單後輪詢持倉以取得 positionId 的間隔
+ORDER_POSITION_POLL_TIMEOUT_SECONDS = 3  # 輪詢 positionId 的最長秒數
+# 交易對規格快取
+INSTRUMENT_SPEC_PATH = "instrument_specs.json"  # Bitunix 交易對規格 (數量精度、最小/最大數量、價格精度、最大槓桿) 的磁碟副本
+INSTRUMENT_SPEC_TTL_SECONDS = 3600  # 規格的有效秒數，過期後重新查詢 (查詢失敗時沿用舊規格)
+INSTRUMENT_SPEC_RETRY_SECONDS = 60  # 查詢失敗後至少間隔多少秒才重試，期間不在下單路徑上重複查詢
@@ -0,0 +1,260 @@
+import json
+import os
+import queue
+import threading
+import time
+
+import requests
+
+import metrics
+from config import DISCORD_BATCH_WINDOW_SECONDS, DISCORD_DEDUPE_WINDOW_SECONDS, DISCORD_FLUSH_TIMEOUT_SECONDS
+from bot_logger import get_logger
+from rate_governor import get_rate_governor
+
+log = get_logger("discord")
+
+MAX_EMBEDS_PER_POST = 10  # Discord webhook 單次最多 10 個 Embed
+MAX_EMBED_CHARS_PER_POST = 6000  # Discord 限制單則訊息所有 Embed 的字數總和
+MAX_SEND_ATTEMPTS = 5
+
+
+class NotificationJob:
+    """
+    一則待發送的通知。
+
+    build(context) 在背景執行緒中產生 Embed 字典；context 為同一批次共用的字典，
+    可用來快取批次內共用的查詢結果 (例如持倉狀態)，避免每則訊息各查一次。
+    """
+    __slots__ = ("build", "dedupe_key", "attachment", "image_path", "created")
+
+    def __init__(self, build, dedupe_key=None, attachment=None, image_path=None):
+        self.build = build
+        self.dedupe_key = dedupe_key
+        self.attachment = attachment  # (檔名, bytes) 或 None
+        self.image_path = image_path  # 發送成功後需刪除的暫存圖片
+        self.created = time.time()
+
+
+def _embed_length(embed):
+    total = len(embed.get("title", "")) + len(embed.get("description", ""))
+    for field in embed.get("fields", []):
+        total += len(field.get("name", "")) + len(field.get("value", ""))
+    return total
+
+
+class DiscordDispatcher:
+    """
+    背景 Discord Webhook 發送器。
+
+    submit() 只把通知放進佇列並立即返回，交易路徑不再等待 HTTP；
+    背景執行緒把短時間內的多則通知合併為單次多 Embed 發送，
+    在 DISCORD_DEDUPE_WINDOW_SECONDS 內壓縮重複訊息 (例如連續的下單錯誤)，
+    每次發送前向共用速率治理器取得 webhook 額度，429 的 retry_after 與用完的剩餘額度
+    也回報給治理器，由它決定下一次發送的時間。flush() 在限定時間內送出佇列中的所有訊息。
+    """
+
+    def __init__(self, webhook_url, batch_window=DISCORD_BATCH_WINDOW_SECONDS, dedupe_window=DISCORD_DEDUPE_WINDOW_SECONDS):
+        self.webhook_url = webhook_url
+        self.batch_window = batch_window
+        self.dedupe_window = dedupe_window
+        self.session = requests.Session()
+        self._queue = queue.Queue()
+        self._recent = {}  # dedupe_key -> [首次發送時間, 被壓縮的次數, 原始 job]
+        self._flushing = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.sent_posts = 0
+        self.suppressed = 0
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="discord-dispatcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, job):
+        """將通知加入佇列 (不阻塞)，重複訊息在時間窗內只發送一次"""
+        if job.dedupe_key is not None and job.attachment is None:
+            now = time.time()
+            with self._lock:
+                recent = self._recent.get(job.dedupe_key)
+                if recent and now - recent[0] < self.dedupe_window:
+                    recent[1] += 1
+                    self.suppressed += 1
+                    return False
+                self._recent[job.dedupe_key] = [now, 0, job]
+        self._ensure_started()
+        self._queue.put(job)
+        return True
+
+    def _collect_batch(self):
+        """取出一批通知: 等待第一則，之後在批次時間窗內持續收集，直到達到 Embed 數量上限"""
+        try:
+            batch = [self._queue.get(timeout=1.0)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.batch_window
+        while len(batch) < MAX_EMBEDS_PER_POST:
+            remaining = 0 if self._flushing.is_set() else deadline - time.time()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _expired_duplicates(self):
+        """時間窗結束後，為被壓縮的重複訊息補發一則摘要"""
+        now = time.time()
+        summaries = []
+        with self._lock:
+            for key, (first_time, count, job) in list(self._recent.items()):
+                if now - first_time >= self.dedupe_window:
+                    del self._recent[key]
+                    if count:
+                        summaries.append((job, count, now - first_time))
+        return summaries
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            queued = len(batch)  # 重複摘要由背景執行緒自行產生，不佔佇列計數
+            for job, count, elapsed in self._expired_duplicates():
+                batch.append(NotificationJob(_repeat_summary_builder(job, count, elapsed)))
+            if not batch:
+                continue
+            try:
+                self._send_batch(batch)
+            except Exception as e:
+                log.exception("背景發送失敗: %s", e)
+            finally:
+                for _ in range(queued):
+                    self._queue.task_done()
+
+    @metrics.timed("discord_send")
+    def _send_batch(self, batch):
+        context = {}
+        posts = []
+        embeds, files, jobs, chars = [], [], [], 0
+        for job in batch:
+            try:
+                embed = job.build(context)
+            except Exception as e:
+                log.exception("產生 Embed 失敗: %s", e)
+                continue
+            if job.image_path and not job.attachment:
+                try:
+                    with open(job.image_path, "rb") as f:
+                        job.attachment = (os.path.basename(job.image_path), f.read())
+                except OSError as e:
+                    log.error("讀取圖片文件 %s 失敗: %s", job.image_path, e)
+            length = _embed_length(embed)
+            if embeds and (len(embeds) >= MAX_EMBEDS_PER_POST or chars + length > MAX_EMBED_CHARS_PER_POST):
+                posts.append((embeds, files, jobs))
+                embeds, files, jobs, chars = [], [], [], 0
+            if job.attachment:
+                filename, data = job.attachment
+                # 同一批次內的附件檔名需唯一，Embed 以 attachment:// 參照
+                filename = f"{len(files)}_{filename}"
+                embed["image"] = {"url": f"attachment://{filename}"}
+                files.append((filename, data))
+            embeds.append(embed)
+            jobs.append(job)
+            chars += length
+        if embeds:
+            posts.append((embeds, files, jobs))
+        for embeds, files, jobs in posts:
+            if self._post(embeds, files):
+                for job in jobs:
+                    if job.image_path:
+                        _remove_file(job.image_path)
+
+    def _post(self, embeds, files):
+        """發送一次 Webhook 請求，遇到 429 依 retry_after 等待後重試"""
+        payload = {"embeds": embeds}
+        governor = get_rate_governor()
+        for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+            governor.acquire("webhook", shared=False)
+            try:
+                if files:
+                    payload["attachments"] = [{"id": i, "filename": name} for i, (name, _) in enumerate(files)]
+                    multipart = [(f"files[{i}]", (name, data, "image/png")) for i, (name, data) in enumerate(files)]
+                    multipart.append(("payload_json", (None, json.dumps(payload), "application/json")))
+                    response = self.session.post(self.webhook_url, files=multipart, timeout=15)
+                else:
+                    response = self.session.post(self.webhook_url, json=payload, timeout=10)
+            except requests.exceptions.RequestException as e:
+                metrics.inc("discord_webhook_responses_total", status="error")
+                log.warning("請求錯誤 (第 %s/%s 次): %s", attempt, MAX_SEND_ATTEMPTS, e)
+                time.sleep(min(2 ** attempt, 30))
+                continue
+
+            metrics.inc("discord_webhook_responses_total", status=str(response.status_code))
+            if response.status_code == 429:
+                governor.throttle("webhook", _retry_after_seconds(response), shared=False)
+                continue
+            if response.status_code >= 500:
+                log.warning("伺服器錯誤 %s (第 %s/%s 次)", response.status_code, attempt, MAX_SEND_ATTEMPTS)
+                time.sleep(min(2 ** attempt, 30))
+                continue
+            if response.status_code >= 400:
+                log.error("HTTP錯誤 - 發送 Discord Embed 失敗: %s, 響應: %s", response.status_code, response.text[:200])
+                return False
+
+            self.sent_posts += 1
+            # 剩餘額度用完時讓下一批等到重置，避免直接收到 429
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                governor.pause("webhook", float(response.headers.get("X-RateLimit-Reset-After", 0) or 0))
+            log.debug("已發送 %s 則 Embed (附件 %s 個)，狀態碼: %s", len(embeds), len(files), response.status_code)
+            return True
+        log.error("已達最大重試次數，放棄發送 %s 則 Embed", len(embeds))
+        return False
+
+    def flush(self, timeout=DISCORD_FLUSH_TIMEOUT_SECONDS):
+        """在 timeout 秒內盡量送出佇列中的所有通知，返回是否已全部送出"""
+        if self._thread is None:
+            return True
+        deadline = time.time() + timeout
+        self._flushing.set()
+        try:
+            while self._queue.unfinished_tasks:
+                if time.time() >= deadline:
+                    log.warning("flush 逾時，仍有 %s 則通知未送出", self._queue.unfinished_tasks)
+                    return False
+                time.sleep(0.05)
+            return True
+        finally:
+            self._flushing.clear()
+
+
+def _retry_after_seconds(response):
+    try:
+        return float(response.json().get("retry_after", 1.0))
+    except (ValueError, AttributeError):
+        try:
+            return float(response.headers.get("Retry-After", 1.0))
+        except (TypeError, ValueError):
+            return 1.0
+
+
+def _repeat_summary_builder(job, count, elapsed):
+    def build(context):
+        embed = job.build(context)
+        embed["description"] = f"{embed.get('description', '')}\n🔁 **此訊息在 {elapsed:.0f} 秒內另外重複了 {count} 次**"
+        return embed
+    return build
+
+
+def _remove_file(path, attempts=3, delay=1.0):
+    """刪除已發送的暫存圖片 (在背景執行緒中重試，不影響交易路徑)"""
+    for i in range(attempts):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+            return True
+        except OSError as e:
+            if i < attempts - 1:
+                time.sleep(delay)
+            else:
+                log.warning("最終刪除失敗: %s...，保留文件: %s", str(e)[:100], path)
+    return False
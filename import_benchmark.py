@@ -0,0 +1,89 @@
+"""
+冷啟動匯入時間基準測試: 在全新的 Python 程序中匯入指定模組，統計匯入耗時與載入的重型套件。
+
+每輪啟動一個子程序 (python -X importtime -c "import 模組")，在空的暫存目錄中執行，
+因此也能檢查匯入時是否有副作用 (例如建立狀態日誌或快取檔案)。報告包含:
+    wall          子程序中 import 敘述的牆鐘時間 (ms)
+    heavy         匯入後已載入的重型套件 (ccxt、pandas、matplotlib、discord 等)
+    side effects  匯入後暫存目錄中出現的檔案
+    top modules   累計匯入時間最長的模組 (取自 -X importtime，最後一輪)
+
+執行:
+    python import_benchmark.py
+    python import_benchmark.py trading_bot portfolio --runs 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+HEAVY_MODULES = ("ccxt", "pandas", "matplotlib", "mplfinance", "discord", "talib", "aiohttp")
+PROBE = """
+import sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import {module}
+print("wall", (time.perf_counter() - started) * 1000)
+print("heavy", ",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def measure(module, root):
+    """在全新的子程序與空目錄中匯入 module 一次，返回 (耗時 ms, 已載入的重型套件, 新建立的檔案, importtime 輸出)"""
+    with tempfile.TemporaryDirectory() as workdir:
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(root=root, module=module, heavy=HEAVY_MODULES)],
+                              cwd=workdir, capture_output=True, text=True, timeout=120)
+        if proc.returncode != 0:
+            raise RuntimeError(f"匯入 {module} 失敗:\n{proc.stderr[-2000:]}")
+        created = sorted(os.listdir(workdir))
+    fields = dict(line.split(" ", 1) for line in proc.stdout.splitlines() if " " in line)
+    heavy = [name for name in fields.get("heavy", "").strip().split(",") if name]
+    return float(fields["wall"]), heavy, created, proc.stderr
+
+
+def top_modules(importtime_output, count):
+    """解析 -X importtime 的輸出，返回累計耗時最長的頂層套件 [(模組, ms)]"""
+    totals = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            micros = int(cumulative.split(":")[-1])
+        except ValueError:
+            continue  # 表頭
+        name = name.strip()
+        package = name.split(".")[0]
+        if name == package:
+            totals[package] = max(totals.get(package, 0), micros)
+    return [(name, micros / 1000) for name, micros in sorted(totals.items(), key=lambda item: -item[1])[:count]]
+
+
+def run_benchmark(modules, runs=5, top=8):
+    root = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in modules:
+        samples, heavy, created, output = [], [], [], ""
+        for _ in range(runs):
+            wall, heavy, created, output = measure(module, root)
+            samples.append(wall)
+        values = np.asarray(samples)
+        results[module] = values
+        print(f"\nimport {module} x {runs} 輪 (單位 ms)")
+        print(f"  wall          p50 {np.percentile(values, 50):.1f}  min {values.min():.1f}  max {values.max():.1f}")
+        print(f"  heavy         {', '.join(heavy) or '無'}")
+        print(f"  side effects  {', '.join(created) or '無'}")
+        print("  top modules   " + ", ".join(f"{name} {ms:.1f}" for name, ms in top_modules(output, top)))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="冷啟動匯入時間基準測試")
+    parser.add_argument("modules", nargs="*", default=["trading_bot", "portfolio"], help="要測試的模組")
+    parser.add_argument("--runs", type=int, default=5, help="每個模組的子程序數量")
+    parser.add_argument("--top", type=int, default=8, help="列出累計匯入時間最長的套件數量")
+    args = parser.parse_args()
+    run_benchmark(args.modules, args.runs, args.top)
@@ -0,0 +1,285 @@
+import math
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class IndicatorValues:
+    """單根K線的指標結果"""
+    __slots__ = ("timestamp", "close", "rsi", "atr", "highest_break")
+
+    def __init__(self, timestamp, close, rsi, atr, highest_break):
+        self.timestamp = timestamp
+        self.close = close
+        self.rsi = rsi
+        self.atr = atr
+        self.highest_break = highest_break
+
+    def __repr__(self):
+        return f"IndicatorValues(ts={self.timestamp}, close={self.close}, rsi={self.rsi}, atr={self.atr}, highest_break={self.highest_break})"
+
+
+class StreamingIndicators:
+    """
+    增量計算 RSI / ATR / 突破高點的指標引擎。
+
+    RSI 與 ATR 採用與 TA-Lib 相同的 Wilder 平滑 (前 N 根取簡單平均作為種子)，
+    突破高點 (highest_break) 為前 breakout_len 根K線最高價的最大值 (等同 high.shift(1).rolling(n).max())，
+    以單調遞減 deque 維護。已收盤K線以 update(..., closed=True) 提交狀態，
+    形成中的K線以 closed=False 預覽，不改動狀態，每次更新皆為 O(1)。
+    """
+
+    def __init__(self, rsi_len, atr_len, breakout_len):
+        self.rsi_len = rsi_len
+        self.atr_len = atr_len
+        self.breakout_len = breakout_len
+        self.lock = threading.Lock()  # 交易 tick 與行情串流回呼共用同一個引擎時，sync 需在此鎖內執行
+        self.reset()
+
+    def reset(self):
+        self.count = 0  # 已提交的K線數量
+        self.last_timestamp = None
+        self.prev_close = None
+        self.gain_sum = 0.0  # RSI 種子期間的累計漲幅
+        self.loss_sum = 0.0  # RSI 種子期間的累計跌幅
+        self.avg_gain = None
+        self.avg_loss = None
+        self.tr_sum = 0.0  # ATR 種子期間的累計真實波幅
+        self.atr = None
+        self.highs = deque()  # (K線序號, 最高價)，最高價單調遞減
+        self.last_values = None  # 最後一根已提交K線的指標值 (sync 的陣列止於該K線時直接返回)
+
+    def _compute(self, high, low, close):
+        """以目前已提交的狀態計算下一根K線的指標，返回 (rsi, atr, highest_break, 新狀態)"""
+        n = self.count
+        avg_gain, avg_loss, gain_sum, loss_sum = self.avg_gain, self.avg_loss, self.gain_sum, self.loss_sum
+        atr, tr_sum = self.atr, self.tr_sum
+        rsi = math.nan
+        atr_out = math.nan
+
+        if n > 0:
+            change = close - self.prev_close
+            gain = change if change > 0 else 0.0
+            loss = -change if change < 0 else 0.0
+            if n < self.rsi_len:
+                gain_sum += gain
+                loss_sum += loss
+            elif n == self.rsi_len:
+                avg_gain = (gain_sum + gain) / self.rsi_len
+                avg_loss = (loss_sum + loss) / self.rsi_len
+            else:
+                avg_gain = (avg_gain * (self.rsi_len - 1) + gain) / self.rsi_len
+                avg_loss = (avg_loss * (self.rsi_len - 1) + loss) / self.rsi_len
+            if avg_gain is not None:
+                total = avg_gain + avg_loss
+                rsi = 100.0 * avg_gain / total if total != 0 else 0.0
+
+            tr = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+            if n < self.atr_len:
+                tr_sum += tr
+            elif n == self.atr_len:
+                atr = (tr_sum + tr) / self.atr_len
+            else:
+                atr = (atr * (self.atr_len - 1) + tr) / self.atr_len
+            if atr is not None:
+                atr_out = atr
+
+        # 移除已超出回看範圍的最高價，deque 首位即為前 breakout_len 根的最高價
+        highs = self.highs
+        while highs and highs[0][0] < n - self.breakout_len:
+            highs.popleft()
+        highest_break = highs[0][1] if n >= self.breakout_len else math.nan
+
+        return rsi, atr_out, highest_break, (avg_gain, avg_loss, gain_sum, loss_sum, atr, tr_sum)
+
+    def update(self, timestamp, high, low, close, closed=True):
+        """
+        餵入一根K線並返回其指標值。
+
+        參數:
+            closed (bool): True 表示K線已收盤並提交狀態；False 表示形成中的K線，只預覽不提交
+        """
+        rsi, atr, highest_break, state = self._compute(high, low, close)
+        values = IndicatorValues(timestamp, close, rsi, atr, highest_break)
+        if closed:
+            self.avg_gain, self.avg_loss, self.gain_sum, self.loss_sum, self.atr, self.tr_sum = state
+            highs = self.highs
+            while highs and highs[-1][1] <= high:
+                highs.pop()
+            highs.append((self.count, high))
+            self.prev_close = close
+            self.count += 1
+            self.last_timestamp = timestamp
+            self.last_values = values
+        return values
+
+    def sync(self, ohlcv):
+        """
+        以K線陣列 (欄位同 fetch_ohlcv) 同步引擎: 只提交尚未處理的已收盤K線，最後一根視為形成中K線預覽。
+        最後一根已經提交過 (例如行情回呼先同步了更新的數據，之後再以截至剛收盤K線的陣列評估) 時返回其提交時的指標值。
+        若陣列與引擎狀態無法銜接 (例如首次使用或長時間中斷)，則重置後重新計算。
+
+        返回:
+            IndicatorValues: 最後一根K線的指標值；陣列為空時返回尚未就緒的預覽 (指標皆為 NaN，不改動狀態)
+        """
+        if len(ohlcv) == 0:
+            return IndicatorValues(self.last_timestamp, self.prev_close if self.prev_close is not None else math.nan,
+                                   math.nan, math.nan, math.nan)
+        timestamps = ohlcv[:, 0]
+        if self.last_timestamp is None:
+            start = 0
+        else:
+            pos = int(np.searchsorted(timestamps, self.last_timestamp))
+            if pos >= len(timestamps) or timestamps[pos] != self.last_timestamp:
+                self.reset()
+                start = 0
+            else:
+                start = pos + 1
+        if start == len(ohlcv) and self.last_values is not None:
+            return self.last_values
+        # 以 tolist() 一次取出 Python float，避免逐列建立陣列視圖與 NumPy 純量 (通常只有形成中的一根)
+        last = len(ohlcv) - 1
+        for timestamp, _, high, low, close, _ in ohlcv[start:last].tolist():
+            self.update(timestamp, high, low, close, closed=True)
+        timestamp, _, high, low, close, _ = ohlcv[last].tolist()
+        return self.update(timestamp, high, low, close, closed=False)
+
+    def snapshot(self):
+        """匯出可 JSON 序列化的引擎狀態"""
+        return {
+            "rsi_len": self.rsi_len,
+            "atr_len": self.atr_len,
+            "breakout_len": self.breakout_len,
+            "count": self.count,
+            "last_timestamp": self.last_timestamp,
+            "prev_close": self.prev_close,
+            "gain_sum": self.gain_sum,
+            "loss_sum": self.loss_sum,
+            "avg_gain": self.avg_gain,
+            "avg_loss": self.avg_loss,
+            "tr_sum": self.tr_sum,
+            "atr": self.atr,
+            "highs": [list(item) for item in self.highs],
+            "last_values": [getattr(self.last_values, name) for name in IndicatorValues.__slots__] if self.last_values else None,
+        }
+
+    @classmethod
+    def restore(cls, snapshot):
+        """由 snapshot() 的結果還原引擎"""
+        engine = cls(snapshot["rsi_len"], snapshot["atr_len"], snapshot["breakout_len"])
+        for key in ("count", "last_timestamp", "prev_close", "gain_sum", "loss_sum", "avg_gain", "avg_loss", "tr_sum", "atr"):
+            setattr(engine, key, snapshot[key])
+        engine.highs = deque((int(i), float(h)) for i, h in snapshot["highs"])
+        if snapshot.get("last_values"):
+            engine.last_values = IndicatorValues(*snapshot["last_values"])
+        return engine
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_indicator_engine(key, rsi_len, atr_len, breakout_len):
+    """取得 (或建立) 指定 key (通常為 (交易對, 時間框架)) 與參數的指標引擎"""
+    full_key = (key, rsi_len, atr_len, breakout_len)
+    engine = _engines.get(full_key)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(full_key)
+            if engine is None:
+                engine = StreamingIndicators(rsi_len, atr_len, breakout_len)
+                _engines[full_key] = engine
+    return engine
+
+
+def batch_rsi(close, rsi_len):
+    """整批計算 RSI (TA-Lib，與增量引擎結果一致)，供回測使用"""
+    import talib
+    return talib.RSI(np.ascontiguousarray(close, dtype=np.float64), timeperiod=rsi_len)
+
+
+def batch_atr(high, low, close, atr_len):
+    """整批計算 ATR (TA-Lib)，供回測使用"""
+    import talib
+    return talib.ATR(np.ascontiguousarray(high, dtype=np.float64), np.ascontiguousarray(low, dtype=np.float64),
+                     np.ascontiguousarray(close, dtype=np.float64), timeperiod=atr_len)
+
+
+def batch_highest_break(high, breakout_len):
+    """整批計算前 breakout_len 根K線的最高價 (不含當根)，等同 high.shift(1).rolling(n).max()"""
+    out = np.full(len(high), np.nan)
+    if len(high) > breakout_len:
+        windows = np.lib.stride_tricks.sliding_window_view(high[:-1], breakout_len)
+        out[breakout_len:] = windows.max(axis=1)
+    return out
+
+
+def verify_talib_parity(ohlcv, rsi_len, atr_len, breakout_len, tolerance=1e-8):
+    """
+    以 TA-Lib / pandas 的整批計算結果核對增量引擎，返回各指標的最大絕對誤差。
+    誤差超過 tolerance 時拋出 AssertionError。
+    """
+    import talib
+    import pandas as pd
+
+    high, low, close = ohlcv[:, 2], ohlcv[:, 3], ohlcv[:, 4]
+    expected = {
+        "rsi": talib.RSI(close, timeperiod=rsi_len),
+        "atr": talib.ATR(high, low, close, timeperiod=atr_len),
+        "highest_break": pd.Series(high).shift(1).rolling(window=breakout_len).max().to_numpy(),
+    }
+
+    engine = StreamingIndicators(rsi_len, atr_len, breakout_len)
+    actual = {name: np.empty(len(ohlcv)) for name in expected}
+    for i, row in enumerate(ohlcv):
+        # 每根K線先以形成中狀態預覽一次，確認預覽不影響之後的提交結果
+        engine.update(row[0], row[2], row[3], row[4], closed=False)
+        values = engine.update(row[0], row[2], row[3], row[4], closed=True)
+        actual["rsi"][i], actual["atr"][i], actual["highest_break"][i] = values.rsi, values.atr, values.highest_break
+
+    errors = {}
+    for name, exp in expected.items():
+        act = actual[name]
+        if not np.array_equal(np.isnan(exp), np.isnan(act)):
+            raise AssertionError(f"{name} 的 NaN 位置與 TA-Lib 不一致")
+        mask = ~np.isnan(exp)
+        errors[name] = float(np.max(np.abs(exp[mask] - act[mask]))) if mask.any() else 0.0
+        if errors[name] > tolerance:
+            raise AssertionError(f"{name} 與 TA-Lib 誤差過大: {errors[name]}")
+
+    # 快照還原後的結果需與原引擎一致
+    restored = StreamingIndicators.restore(engine.snapshot())
+    row = ohlcv[-1]
+    a = engine.update(row[0] + 1, row[2], row[3], row[4] * 1.01, closed=False)
+    b = restored.update(row[0] + 1, row[2], row[3], row[4] * 1.01, closed=False)
+    if (a.rsi, a.atr, a.highest_break) != (b.rsi, b.atr, b.highest_break):
+        raise AssertionError("快照還原後的指標結果不一致")
+
+    # 行情回呼先以含新K線的陣列同步 (提交剛收盤的K線)，之後的收盤評估只同步到剛收盤的K線: 結果需等於整批計算值
+    for end in (len(ohlcv) // 2, len(ohlcv) - 1):
+        engine = StreamingIndicators(rsi_len, atr_len, breakout_len)
+        engine.sync(ohlcv[:end + 1])
+        values = engine.sync(ohlcv[:end])
+        for name, exp in expected.items():
+            act = getattr(values, name)
+            if not (np.isnan(exp[end - 1]) and np.isnan(act)) and abs(exp[end - 1] - act) > tolerance:
+                raise AssertionError(f"先同步新K線後再評估收盤K線時 {name} 不一致: {act} != {exp[end - 1]}")
+    return errors
+
+
+if __name__ == "__main__":
+    # 以隨機漫步K線核對 TA-Lib 一致性: python indicators.py
+    from config import RSI_LEN, ATR_LEN, BREAKOUT_LOOKBACK
+
+    rng = np.random.default_rng(42)
+    n = 5000
+    close = 2000 + np.cumsum(rng.normal(0, 10, n))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    high = np.maximum(open_, close) + rng.uniform(0, 8, n)
+    low = np.minimum(open_, close) - rng.uniform(0, 8, n)
+    ts = np.arange(n, dtype=np.float64) * 14_400_000
+    data = np.column_stack([ts, open_, high, low, close, rng.uniform(100, 1000, n)])
+    for params in [(RSI_LEN, ATR_LEN, BREAKOUT_LOOKBACK), (14, 14, 20), (2, 1, 1)]:
+        print(f"參數 {params} 最大誤差: {verify_talib_parity(data, *params)}")
+    print("增量指標引擎與 TA-Lib 結果一致")
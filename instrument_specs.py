@@ -0,0 +1,212 @@
+"""
+交易對規格快取: 從 Bitunix trading_pairs 端點載入數量精度、最小/最大下單數量、價格精度與最大槓桿，
+讓倉位計算與所有下單、止盈止損請求第一次送出就是交易所接受的數值。
+
+* 一次查詢取得所有交易對的規格，保存在記憶體並寫入磁碟副本 (INSTRUMENT_SPEC_PATH)；
+  重啟時磁碟副本未過期就直接使用，不必等待查詢。
+* 規格超過 INSTRUMENT_SPEC_TTL_SECONDS 時重新查詢；查詢失敗時沿用舊規格，
+  INSTRUMENT_SPEC_RETRY_SECONDS 內不再重試，下單路徑不會因此多出請求。
+* 交易所沒有提供規格的交易對退回交易對設定的 QUANTITY_PRECISION (不檢查數量上下限)。
+"""
+import json
+import math
+import os
+import threading
+import time
+
+from config import INSTRUMENT_SPEC_PATH, INSTRUMENT_SPEC_TTL_SECONDS, INSTRUMENT_SPEC_RETRY_SECONDS, QUANTITY_PRECISION
+from bitunix_client import get_bitunix_client
+from bot_logger import get_logger
+
+log = get_logger("instruments")
+
+TRADING_PAIRS_PATH = "/api/v1/futures/market/trading_pairs"
+FALLBACK_PRICE_DECIMALS = 8  # 沒有價格精度時的格式化位數 (去除尾端的 0)
+
+
+def _float(value, default=None):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class InstrumentSpec:
+    """單一交易對的下單規格"""
+    __slots__ = ("symbol", "qty_precision", "min_qty", "max_qty", "price_precision", "max_leverage", "status")
+
+    def __init__(self, symbol, qty_precision, min_qty=0.0, max_qty=None, price_precision=None, max_leverage=None, status=None):
+        self.symbol = symbol
+        self.qty_precision = int(qty_precision)
+        self.min_qty = min_qty or 0.0
+        self.max_qty = max_qty
+        self.price_precision = price_precision
+        self.max_leverage = max_leverage
+        self.status = status
+
+    @classmethod
+    def from_api(cls, item):
+        """由 trading_pairs 回應的一筆資料建立 (basePrecision/quotePrecision 為數量/價格的小數位數)"""
+        price_precision = item.get("quotePrecision")
+        return cls(item["symbol"], int(item.get("basePrecision", QUANTITY_PRECISION)),
+                   min_qty=_float(item.get("minTradeVolume"), 0.0),
+                   max_qty=_float(item.get("maxMarketOrderVolume")),
+                   price_precision=int(price_precision) if price_precision is not None else None,
+                   max_leverage=_float(item.get("maxLeverage")),
+                   status=item.get("symbolStatus"))
+
+    @classmethod
+    def fallback(cls, symbol, quantity_precision=QUANTITY_PRECISION):
+        """交易所沒有提供規格時使用的設定值"""
+        return cls(symbol, quantity_precision)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @property
+    def tick_size(self):
+        return 10.0 ** -self.price_precision if self.price_precision is not None else None
+
+    def round_qty(self, qty):
+        """數量向下取到數量精度 (不超過可用資金)，並限制在最大下單數量內；低於最小下單數量時返回 0"""
+        step = 10.0 ** self.qty_precision
+        qty = math.floor(qty * step + 1e-9) / step
+        if self.max_qty:
+            qty = min(qty, self.max_qty)
+        return qty if qty >= self.min_qty and qty > 0 else 0.0
+
+    def format_qty(self, qty):
+        return f"{float(qty):.{self.qty_precision}f}"
+
+    def round_price(self, price):
+        """價格取到最接近的價格刻度"""
+        if self.price_precision is None:
+            return float(price)
+        return round(float(price), self.price_precision)
+
+    def format_price(self, price):
+        """價格格式化為交易所接受的字串 (例如 2965.43，而不是 str(float) 的 15 位小數)"""
+        if self.price_precision is None:
+            return f"{float(price):.{FALLBACK_PRICE_DECIMALS}f}".rstrip("0").rstrip(".")
+        return f"{float(price):.{self.price_precision}f}"
+
+    def clamp_leverage(self, leverage):
+        return min(leverage, self.max_leverage) if self.max_leverage else leverage
+
+
+class InstrumentSpecCache:
+    """
+    交易對規格快取 (整個程序共用)。
+
+    參數:
+        api_key / secret_key: 用來取得共用的 BitunixClient (trading_pairs 為公開端點，不簽名)
+        path (str): 磁碟副本路徑，空白表示不寫入磁碟
+        ttl (float): 規格的有效秒數
+    """
+
+    def __init__(self, api_key, secret_key, path=INSTRUMENT_SPEC_PATH, ttl=INSTRUMENT_SPEC_TTL_SECONDS,
+                 retry_interval=INSTRUMENT_SPEC_RETRY_SECONDS):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.path = path
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.specs = {}
+        self.missing = set()  # 最近一次查詢確認交易所沒有列出的交易對，下一次成功查詢前不再為它們重新查詢
+        self.loaded_at = 0.0  # 規格的查詢時間 (time.time()，從磁碟載入時為檔案中記錄的時間)
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+        self._load_disk()
+
+    def get(self, symbol, quantity_precision=QUANTITY_PRECISION):
+        """返回 symbol 的規格 (過期時先重新查詢)；沒有規格時返回以 quantity_precision 建立的預設規格"""
+        if time.time() - self.loaded_at > self.ttl or (symbol not in self.specs and symbol not in self.missing):
+            self.refresh()
+        spec = self.specs.get(symbol)
+        if spec is None and self.specs:
+            self.missing.add(symbol)
+        return spec if spec is not None else InstrumentSpec.fallback(symbol, quantity_precision)
+
+    def preload(self, symbols):
+        """啟動時載入規格並檢查所有要交易的交易對，返回缺少規格的交易對"""
+        if time.time() - self.loaded_at > self.ttl or any(symbol not in self.specs for symbol in symbols):
+            self.refresh()
+        missing = [symbol for symbol in symbols if symbol not in self.specs]
+        if missing and self.specs:
+            log.warning("交易所沒有 %s 的交易對規格，將使用設定的數量精度", ", ".join(missing))
+        for symbol in symbols:
+            spec = self.specs.get(symbol)
+            if spec is not None:
+                log.info("%s 規格: 數量精度 %d, 最小數量 %s, 最大數量 %s, 價格精度 %s, 最大槓桿 %s", symbol,
+                         spec.qty_precision, spec.min_qty, spec.max_qty, spec.price_precision, spec.max_leverage)
+        return missing
+
+    def refresh(self, force=False):
+        """從交易所重新查詢所有交易對的規格，返回是否成功 (距離上次嘗試不足 retry_interval 秒時不查詢)"""
+        with self._lock:
+            now = time.time()
+            if not force and now - self._last_attempt < self.retry_interval:
+                return False
+            self._last_attempt = now
+            try:
+                response = get_bitunix_client(self.api_key, self.secret_key).get(TRADING_PAIRS_PATH, signed=False)
+                response.raise_for_status()
+                result = response.json()
+                if result.get("code") != 0:
+                    raise ValueError(f"API 返回錯誤: {result.get('msg')} (code={result.get('code')})")
+                specs = {}
+                for item in result.get("data") or []:
+                    spec = InstrumentSpec.from_api(item)
+                    specs[spec.symbol] = spec
+            except Exception as e:
+                log.warning("查詢交易對規格失敗 (%s 秒內不重試，沿用%s): %s", self.retry_interval,
+                            "舊規格" if self.specs else "設定的數量精度", e)
+                return False
+            if not specs:
+                return False
+            self.specs, self.loaded_at = specs, now
+            self.missing = set()
+            self._save_disk()
+            log.debug("已載入 %d 個交易對規格", len(specs))
+            return True
+
+    def _save_disk(self):
+        """以原子替換方式寫入磁碟副本"""
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"loaded_at": self.loaded_at, "specs": [spec.to_dict() for spec in self.specs.values()]}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.error("寫入交易對規格快取失敗: %s", e)
+
+    def _load_disk(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.specs = {item["symbol"]: InstrumentSpec(**item) for item in data.get("specs", [])}
+            self.loaded_at = float(data.get("loaded_at", 0))
+            log.debug("從磁碟載入 %d 個交易對規格 (%.0f 秒前查詢)", len(self.specs), time.time() - self.loaded_at)
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            log.error("讀取交易對規格快取失敗: %s", e)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_instrument_specs(api_key, secret_key):
+    """取得 (或建立) 對應 API Key 的共用交易對規格快取"""
+    key = (api_key, secret_key)
+    cache = _caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(key)
+            if cache is None:
+                cache = _caches[key] = InstrumentSpecCache(api_key, secret_key)
+    return cache
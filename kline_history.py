@@ -0,0 +1,247 @@
+"""
+歷史K線庫: 以多執行緒分頁下載多年的K線，支援中斷後續傳，存成可直接記憶體映射的欄式檔案。
+
+檔案配置 (HISTORY_DIR/交易對/):
+    <時間框架>.npy      (N, 6) float64，欄位同 COLUMNS，以 Fortran (欄優先) 順序存放，每個欄位在檔案中連續。
+                        np.load(mmap_mode="r") 直接映射，不解析也不複製；回測取用單一欄位即為連續的記憶體
+    <時間框架>.json     中繼資料: 根數、起迄時間、缺口與整理時丟棄的重複/未對齊K線數量
+    <時間框架>.parts/   下載中的斷點: 每個完成的區段一個 .npy，中斷後重新執行只下載缺少的區段
+
+* 下載範圍切成固定的區段 (HISTORY_SEGMENT_PAGES 頁)，由 HISTORY_DOWNLOAD_WORKERS 個執行緒並行分頁，
+  請求與其他行情讀取共用 market 類別的速率額度。
+* 只下載庫中還沒有的部分 (最早一根之前與最後一根之後)，形成中的K線不寫入。
+* 所有區段完成後才整理: 依時間排序、去除重複 (保留較新下載的一筆)、丟棄未對齊時間框架的K線，
+  並記錄缺口 (交易所停機等造成的缺口會保留在 meta 中，不重複下載)。
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import HISTORY_DIR, HISTORY_DOWNLOAD_WORKERS, HISTORY_SEGMENT_PAGES
+from candle_store import COLUMNS, FETCH_PAGE_LIMIT, get_exchange, timeframe_to_ms
+from rate_governor import get_rate_governor
+from bot_logger import get_logger
+
+log = get_logger("history")
+
+
+def _save_atomic(path, array):
+    """以原子替換方式寫入 .npy (保留陣列的記憶體順序)"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class KlineArchive:
+    """
+    單一 (交易對, 時間框架) 的歷史K線庫。
+
+    參數:
+        root (str): 歷史庫根目錄
+        exchange: ccxt 交易所實例，預設使用 candle_store 的共用 Binance 實例
+    """
+
+    def __init__(self, trading_pair, timeframe, root=HISTORY_DIR, exchange=None):
+        self.trading_pair = trading_pair
+        self.timeframe = timeframe
+        self.tf_ms = timeframe_to_ms(timeframe)
+        self.exchange = exchange
+        directory = os.path.join(root, trading_pair.replace("/", ""))
+        self.data_path = os.path.join(directory, f"{timeframe}.npy")
+        self.meta_path = os.path.join(directory, f"{timeframe}.json")
+        self.parts_dir = os.path.join(directory, f"{timeframe}.parts")
+        self._lock = threading.Lock()
+
+    # === 載入 === #
+    def load(self, start=None, end=None):
+        """
+        以記憶體映射載入 [start, end) (ms) 的K線，返回唯讀的 (N, 6) 陣列視圖 (不複製)。
+        庫中沒有數據時返回空陣列。
+        """
+        if not os.path.exists(self.data_path):
+            return np.empty((0, len(COLUMNS)))
+        data = np.load(self.data_path, mmap_mode="r")
+        if start is None and end is None:
+            return data
+        timestamps = data[:, 0]
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start))
+        hi = len(data) if end is None else int(np.searchsorted(timestamps, end))
+        return data[lo:hi]
+
+    def meta(self):
+        """庫的中繼資料 (尚未建立時返回空字典)"""
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # === 下載 === #
+    def segments(self, start, end):
+        """將 [start, end) 切成對齊固定網格的區段 (同一網格在每次執行時相同，斷點才能沿用)"""
+        span = self.tf_ms * FETCH_PAGE_LIMIT * HISTORY_SEGMENT_PAGES
+        start = -(-start // self.tf_ms) * self.tf_ms
+        result = []
+        while start < end:
+            seg_end = min(end, (start // span + 1) * span)
+            result.append((start, seg_end))
+            start = seg_end
+        return result
+
+    def missing_ranges(self, start, end):
+        """[start, end) 中庫裡還沒有的區間 (最早一根之前與最後一根之後)"""
+        meta = self.meta()
+        first, last = meta.get("covered_from", meta.get("first_timestamp")), meta.get("last_timestamp")
+        if first is None or last is None:
+            return [(start, end)] if start < end else []
+        ranges = []
+        if start < first:
+            ranges.append((start, first))
+        if last + self.tf_ms < end:
+            ranges.append((max(start, last + self.tf_ms), end))
+        return ranges
+
+    def download(self, start, end=None, workers=HISTORY_DOWNLOAD_WORKERS):
+        """
+        下載 [start, end) (ms，end 預設為形成中K線的開盤時間) 中庫裡還沒有的K線並整理入庫。
+
+        返回:
+            dict: segments (需要的區段數)、resumed (沿用斷點的區段數)、failed (失敗的區段數)、
+                  rows (本次下載的K線數) 與整理後的 meta；有區段失敗時不整理，保留斷點待下次續傳
+        """
+        now_ms = int(time.time() * 1000)
+        end = min(end or now_ms, now_ms - now_ms % self.tf_ms)
+        segments = [seg for rng in self.missing_ranges(start, end) for seg in self.segments(*rng)]
+        pending = [seg for seg in segments if not os.path.exists(self._part_path(*seg))]
+        summary = {"segments": len(segments), "resumed": len(segments) - len(pending), "failed": 0, "rows": 0}
+        if pending:
+            log.info("下載 %s %s: %d 個區段 (沿用斷點 %d 個)，%d 個執行緒", self.trading_pair, self.timeframe,
+                     len(segments), summary["resumed"], workers)
+            os.makedirs(self.parts_dir, exist_ok=True)
+            exchange = self.exchange or get_exchange()
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="history") as executor:
+                for count in executor.map(lambda seg: self._download_segment(exchange, *seg), pending):
+                    if count is None:
+                        summary["failed"] += 1
+                    else:
+                        summary["rows"] += count
+        if summary["failed"]:
+            log.error("%s %s 有 %d 個區段下載失敗，已完成的區段保留在 %s，重新執行即可續傳", self.trading_pair,
+                      self.timeframe, summary["failed"], self.parts_dir)
+            return summary
+        summary["meta"] = self.compact(covered_from=start) if segments else self.meta()
+        return summary
+
+    def _part_path(self, seg_start, seg_end):
+        return os.path.join(self.parts_dir, f"{seg_start}_{seg_end}.npy")
+
+    def _download_segment(self, exchange, seg_start, seg_end):
+        """分頁下載一個區段並寫入斷點檔，返回K線數量；失敗時返回 None"""
+        rows = []
+        since = seg_start
+        try:
+            while since < seg_end:
+                # Binance 行情不佔 Bitunix 的總預算，但與其他行情讀取共用 market 類別的額度
+                get_rate_governor().acquire("market", shared=False)
+                batch = exchange.fetch_ohlcv(self.trading_pair, timeframe=self.timeframe, since=since, limit=FETCH_PAGE_LIMIT)
+                batch = [row for row in batch if since <= row[0] < seg_end]
+                if not batch:
+                    break  # 區段結束或交易對尚未上市
+                rows.extend(batch)
+                since = int(batch[-1][0]) + self.tf_ms
+            _save_atomic(self._part_path(seg_start, seg_end), np.asarray(rows, dtype=np.float64).reshape(-1, len(COLUMNS)))
+        except Exception as e:
+            log.warning("下載 %s %s 區段 %s -> %s 失敗: %s", self.trading_pair, self.timeframe, seg_start, seg_end, e)
+            return None
+        return len(rows)
+
+    # === 整理 === #
+    def compact(self, covered_from=None):
+        """
+        將斷點檔與既有的庫合併: 排序、去除重複與未對齊的K線、記錄缺口，寫入後刪除斷點檔，返回 meta。
+        covered_from 為已確認下載過的最早時間 (交易對上市前的區間不必每次重新查詢)。
+        """
+        with self._lock:
+            parts = sorted(os.listdir(self.parts_dir)) if os.path.isdir(self.parts_dir) else []
+            arrays = [self.load()] + [np.load(os.path.join(self.parts_dir, name)) for name in parts if name.endswith(".npy")]
+            merged = np.concatenate([np.asarray(a, dtype=np.float64).reshape(-1, len(COLUMNS)) for a in arrays])
+            meta = self.meta()
+            aligned = merged[:, 0] % self.tf_ms == 0
+            misaligned = int(len(merged) - aligned.sum())
+            merged = merged[aligned]
+            # 穩定排序後保留每個時間戳的最後一筆 (斷點檔排在既有數據之後，即較新下載的一筆)
+            merged = merged[np.argsort(merged[:, 0], kind="stable")]
+            keep = np.r_[merged[1:, 0] != merged[:-1, 0], True] if len(merged) else np.empty(0, dtype=bool)
+            duplicates = int(len(merged) - keep.sum())
+            merged = merged[keep]
+            timestamps = merged[:, 0]
+            gap_idx = np.flatnonzero(np.diff(timestamps) > self.tf_ms)
+            gaps = [[int(timestamps[i]), int(timestamps[i + 1]), int((timestamps[i + 1] - timestamps[i]) // self.tf_ms - 1)]
+                    for i in gap_idx]
+            os.makedirs(os.path.dirname(self.data_path) or ".", exist_ok=True)
+            merged = np.asfortranarray(merged)
+            # 寫入新的庫時舊檔可能仍被映射 (Windows 上無法替換)，先釋放本方法中的映射
+            del arrays
+            _save_atomic(self.data_path, merged)
+            meta = {
+                "trading_pair": self.trading_pair,
+                "timeframe": self.timeframe,
+                "columns": COLUMNS,
+                "rows": len(merged),
+                "first_timestamp": int(timestamps[0]) if len(merged) else None,
+                "last_timestamp": int(timestamps[-1]) if len(merged) else None,
+                "covered_from": min(filter(None, [covered_from, meta.get("covered_from"),
+                                                  int(timestamps[0]) if len(merged) else None]), default=None),
+                "gaps": gaps,
+                "missing_bars": sum(gap[2] for gap in gaps),
+                "duplicates_dropped": meta.get("duplicates_dropped", 0) + duplicates,
+                "misaligned_dropped": meta.get("misaligned_dropped", 0) + misaligned,
+                "updated_at": time.time(),
+            }
+            tmp_path = self.meta_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self.meta_path)
+            for name in parts:
+                os.remove(os.path.join(self.parts_dir, name))
+            if os.path.isdir(self.parts_dir):
+                os.rmdir(self.parts_dir)
+            if gaps or duplicates or misaligned:
+                log.warning("%s %s: %d 個缺口 (缺少 %d 根)，丟棄重複 %d 根、未對齊 %d 根", self.trading_pair, self.timeframe,
+                            len(gaps), meta["missing_bars"], duplicates, misaligned)
+            log.info("%s %s 歷史庫共 %d 根K線", self.trading_pair, self.timeframe, len(merged))
+            return meta
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from config import TRADING_PAIR, TIMEFRAME
+    from bot_logger import setup_logging
+
+    parser = argparse.ArgumentParser(description="下載歷史K線到本地歷史庫")
+    parser.add_argument("trading_pair", nargs="?", default=TRADING_PAIR, help="交易對，例如 ETH/USDT")
+    parser.add_argument("timeframe", nargs="?", default=TIMEFRAME, help="時間框架，例如 1m、4h")
+    parser.add_argument("--days", type=float, default=365, help="下載最近幾天的K線")
+    parser.add_argument("--workers", type=int, default=HISTORY_DOWNLOAD_WORKERS, help="並行下載的執行緒數")
+    parser.add_argument("--load-only", action="store_true", help="不下載，只測量載入時間")
+    args = parser.parse_args()
+    setup_logging(level="INFO", log_file="")
+
+    archive = KlineArchive(args.trading_pair, args.timeframe)
+    if not args.load_only:
+        started = time.perf_counter()
+        result = archive.download(int(time.time() * 1000) - int(args.days * 86_400_000), workers=args.workers)
+        print(f"下載 {result['segments']} 個區段 (沿用斷點 {result['resumed']}，失敗 {result['failed']})，"
+              f"新增 {result['rows']} 根，耗時 {time.perf_counter() - started:.1f} 秒")
+    started = time.perf_counter()
+    data = archive.load()
+    elapsed = (time.perf_counter() - started) * 1000
+    meta = archive.meta()
+    print(f"載入 {len(data)} 根 {args.trading_pair} {args.timeframe} K線: {elapsed:.2f} ms (記憶體映射)；"
+          f"缺口 {len(meta.get('gaps', []))} 個，缺少 {meta.get('missing_bars', 0)} 根")
@@ -0,0 +1,255 @@
+"""
+交易路徑延遲基準測試: 以 mock_bitunix 模擬交易所，驅動 execute_trading_strategy 並統計各階段延遲。
+
+階段 (每個交易對每輪一次開倉):
+    read          並行讀取K線/持倉/餘額 (fetch_tick_inputs)
+    decide        指標計算與信號判斷 (讀取完成 -> 發出下單)
+    order_ack     下單到確認成交、取得 positionId 並確認止損 (send_order)
+    stop_ack      另外設置止損止盈的請求耗時 (place_conditional_orders；止損隨開倉單附帶時為 0)
+    signal_to_stop 發出下單到止損確認 (開倉後無保護時間的上限)
+    tick_total    整個 tick (讀取開始 -> 策略返回)
+
+K線由本程式產生 (每輪都會觸發 RSI 開多)，不連線 Binance；Discord 通知送往模擬伺服器的 /webhook。
+預設不限速，各階段只量測請求路徑本身；--rate 指定共用速率上限，--config-limits 改用 config.py 的 RATE_LIMITS
+(多交易對負載測試)，速率治理的排隊時間另外列在報告最後。
+
+--alloc 改為比較 tick 讀取K線到取得最新指標的資料路徑 (不發任何請求)，每個 tick 先原地更新形成中的K線:
+    pandas        舊路徑: DataFrame、to_datetime、TA-Lib 全段重算、iloc 取最後一根
+    numpy copy    store.latest(100) 複製後由增量指標引擎同步
+    numpy out     複製到預先配置的緩衝區 (ohlcv_buffer) 後同步，即目前 tick 使用的路徑
+報告每個 tick 的耗時 (µs) 與 tracemalloc 量到的暫時配置峰值 (bytes)。
+
+執行:
+    python latency_benchmark.py --iterations 50 --latency 0.02
+    python latency_benchmark.py --symbols 30 --iterations 10 --rate 50    # 多交易對負載測試
+    python latency_benchmark.py --symbols 30 --iterations 10 --config-limits
+    python latency_benchmark.py --alloc --iterations 2000                 # 資料路徑配置與延遲
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from bot_logger import setup_logging
+from bitunix_client import get_bitunix_client
+from mock_bitunix import MockBitunixServer
+from rate_governor import RateGovernor
+from instrument_specs import get_instrument_specs
+from config import RATE_LIMITS
+from state_journal import StateJournal
+from trade_ledger import TradeLedger
+
+STAGES = ("read", "decide", "order_ack", "stop_ack", "signal_to_stop", "tick_total")
+
+
+def synthetic_ohlcv(limit=100, start_price=100.0, timeframe_ms=4 * 3600 * 1000):
+    """上升趨勢的K線 (2025 年內，位於實盤交易期間)，最新一根的 RSI 高於 RSI_BUY"""
+    base = 1735689600000  # 2025-01-01 00:00 UTC
+    close = start_price * (1 + np.linspace(0, 0.5, limit)) + np.sin(np.arange(limit)) * start_price * 0.01
+    timestamps = base + np.arange(limit) * float(timeframe_ms)
+    return np.column_stack([timestamps, close, close * 1.005, close * 0.995, close, np.ones(limit)])
+
+
+class StageRecorder:
+    """以包裝函數記錄每個交易對的階段時間點 (perf_counter)"""
+
+    def __init__(self):
+        self.marks = {}  # symbol -> {事件: 時間}
+        self._lock = threading.Lock()
+
+    def mark(self, symbol, event, first=True):
+        now = time.perf_counter()
+        with self._lock:
+            marks = self.marks.setdefault(symbol, {})
+            if not first or event not in marks:
+                marks[event] = now
+
+    def wrap(self, func, start_event, end_event):
+        def wrapper(api_key, secret_key, symbol, *args, **kwargs):
+            self.mark(symbol, start_event)
+            try:
+                return func(api_key, secret_key, symbol, *args, **kwargs)
+            finally:
+                self.mark(symbol, end_event)
+        return wrapper
+
+    def durations(self):
+        """返回本輪每個交易對的階段耗時 (秒)，未完成開倉流程的交易對略過"""
+        rows = []
+        for marks in self.marks.values():
+            needed = ("read_start", "read_end", "order_start", "order_end", "tick_end")
+            if not all(key in marks for key in needed):
+                continue
+            # 止損隨開倉單附帶時不會呼叫 place_conditional_orders，send_order 返回時止損已確認
+            stop_start, stop_end = marks.get("stop_start", marks["order_end"]), marks.get("stop_end", marks["order_end"])
+            rows.append({
+                "read": marks["read_end"] - marks["read_start"],
+                "decide": marks["order_start"] - marks["read_end"],
+                "order_ack": marks["order_end"] - marks["order_start"],
+                "stop_ack": stop_end - stop_start,
+                "signal_to_stop": max(stop_end, marks["order_end"]) - marks["order_start"],
+                "tick_total": marks["tick_end"] - marks["read_start"],
+            })
+        self.marks.clear()
+        return rows
+
+
+UNTHROTTLED_RATE = 1e9  # 預設的速率上限 (每秒)，實際上不限速
+
+
+def report(samples, title):
+    print(f"\n{title} (樣本數 {len(samples)}，單位 ms)")
+    print(f"{'階段':<16}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for stage in STAGES:
+        values = np.array([row[stage] for row in samples]) * 1000
+        if len(values) == 0:
+            continue
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        print(f"{stage:<16}{p50:>10.2f}{p90:>10.2f}{p99:>10.2f}{values.max():>10.2f}")
+
+
+def run_benchmark(iterations=50, symbols=1, latency=0.0, error_rate=0.0, rate=None, parallel=8, config_limits=False):
+    import trading_bot
+    from portfolio import PortfolioRunner
+    from account_snapshot import get_account_snapshot
+
+    server = MockBitunixServer(balance=1_000_000).start()
+    server.latency = latency
+    server.error_rate = error_rate
+    client = get_bitunix_client(server.api_key, server.secret_key)
+    client.base_url = server.url
+    if not config_limits:
+        # 預設不限速，read 等階段量測的是請求路徑而不是速率治理的排隊時間
+        rate = rate or UNTHROTTLED_RATE
+        client.governor = RateGovernor(rate, {name: (rate, rate) for name in RATE_LIMITS})
+    trading_bot.discord_dispatcher.webhook_url = f"{server.url}/webhook"
+
+    recorder = StageRecorder()
+    ohlcv = synthetic_ohlcv()
+    trading_bot.fetch_ohlcv = lambda *args, **kwargs: ohlcv
+    trading_bot.fetch_tick_inputs = recorder.wrap(trading_bot.fetch_tick_inputs, "read_start", "read_end")
+    trading_bot.send_order = recorder.wrap(trading_bot.send_order, "order_start", "order_end")
+    trading_bot.place_conditional_orders = recorder.wrap(trading_bot.place_conditional_orders, "stop_start", "stop_end")
+    execute = trading_bot.execute_trading_strategy
+
+    def timed_execute(api_key, secret_key, symbol, *args, **kwargs):
+        try:
+            return execute(api_key, secret_key, symbol, *args, **kwargs)
+        finally:
+            recorder.mark(symbol, "tick_end", first=False)
+    trading_bot.execute_trading_strategy = timed_execute
+
+    # 每個交易對只使用少量資金，所有交易對同時開倉也不會超過模擬帳戶的餘額
+    overrides = [{"SYMBOL": f"BENCH{i}USDT", "WALLET_PERCENTAGE": 0.5 / symbols} for i in range(symbols)]
+    runner = PortfolioRunner(server.api_key, server.secret_key, overrides, max_parallel=parallel, use_stream=False)
+    # 狀態日誌與交易帳本寫入暫存檔，不影響實盤的 state_journal.db / trade_ledger.db
+    journal_dir = tempfile.TemporaryDirectory()
+    journal = StateJournal(os.path.join(journal_dir.name, "bench_journal.db"))
+    ledger = TradeLedger(os.path.join(journal_dir.name, "bench_ledger.db"))
+    trading_bot.get_trade_ledger = lambda: ledger
+    get_instrument_specs(server.api_key, server.secret_key).path = ""  # 不寫入規格的磁碟副本
+    for state in runner.states:
+        state.journal = journal
+    samples, tick_walls = [], []
+    try:
+        for _ in range(iterations):
+            server.reset()
+            for state in runner.states:
+                state.reset_position()
+                server.set_price(state.symbol, ohlcv[-1][4])
+            get_account_snapshot(server.api_key, server.secret_key).invalidate()
+            tick_walls.append(runner.run_tick())
+            samples.extend(recorder.durations())
+        trading_bot.flush_discord_messages()
+    finally:
+        runner.stop()
+        server.stop()
+        journal.close()
+        ledger.close()
+        journal_dir.cleanup()
+
+    report(samples, f"{symbols} 個交易對 x {iterations} 輪，模擬延遲 {latency * 1000:.0f} ms")
+    walls = np.array(tick_walls) * 1000
+    print(f"\n每輪 (全部交易對) 牆鐘時間: p50 {np.percentile(walls, 50):.2f} ms, max {walls.max():.2f} ms；"
+          f"完成開倉流程 {len(samples)}/{symbols * iterations}，Discord 通知 {len(server.webhooks)} 批")
+    budget = client.governor.report()
+    waits = ", ".join(f"{name}={item['wait_seconds'] * 1000:.1f} ms ({item['waits']} 次)" for name, item in budget.items() if item.get("waits"))
+    print("速率治理等待: " + (waits or "無"))
+    counts = trading_bot.report_request_counts(server.api_key, server.secret_key)
+    print("端點請求次數: " + ", ".join(f"{endpoint}={count}" for endpoint, count in counts.items()))
+    return samples
+
+
+def run_alloc_benchmark(iterations=2000, limit=100):
+    import pandas as pd
+    import trading_bot
+    from candle_store import CandleStore
+    from indicators import StreamingIndicators
+    from config import RSI_LEN, ATR_LEN, BREAKOUT_LOOKBACK
+
+    store = CandleStore("BENCH/USDT", "4h", cache_dir="")
+    store.merge(synthetic_ohlcv(500))
+    forming = store.latest(1)[0].copy()
+    engine = StreamingIndicators(RSI_LEN, ATR_LEN, BREAKOUT_LOOKBACK)
+    buf = trading_bot.ohlcv_buffer("BENCH/USDT", "4h", "bench", limit)
+
+    def pandas_path():
+        df = pd.DataFrame(store.latest(limit), columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+        df = trading_bot.compute_indicators(df, RSI_LEN, ATR_LEN, BREAKOUT_LOOKBACK)
+        return df['close'].iloc[-1], df['rsi'].iloc[-1], df['highest_break'].iloc[-1], df['atr'].iloc[-1]
+
+    def numpy_copy_path():
+        return engine.sync(store.latest(limit))
+
+    def numpy_out_path():
+        return engine.sync(store.latest(limit, out=buf))
+
+    paths = (("pandas", pandas_path), ("numpy copy", numpy_copy_path), ("numpy out", numpy_out_path))
+    rng = np.random.default_rng(1)
+    moves = forming[4] * (1 + rng.normal(0, 0.001, iterations))
+    print(f"\n資料路徑 (最近 {limit} 根K線) x {iterations} 個 tick")
+    print(f"{'路徑':<14}{'p50 µs':>10}{'p99 µs':>10}{'峰值 bytes':>14}")
+    for name, path in paths:
+        path()  # 暖機 (首次建立內部狀態)
+        elapsed, peaks = np.empty(iterations), np.empty(iterations)
+        for i, price in enumerate(moves):
+            forming[4] = price
+            store.merge([forming])
+            started = time.perf_counter()
+            path()
+            elapsed[i] = time.perf_counter() - started
+        tracemalloc.start()
+        for i, price in enumerate(moves[:min(iterations, 200)]):
+            forming[4] = price
+            store.merge([forming])
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            path()
+            peaks[i] = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        micros = elapsed * 1e6
+        print(f"{name:<14}{np.percentile(micros, 50):>10.1f}{np.percentile(micros, 99):>10.1f}"
+              f"{np.median(peaks[:min(iterations, 200)]):>14.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="交易路徑延遲基準測試 (模擬 Bitunix)")
+    parser.add_argument("--iterations", type=int, default=50, help="每個交易對的開倉輪數")
+    parser.add_argument("--symbols", type=int, default=1, help="同時測試的交易對數量")
+    parser.add_argument("--latency", type=float, default=0.0, help="模擬交易所每個請求的延遲 (秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模擬交易所隨機返回 500 的機率")
+    parser.add_argument("--rate", type=float, default=None, help="共用請求速率上限 (每秒)，預設不限速")
+    parser.add_argument("--config-limits", action="store_true", help="使用 config.py 的 RATE_LIMITS 速率治理 (負載測試)")
+    parser.add_argument("--parallel", type=int, default=8, help="同時執行 tick 的交易對數量")
+    parser.add_argument("--alloc", action="store_true", help="只比較 tick 資料路徑的配置與延遲 (不啟動模擬交易所)")
+    args = parser.parse_args()
+    setup_logging(level="WARNING", log_file="")  # 只輸出警告與錯誤，報告由本程式輸出
+    if args.alloc:
+        run_alloc_benchmark(args.iterations)
+        raise SystemExit(0)
+    run_benchmark(args.iterations, args.symbols, args.latency, args.error_rate, args.rate, args.parallel, args.config_limits)
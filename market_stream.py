@@ -0,0 +1,223 @@
+"""
+WebSocket 行情串流: 訂閱K線與最新價 (miniTicker) 頻道，推送即時寫入 candle_store。
+
+* 斷線後以指數退避 (含隨機抖動) 自動重連，並重新訂閱所有頻道。
+* 以K線開盤時間檢查連續性: 推送的K線與儲存無法銜接 (缺少K線) 或剛重連 (斷線期間可能錯過收盤) 時，
+  在背景執行緒以 REST (CandleStore.update) 回補，回補期間的推送照常處理。
+* 每筆K線/最新價更新都會呼叫已註冊的回呼 (在串流執行緒中執行，回呼應保持輕量)。
+
+數據來源與 candle_store 相同 (Binance)，使 WebSocket 與 REST 回補的K線一致。
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+
+from config import MARKET_WS_URL, MARKET_WS_STALE_SECONDS, MARKET_WS_RECONNECT_MAX_SECONDS
+from candle_store import get_candle_store
+from bot_logger import get_logger
+
+log = get_logger("stream")
+
+
+def stream_symbol(trading_pair):
+    """'ETH/USDT' -> 'ethusdt' (Binance 串流名稱使用小寫)"""
+    return trading_pair.replace("/", "").lower()
+
+
+class MarketStream:
+    """
+    單一交易對的K線與最新價串流 (在自己的執行緒與事件迴圈中運行)。
+
+    參數:
+        timeframes (list): 需要訂閱的K線時間框架，每個時間框架對應一個 CandleStore
+        exchange: REST 回補使用的 ccxt 交易所實例，預設為 candle_store 的共用實例
+    """
+
+    def __init__(self, trading_pair, timeframes, url=MARKET_WS_URL, exchange=None, reconnect_max=MARKET_WS_RECONNECT_MAX_SECONDS):
+        self.trading_pair = trading_pair
+        self.symbol = stream_symbol(trading_pair)
+        self.timeframes = list(timeframes)
+        self.stores = {tf: get_candle_store(trading_pair, tf) for tf in self.timeframes}
+        self.url = url
+        self.exchange = exchange
+        self.reconnect_max = reconnect_max
+        self.connected = False
+        self.last_price = None
+        self.last_price_time = 0.0
+        self.last_message_time = 0.0
+        self.messages = 0
+        self.reconnects = 0
+        self.backfills = 0
+        self._last_event_time = {}  # 串流名稱 -> 最後處理的事件時間 (ms)，丟棄亂序的舊推送
+        self._candle_callbacks = []
+        self._ticker_callbacks = []
+        self._backfilling = set()
+        self._request_id = 0
+        self._thread = None
+        self._loop = None
+        self._ws = None
+        self._stop = threading.Event()
+        self._stop_async = None
+
+    @property
+    def streams(self):
+        return [f"{self.symbol}@kline_{tf}" for tf in self.timeframes] + [f"{self.symbol}@miniTicker"]
+
+    def on_candle(self, callback):
+        """註冊K線回呼: callback(timeframe, store, row, closed)"""
+        self._candle_callbacks.append(callback)
+
+    def on_ticker(self, callback):
+        """註冊最新價回呼: callback(price, event_time_ms)"""
+        self._ticker_callbacks.append(callback)
+
+    def is_live(self, max_age=MARKET_WS_STALE_SECONDS):
+        return self.connected and time.time() - self.last_message_time <= max_age
+
+    # === 執行緒控制 === #
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._thread_main, name="market-stream", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(self._request_stop)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _request_stop(self):
+        if self._stop_async is not None:
+            self._stop_async.set()
+        if self._ws is not None:
+            asyncio.ensure_future(self._ws.close())
+
+    def _thread_main(self):
+        asyncio.run(self._run())
+
+    # === 連線與訂閱 === #
+    async def _run(self):
+        import aiohttp
+
+        self._loop = asyncio.get_running_loop()
+        self._stop_async = asyncio.Event()
+        backoff = 1.0
+        async with aiohttp.ClientSession() as session:
+            while not self._stop.is_set():
+                try:
+                    async with session.ws_connect(self.url, heartbeat=20, receive_timeout=MARKET_WS_STALE_SECONDS * 3) as ws:
+                        self._ws = ws
+                        self.connected = True
+                        await self._subscribe(ws)
+                        log.info("已連線並訂閱: %s", ', '.join(self.streams))
+                        # 首次連線或重連後，斷線期間可能錯過K線收盤，以 REST 補齊
+                        for tf in self.timeframes:
+                            self._schedule_backfill(tf)
+                        backoff = 1.0
+                        async for msg in ws:
+                            if msg.type == aiohttp.WSMsgType.TEXT:
+                                self._handle_message(msg.data)
+                            elif msg.type in (aiohttp.WSMsgType.ERROR, aiohttp.WSMsgType.CLOSED):
+                                break
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    log.warning("連線錯誤: %s", e)
+                finally:
+                    self.connected = False
+                    self._ws = None
+                if self._stop.is_set():
+                    break
+                self.reconnects += 1
+                delay = min(backoff, self.reconnect_max) * random.uniform(0.5, 1.0)
+                backoff *= 2
+                log.warning("連線中斷，%.1f 秒後重連 (第 %s 次)", delay, self.reconnects)
+                try:
+                    await asyncio.wait_for(self._stop_async.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _subscribe(self, ws):
+        self._request_id += 1
+        await ws.send_str(json.dumps({"method": "SUBSCRIBE", "params": self.streams, "id": self._request_id}))
+
+    # === 訊息處理 === #
+    def _handle_message(self, raw):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+        if "result" in message and "id" in message:
+            return  # 訂閱回應
+        data = message.get("data", message)  # 兼容組合串流 (/stream?streams=) 的格式
+        event = data.get("e")
+        self.messages += 1
+        self.last_message_time = time.time()
+        if event == "kline":
+            self._handle_kline(data)
+        elif event == "24hrMiniTicker":
+            self._handle_ticker(data)
+
+    def _is_stale_event(self, stream, event_time):
+        last = self._last_event_time.get(stream)
+        if last is not None and event_time < last:
+            return True
+        self._last_event_time[stream] = event_time
+        return False
+
+    def _handle_kline(self, data):
+        k = data["k"]
+        timeframe = k["i"]
+        store = self.stores.get(timeframe)
+        if store is None or self._is_stale_event(f"kline_{timeframe}", data.get("E", 0)):
+            return
+        row = [float(k["t"]), float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"]), float(k["v"])]
+        status = store.apply_stream_row(row)
+        if status == "gap":
+            log.warning("%s %s K線不連續 (最後 %s，收到 %s)，以 REST 回補", self.trading_pair, timeframe, store.last_timestamp, int(row[0]))
+            self._schedule_backfill(timeframe)
+            return
+        if status == "stale":
+            return
+        self._emit_candle(timeframe, store, row, bool(k.get("x")))
+
+    def _handle_ticker(self, data):
+        if self._is_stale_event("miniTicker", data.get("E", 0)):
+            return
+        self.last_price = float(data["c"])
+        self.last_price_time = time.time()
+        for callback in self._ticker_callbacks:
+            try:
+                callback(self.last_price, data.get("E"))
+            except Exception as e:
+                log.exception("最新價回呼錯誤: %s", e)
+
+    def _emit_candle(self, timeframe, store, row, closed):
+        for callback in self._candle_callbacks:
+            try:
+                callback(timeframe, store, row, closed)
+            except Exception as e:
+                log.exception("K線回呼錯誤: %s", e)
+
+    # === REST 回補 === #
+    def _schedule_backfill(self, timeframe):
+        if timeframe in self._backfilling:
+            return
+        self._backfilling.add(timeframe)
+        self._loop.run_in_executor(None, self._backfill, timeframe)
+
+    def _backfill(self, timeframe):
+        store = self.stores[timeframe]
+        try:
+            store.update(exchange=self.exchange)
+            self.backfills += 1
+            if len(store):
+                self._emit_candle(timeframe, store, store.latest(1)[0], False)
+        except Exception as e:
+            log.error("REST 回補 %s %s 失敗: %s", self.trading_pair, timeframe, e)
+        finally:
+            self._backfilling.discard(timeframe)
@@ -0,0 +1,327 @@
+"""
+輕量監控指標: 計數器與直方圖，匯出為 Prometheus 文字格式 (本機 HTTP 端點) 與定期輪替的 JSONL。
+
+熱路徑只做 perf_counter 兩次、一次 bisect 與幾個整數加法 (不加鎖，每個 span 約 1 微秒以內)；
+格式化與輸出都在匯出時 (HTTP 請求或 JSONL 執行緒) 才進行。
+
+用法:
+    @timed("send_order")                  # 函數耗時記入 bot_stage_seconds{stage="send_order"}
+    with span("indicators"): ...          # 任意程式區塊
+    inc("bitunix_http_requests_total", endpoint="/api/...", status="200")
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+from config import METRICS_ENABLED, METRICS_PORT, METRICS_JSONL_PATH, METRICS_JSONL_INTERVAL_SECONDS, METRICS_JSONL_MAX_BYTES
+from bot_logger import get_logger
+
+log = get_logger("metrics")
+
+# 秒為單位的直方圖區間 (涵蓋微秒級的本地計算到數秒的網路請求)
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_METRIC = "bot_stage_seconds"
+STAGE_ERRORS = "bot_stage_errors_total"
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+class Histogram:
+    """
+    固定區間的直方圖 (另記錄總和、次數與最大值)。
+
+    observe 不加鎖以維持熱路徑的低開銷: 多執行緒同時更新同一直方圖時，
+    極少數情況下 (GIL 恰好在讀寫之間切換) 可能少計一次，對監控用途可以接受。
+    """
+    __slots__ = ("bounds", "counts", "sum", "count", "max")
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最後一格為 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """以區間上限估計分位數 (落在 +Inf 區間時返回最大值)"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+class MetricsRegistry:
+    """所有計數器與直方圖的集中儲存 (以名稱與標籤區分)"""
+
+    def __init__(self):
+        self.counters = {}  # (名稱, 標籤) -> 數值
+        self.histograms = {}  # (名稱, 標籤) -> Histogram
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def histogram(self, name, **labels):
+        key = (name, _label_key(labels))
+        hist = self.histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self.histograms.setdefault(key, Histogram())
+        return hist
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def reset(self):
+        """將所有數值歸零 (保留已建立的直方圖，已取得直方圖的裝飾器仍然有效)"""
+        with self._lock:
+            self.counters.clear()
+            for hist in self.histograms.values():
+                hist.counts = [0] * len(hist.counts)
+                hist.sum = 0.0
+                hist.count = 0
+                hist.max = 0.0
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+        last_name = None
+        for (name, key), value in counters:
+            if name != last_name:
+                lines.append(f"# TYPE {name} counter")
+                last_name = name
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        last_name = None
+        for (name, key), hist in histograms:
+            if name != last_name:
+                lines.append(f"# TYPE {name} histogram")
+                last_name = name
+            counts, total, count = list(hist.counts), hist.sum, sum(hist.counts)
+            cumulative = 0
+            for bound, bucket in zip(hist.bounds + (float("inf"),), counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(key, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """可序列化為 JSON 的摘要 (直方圖以次數、總和、p50/p99 估計與最大值表示)"""
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        return {
+            "ts": time.time(),
+            "counters": {f"{name}{_format_labels(key)}": value for (name, key), value in counters.items()},
+            "histograms": {f"{name}{_format_labels(key)}": {"count": h.count, "sum": h.sum, "p50": h.quantile(0.5),
+                                                            "p99": h.quantile(0.99), "max": h.max}
+                           for (name, key), h in histograms.items()},
+        }
+
+
+registry = MetricsRegistry()
+_stage_histograms = {}  # 階段名稱 -> Histogram (span 直接查表，不必每次整理標籤)
+
+
+def _stage_histogram(stage):
+    hist = _stage_histograms.get(stage)
+    if hist is None:
+        hist = _stage_histograms[stage] = registry.histogram(STAGE_METRIC, stage=stage)
+    return hist
+
+
+class _Span:
+    __slots__ = ("hist", "stage", "start")
+
+    def __init__(self, hist, stage):
+        self.hist = hist
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.hist.observe(perf_counter() - self.start)
+        if exc_type is not None:
+            registry.inc(STAGE_ERRORS, stage=self.stage)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(stage):
+    """計時區塊: with span("indicators"): ...，耗時記入 bot_stage_seconds{stage=...}"""
+    if not METRICS_ENABLED:
+        return _NULL_SPAN
+    return _Span(_stage_histogram(stage), stage)
+
+
+def timed(stage):
+    """函數計時裝飾器 (直方圖在裝飾時取得，呼叫時不查表)"""
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+        hist = _stage_histogram(stage)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                registry.inc(STAGE_ERRORS, stage=stage)
+                raise
+            finally:
+                hist.observe(perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def inc(name, value=1, **labels):
+    if METRICS_ENABLED:
+        registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    if METRICS_ENABLED:
+        registry.observe(name, value, **labels)
+
+
+# === 匯出 === #
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        data = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsExporter:
+    """Prometheus 文字格式 HTTP 端點 (只綁定本機) 與 JSONL 快照寫入執行緒"""
+
+    def __init__(self, port=METRICS_PORT, jsonl_path=METRICS_JSONL_PATH, interval=METRICS_JSONL_INTERVAL_SECONDS,
+                 max_bytes=METRICS_JSONL_MAX_BYTES, host="127.0.0.1"):
+        self.port = port
+        self.host = host
+        self.jsonl_path = jsonl_path
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self._server = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def url(self):
+        if self._server is None:
+            return None
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        if self.port is not None and self.port >= 0 and self._server is None:
+            try:
+                self._server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+                self._server.daemon_threads = True
+            except OSError as e:
+                log.error("無法啟動指標端點 (%s:%s): %s", self.host, self.port, e)
+            else:
+                self._spawn(self._server.serve_forever, "metrics-http")
+                log.info("Prometheus 指標端點: %s", self.url)
+        if self.jsonl_path:
+            self._spawn(self._jsonl_loop, "metrics-jsonl")
+        return self
+
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _jsonl_loop(self):
+        while not self._stop.wait(self.interval):
+            self.write_jsonl()
+
+    def write_jsonl(self):
+        """附加一筆快照；檔案超過 max_bytes 時輪替為 .1 (只保留一份舊檔)"""
+        try:
+            if os.path.exists(self.jsonl_path) and os.path.getsize(self.jsonl_path) >= self.max_bytes:
+                os.replace(self.jsonl_path, self.jsonl_path + ".1")
+            with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(registry.snapshot(), ensure_ascii=False) + "\n")
+        except OSError as e:
+            log.error("寫入 JSONL 失敗: %s", e)
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self.jsonl_path:
+            self.write_jsonl()
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def start_metrics_exporter():
+    """啟動 (只啟動一次) 指標匯出；METRICS_ENABLED 為 False 或 METRICS_PORT 為 0 且未設定 JSONL 時不啟動"""
+    global _exporter
+    if not METRICS_ENABLED or (not METRICS_PORT and not METRICS_JSONL_PATH):
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = MetricsExporter(port=METRICS_PORT or None).start()
+    return _exporter
@@ -0,0 +1,531 @@
+"""
+本地 Bitunix 合約 REST 模擬伺服器，用於在沒有 API Key 的情況下測試下單、止盈止損、持倉與餘額查詢。
+
+* 以與 bitunix_client.get_signed_params 相同的雙重 SHA256 規則驗證簽名，錯誤時返回 code 10007。
+* 保存帳戶餘額、持倉 (含止盈止損) 狀態: 開倉扣除保證金，平倉以 set_price 設定的價格結算盈虧；
+  set_price 使價格觸及止損/止盈時由模擬交易所自行平倉，平倉紀錄可由歷史持倉端點查詢。
+* 下單以 clientId 去重 (重送同一個 clientId 不會重複開倉)，開倉單可直接附帶 slPrice/tpPrice；
+  與正式 API 相同，下單回應只有 orderId/clientId，positionId 需查詢持倉取得。
+* 可注入延遲 (latency，整體或按路徑)、隨機錯誤 (error_rate) 與固定次數的故障 (inject，例如 429，
+  或 status=None 的延遲回應: 請求照常處理，但回應晚於客戶端逾時，模擬「已成交但回應遺失」)。
+* 額外提供 /webhook 端點接收 Discord 通知，測試時不必連線 Discord。
+* start_private_ws() 另外啟動私有頻道 WebSocket (aiohttp): 驗證登入簽名，推送持倉、訂單、餘額與止盈止損變化；
+  ws_push_enabled = False 可模擬遺漏推送，drop_private_ws() 可模擬斷線。
+
+直接執行 (python mock_bitunix.py) 會啟動伺服器，以共用客戶端驗證開倉 -> 止損 -> 修改止損 -> 平倉的完整流程。
+"""
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from config import LEVERAGE, MARGIN_COIN
+
+
+def expected_sign(api_key, secret_key, nonce, timestamp, query_params=None, body_str=""):
+    """依 Bitunix 規則計算簽名 (GET 使用排序後的查詢參數，POST 使用原始主體)"""
+    if query_params is not None:
+        payload = "".join(f"{k}{v}" for k, v in sorted(query_params.items()))
+    else:
+        payload = body_str
+    digest = hashlib.sha256((nonce + timestamp + api_key + payload).encode("utf-8")).hexdigest()
+    return hashlib.sha256((digest + secret_key).encode("utf-8")).hexdigest()
+
+
+class MockPosition:
+    __slots__ = ("position_id", "symbol", "side", "qty", "max_qty", "entry_price", "leverage", "margin", "tp_price", "sl_price",
+                 "realized_pnl", "ctime")
+
+    def __init__(self, symbol, side, qty, entry_price, leverage):
+        self.position_id = uuid.uuid4().hex[:16]
+        self.symbol = symbol
+        self.side = side  # "BUY" (多) 或 "SELL" (空)
+        self.qty = qty
+        self.max_qty = qty
+        self.entry_price = entry_price
+        self.leverage = leverage
+        self.margin = qty * entry_price / leverage
+        self.tp_price = None
+        self.sl_price = None
+        self.realized_pnl = 0.0
+        self.ctime = int(time.time() * 1000)
+
+    def unrealized_pnl(self, price):
+        direction = 1 if self.side == "BUY" else -1
+        return (price - self.entry_price) * self.qty * direction
+
+    def to_dict(self, price):
+        return {"positionId": self.position_id, "symbol": self.symbol, "side": self.side, "qty": str(self.qty),
+                "avgOpenPrice": str(self.entry_price), "leverage": self.leverage, "margin": str(self.margin),
+                "unrealizedPNL": str(self.unrealized_pnl(price)),
+                "tpPrice": None if self.tp_price is None else str(self.tp_price),
+                "slPrice": None if self.sl_price is None else str(self.sl_price)}
+
+    def to_push(self, event, price):
+        """私有頻道 position 推送的資料 (side 為 LONG/SHORT)"""
+        return {"event": event, "positionId": self.position_id, "symbol": self.symbol,
+                "side": "LONG" if self.side == "BUY" else "SHORT", "qty": str(self.qty), "leverage": self.leverage,
+                "margin": str(self.margin), "unrealizedPNL": str(self.unrealized_pnl(price)),
+                "realizedPNL": str(self.realized_pnl), "ctime": str(self.ctime)}
+
+    def to_history(self, close_price, mtime):
+        return {"positionId": self.position_id, "symbol": self.symbol, "side": "LONG" if self.side == "BUY" else "SHORT",
+                "maxQty": str(self.max_qty), "entryPrice": str(self.entry_price), "closePrice": str(close_price),
+                "leverage": self.leverage, "fee": "0", "funding": "0", "realizedPNL": str(self.realized_pnl),
+                "ctime": str(self.ctime), "mtime": str(mtime)}
+
+
+class MockBitunixServer:
+    """在背景執行緒運行的 Bitunix REST 模擬伺服器"""
+
+    def __init__(self, api_key="mock-api-key", secret_key="mock-secret-key", balance=1000.0, host="127.0.0.1", port=0,
+                 leverage=LEVERAGE, margin_coin=MARGIN_COIN):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.margin_coin = margin_coin
+        self.leverage = leverage
+        self.available = float(balance)
+        self.positions = {}  # positionId -> MockPosition
+        self.history = []  # 已平倉的持倉 (歷史持倉端點的資料)
+        self.orders = {}  # clientId -> 訂單資料 (下單去重與訂單查詢)
+        self.prices = {}  # symbol -> 最新價 (開倉與平倉的成交價)
+        # trading_pairs 端點為每個有價格的交易對返回的規格
+        self.instrument = {"basePrecision": 4, "quotePrecision": 2, "minTradeVolume": "0.0001",
+                           "maxMarketOrderVolume": "1000000", "maxLeverage": 125, "symbolStatus": "OPEN"}
+        self.latency = 0.0  # 每個請求的額外延遲 (秒)
+        self.path_latency = {}  # 路徑 -> 額外延遲 (秒)，優先於 latency
+        self.error_rate = 0.0  # 隨機返回 HTTP 500 的機率
+        self.log = deque(maxlen=10000)  # (收到時間, 回應時間, 方法, 路徑, HTTP 狀態, code)
+        self.webhooks = []  # /webhook 收到的通知主體
+        self._faults = deque()  # (路徑或 None, HTTP 狀態或 None, 回應主體, 延遲秒數)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+        self.ws_push_enabled = True  # False 時不推送 (模擬遺漏的推送)
+        self._ws_clients = set()  # 已登入並訂閱的私有頻道連線
+        self._ws_loop = None
+        self._ws_url = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-bitunix", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._ws_loop is not None:
+            self._ws_loop.call_soon_threadsafe(self._ws_loop.stop)
+
+    # === 私有頻道 (WebSocket) === #
+    @property
+    def ws_url(self):
+        return self._ws_url
+
+    def start_private_ws(self, host="127.0.0.1", port=0):
+        """在背景執行緒啟動私有頻道 WebSocket，返回連線 URL"""
+        from aiohttp import web
+
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            app = web.Application()
+            app.router.add_get("/private/", self._ws_handler)
+            runner = web.AppRunner(app)
+            loop.run_until_complete(runner.setup())
+            site = web.TCPSite(runner, host, port)
+            loop.run_until_complete(site.start())
+            bound = runner.addresses[0]
+            self._ws_url = f"ws://{bound[0]}:{bound[1]}/private/"
+            self._ws_loop = loop
+            ready.set()
+            loop.run_forever()
+            loop.run_until_complete(runner.cleanup())
+
+        threading.Thread(target=run, name="mock-bitunix-ws", daemon=True).start()
+        ready.wait(5)
+        return self._ws_url
+
+    async def _ws_handler(self, request):
+        from aiohttp import web
+
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        logged_in = False
+        try:
+            async for msg in ws:
+                try:
+                    message = json.loads(msg.data)
+                except ValueError:
+                    continue
+                op = message.get("op")
+                if op == "login":
+                    args = (message.get("args") or [{}])[0]
+                    logged_in = args.get("apiKey") == self.api_key and args.get("sign") == expected_sign(
+                        self.api_key, self.secret_key, args.get("nonce", ""), args.get("timestamp", ""))
+                    await ws.send_str(json.dumps({"op": "login", "data": {"result": logged_in}}))
+                elif op == "subscribe" and logged_in:
+                    self._ws_clients.add(ws)
+                    await ws.send_str(json.dumps({"op": "subscribe", "data": message.get("args")}))
+                elif op == "ping":
+                    await ws.send_str(json.dumps({"op": "ping", "pong": int(time.time()), "ping": message.get("ping")}))
+        finally:
+            self._ws_clients.discard(ws)
+        return ws
+
+    def _push(self, channel, data):
+        """向所有已訂閱的連線推送 (可在任何執行緒呼叫)"""
+        if self._ws_loop is None or not self._ws_clients or not self.ws_push_enabled:
+            return
+        payload = json.dumps({"ch": channel, "ts": int(time.time() * 1000), "data": data})
+
+        def send():
+            for ws in list(self._ws_clients):
+                asyncio.ensure_future(ws.send_str(payload))
+        self._ws_loop.call_soon_threadsafe(send)
+
+    def _push_balance(self):
+        margin = sum(p.margin for p in self.positions.values())
+        self._push("balance", {"coin": self.margin_coin, "available": str(self.available), "margin": str(margin)})
+
+    def drop_private_ws(self):
+        """關閉所有私有頻道連線 (模擬斷線，客戶端應自動重連)"""
+        if self._ws_loop is None:
+            return
+
+        def close():
+            for ws in list(self._ws_clients):
+                asyncio.ensure_future(ws.close())
+        self._ws_loop.call_soon_threadsafe(close)
+
+    # === 測試控制 === #
+    def set_price(self, symbol, price):
+        """設定最新價；觸及止損或止盈的持倉以觸發價平倉 (模擬交易所端的條件單)"""
+        price = float(price)
+        with self._lock:
+            self.prices[symbol] = price
+            for position in self.open_positions(symbol):
+                long = position.side == "BUY"
+                if position.sl_price is not None and (price <= position.sl_price if long else price >= position.sl_price):
+                    self._push("tpsl", {"event": "CLOSE", "positionId": position.position_id, "symbol": symbol, "status": "TRIGGERED", "slPrice": str(position.sl_price)})
+                    self._close(position, position.qty, position.sl_price)
+                elif position.tp_price is not None and (price >= position.tp_price if long else price <= position.tp_price):
+                    self._push("tpsl", {"event": "CLOSE", "positionId": position.position_id, "symbol": symbol, "status": "TRIGGERED", "tpPrice": str(position.tp_price)})
+                    self._close(position, position.qty, position.tp_price)
+
+    def inject(self, status=429, count=1, path=None, body=None, delay=0.0):
+        """
+        接下來 count 個 (符合 path 的) 請求返回指定的 HTTP 狀態 (先等待 delay 秒)；
+        status 為 None 時請求照常處理，只延遲 delay 秒後才回應。
+        """
+        if body is None and status is not None:
+            body = {"code": status, "msg": "Too Many Requests" if status == 429 else "Injected fault"}
+        with self._lock:
+            for _ in range(count):
+                self._faults.append((path, status, body, delay))
+
+    def reset(self, balance=None):
+        with self._lock:
+            self.positions.clear()
+            self.history.clear()
+            self.orders.clear()
+            self._faults.clear()
+            self.log.clear()
+            if balance is not None:
+                self.available = float(balance)
+
+    def open_positions(self, symbol=None):
+        return [p for p in self.positions.values() if symbol is None or p.symbol == symbol]
+
+    # === 請求處理 === #
+    def _take_fault(self, path):
+        with self._lock:
+            for i, (fault_path, status, body, delay) in enumerate(self._faults):
+                if fault_path is None or fault_path == path:
+                    del self._faults[i]
+                    break
+            else:
+                status = None
+                delay = 0.0
+        if delay:
+            time.sleep(delay)
+        if status is not None:
+            return status, body
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, {"code": 500, "msg": "Injected random error"}
+        return None
+
+    def _check_sign(self, headers, query_params, body_str):
+        if headers.get("api-key") != self.api_key:
+            return False
+        nonce, timestamp = headers.get("nonce", ""), headers.get("timestamp", "")
+        sign = expected_sign(self.api_key, self.secret_key, nonce, timestamp, query_params, body_str)
+        return headers.get("sign") == sign
+
+    def handle(self, method, raw_path, headers, body_str):
+        """返回 (HTTP 狀態, 回應字典)"""
+        split = urlsplit(raw_path)
+        path = split.path
+        query = dict(parse_qsl(split.query))
+        delay = self.path_latency.get(path, self.latency)
+        if delay:
+            time.sleep(delay)
+        if path == "/webhook":
+            self.webhooks.append(body_str)
+            return 204, None
+        fault = self._take_fault(path)
+        if fault is not None:
+            return fault
+        if path == "/api/v1/futures/market/tickers":
+            return 200, {"code": 0, "data": [{"symbol": s, "lastPrice": str(p)} for s, p in self.prices.items()]}
+        if path == "/api/v1/futures/market/trading_pairs":
+            return 200, {"code": 0, "data": [dict(self.instrument, symbol=s) for s in self.prices]}
+        if not self._check_sign(headers, query if method == "GET" else None, body_str):
+            return 200, {"code": 10007, "msg": "Signature Error"}
+        payload = json.loads(body_str) if body_str else {}
+        with self._lock:
+            if path == "/api/v1/futures/account":
+                return 200, self._account()
+            if path == "/api/v1/futures/position/get_pending_positions":
+                symbol = query.get("symbol")
+                return 200, {"code": 0, "data": [p.to_dict(self.prices.get(p.symbol, p.entry_price)) for p in self.open_positions(symbol)]}
+            if path == "/api/v1/futures/position/get_history_positions":
+                return 200, self._history(query)
+            if path == "/api/v1/futures/trade/place_order":
+                return 200, self._place_order(payload)
+            if path == "/api/v1/futures/trade/get_order_detail":
+                order = self.orders.get(query.get("clientId")) or next(
+                    (o for o in self.orders.values() if o["orderId"] == query.get("orderId")), None)
+                return 200, {"code": 0, "data": order} if order else {"code": 20008, "msg": "Order not found"}
+            if path in ("/api/v1/futures/tpsl/position/place_order", "/api/v1/futures/tpsl/modify_position_tp_sl_order"):
+                return 200, self._set_tpsl(payload)
+        return 404, {"code": 404, "msg": f"Unknown path {path}"}
+
+    def _account(self):
+        margin = sum(p.margin for p in self.positions.values())
+        pnl = sum(p.unrealized_pnl(self.prices.get(p.symbol, p.entry_price)) for p in self.positions.values())
+        return {"code": 0, "data": {"marginCoin": self.margin_coin, "available": str(self.available), "margin": str(margin),
+                                    "crossUnrealizedPNL": str(pnl), "isolationUnrealizedPNL": "0"}}
+
+    def _place_order(self, payload):
+        client_id = payload.get("clientId")
+        if client_id and client_id in self.orders:
+            order = self.orders[client_id]  # 重送的訂單: 返回原訂單，不重複成交
+            return {"code": 0, "data": {"orderId": order["orderId"], "clientId": client_id}}
+        result = self._execute_order(payload)
+        if result.get("code") == 0:
+            order_id, position_id = result["data"]
+            self._push("order", {"event": "CLOSE", "orderId": order_id, "clientId": client_id, "symbol": payload.get("symbol"),
+                                 "side": payload.get("side"), "qty": payload.get("qty"), "orderStatus": "FILLED"})
+            result["data"] = {"orderId": order_id, "clientId": client_id}
+            if client_id:
+                self.orders[client_id] = {"orderId": order_id, "clientId": client_id, "symbol": payload.get("symbol"),
+                                          "side": payload.get("side"), "tradeSide": payload.get("tradeSide"),
+                                          "qty": payload.get("qty"), "status": "FILLED", "positionId": position_id,
+                                          "ctime": str(int(time.time() * 1000))}
+        return result
+
+    def _execute_order(self, payload):
+        """成交訂單，成功時 data 為 (orderId, positionId)"""
+        symbol = payload.get("symbol")
+        price = self.prices.get(symbol)
+        qty = float(payload.get("qty", 0))
+        if price is None:
+            return {"code": 2, "msg": f"No price for {symbol}"}
+        if qty <= 0:
+            return {"code": 2, "msg": "Invalid qty"}
+        order_id = uuid.uuid4().hex[:16]
+        if payload.get("tradeSide") == "OPEN":
+            position = MockPosition(symbol, payload.get("side"), qty, price, self.leverage)
+            if position.margin > self.available:
+                return {"code": 20003, "msg": "Insufficient balance"}
+            if "slPrice" in payload:
+                position.sl_price = float(payload["slPrice"])
+            if "tpPrice" in payload:
+                position.tp_price = float(payload["tpPrice"])
+            self.available -= position.margin
+            self.positions[position.position_id] = position
+            self._push("position", position.to_push("OPEN", price))
+            self._push_balance()
+            return {"code": 0, "data": (order_id, position.position_id)}
+        position = self.positions.get(payload.get("positionId")) or next(iter(self.open_positions(symbol)), None)
+        if position is None:
+            return {"code": 20007, "msg": "Position not found"}
+        self._close(position, qty, price)
+        return {"code": 0, "data": (order_id, position.position_id)}
+
+    def _close(self, position, qty, price):
+        closed_qty = min(qty, position.qty)
+        fraction = closed_qty / position.qty
+        pnl = position.unrealized_pnl(price) * fraction
+        self.available += position.margin * fraction + pnl
+        position.realized_pnl += pnl
+        position.qty -= closed_qty
+        position.margin -= position.margin * fraction
+        if position.qty <= 1e-12:
+            del self.positions[position.position_id]
+            self.history.append(position.to_history(price, int(time.time() * 1000)))
+            self._push("position", position.to_push("CLOSE", price))
+        else:
+            self._push("position", position.to_push("UPDATE", price))
+        self._push_balance()
+
+    def _history(self, query):
+        """歷史持倉 (依平倉時間由新到舊，支援 symbol、startTime、endTime、skip、limit)"""
+        start, end = int(query.get("startTime", 0)), int(query.get("endTime", 2 ** 62))
+        items = [h for h in reversed(self.history)
+                 if (not query.get("symbol") or h["symbol"] == query["symbol"]) and start <= int(h["mtime"]) <= end]
+        skip, limit = int(query.get("skip", 0)), int(query.get("limit", 10))
+        return {"code": 0, "data": {"positionList": items[skip:skip + limit], "total": len(items)}}
+
+    def _set_tpsl(self, payload):
+        position = self.positions.get(payload.get("positionId"))
+        if position is None or position.symbol != payload.get("symbol"):
+            return {"code": 20007, "msg": "Position not found"}
+        if "slPrice" in payload:
+            position.sl_price = float(payload["slPrice"])
+        if "tpPrice" in payload:
+            position.tp_price = float(payload["tpPrice"])
+        self._push("tpsl", {"event": "UPDATE", "positionId": position.position_id, "symbol": position.symbol,
+                            "slPrice": None if position.sl_price is None else str(position.sl_price),
+                            "tpPrice": None if position.tp_price is None else str(position.tp_price)})
+        return {"code": 0, "data": {"orderId": uuid.uuid4().hex[:16]}}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive，與正式環境的連線重用行為一致
+            disable_nagle_algorithm = True  # 標頭與主體分開寫出，避免 Nagle + 延遲 ACK 額外增加約 40 ms
+
+            def _serve(self, method):
+                received = time.perf_counter()
+                length = int(self.headers.get("Content-Length") or 0)
+                body_str = self.rfile.read(length).decode("utf-8") if length else ""
+                headers = {k.lower(): v for k, v in self.headers.items()}
+                try:
+                    status, payload = server.handle(method, self.path, headers, body_str)
+                except Exception as e:
+                    status, payload = 500, {"code": 500, "msg": str(e)}
+                data = b"" if payload is None else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客戶端已逾時斷線 (注入延遲回應時的預期情況)
+                server.log.append((received, time.perf_counter(), method, urlsplit(self.path).path, status,
+                                   payload.get("code") if isinstance(payload, dict) else None))
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    from bitunix_client import BitunixClient
+
+    server = MockBitunixServer(balance=1000).start()
+    server.set_price("ETHUSDT", 2000.0)
+    client = BitunixClient(server.api_key, server.secret_key, base_url=server.url)
+
+    def call(method, path, payload=None):
+        response = client.get(path, payload) if method == "GET" else client.post(path, payload)
+        return response.status_code, response.json()
+
+    def pending_position_id():
+        return call("GET", "/api/v1/futures/position/get_pending_positions", {"symbol": "ETHUSDT"})[1]["data"][0]["positionId"]
+
+    call("POST", "/api/v1/futures/trade/place_order",
+         {"symbol": "ETHUSDT", "marginCoin": "USDT", "qty": "0.5", "side": "BUY", "tradeSide": "OPEN", "orderType": "MARKET"})
+    position_id = pending_position_id()
+    assert call("POST", "/api/v1/futures/tpsl/position/place_order", {"symbol": "ETHUSDT", "positionId": position_id, "slPrice": "1900"})[1]["code"] == 0
+    assert call("POST", "/api/v1/futures/tpsl/modify_position_tp_sl_order", {"symbol": "ETHUSDT", "positionId": position_id, "slPrice": "1950"})[1]["code"] == 0
+    positions = call("GET", "/api/v1/futures/position/get_pending_positions", {"symbol": "ETHUSDT"})[1]["data"]
+    assert positions[0]["slPrice"] == "1950.0"
+    pairs = client.get("/api/v1/futures/market/trading_pairs", signed=False).json()["data"]
+    assert [pair["symbol"] for pair in pairs] == ["ETHUSDT"] and pairs[0]["basePrecision"] == 4
+    server.set_price("ETHUSDT", 2100.0)
+    call("POST", "/api/v1/futures/trade/place_order",
+         {"symbol": "ETHUSDT", "marginCoin": "USDT", "qty": "0.5", "side": "SELL", "tradeSide": "CLOSE", "positionId": position_id})
+    account = call("GET", "/api/v1/futures/account", {"marginCoin": "USDT"})[1]["data"]
+    assert abs(float(account["available"]) - 1050.0) < 1e-9 and not server.positions
+    print(f"開倉 -> 止損 -> 修改止損 -> 平倉完成，可用餘額 {account['available']} USDT")
+
+    # 交易所端止損觸發與歷史持倉
+    call("POST", "/api/v1/futures/trade/place_order",
+         {"symbol": "ETHUSDT", "marginCoin": "USDT", "qty": "0.5", "side": "BUY", "tradeSide": "OPEN", "orderType": "MARKET"})
+    call("POST", "/api/v1/futures/tpsl/position/place_order", {"symbol": "ETHUSDT", "positionId": pending_position_id(), "slPrice": "2050"})
+    server.set_price("ETHUSDT", 2040.0)
+    history = call("GET", "/api/v1/futures/position/get_history_positions", {"symbol": "ETHUSDT"})[1]["data"]["positionList"]
+    assert not server.positions and len(history) == 2 and float(history[0]["realizedPNL"]) == -25.0, history
+    print(f"止損觸發平倉完成，歷史持倉 {len(history)} 筆")
+
+    # clientId 去重、開倉單附帶止損與訂單查詢
+    order = {"symbol": "ETHUSDT", "marginCoin": "USDT", "qty": "0.1", "side": "BUY", "tradeSide": "OPEN", "orderType": "MARKET",
+             "clientId": "selfcheck-1", "slPrice": "1900", "tpPrice": "2200"}
+    first, again = call("POST", "/api/v1/futures/trade/place_order", order)[1], call("POST", "/api/v1/futures/trade/place_order", order)[1]
+    assert first["data"] == again["data"] and len(server.positions) == 1, (first, again)
+    detail = call("GET", "/api/v1/futures/trade/get_order_detail", {"symbol": "ETHUSDT", "clientId": "selfcheck-1"})[1]["data"]
+    position = call("GET", "/api/v1/futures/position/get_pending_positions", {"symbol": "ETHUSDT"})[1]["data"][0]
+    assert detail["positionId"] == position["positionId"] and position["slPrice"] == "1900.0" and position["tpPrice"] == "2200.0"
+    assert call("GET", "/api/v1/futures/trade/get_order_detail", {"symbol": "ETHUSDT", "clientId": "missing"})[1]["code"] != 0
+    print("clientId 去重、附帶止損止盈與訂單查詢正常")
+
+    # 錯誤簽名與故障注入
+    bad = BitunixClient(server.api_key, "wrong-secret", base_url=server.url)
+    assert bad.get("/api/v1/futures/account", {"marginCoin": "USDT"}).json()["code"] == 10007
+    server.inject(429, count=2, path="/api/v1/futures/account")
+    statuses = [client.get("/api/v1/futures/account", {"marginCoin": "USDT"}).status_code for _ in range(3)]
+    assert statuses == [429, 429, 200], statuses
+    print(f"簽名驗證與故障注入正常 (狀態: {statuses})")
+
+    # 私有頻道: 鏡像初始化、開倉推送與止損觸發的平倉事件
+    from account_stream import AccountStream
+    from bitunix_client import get_bitunix_client
+
+    get_bitunix_client(server.api_key, server.secret_key).base_url = server.url  # REST 校正使用共用客戶端
+    account = AccountStream(server.api_key, server.secret_key, url=server.start_private_ws())
+    events = []
+    account.on_event(lambda kind, symbol, data: events.append(kind))
+    account.start()
+    deadline = time.time() + 5
+    while not account.is_live() and time.time() < deadline:
+        time.sleep(0.02)
+    server.set_price("ETHUSDT", 2000.0)
+    call("POST", "/api/v1/futures/trade/place_order",
+         {"symbol": "ETHUSDT", "marginCoin": "USDT", "qty": "0.5", "side": "BUY", "tradeSide": "OPEN", "orderType": "MARKET", "slPrice": "1990"})
+    server.set_price("ETHUSDT", 1980.0)
+    while "position_close" not in events and time.time() < deadline:
+        time.sleep(0.02)
+    assert account.is_live() and "position_open" in events and "position_close" in events, events
+    assert set(account.mirror.positions) == set(server.positions)
+    account.stop()
+    print(f"私有頻道推送正常 (事件: {', '.join(events)})")
+    server.stop()
+    print("Bitunix 模擬伺服器測試通過")
@@ -0,0 +1,203 @@
+"""
+本地行情 WebSocket 模擬伺服器 (Binance 串流格式)，用於在不連線交易所的情況下測試 market_stream。
+
+* 接受 SUBSCRIBE 請求並回覆訂閱結果，只推送已訂閱的頻道。
+* push_kline / push_ticker 推送指定的K線與最新價；drop_connections 模擬斷線。
+* FakeExchange 以同一份K線數據回應 fetch_ohlcv，供 REST 回補使用。
+
+直接執行 (python mock_market_ws.py) 會啟動伺服器，以 MarketStream 連線並驗證
+推送延遲、斷線重連與缺口回補。
+"""
+import asyncio
+import json
+import threading
+import time
+
+from candle_store import timeframe_to_ms
+
+
+class FakeExchange:
+    """以記憶體中的K線回應 fetch_ohlcv (與 ccxt 介面相同)"""
+
+    def __init__(self, candles=None):
+        self.candles = list(candles or [])
+        self.calls = 0
+
+    def fetch_ohlcv(self, symbol, timeframe="4h", since=None, limit=100):
+        self.calls += 1
+        rows = [list(r) for r in self.candles if since is None or r[0] >= since]
+        return rows[:limit] if since is not None else rows[-limit:]
+
+
+class MockMarketServer:
+    """在背景執行緒運行的 aiohttp WebSocket 伺服器"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.subscriptions = set()
+        self.subscribe_requests = 0
+        self.connections = 0
+        self._clients = set()
+        self._loop = None
+        self._runner = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}/ws"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._thread_main, name="mock-market-ws", daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def _thread_main(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._start_server())
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _start_server(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/ws", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def _handle(self, request):
+        from aiohttp import web, WSMsgType
+
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        self._clients.add(ws)
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                payload = json.loads(msg.data)
+                if payload.get("method") == "SUBSCRIBE":
+                    self.subscribe_requests += 1
+                    self.subscriptions.update(payload.get("params", []))
+                    await ws.send_str(json.dumps({"result": None, "id": payload.get("id")}))
+        finally:
+            self._clients.discard(ws)
+        return ws
+
+    def _broadcast(self, stream, payload):
+        if stream not in self.subscriptions:
+            return
+        data = json.dumps(payload)
+
+        async def send():
+            for ws in list(self._clients):
+                if not ws.closed:
+                    await ws.send_str(data)
+        asyncio.run_coroutine_threadsafe(send(), self._loop).result(5)
+
+    def push_kline(self, symbol, timeframe, row, closed=False, event_time=None):
+        ts, o, h, l, c, v = row
+        event_time = int(time.time() * 1000) if event_time is None else event_time
+        self._broadcast(f"{symbol}@kline_{timeframe}", {
+            "e": "kline", "E": event_time, "s": symbol.upper(),
+            "k": {"t": int(ts), "T": int(ts) + timeframe_to_ms(timeframe) - 1, "s": symbol.upper(), "i": timeframe,
+                  "o": str(o), "h": str(h), "l": str(l), "c": str(c), "v": str(v), "x": closed},
+        })
+
+    def push_ticker(self, symbol, price, event_time=None):
+        event_time = int(time.time() * 1000) if event_time is None else event_time
+        self._broadcast(f"{symbol}@miniTicker", {"e": "24hrMiniTicker", "E": event_time, "s": symbol.upper(), "c": str(price)})
+
+    def drop_connections(self):
+        """關閉所有客戶端連線並清空訂閱 (客戶端需重新訂閱)"""
+        async def close_all():
+            for ws in list(self._clients):
+                await ws.close()
+        self.subscriptions.clear()
+        asyncio.run_coroutine_threadsafe(close_all(), self._loop).result(5)
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def _wait_until(condition, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+if __name__ == "__main__":
+    import numpy as np
+
+    from candle_store import CandleStore
+    from market_stream import MarketStream
+
+    timeframe = "1m"
+    tf_ms = timeframe_to_ms(timeframe)
+    start = (int(time.time() * 1000) // tf_ms - 50) * tf_ms
+    candles = [[start + i * tf_ms, 100.0 + i, 101.0 + i, 99.0 + i, 100.5 + i, 10.0] for i in range(50)]
+    exchange = FakeExchange(candles)
+
+    server = MockMarketServer().start()
+    stream = MarketStream("ETH/USDT", [timeframe], url=server.url, exchange=exchange, reconnect_max=0.5)
+    # 使用不寫入磁碟的獨立儲存
+    stream.stores[timeframe] = CandleStore("ETH/USDT", timeframe, capacity=200, cache_dir=None)
+    store = stream.stores[timeframe]
+
+    received = []
+    stream.on_candle(lambda tf, s, row, closed: received.append((time.perf_counter(), row[0], closed)))
+    stream.start()
+    assert _wait_until(lambda: stream.connected and len(store) == 50 and server.subscriptions), "初次連線或回補失敗"
+    print(f"初次連線: 已訂閱 {sorted(server.subscriptions)}，REST 回補 {len(store)} 根K線")
+
+    # 推送延遲: 從伺服器送出到回呼執行
+    latencies = []
+    next_ts = candles[-1][0] + tf_ms
+    for i in range(200):
+        received.clear()
+        sent = time.perf_counter()
+        server.push_kline(stream.symbol, timeframe, [next_ts, 150.0, 151.0 + i * 0.01, 149.0, 150.5, 1.0])
+        assert _wait_until(lambda: received, 5)
+        latencies.append((received[0][0] - sent) * 1000)
+    print(f"推送 -> 回呼延遲: 中位數 {np.median(latencies):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms")
+    assert store.last_timestamp == next_ts and store.is_streaming(5)
+
+    # 斷線重連並重新訂閱
+    server.drop_connections()
+    assert _wait_until(lambda: stream.reconnects >= 1 and stream.connected and server.subscriptions), "重連失敗"
+    print(f"斷線後已重連 (重連 {stream.reconnects} 次，訂閱請求 {server.subscribe_requests} 次)")
+
+    # 缺口: 跳過兩根K線後推送，應觸發 REST 回補
+    exchange.candles.append([next_ts, 150.0, 152.0, 149.0, 151.0, 5.0])
+    for k in (1, 2, 3):
+        exchange.candles.append([next_ts + k * tf_ms, 151.0, 152.0, 150.0, 151.5, 5.0])
+    backfills = stream.backfills
+    server.push_kline(stream.symbol, timeframe, exchange.candles[-1])
+    assert _wait_until(lambda: stream.backfills > backfills and store.last_timestamp == exchange.candles[-1][0]), "缺口回補失敗"
+    assert not store.find_gaps()
+    print(f"缺口已由 REST 回補，最後K線 {store.last_timestamp}，儲存無缺口")
+
+    # 亂序的舊推送會被丟棄
+    server.push_ticker(stream.symbol, 200.0, event_time=int(time.time() * 1000))
+    server.push_ticker(stream.symbol, 100.0, event_time=0)
+    time.sleep(0.2)
+    assert stream.last_price == 200.0
+    print(f"最新價: {stream.last_price} (亂序推送已忽略)")
+
+    stream.stop()
+    server.stop()
+    print("WebSocket 行情串流測試通過")
@@ -0,0 +1,252 @@
+"""
+下單管理: 冪等的 clientId、在途訂單追蹤、可安全重送的指數退避重試，以及開倉時立即附帶止損止盈。
+
+* 每筆訂單在送出前產生 clientId，重試一律沿用同一個 clientId 與同一份主體。
+* 只對結果未知的失敗重試 (讀取逾時、連線中斷、HTTP 429/5xx)；重送前先以 clientId 查詢訂單，
+  已經成交的訂單直接採用查到的結果，不會重複下單。查詢本身失敗時只重試查詢，不盲目重送。
+  交易所明確拒絕 (code != 0) 的訂單不重試。
+* 開倉單直接帶 slPrice/tpPrice (place_order 支援的欄位)，持倉建立時交易所就已掛上止損，
+  不必等回應中的 positionId 再另外下條件單。
+* 回應沒有 positionId 時以短間隔輪詢持倉取得，同一次查詢也確認止損確實已掛上；
+  未確認時才退回呼叫端提供的 protect(position_id) 另外設置。
+* 無保護時間 (持倉可能已存在、止損尚未確認的秒數) 記入 order_unprotected_seconds 直方圖。
+"""
+import random
+import threading
+import time
+import uuid
+
+import requests
+
+import metrics
+from config import (ORDER_MAX_ATTEMPTS, ORDER_RETRY_BACKOFF_SECONDS, ORDER_TIMEOUT_SECONDS,
+                    ORDER_POSITION_POLL_INTERVAL_SECONDS, ORDER_POSITION_POLL_TIMEOUT_SECONDS)
+from bitunix_client import get_bitunix_client
+from account_snapshot import get_account_snapshot
+from bot_logger import get_logger
+
+log = get_logger("orders")
+
+PLACE_ORDER_PATH = "/api/v1/futures/trade/place_order"
+ORDER_DETAIL_PATH = "/api/v1/futures/trade/get_order_detail"
+PENDING_POSITIONS_PATH = "/api/v1/futures/position/get_pending_positions"
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class InFlightOrder:
+    """已產生 clientId、尚未得到最終結果的訂單"""
+    __slots__ = ("client_id", "symbol", "body", "attempts", "created", "sent_at", "status")
+
+    def __init__(self, body):
+        self.client_id = body["clientId"]
+        self.symbol = body.get("symbol")
+        self.body = body
+        self.attempts = 0
+        self.created = time.time()
+        self.sent_at = None  # 最後一次送出的 perf_counter 時間
+        self.status = "pending"  # pending / unknown (送出後結果未知) / acked / rejected
+
+    def to_dict(self):
+        return {"clientId": self.client_id, "symbol": self.symbol, "side": self.body.get("side"),
+                "tradeSide": self.body.get("tradeSide"), "qty": self.body.get("qty"), "attempts": self.attempts,
+                "status": self.status, "age": time.time() - self.created}
+
+
+def _backoff(base, attempt):
+    """第 attempt 次重試前的等待秒數: base * 2^(attempt-1)，另加最多 50% 的隨機抖動避免同時重送"""
+    delay = base * (2 ** (attempt - 1))
+    return delay * (1 + random.random() * 0.5)
+
+
+class OrderManager:
+    """單一 API Key 的下單管理 (共用 BitunixClient 的連線池與速率預算，下單流程中的查詢也以 trade 類別優先)"""
+
+    def __init__(self, api_key, secret_key, max_attempts=ORDER_MAX_ATTEMPTS, backoff=ORDER_RETRY_BACKOFF_SECONDS,
+                 timeout=ORDER_TIMEOUT_SECONDS, poll_interval=ORDER_POSITION_POLL_INTERVAL_SECONDS,
+                 poll_timeout=ORDER_POSITION_POLL_TIMEOUT_SECONDS):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.poll_timeout = poll_timeout
+        self.in_flight = {}  # clientId -> InFlightOrder
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return get_bitunix_client(self.api_key, self.secret_key)
+
+    def in_flight_orders(self):
+        """目前在途的訂單 (除錯與監控用)"""
+        with self._lock:
+            return [order.to_dict() for order in self.in_flight.values()]
+
+    def place(self, body, stop_price=None, limit_price=None, protect=None):
+        """
+        送出市價單並等待最終結果。
+
+        參數:
+            body (dict): place_order 主體 (不含 clientId，由這裡產生)
+            stop_price / limit_price: 開倉單附帶的止損/止盈價格
+            protect: 附帶的止損未確認時呼叫 protect(position_id)，返回不含 "error" 的字典表示已設置
+
+        返回:
+            成功時為交易所回應 (data.positionId 已補齊)，另含 clientId、attempts 與 protected (止損是否已確認)；
+            失敗時為 {"error": 訊息, "clientId": ...}。
+        """
+        body = dict(body, clientId=uuid.uuid4().hex)
+        opening = body.get("tradeSide") == "OPEN"
+        if opening and stop_price is not None:
+            body.update(slPrice=str(stop_price), slStopType="LAST_PRICE", slOrderType="MARKET")
+        if opening and limit_price is not None:
+            body.update(tpPrice=str(limit_price), tpStopType="LAST_PRICE", tpOrderType="MARKET")
+        order = InFlightOrder(body)
+        with self._lock:
+            self.in_flight[order.client_id] = order
+        try:
+            result = self._submit(order)
+            if "error" in result or not opening:
+                return result
+            return self._secure_position(order, result, stop_price is not None, protect)
+        finally:
+            with self._lock:
+                self.in_flight.pop(order.client_id, None)
+
+    # === 送出與重試 === #
+    def _submit(self, order):
+        last_error = None
+        for attempt in range(1, self.max_attempts + 1):
+            if order.status == "unknown":
+                # 上一次送出的結果未知: 先確認訂單是否已到達交易所，查不到才以同一個 clientId 重送
+                time.sleep(_backoff(self.backoff, attempt - 1))
+                found = self._lookup(order)
+                if found is None:
+                    metrics.inc("order_retries_total", reason="lookup_failed")
+                    continue
+                if found:
+                    log.warning("訂單 %s 的回應遺失，但交易所已收到 (第 %d 次嘗試後確認)", order.client_id, order.attempts)
+                    order.status = "acked"
+                    return {"code": 0, "data": found, "clientId": order.client_id, "attempts": order.attempts}
+                metrics.inc("order_retries_total", reason="resend")
+            order.attempts += 1
+            order.sent_at = time.perf_counter()
+            order.status = "unknown"
+            try:
+                response = self.client.post(PLACE_ORDER_PATH, order.body, timeout=self.timeout)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                last_error = f"請求錯誤: {e}"
+                log.warning("下單請求 %s 未得到回應 (第 %d 次): %s", order.client_id, order.attempts, e)
+                continue
+            except requests.exceptions.RequestException as e:
+                order.status = "rejected"
+                return {"error": f"請求錯誤: {e}", "clientId": order.client_id}
+            finally:
+                # 逾時也可能已成交，讓帳戶快照失效
+                get_account_snapshot(self.api_key, self.secret_key).invalidate()
+            if response.status_code in RETRYABLE_STATUS:
+                last_error = f"HTTP {response.status_code}: {response.text[:200]}"
+                log.warning("下單請求 %s 返回 HTTP %s (第 %d 次)", order.client_id, response.status_code, order.attempts)
+                continue
+            try:
+                response.raise_for_status()
+                result = response.json()
+            except (requests.exceptions.HTTPError, ValueError) as e:
+                order.status = "rejected"
+                return {"error": f"HTTP錯誤: {e}, 響應: {response.text[:200]}", "clientId": order.client_id}
+            log.debug("API響應: %s", result)
+            if result.get("code") != 0:
+                # 重送時先前送出的請求可能剛好成交 (交易所以重複的 clientId 拒絕)，以查詢結果為準
+                found = self._lookup(order) if order.attempts > 1 else None
+                if found:
+                    order.status = "acked"
+                    return {"code": 0, "data": found, "clientId": order.client_id, "attempts": order.attempts}
+                # HTTP 200 但交易所拒絕 (例如餘額不足)，不可視為成交，也不重試
+                order.status = "rejected"
+                return {"error": f"API 返回錯誤: {result.get('msg', '未知錯誤')} (code={result.get('code')})",
+                        "clientId": order.client_id}
+            order.status = "acked"
+            return dict(result, clientId=order.client_id, attempts=order.attempts)
+        # 重試次數用盡: 最後確認一次，避免把已成交的訂單回報為失敗
+        found = self._lookup(order)
+        if found:
+            order.status = "acked"
+            return {"code": 0, "data": found, "clientId": order.client_id, "attempts": order.attempts}
+        metrics.inc("order_failures_total", outcome="unknown" if found is None else "not_filled")
+        state = "結果未知，請檢查交易所" if found is None else "交易所未收到訂單"
+        return {"error": f"下單 {order.attempts} 次後仍失敗 ({state}): {last_error}", "clientId": order.client_id}
+
+    def _lookup(self, order):
+        """以 clientId 查詢訂單: 找到時返回訂單資料，確定不存在時返回 {}，查詢失敗時返回 None"""
+        try:
+            response = self.client.get(ORDER_DETAIL_PATH, {"symbol": order.symbol, "clientId": order.client_id},
+                                       timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log.warning("查詢訂單 %s 失敗: %s", order.client_id, e)
+            return None
+        if result.get("code") == 0:
+            return result.get("data") or {}
+        return {}  # 交易所回覆查無此單
+
+    # === 持倉與止損確認 === #
+    def _secure_position(self, order, result, attached, protect):
+        data = dict(result.get("data") or {})
+        position_id, protected = data.get("positionId"), False
+        position = self._poll_position(order, position_id)
+        if position is not None:
+            position_id = position.get("positionId")
+            protected = attached and position.get("slPrice") not in (None, "", "0")
+        if position_id is None:
+            log.error("下單 %s 已成交，但 %.1f 秒內未查到持倉 positionId", order.client_id, self.poll_timeout)
+        elif not protected and protect is not None:
+            outcome = protect(position_id)
+            protected = bool(outcome) and "error" not in outcome
+        unprotected = 0.0 if attached and protected and position is not None else time.perf_counter() - order.sent_at
+        if protected:
+            metrics.observe("order_unprotected_seconds", unprotected)
+            log.info("持倉 %s 止損已確認 (%s，無保護時間 %.1f ms)", position_id,
+                     "隨開倉單附帶" if unprotected == 0.0 else "另外設置", unprotected * 1000)
+        else:
+            metrics.inc("order_unprotected_total")
+            log.error("持倉 %s 的止損未能確認，目前沒有保護", position_id)
+        data["positionId"] = position_id
+        return dict(result, data=data, protected=protected, unprotected_seconds=None if not protected else unprotected)
+
+    def _poll_position(self, order, position_id=None):
+        """短間隔輪詢持倉，返回 positionId 相符 (未知時為同方向) 的持倉；逾時返回 None"""
+        side = order.body.get("side")
+        deadline = time.perf_counter() + self.poll_timeout
+        while True:
+            try:
+                result = self.client.get(PENDING_POSITIONS_PATH, {"symbol": order.symbol}, timeout=self.timeout,
+                                         endpoint_class="trade").json()
+                positions = (result.get("data") or []) if result.get("code") == 0 else []
+                for position in positions:
+                    if position_id and position.get("positionId") == position_id:
+                        return position
+                    if not position_id and position.get("side") == side:
+                        return position
+            except (requests.exceptions.RequestException, ValueError) as e:
+                log.warning("輪詢持倉失敗: %s", e)
+            if time.perf_counter() + self.poll_interval > deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_order_manager(api_key, secret_key):
+    """取得 (或建立) 對應 API Key 的共用下單管理器"""
+    key = (api_key, secret_key)
+    manager = _managers.get(key)
+    if manager is None:
+        with _managers_lock:
+            manager = _managers.get(key)
+            if manager is None:
+                manager = _managers[key] = OrderManager(api_key, secret_key)
+    return manager
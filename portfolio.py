@@ -0,0 +1,209 @@
+"""
+多交易對投資組合執行器: 在同一個程序中同時交易多個 USDT 永續合約。
+
+* 每個交易對有自己的 SymbolConfig (config.py 的 PORTFOLIO_SYMBOLS 可逐項覆寫參數) 與 SymbolState
+  (持倉記憶、勝負統計)，K線儲存與指標引擎以 (交易對, 時間框架) 區分，彼此不共用任何可變狀態。
+* HTTP 連線池、請求速率治理 (rate_governor，下單優先於讀取)、帳戶快照與 Discord 通知佇列為所有交易對共用。
+* 每個交易對依自己的時間框架排程 (scheduler.BarScheduler): 收盤後執行完整評估，收盤之間只做輕量檢查；
+  到期的交易對在有界執行緒池中並行執行，同一交易對的 tick 不會重疊 (上一輪尚未結束時略過本輪)。
+* 啟用 WebSocket 時每個交易對各有一條行情串流，只喚醒出現可操作條件的交易對。
+  所有交易對共用一條 Bitunix 私有頻道 (account_stream)，持倉與餘額讀取記憶體鏡像，交易所端平倉時立即喚醒該交易對。
+
+執行: python portfolio.py
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from config import (BITUNIX_API_KEY, BITUNIX_SECRET_KEY, MARKET_WS_ENABLED, PORTFOLIO_SYMBOLS,
+                    PORTFOLIO_MAX_PARALLEL_TICKS, BALANCE_CHECK_INTERVAL_SECONDS, LEDGER_SYNC_INTERVAL_SECONDS,
+                    ACCOUNT_WS_RECONCILE_SECONDS, INSTRUMENT_SPEC_TTL_SECONDS)
+from symbol_state import SymbolConfig, register_symbol_state
+from bitunix_client import get_bitunix_client
+from instrument_specs import get_instrument_specs
+from scheduler import BarScheduler, PeriodicJob
+from metrics import start_metrics_exporter
+from bot_logger import get_logger, setup_logging
+import trading_bot
+
+log = get_logger("portfolio")
+
+
+class PortfolioRunner:
+    """
+    同時驅動多個交易對的策略 tick。
+
+    參數:
+        symbol_overrides (list): 每個交易對的設定覆寫 (dict，鍵名與 config.py 相同)，
+            空白時只交易 config.py 的 SYMBOL
+        max_parallel (int): 同時執行 tick 的交易對數量
+    """
+
+    def __init__(self, api_key, secret_key, symbol_overrides=None, max_parallel=PORTFOLIO_MAX_PARALLEL_TICKS, use_stream=MARKET_WS_ENABLED):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.states = []
+        for overrides in (symbol_overrides or [{}]):
+            state = register_symbol_state(SymbolConfig(**overrides))
+            if state not in self.states:
+                self.states.append(state)
+        self.schedulers = {state.symbol: BarScheduler(state.config.timeframe) for state in self.states}
+        self.use_stream = use_stream
+        self.streams = {}
+        self.candle_sources = {}  # 交易對 -> 註冊K線回呼的對象 (MarketStream 或 CandleResampler)
+        self.account_stream = None
+        self.skipped_ticks = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="portfolio-tick")
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    @property
+    def symbols(self):
+        return [state.symbol for state in self.states]
+
+    def load_stats(self):
+        for state in self.states:
+            state.load_stats()
+
+    # === tick === #
+    def tick_symbol(self, state):
+        """執行單一交易對的 tick；上一輪仍在執行時略過，返回是否已執行"""
+        if not state.lock.acquire(blocking=False):
+            self.skipped_ticks += 1
+            log.warning("%s 上一輪 tick 尚未完成，略過本輪", state.symbol)
+            return False
+        try:
+            cfg = state.config
+            state.wake_requested = False
+            tick_inputs = trading_bot.fetch_tick_inputs(self.api_key, self.secret_key, cfg.symbol, cfg.margin_coin, cfg)
+            trading_bot.execute_trading_strategy(self.api_key, self.secret_key, cfg.symbol, cfg.margin_coin, cfg.wallet_percentage,
+                                                 cfg.leverage, cfg.rsi_buy, cfg.breakout_lookback, cfg.atr_mult,
+                                                 tick_inputs=tick_inputs, state=state)
+            state.last_tick_time = time.time()
+            return True
+        except Exception as e:
+            log.exception("%s tick 執行錯誤: %s", state.symbol, e)
+            trading_bot.send_discord_message(f"🔴 **交易任務錯誤**: {e} 🔴", self.api_key, self.secret_key, symbol=state.symbol,
+                                             operation_details={"type": "error", "details": str(e), "force_send": True})
+            return False
+        finally:
+            state.lock.release()
+
+    def run_tick(self, states=None):
+        """並行執行指定交易對 (預設為全部) 的 tick，返回耗時秒數"""
+        started = time.perf_counter()
+        futures = [self._executor.submit(self.tick_symbol, state) for state in (states or self.states)]
+        wait(futures)
+        return time.perf_counter() - started
+
+    def _light_check(self, state):
+        try:
+            return trading_bot.light_check(self.api_key, self.secret_key, state)
+        except Exception as e:
+            log.exception("%s 輕量檢查錯誤: %s", state.symbol, e)
+            return None
+
+    def due_states(self, now=None):
+        """返回本輪需要完整評估的交易對: 收盤到期、串流喚醒，或輕量檢查偵測到可操作條件"""
+        now = time.time() if now is None else now
+        full, light = [], []
+        for state in self.states:
+            scheduler = self.schedulers[state.symbol]
+            if state.wake_requested:
+                scheduler.mark_full(now)
+                full.append(state)
+                continue
+            kind = scheduler.poll(now)
+            if kind == "full":
+                full.append(state)
+            elif kind == "light":
+                light.append(state)
+        # 輕量檢查不查詢帳戶，並行執行
+        for state, reason in zip(light, self._executor.map(self._light_check, light)):
+            if reason:
+                log.info("%s 輕量檢查偵測到 %s 條件，執行完整評估", state.symbol, reason)
+                self.schedulers[state.symbol].mark_full(now)
+                full.append(state)
+        return full
+
+    # === WebSocket 行情 === #
+    def start_streams(self):
+        """每個交易對啟動一條行情串流 (同一交易對的多個時間框架共用一條連線)"""
+        if not self.use_stream:
+            return self.streams
+        timeframes = {}
+        for state in self.states:
+            timeframes.setdefault(state.config.trading_pair, set()).add(state.config.timeframe)
+        for trading_pair, tfs in timeframes.items():
+            if trading_pair not in self.streams:
+                self.streams[trading_pair], self.candle_sources[trading_pair] = trading_bot.create_market_stream(trading_pair, sorted(tfs))
+        for state in self.states:
+            self.candle_sources[state.config.trading_pair].on_candle(trading_bot.make_stream_candle_handler(state, self._wake.set))
+        for stream in self.streams.values():
+            stream.start()
+        return self.streams
+
+    # === 主迴圈 === #
+    def _check_balance(self):
+        balance = trading_bot.check_wallet_balance(self.api_key, self.secret_key)
+        if balance is None or balance <= 0:
+            log.critical("餘額為0或無法獲取餘額，退出程序")
+            trading_bot.send_discord_message("🛑 **程序終止**: 餘額為0或無法獲取餘額，交易機器人已停止運行 🛑", self.api_key, self.secret_key)
+            self._stop.set()
+
+    def _sync_ledger(self):
+        for state in self.states:
+            trading_bot.settle_unsettled(self.api_key, self.secret_key, state)
+
+    def run_forever(self):
+        self.load_stats()
+        log.info("開始交易 %s 個交易對: %s", len(self.states), ', '.join(self.symbols))
+        specs = get_instrument_specs(self.api_key, self.secret_key)
+        specs.preload(self.symbols)
+        self.start_streams()
+        # 所有交易對共用一條私有頻道，交易所端平倉時只喚醒對應的交易對 (是否啟用由 ACCOUNT_WS_ENABLED 決定，與行情串流無關)
+        self.account_stream = trading_bot.start_account_stream(self.api_key, self.secret_key,
+                                                               {state.symbol: state for state in self.states}, self._wake.set)
+        start_metrics_exporter()
+        client = get_bitunix_client(self.api_key, self.secret_key)
+        jobs = [PeriodicJob("balance_check", BALANCE_CHECK_INTERVAL_SECONDS, self._check_balance),
+                PeriodicJob("ledger_sync", LEDGER_SYNC_INTERVAL_SECONDS, self._sync_ledger),
+                PeriodicJob("instrument_specs", INSTRUMENT_SPEC_TTL_SECONDS / 2, specs.refresh)]
+        if self.account_stream is not None:
+            jobs.append(PeriodicJob("account_reconcile", ACCOUNT_WS_RECONCILE_SECONDS, self.account_stream.reconcile))
+        while not self._stop.is_set():
+            states = self.due_states()
+            if states:
+                elapsed = self.run_tick(states)
+                log.info("%s 個交易對完整評估完成，耗時 %.2f 秒", len(states), elapsed)
+                self._check_balance()
+                trading_bot.report_request_counts(self.api_key, self.secret_key)
+            for job in jobs:
+                job.run_if_due(time.time())
+            if any(scheduler.prewarm_due() for scheduler in self.schedulers.values()):
+                client.prewarm()
+            if self._stop.is_set():
+                break
+            now = time.time()
+            timeout = min([scheduler.seconds_until_due(now) for scheduler in self.schedulers.values()] + [job.next_run - now for job in jobs])
+            self._wake.wait(max(0.0, timeout))
+            self._wake.clear()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for stream in self.streams.values():
+            stream.stop()
+        if self.account_stream is not None:
+            self.account_stream.stop()
+        self._executor.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    setup_logging()
+    runner = PortfolioRunner(BITUNIX_API_KEY, BITUNIX_SECRET_KEY, PORTFOLIO_SYMBOLS)
+    try:
+        runner.run_forever()
+    finally:
+        runner.stop()
+        trading_bot.flush_discord_messages()
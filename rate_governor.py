@@ -0,0 +1,207 @@
+"""
+請求速率治理: 所有呼叫端 (各交易對的 tick、週期任務、Discord 發送器、K線回補) 共用的令牌桶。
+
+* 每個端點類別一個令牌桶 (RATE_LIMITS):
+    trade    下單、止盈止損與下單流程中的查詢 (最優先)
+    account  餘額、持倉、帳本等私有讀取
+    market   行情 (Bitunix 公開端點與 Binance K線)
+    webhook  Discord Webhook
+* Bitunix 的三個類別另外共用一個總預算 (BITUNIX_MAX_REQUESTS_PER_SECOND)。低優先的讀取只在總預算
+  還剩超過 RATE_PRIORITY_RESERVE 個令牌時才取用，下單則可以透支並依到達順序等待；
+  交易對增加、總預算吃緊時先變慢的是讀取，下單不會排在讀取後面。
+* 收到 429 時 (呼叫 throttle) 該類別在 Retry-After 期間暫停，速率減半 (最低 RATE_BACKOFF_MIN_FACTOR)，
+  之後每秒恢復 RATE_RECOVERY_PER_SECOND；Bitunix 的 429 同時讓低優先的讀取退避，下單只在自己收到 429 時暫停。
+* report() 返回各類別在報告區間內的請求數、等待時間、429 次數與預算使用率。
+"""
+import threading
+import time
+
+import metrics
+from config import (BITUNIX_MAX_REQUESTS_PER_SECOND, RATE_LIMITS, RATE_PRIORITY_RESERVE, RATE_BACKOFF_MIN_FACTOR,
+                    RATE_RECOVERY_PER_SECOND)
+from bot_logger import get_logger
+
+log = get_logger("rate")
+
+MAX_POLL_SECONDS = 0.25  # 低優先請求等待期間重新檢查的最長間隔 (期間可能被下單取走令牌)
+
+
+def endpoint_class(path):
+    """依 Bitunix 路徑判斷端點類別"""
+    if "/futures/trade/" in path or "/futures/tpsl/" in path:
+        return "trade"
+    if "/futures/market/" in path:
+        return "market"
+    return "account"
+
+
+class TokenBucket:
+    """令牌桶 (實際速率為 rate * factor，factor 因 429 降低後隨時間恢復)"""
+    __slots__ = ("rate", "burst", "tokens", "updated", "factor", "blocked_until")
+
+    def __init__(self, rate, burst=None, now=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic() if now is None else now
+        self.factor = 1.0
+        self.blocked_until = 0.0
+
+    @property
+    def effective_rate(self):
+        return self.rate * self.factor
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.effective_rate)
+            self.factor = min(1.0, self.factor + elapsed * RATE_RECOVERY_PER_SECOND)
+            self.updated = now
+
+    def seconds_until(self, tokens):
+        """令牌數達到 tokens 還需要的秒數"""
+        return max(0.0, (tokens - self.tokens) / self.effective_rate)
+
+    def back_off(self, now, retry_after):
+        self.factor = max(RATE_BACKOFF_MIN_FACTOR, self.factor * 0.5)
+        self.blocked_until = max(self.blocked_until, now + retry_after)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class _ClassStats:
+    __slots__ = ("requests", "waits", "wait_seconds", "throttled")
+
+    def __init__(self):
+        self.requests = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+
+
+class RateGovernor:
+    """
+    共用的請求速率治理器。
+
+    參數:
+        total_rate (float): Bitunix 總預算 (每秒請求數，突發上限相同)
+        limits (dict): 端點類別 -> (每秒請求數, 突發上限)
+        reserve (dict): 端點類別 -> 取用總預算時必須留下的令牌數
+    """
+
+    def __init__(self, total_rate=BITUNIX_MAX_REQUESTS_PER_SECOND, limits=None, reserve=None):
+        now = time.monotonic()
+        self.total = TokenBucket(total_rate, total_rate, now)
+        self.buckets = {name: TokenBucket(rate, burst, now) for name, (rate, burst) in (limits or RATE_LIMITS).items()}
+        self.reserve = dict(RATE_PRIORITY_RESERVE if reserve is None else reserve)
+        self._stats = {name: _ClassStats() for name in self.buckets}
+        self._window_start = now
+        self._lock = threading.Lock()
+
+    def acquire(self, endpoint_class, shared=True):
+        """
+        取得一個請求額度，返回等待的秒數。
+        shared=True 表示請求發往 Bitunix，同時佔用總預算 (Discord 與 Binance 請求傳 False)。
+        """
+        bucket = self.buckets[endpoint_class]
+        reserve = self.reserve.get(endpoint_class, 0) if shared else 0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                bucket.refill(now)
+                if shared:
+                    self.total.refill(now)
+                wait = bucket.blocked_until - now
+                granted = False
+                if wait <= 0 and reserve <= 0:
+                    # 最優先: 直接預約令牌 (可透支)，在鎖外等待到自己的令牌產生為止，不會被之後到達的讀取插隊
+                    bucket.tokens -= 1
+                    wait = bucket.seconds_until(0)
+                    if shared:
+                        self.total.tokens -= 1
+                        wait = max(wait, self.total.seconds_until(0))
+                    granted = True
+                elif wait <= 0:
+                    # 低優先: 類別令牌與總預算 (留下 reserve 個給較高優先的請求) 都足夠時才取用，否則稍後重新檢查
+                    wait = max(bucket.seconds_until(1), self.total.seconds_until(reserve + 1) if shared else 0.0)
+                    if wait <= 0:
+                        bucket.tokens -= 1
+                        if shared:
+                            self.total.tokens -= 1
+                        granted = True
+                if granted:
+                    stats = self._stats[endpoint_class]
+                    stats.requests += 1
+                    if waited + wait > 0:
+                        stats.waits += 1
+                        stats.wait_seconds += waited + wait
+            if granted:
+                if wait > 0:
+                    time.sleep(wait)
+                waited += max(wait, 0.0)
+                break
+            wait = min(wait, MAX_POLL_SECONDS) if reserve > 0 else wait
+            time.sleep(wait)
+            waited += wait
+        if waited:
+            metrics.observe("rate_governor_wait_seconds", waited, endpoint_class=endpoint_class)
+        return waited
+
+    def throttle(self, endpoint_class, retry_after=None, shared=True):
+        """收到 429: 該類別暫停 retry_after 秒並減半速率；Bitunix 的 429 同時讓低優先的讀取退避"""
+        bucket = self.buckets[endpoint_class]
+        retry_after = retry_after if retry_after is not None else 1.0 / bucket.effective_rate
+        with self._lock:
+            now = time.monotonic()
+            bucket.back_off(now, retry_after)
+            self._stats[endpoint_class].throttled += 1
+            if shared:
+                for name, other in self.buckets.items():
+                    if name != endpoint_class and self.reserve.get(name, 0) > 0:
+                        other.back_off(now, retry_after)
+            factor = bucket.factor
+        metrics.inc("rate_governor_throttled_total", endpoint_class=endpoint_class)
+        log.warning("%s 請求收到 429，暫停 %.2f 秒，速率降為 %.0f%%", endpoint_class, retry_after, factor * 100)
+
+    def pause(self, endpoint_class, seconds):
+        """暫停該類別 seconds 秒 (例如回應表示剩餘額度為 0)，不降低速率"""
+        with self._lock:
+            bucket = self.buckets[endpoint_class]
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + seconds)
+
+    def report(self, reset=False):
+        """
+        各端點類別在報告區間內的統計:
+        requests、waits (需要等待的請求數)、wait_seconds、throttled (429 次數)、
+        rate (目前的實際速率) 與 utilization (請求數 / 設定速率下可用的額度)。
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(now - self._window_start, 1e-9)
+            report = {}
+            for name, stats in self._stats.items():
+                bucket = self.buckets[name]
+                report[name] = {"requests": stats.requests, "waits": stats.waits, "wait_seconds": stats.wait_seconds,
+                                "throttled": stats.throttled, "rate": bucket.effective_rate,
+                                "utilization": stats.requests / (bucket.rate * elapsed + bucket.burst)}
+            shared_requests = sum(report[name]["requests"] for name in report if name in self.reserve)
+            report["bitunix_total"] = {"requests": shared_requests,
+                                       "utilization": shared_requests / (self.total.rate * elapsed + self.total.burst)}
+            if reset:
+                self._stats = {name: _ClassStats() for name in self.buckets}
+                self._window_start = now
+        return report
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_rate_governor():
+    """取得 (或建立) 整個程序共用的速率治理器"""
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = RateGovernor()
+    return _governor
@@ -0,0 +1,185 @@
+"""
+以K線收盤為基準的排程器。
+
+* 完整策略評估 (K線、帳戶、指標、信號) 只在每根K線收盤後 close_delay 秒執行一次；
+  醒來時若已錯過收盤 (例如上一輪執行過久或系統休眠)，立即補跑一次。
+* 收盤之間以 light_interval 秒的間隔執行輕量價格檢查 (移動止損/出場)，只在出現可操作的條件時才升級為完整評估。
+* 週期任務 (例如餘額檢查) 以隨機抖動錯開觸發時間。
+* 收盤前 prewarm_lead 秒呼叫一次預熱回呼 (預先建立下單連線)。
+"""
+import random
+import threading
+import time
+
+from config import LOOP_INTERVAL_SECONDS, PREWARM_SECONDS_BEFORE_CLOSE, SCHEDULE_CLOSE_DELAY_SECONDS, SCHEDULE_JITTER_SECONDS
+from candle_store import timeframe_to_ms
+from bot_logger import get_logger
+
+log = get_logger("scheduler")
+
+
+class BarScheduler:
+    """
+    單一時間框架的收盤排程 (只負責決定何時執行哪一種 tick，本身不執行任何工作)。
+
+    poll() 返回 "full"、"light" 或 None，並將返回的工作視為已執行；
+    由其他來源 (例如 WebSocket 收盤推送) 觸發的完整評估以 mark_full() 記錄，避免同一根K線重複評估。
+    """
+
+    def __init__(self, timeframe, close_delay=SCHEDULE_CLOSE_DELAY_SECONDS, light_interval=LOOP_INTERVAL_SECONDS,
+                 prewarm_lead=PREWARM_SECONDS_BEFORE_CLOSE):
+        self.timeframe = timeframe
+        self.tf_seconds = timeframe_to_ms(timeframe) / 1000
+        self.close_delay = close_delay
+        self.light_interval = light_interval
+        self.prewarm_lead = prewarm_lead
+        self.last_full_bar = None  # 最後一次完整評估時所在K線的開盤時間 (秒)
+        self.next_light = 0.0
+        self.last_prewarm_bar = None
+        self.full_runs = 0
+        self.light_runs = 0
+        self.catch_ups = 0
+
+    def bar_start(self, now):
+        return now - now % self.tf_seconds
+
+    def next_close(self, now=None):
+        now = time.time() if now is None else now
+        return self.bar_start(now) + self.tf_seconds
+
+    def _due_bar(self, now):
+        # 收盤後 close_delay 秒內仍視為上一根K線，延遲結束後才輪到新K線的完整評估
+        return self.bar_start(now - self.close_delay)
+
+    def mark_full(self, now=None):
+        """記錄已完成一次完整評估 (同時延後下一次輕量檢查)"""
+        now = time.time() if now is None else now
+        self.last_full_bar = max(self.bar_start(now), self.last_full_bar or 0.0)
+        self.next_light = now + self.light_interval
+        self.full_runs += 1
+
+    def poll(self, now=None):
+        now = time.time() if now is None else now
+        due_bar = self._due_bar(now)
+        if self.last_full_bar is None or due_bar > self.last_full_bar:
+            if self.last_full_bar is not None:
+                missed = int((due_bar - self.last_full_bar) // self.tf_seconds)
+                late = now - due_bar - self.close_delay
+                if missed > 1 or late > max(self.light_interval, self.close_delay):
+                    self.catch_ups += 1
+                    log.warning("%s 收盤評估延遲 %.1f 秒 (錯過 %s 根K線)，立即補跑", self.timeframe, late, missed)
+            self.mark_full(now)
+            self.last_full_bar = due_bar
+            return "full"
+        if now >= self.next_light:
+            self.next_light = now + self.light_interval
+            self.light_runs += 1
+            return "light"
+        return None
+
+    def prewarm_due(self, now=None):
+        """收盤前 prewarm_lead 秒內返回 True (每根K線只返回一次)"""
+        now = time.time() if now is None else now
+        bar = self.bar_start(now)
+        if self.next_close(now) - now <= self.prewarm_lead and self.last_prewarm_bar != bar:
+            self.last_prewarm_bar = bar
+            return True
+        return False
+
+    def seconds_until_due(self, now=None):
+        """距離下一個排程事件 (收盤評估、輕量檢查或預熱) 的秒數"""
+        now = time.time() if now is None else now
+        events = [self.next_close(now - self.close_delay) + self.close_delay, self.next_light]
+        prewarm_at = self.next_close(now) - self.prewarm_lead
+        if self.last_prewarm_bar != self.bar_start(now) and prewarm_at > now:
+            events.append(prewarm_at)
+        return max(0.0, min(events) - now)
+
+
+class PeriodicJob:
+    """以隨機抖動錯開的週期任務 (例如餘額檢查)"""
+    __slots__ = ("name", "interval", "func", "jitter", "next_run", "runs")
+
+    def __init__(self, name, interval, func, jitter=SCHEDULE_JITTER_SECONDS, now=None):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.jitter = jitter
+        self.runs = 0
+        self.schedule_next(time.time() if now is None else now)
+
+    def schedule_next(self, now):
+        self.next_run = now + max(0.0, self.interval + random.uniform(-self.jitter, self.jitter))
+
+    def run_if_due(self, now):
+        if now < self.next_run:
+            return False
+        self.schedule_next(now)
+        self.runs += 1
+        try:
+            self.func()
+        except Exception as e:
+            log.exception("週期任務 %s 執行錯誤: %s", self.name, e)
+        return True
+
+
+class TickLoop:
+    """
+    以 BarScheduler 驅動的主迴圈。
+
+    參數:
+        full_tick: 完整策略評估 (無參數)
+        light_tick: 輕量檢查 (無參數)，返回真值表示需要立即執行完整評估
+        jobs (list): PeriodicJob 週期任務
+        prewarm: 收盤前的預熱回呼 (可為 None)
+        wake_event (threading.Event): 被設置時立即執行完整評估 (WebSocket 偵測到可操作的條件)
+    """
+
+    def __init__(self, scheduler, full_tick, light_tick=None, jobs=(), prewarm=None, wake_event=None):
+        self.scheduler = scheduler
+        self.full_tick = full_tick
+        self.light_tick = light_tick
+        self.jobs = list(jobs)
+        self.prewarm = prewarm
+        self.wake_event = wake_event or threading.Event()
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+        self.wake_event.set()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def run_once(self, now=None):
+        """執行目前到期的工作，返回執行的 tick 類型 ("full"、"light" 或 None)"""
+        now = time.time() if now is None else now
+        kind = self.scheduler.poll(now)
+        if kind == "light" and self.light_tick is not None:
+            reason = self.light_tick()
+            if reason:
+                log.info("輕量檢查偵測到 %s 條件，執行完整評估", reason)
+                self.scheduler.mark_full()
+                kind = "full"
+        if kind == "full" and not self.stopped:
+            self.full_tick()
+        for job in self.jobs:
+            if self.stopped:
+                break
+            job.run_if_due(time.time())
+        if self.prewarm is not None and not self.stopped and self.scheduler.prewarm_due():
+            self.prewarm()
+        return kind
+
+    def run_forever(self):
+        while not self.stopped:
+            self.run_once()
+            now = time.time()
+            timeout = self.scheduler.seconds_until_due(now)
+            if self.jobs:
+                timeout = min(timeout, max(0.0, min(job.next_run for job in self.jobs) - now))
+            if self.wake_event.wait(timeout) and not self.stopped:
+                self.wake_event.clear()
+                self.scheduler.mark_full()
+                self.full_tick()
@@ -0,0 +1,178 @@
+"""
+交易對狀態日誌: 以 SQLite (WAL 模式) 附加記錄進場、止損移動、出場與勝負統計，重啟時重建持倉記憶。
+
+* events 表只附加不修改；snapshots 表保存每個交易對最近一次的完整狀態與對應的事件編號，
+  恢復時讀取快照後只重放其後的少量事件。
+* synchronous=NORMAL: 每次提交只附加到 WAL，不做 fsync (程序崩潰不會遺失已提交的事件)；
+  fsync 集中在檢查點執行，每 JOURNAL_CHECKPOINT_SECONDS 秒最多一次，斷電時最多遺失這段時間內的事件。
+* 單筆事件的寫入約數十微秒，可以在每個 tick 記錄。
+
+事件類型:
+    open      進場 (side、position_id、entry_type、stop_loss_price)
+    stop      止損價格更新 (stop_loss_price)
+    close     平倉 (pnl；pnl > 0 計為勝，其餘計為敗，pnl 為 None 時不計入)
+    pending   交易所已平倉但帳本尚無平倉紀錄: 清除持倉記憶，position_id 留待之後結算
+    settle    以帳本紀錄結算先前待結算的持倉 (position_id、pnl，計入勝負規則與 close 相同)
+    counters  直接設定勝負統計 (由舊的 stats.json 匯入)
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import JOURNAL_PATH, JOURNAL_SYNCHRONOUS, JOURNAL_CHECKPOINT_SECONDS, JOURNAL_SNAPSHOT_EVERY
+from bot_logger import get_logger
+
+log = get_logger("journal")
+
+# 由日誌重建的 SymbolState 欄位
+STATE_FIELDS = ("pos_side", "entry_type", "stop_loss_price", "position_id", "win_count", "loss_count", "unsettled")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    symbol TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_symbol ON events (symbol, id);
+CREATE TABLE IF NOT EXISTS snapshots (
+    symbol TEXT PRIMARY KEY,
+    event_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    state TEXT NOT NULL
+);
+"""
+
+
+def empty_state():
+    return {"pos_side": None, "entry_type": None, "stop_loss_price": None, "position_id": None,
+            "win_count": 0, "loss_count": 0, "unsettled": []}
+
+
+def apply_event(fields, kind, data):
+    """將一筆事件套用到狀態字典 (恢復與即時更新共用同一套規則)"""
+    if kind == "open":
+        fields.update(pos_side=data.get("side", "long"), position_id=data.get("position_id"),
+                      entry_type=data.get("entry_type"), stop_loss_price=data.get("stop_loss_price"))
+    elif kind == "stop":
+        fields["stop_loss_price"] = data.get("stop_loss_price")
+    elif kind == "close":
+        fields.update(pos_side=None, entry_type=None, stop_loss_price=None, position_id=None)
+        pnl = data.get("pnl")
+        if pnl is not None:
+            fields["win_count" if pnl > 0 else "loss_count"] += 1
+    elif kind == "pending":
+        fields.update(pos_side=None, entry_type=None, stop_loss_price=None, position_id=None)
+        if data.get("position_id") not in fields["unsettled"]:
+            fields["unsettled"] = fields["unsettled"] + [data.get("position_id")]
+    elif kind == "settle":
+        fields["unsettled"] = [position_id for position_id in fields["unsettled"] if position_id != data.get("position_id")]
+        pnl = data.get("pnl")
+        if pnl is not None:
+            fields["win_count" if pnl > 0 else "loss_count"] += 1
+    elif kind == "counters":
+        fields.update(win_count=data.get("win_count", 0), loss_count=data.get("loss_count", 0))
+    return fields
+
+
+class StateJournal:
+    """所有交易對共用的狀態日誌 (單一 SQLite 連線，寫入以鎖序列化)"""
+
+    def __init__(self, path=JOURNAL_PATH, synchronous=JOURNAL_SYNCHRONOUS, checkpoint_interval=JOURNAL_CHECKPOINT_SECONDS,
+                 snapshot_every=JOURNAL_SNAPSHOT_EVERY):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.snapshot_every = snapshot_every
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._since_snapshot = {}  # symbol -> 上次快照後的事件數
+        self._last_checkpoint = time.monotonic()
+
+    def record(self, symbol, kind, fields=None, **data):
+        """
+        附加一筆事件並提交，返回事件編號。
+        fields 為套用事件後的完整狀態 (SymbolState.journal_fields())；提供時每 snapshot_every 筆事件寫入一次快照。
+        """
+        with self._lock:
+            cursor = self._conn.execute("INSERT INTO events (ts, symbol, kind, data) VALUES (?, ?, ?, ?)",
+                                        (time.time(), symbol, kind, json.dumps(data)))
+            event_id = cursor.lastrowid
+            count = self._since_snapshot.get(symbol, 0) + 1
+            self._since_snapshot[symbol] = count
+            if fields is not None and count >= self.snapshot_every:
+                self._write_snapshot(symbol, event_id, fields)
+            self._maybe_checkpoint()
+        return event_id
+
+    def snapshot(self, symbol, fields):
+        """保存交易對的完整狀態 (恢復時從這裡開始重放)"""
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(id) FROM events WHERE symbol = ?", (symbol,)).fetchone()
+            self._write_snapshot(symbol, row[0] or 0, fields)
+
+    def _write_snapshot(self, symbol, event_id, fields):
+        state = {key: fields[key] for key in STATE_FIELDS}
+        self._conn.execute("INSERT OR REPLACE INTO snapshots (symbol, event_id, ts, state) VALUES (?, ?, ?, ?)",
+                           (symbol, event_id, time.time(), json.dumps(state)))
+        self._since_snapshot[symbol] = 0
+
+    def _maybe_checkpoint(self):
+        now = time.monotonic()
+        if now - self._last_checkpoint >= self.checkpoint_interval:
+            self._last_checkpoint = now
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def recover(self, symbol):
+        """
+        重建交易對狀態: 讀取最近的快照並重放其後的事件。
+        返回 (狀態字典, 重放的事件數)；日誌中沒有該交易對時返回 (None, 0)。
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT event_id, state FROM snapshots WHERE symbol = ?", (symbol,)).fetchone()
+            after_id, fields = (row[0], dict(empty_state(), **json.loads(row[1]))) if row else (0, empty_state())
+            events = self._conn.execute("SELECT kind, data FROM events WHERE symbol = ? AND id > ? ORDER BY id",
+                                        (symbol, after_id)).fetchall()
+        if row is None and not events:
+            return None, 0
+        for kind, data in events:
+            apply_event(fields, kind, json.loads(data))
+        self._since_snapshot[symbol] = len(events)
+        return fields, len(events)
+
+    def events(self, symbol=None, limit=100):
+        """最近的事件 (新到舊)，供除錯與報表使用"""
+        query, params = "SELECT id, ts, symbol, kind, data FROM events", ()
+        if symbol:
+            query, params = query + " WHERE symbol = ?", (symbol,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id DESC LIMIT ?", params + (limit,)).fetchall()
+        return [{"id": r[0], "ts": r[1], "symbol": r[2], "kind": r[3], **json.loads(r[4])} for r in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def get_state_journal(path=JOURNAL_PATH):
+    """取得 (或建立) 指定路徑的共用狀態日誌"""
+    journal = _journals.get(path)
+    if journal is None:
+        with _journals_lock:
+            journal = _journals.get(path)
+            if journal is None:
+                journal = _journals[path] = StateJournal(path)
+    return journal
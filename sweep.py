@@ -0,0 +1,240 @@
+"""
+多核心參數掃描: 以進程池對 config.py 的策略參數網格執行 backtest.run_backtest。
+
+* 每個時間框架的K線只載入一次並放入共享記憶體，工作進程以零複製方式映射。
+* 任務依 (TIMEFRAME, RSI_LEN, ATR_LEN) 分組派發，同組組合重用已計算的指標欄位。
+* 每個組合的結果以 (參數, 數據摘要, 回測設定) 的雜湊值快取於磁碟，重跑時只計算新組合；
+  回測設定包含手續費率、倉位比例 (WALLET_PERCENTAGE) 與初始資金，回測規則變更時遞增 SWEEP_CACHE_VERSION。
+"""
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import RSI_BUY, RSI_LEN, EXIT_RSI, BREAKOUT_LOOKBACK, ATR_LEN, STOP_MULT, LIMIT_MULT, LEVERAGE, WALLET_PERCENTAGE, TIMEFRAME, TRADING_PAIR
+from backtest import run_backtest, DEFAULT_FEE_RATE, DEFAULT_INITIAL_EQUITY
+from indicators import batch_rsi, batch_atr, batch_highest_break
+
+SWEEP_CACHE_FILE = os.path.join("sweep_cache", "results.jsonl")
+SWEEP_CACHE_VERSION = 2  # 回測規則或結果欄位變更時遞增，使舊的快取結果失效
+PARAM_NAMES = ("RSI_BUY", "RSI_LEN", "EXIT_RSI", "BREAKOUT_LOOKBACK", "ATR_LEN", "STOP_MULT", "LIMIT_MULT", "LEVERAGE", "TIMEFRAME")
+
+# 預設網格: 以 config.py 的目前設定為中心
+DEFAULT_GRID = {
+    "RSI_BUY": [RSI_BUY - 6, RSI_BUY - 3, RSI_BUY, RSI_BUY + 3, RSI_BUY + 6],
+    "RSI_LEN": [RSI_LEN - 4, RSI_LEN, RSI_LEN + 4],
+    "EXIT_RSI": [EXIT_RSI - 5, EXIT_RSI, EXIT_RSI + 3],
+    "BREAKOUT_LOOKBACK": [BREAKOUT_LOOKBACK, BREAKOUT_LOOKBACK * 2, BREAKOUT_LOOKBACK * 5],
+    "ATR_LEN": [ATR_LEN - 4, ATR_LEN, ATR_LEN + 8],
+    "STOP_MULT": [STOP_MULT, STOP_MULT * 1.5, STOP_MULT * 2],
+    "LIMIT_MULT": [LIMIT_MULT * 0.5, LIMIT_MULT],
+    "LEVERAGE": [LEVERAGE],
+    "TIMEFRAME": [TIMEFRAME],
+}
+
+
+def build_grid(grid):
+    """將 {參數名: [候選值]} 展開為參數組合列表"""
+    names = [name for name in PARAM_NAMES if name in grid]
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def data_digest(ohlcv):
+    """K線數據摘要，用於結果快取鍵"""
+    return hashlib.sha256(np.ascontiguousarray(ohlcv).tobytes()).hexdigest()[:16]
+
+
+def result_key(params, digest, settings):
+    """結果快取鍵: 涵蓋所有影響回測結果的輸入 (參數、K線數據、回測設定與快取版本)"""
+    payload = json.dumps({"version": SWEEP_CACHE_VERSION, "params": params, "data": digest, "settings": settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_result_cache(path=SWEEP_CACHE_FILE):
+    cache = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    cache[record["key"]] = record
+                except (json.JSONDecodeError, KeyError):
+                    continue
+    return cache
+
+
+# === 工作進程 === #
+_worker_data = {}  # TIMEFRAME -> K線陣列 (共享記憶體視圖)
+_worker_shms = []
+_worker_settings = {}  # run_backtest 的非網格參數 (fee_rate、wallet_percentage、initial_equity)
+_worker_indicators = {}  # (TIMEFRAME, 指標名, 長度) -> 指標陣列
+_WORKER_INDICATOR_CACHE_SIZE = 64
+
+
+def _attach_shared_memory(name):
+    try:
+        # Python 3.13+: 附加端不登記到 resource_tracker，釋放由主進程負責
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # 舊版本中工作進程與主進程共用同一個 resource_tracker，重複登記不影響主進程的 unlink
+        return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(descriptors, settings):
+    """descriptors: {TIMEFRAME: (共享記憶體名稱, shape)}"""
+    _worker_settings.update(settings)
+    for timeframe, (name, shape) in descriptors.items():
+        shm = _attach_shared_memory(name)
+        _worker_shms.append(shm)
+        _worker_data[timeframe] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+
+def _cached_indicator(timeframe, kind, length, compute):
+    key = (timeframe, kind, length)
+    value = _worker_indicators.get(key)
+    if value is None:
+        if len(_worker_indicators) >= _WORKER_INDICATOR_CACHE_SIZE:
+            _worker_indicators.pop(next(iter(_worker_indicators)))
+        value = compute()
+        _worker_indicators[key] = value
+    return value
+
+
+def _run_chunk(chunk):
+    """在工作進程中回測一組參數 (同組共用 RSI/ATR 指標)"""
+    results = []
+    for key, params in chunk:
+        timeframe = params["TIMEFRAME"]
+        ohlcv = _worker_data[timeframe]
+        high, low, close = ohlcv[:, 2], ohlcv[:, 3], ohlcv[:, 4]
+        rsi = _cached_indicator(timeframe, "rsi", params["RSI_LEN"], lambda: batch_rsi(close, params["RSI_LEN"]))
+        atr = _cached_indicator(timeframe, "atr", params["ATR_LEN"], lambda: batch_atr(high, low, close, params["ATR_LEN"]))
+        highest_break = _cached_indicator(timeframe, "highest_break", params["BREAKOUT_LOOKBACK"],
+                                          lambda: batch_highest_break(high, params["BREAKOUT_LOOKBACK"]))
+        result = run_backtest(ohlcv, rsi_buy=params["RSI_BUY"], exit_rsi=params["EXIT_RSI"],
+                              stop_mult=params["STOP_MULT"], limit_mult=params["LIMIT_MULT"],
+                              leverage=params["LEVERAGE"], indicators=(rsi, atr, highest_break), **_worker_settings)
+        summary = result.summary()
+        summary.pop("bars_per_second", None)
+        results.append({"key": key, "params": params, "summary": summary})
+    return results
+
+
+# === 主進程 === #
+def run_sweep(datasets, grid=None, workers=None, fee_rate=DEFAULT_FEE_RATE, wallet_percentage=WALLET_PERCENTAGE,
+              initial_equity=DEFAULT_INITIAL_EQUITY, chunk_size=64, cache_path=SWEEP_CACHE_FILE):
+    """
+    執行參數掃描。
+
+    參數:
+        datasets (dict): {TIMEFRAME: K線陣列}，需包含網格中所有的 TIMEFRAME
+        grid (dict): {參數名: [候選值]}，未指定的參數使用 config.py 的值
+        fee_rate / wallet_percentage / initial_equity: 所有組合共用的回測設定 (同樣計入快取鍵)
+    返回:
+        list: 依參數組合排列的結果記錄 {"key", "params", "summary"}
+    """
+    base = {"RSI_BUY": RSI_BUY, "RSI_LEN": RSI_LEN, "EXIT_RSI": EXIT_RSI, "BREAKOUT_LOOKBACK": BREAKOUT_LOOKBACK,
+            "ATR_LEN": ATR_LEN, "STOP_MULT": STOP_MULT, "LIMIT_MULT": LIMIT_MULT, "LEVERAGE": LEVERAGE, "TIMEFRAME": TIMEFRAME}
+    grid = dict(DEFAULT_GRID if grid is None else grid)
+    for name, value in base.items():
+        grid.setdefault(name, [value])
+    combos = build_grid(grid)
+    missing = {c["TIMEFRAME"] for c in combos} - set(datasets)
+    if missing:
+        raise ValueError(f"缺少時間框架的K線數據: {sorted(missing)}")
+
+    settings = {"fee_rate": fee_rate, "wallet_percentage": wallet_percentage, "initial_equity": initial_equity}
+    digests = {tf: data_digest(data) for tf, data in datasets.items()}
+    cache = load_result_cache(cache_path)
+    records = []
+    pending = []
+    for params in combos:
+        key = result_key(params, digests[params["TIMEFRAME"]], settings)
+        if key in cache:
+            records.append(cache[key])
+        else:
+            pending.append((key, params))
+    print(f"[Sweep] 共 {len(combos)} 組參數，快取命中 {len(records)} 組，待計算 {len(pending)} 組")
+    if not pending:
+        return records
+
+    # 依 (TIMEFRAME, RSI_LEN, ATR_LEN, BREAKOUT_LOOKBACK) 排序後切塊，使同一塊重用相同指標
+    pending.sort(key=lambda item: (item[1]["TIMEFRAME"], item[1]["RSI_LEN"], item[1]["ATR_LEN"], item[1]["BREAKOUT_LOOKBACK"]))
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+
+    shms = []
+    descriptors = {}
+    started = time.perf_counter()
+    try:
+        for timeframe, data in datasets.items():
+            data = np.ascontiguousarray(data, dtype=np.float64)
+            shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+            np.ndarray(data.shape, dtype=np.float64, buffer=shm.buf)[:] = data
+            shms.append(shm)
+            descriptors[timeframe] = (shm.name, data.shape)
+
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        done = 0
+        with open(cache_path, "a", encoding="utf-8") as cache_file, \
+                ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(descriptors, settings)) as pool:
+            futures = [pool.submit(_run_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                for record in future.result():
+                    records.append(record)
+                    cache_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                done += 1
+                if done % max(1, len(chunks) // 10) == 0 or done == len(chunks):
+                    print(f"[Sweep] 進度 {done}/{len(chunks)} 塊，已耗時 {time.perf_counter() - started:.1f} 秒")
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+    print(f"[Sweep] 完成 {len(pending)} 組回測，耗時 {time.perf_counter() - started:.1f} 秒")
+    return records
+
+
+def rank_results(records, sort_by="total_return", ascending=False):
+    """將掃描結果整理成依指定欄位排序的 DataFrame"""
+    import pandas as pd
+    rows = [{**record["params"], **record["summary"]} for record in records]
+    return pd.DataFrame(rows).sort_values(sort_by, ascending=ascending).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from backtest import load_history
+
+    parser = argparse.ArgumentParser(description="對 config.py 的策略參數執行多核心網格掃描")
+    parser.add_argument("--days", type=int, default=365 * 3, help="回測天數")
+    parser.add_argument("--grid", help="參數網格 JSON 檔 ({參數名: [候選值]})，預設使用 DEFAULT_GRID")
+    parser.add_argument("--workers", type=int, default=None, help="工作進程數 (預設為 CPU 核心數)")
+    parser.add_argument("--fee", type=float, default=DEFAULT_FEE_RATE, help="單邊手續費率")
+    parser.add_argument("--wallet-percentage", type=float, default=WALLET_PERCENTAGE, help="每次進場使用的資金比例")
+    parser.add_argument("--initial-equity", type=float, default=DEFAULT_INITIAL_EQUITY, help="初始資金 (USDT)")
+    parser.add_argument("--sort", default="total_return", help="排序欄位")
+    parser.add_argument("--top", type=int, default=20, help="顯示前幾名")
+    parser.add_argument("--csv", help="輸出完整排名 CSV 的路徑")
+    args = parser.parse_args()
+
+    sweep_grid = DEFAULT_GRID
+    if args.grid:
+        with open(args.grid, "r", encoding="utf-8") as f:
+            sweep_grid = json.load(f)
+    timeframes = sweep_grid.get("TIMEFRAME", [TIMEFRAME])
+    data_by_tf = {}
+    for tf in timeframes:
+        data_by_tf[tf] = load_history(TRADING_PAIR, tf, days=args.days)
+        print(f"已載入 {len(data_by_tf[tf])} 根 {TRADING_PAIR} {tf} K線")
+
+    table = rank_results(run_sweep(data_by_tf, sweep_grid, workers=args.workers, fee_rate=args.fee,
+                                   wallet_percentage=args.wallet_percentage, initial_equity=args.initial_equity), sort_by=args.sort)
+    print(table.head(args.top).to_string())
+    if args.csv:
+        table.to_csv(args.csv, index=False)
+        print(f"完整排名已輸出至 {args.csv}")
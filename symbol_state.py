@@ -0,0 +1,202 @@
+import json
+import os
+import threading
+import time
+
+import config
+from bot_logger import get_logger
+from state_journal import STATE_FIELDS, get_state_journal
+
+log = get_logger("stats")
+
+# 可由每個交易對個別覆寫的設定 (名稱與 config.py 相同)
+CONFIG_KEYS = ("SYMBOL", "TRADING_PAIR", "MARGIN_COIN", "LEVERAGE", "WALLET_PERCENTAGE", "TIMEFRAME",
+               "RSI_BUY", "RSI_LEN", "EXIT_RSI", "BREAKOUT_LOOKBACK", "ATR_LEN", "ATR_MULT",
+               "STOP_MULT", "LIMIT_MULT", "QUANTITY_PRECISION")
+STATS_FILE = "stats.json"  # 舊版的統計檔案 (其他交易對為 stats_<SYMBOL>.json)，只在狀態日誌沒有記錄時匯入
+
+
+class SymbolConfig:
+    """
+    單一交易對的策略設定: 未覆寫的項目沿用 config.py。
+
+    例: SymbolConfig(SYMBOL="BTCUSDT", LEVERAGE=5)；只指定 SYMBOL 時，
+    TRADING_PAIR 由 SYMBOL 與 MARGIN_COIN 推導 (BTCUSDT -> BTC/USDT)。
+    """
+    __slots__ = tuple(key.lower() for key in CONFIG_KEYS)
+
+    def __init__(self, **overrides):
+        unknown = set(overrides) - set(CONFIG_KEYS)
+        if unknown:
+            raise ValueError(f"不支援的交易對設定: {sorted(unknown)}")
+        for key in CONFIG_KEYS:
+            setattr(self, key.lower(), overrides.get(key, getattr(config, key)))
+        if "SYMBOL" in overrides and "TRADING_PAIR" not in overrides:
+            base = self.symbol[:-len(self.margin_coin)] if self.symbol.endswith(self.margin_coin) else self.symbol
+            self.trading_pair = f"{base}/{self.margin_coin}"
+
+    def __repr__(self):
+        return f"SymbolConfig({', '.join(f'{key}={getattr(self, key.lower())!r}' for key in CONFIG_KEYS)})"
+
+
+class SymbolState:
+    """
+    單一交易對的持倉記憶與勝負統計 (取代原本的模組全域變數)。
+
+    進場、止損移動與出場透過 open_position / update_stop / close_position 修改，
+    交易所已平倉但帳本尚無紀錄的持倉以 defer_close 留待結算，之後由 settle 計入勝負；
+    每次修改都附加到狀態日誌 (state_journal)，重啟後 load_stats() 可完整恢復移動止損所需的記憶。
+    """
+    __slots__ = ("config", "pos_side", "entry_type", "stop_loss_price", "position_id",
+                 "win_count", "loss_count", "unsettled", "stream_closes", "stats_file", "last_tick_time", "last_close_bar",
+                 "wake_requested", "lock", "journal")
+
+    def __init__(self, symbol_config, stats_file=None, journal=None):
+        self.config = symbol_config
+        self.pos_side = None  # 最近一次 tick 得知的持倉方向
+        self.entry_type = None  # 持倉的進場信號類型 ('rsi' 或 'breakout')
+        self.stop_loss_price = None  # 當前持倉的止損價格
+        self.position_id = None  # 當前持倉的 positionId
+        self.win_count = 0
+        self.loss_count = 0
+        self.unsettled = []  # 交易所已平倉、尚待帳本紀錄結算的 positionId
+        self.stream_closes = {}  # 帳戶串流推送的平倉 positionId -> {side, qty, realized_pnl}，帳本尚無紀錄時使用
+        if stats_file is None:
+            stats_file = STATS_FILE if symbol_config.symbol == config.SYMBOL else f"stats_{symbol_config.symbol}.json"
+        self.stats_file = stats_file
+        self.last_tick_time = 0.0
+        self.last_close_bar = None  # 最後一次以收盤K線完整評估的K線開盤時間 (ms)
+        self.wake_requested = False  # 行情串流要求立即執行 tick
+        self.lock = threading.Lock()  # 同一交易對的 tick 不會重疊執行
+        self.journal = journal  # None 表示使用預設路徑的共用日誌 (第一次寫入時才開啟)
+
+    @property
+    def symbol(self):
+        return self.config.symbol
+
+    def reset_position(self):
+        """只清除記憶體中的持倉記憶 (不寫入日誌)"""
+        self.pos_side = None
+        self.entry_type = None
+        self.stop_loss_price = None
+        self.position_id = None
+
+    # === 狀態日誌 === #
+    def _journal(self):
+        if self.journal is None:
+            self.journal = get_state_journal()
+        return self.journal
+
+    def journal_fields(self):
+        return {key: getattr(self, key) for key in STATE_FIELDS}
+
+    def _record(self, kind, **data):
+        try:
+            self._journal().record(self.symbol, kind, self.journal_fields(), **data)
+        except Exception as e:
+            # 日誌寫入失敗不影響交易，記憶體中的狀態仍然正確
+            log.error("寫入 %s 狀態日誌失敗 (%s): %s", self.symbol, kind, e)
+
+    def open_position(self, side, position_id, entry_type, stop_loss_price=None):
+        self.pos_side = side
+        self.position_id = position_id
+        self.entry_type = entry_type
+        self.stop_loss_price = stop_loss_price
+        self._record("open", side=side, position_id=position_id, entry_type=entry_type, stop_loss_price=stop_loss_price)
+
+    def update_stop(self, stop_loss_price):
+        self.stop_loss_price = stop_loss_price
+        self._record("stop", stop_loss_price=stop_loss_price)
+
+    def close_position(self, pnl):
+        """記錄平倉: pnl > 0 計為勝，其餘計為敗，pnl 為 None (無法計算) 時不計入統計"""
+        if pnl is not None:
+            if pnl > 0:
+                self.win_count += 1
+            else:
+                self.loss_count += 1
+        self.stream_closes.pop(self.position_id, None)
+        self.reset_position()
+        self._record("close", pnl=pnl)
+
+    def defer_close(self):
+        """交易所已平倉但帳本尚無平倉紀錄: 清除持倉記憶，positionId 留待之後以帳本紀錄結算"""
+        position_id = self.position_id
+        self.reset_position()
+        if position_id not in self.unsettled:
+            self.unsettled = self.unsettled + [position_id]
+        self._record("pending", position_id=position_id)
+
+    def settle(self, position_id, pnl):
+        """結算先前待結算的持倉，計入勝負的規則與 close_position 相同"""
+        if pnl is not None:
+            if pnl > 0:
+                self.win_count += 1
+            else:
+                self.loss_count += 1
+        self.unsettled = [pending for pending in self.unsettled if pending != position_id]
+        self.stream_closes.pop(position_id, None)
+        self._record("settle", position_id=position_id, pnl=pnl)
+
+    def load_stats(self):
+        """從狀態日誌恢復持倉記憶與勝負統計；日誌中沒有記錄時匯入舊的 stats 檔案"""
+        started = time.perf_counter()
+        try:
+            fields, replayed = self._journal().recover(self.symbol)
+        except Exception as e:
+            log.error("讀取 %s 狀態日誌失敗: %s", self.symbol, e)
+            return
+        if fields is None:
+            self.win_count, self.loss_count = self._load_legacy_stats()
+            self.reset_position()
+            if self.win_count or self.loss_count:
+                self._record("counters", win_count=self.win_count, loss_count=self.loss_count)
+            return
+        for key, value in fields.items():
+            setattr(self, key, value)
+        log.info("已從狀態日誌恢復 %s (重放 %s 筆事件，耗時 %.1f ms): 勝場 %s, 敗場 %s, 持倉 %s, 進場類型 %s, 止損 %s",
+                 self.symbol, replayed, (time.perf_counter() - started) * 1000, self.win_count, self.loss_count,
+                 self.position_id, self.entry_type, self.stop_loss_price)
+
+    def _load_legacy_stats(self):
+        if not os.path.exists(self.stats_file):
+            log.info("%s 沒有統計記錄，初始化勝敗場為 0", self.symbol)
+            return 0, 0
+        try:
+            with open(self.stats_file, 'r') as f:
+                stats = json.load(f)
+            log.info("已從 %s 匯入 %s 統計數據: 勝場 %s, 敗場 %s", self.stats_file, self.symbol,
+                     stats.get('win_count', 0), stats.get('loss_count', 0))
+            return stats.get('win_count', 0), stats.get('loss_count', 0)
+        except Exception as e:
+            log.error("載入 %s 統計數據失敗: %s", self.symbol, e)
+            return 0, 0
+
+    def save_stats(self):
+        """將目前的完整狀態寫入日誌快照 (平倉等事件本身已即時記錄，快照只縮短恢復時的重放)"""
+        try:
+            self._journal().snapshot(self.symbol, self.journal_fields())
+        except Exception as e:
+            log.error("儲存 %s 狀態快照失敗: %s", self.symbol, e)
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+def register_symbol_state(symbol_config):
+    """以指定設定建立 (或取得已存在的) 交易對狀態"""
+    with _states_lock:
+        state = _states.get(symbol_config.symbol)
+        if state is None:
+            state = SymbolState(symbol_config)
+            _states[symbol_config.symbol] = state
+        return state
+
+
+def get_symbol_state(symbol=None):
+    """取得交易對狀態，未註冊的交易對以 config.py 的設定建立"""
+    symbol = symbol or config.SYMBOL
+    state = _states.get(symbol)
+    if state is None:
+        state = register_symbol_state(SymbolConfig() if symbol == config.SYMBOL else SymbolConfig(SYMBOL=symbol))
+    return state
@@ -0,0 +1,286 @@
+"""
+本地交易帳本: 從 Bitunix 歷史持倉端點增量同步已平倉的交易，並以 NumPy 計算績效統計。
+
+* 帳本以 SQLite 保存 (以 positionId 為主鍵，依交易對與平倉時間建立索引)，重複同步同一筆交易只會覆寫，
+  交易所端觸發的止盈止損也會被記錄。
+* 每個交易對記錄最後同步到的平倉時間，之後只請求該時間之後的歷史。
+* 進場類型 (rsi / breakout) 在開倉時以 tag_entry_type 記錄，平倉同步後與交易合併。
+* 績效統計 (勝率、獲利因子、最大回撤、Sharpe/Sortino、平均持倉時間、按進場類型分組) 只使用記憶體中的
+  NumPy 陣列，帳本有變動時才重新讀取資料庫，每次 Discord 通知都可以重新計算。
+
+執行 python trade_ledger.py 會同步 config.py 的交易對並輸出統計。
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from config import LEDGER_PATH, LEDGER_SYNC_PAGE_SIZE, LEDGER_SYNC_LOOKBACK_DAYS
+from bitunix_client import get_bitunix_client
+from bot_logger import get_logger
+
+log = get_logger("ledger")
+
+HISTORY_POSITIONS_PATH = "/api/v1/futures/position/get_history_positions"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trades (
+    position_id TEXT PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    side TEXT NOT NULL,
+    qty REAL NOT NULL,
+    entry_price REAL NOT NULL,
+    close_price REAL NOT NULL,
+    realized_pnl REAL NOT NULL,
+    fee REAL NOT NULL,
+    funding REAL NOT NULL,
+    open_time INTEGER NOT NULL,
+    close_time INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trades_symbol_close ON trades (symbol, close_time);
+CREATE INDEX IF NOT EXISTS trades_close ON trades (close_time);
+CREATE TABLE IF NOT EXISTS entry_types (
+    position_id TEXT PRIMARY KEY,
+    entry_type TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_cursor (
+    symbol TEXT PRIMARY KEY,
+    last_close_time INTEGER NOT NULL
+);
+"""
+
+# load() 返回的結構化陣列欄位
+TRADE_DTYPE = np.dtype([("symbol", "U32"), ("entry_type", "U16"), ("side", "U8"), ("qty", "f8"), ("entry_price", "f8"),
+                        ("close_price", "f8"), ("pnl", "f8"), ("open_time", "i8"), ("close_time", "i8")])
+HOURS_MS = 3600 * 1000
+
+
+def _float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_history_position(item):
+    """將歷史持倉端點的一筆資料轉為帳本欄位 (side 統一為 long/short)"""
+    side = str(item.get("side", "")).upper()
+    qty = _float(item.get("maxQty", item.get("qty")))
+    return (str(item["positionId"]), item.get("symbol", ""), "long" if side in ("BUY", "LONG") else "short", qty,
+            _float(item.get("entryPrice", item.get("avgOpenPrice"))), _float(item.get("closePrice")),
+            _float(item.get("realizedPNL")), _float(item.get("fee")), _float(item.get("funding")),
+            int(_float(item.get("ctime"))), int(_float(item.get("mtime"))))
+
+
+class TradeLedger:
+    """已平倉交易的本地帳本 (所有交易對共用一個資料庫)"""
+
+    def __init__(self, path=LEDGER_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._version = 0  # 帳本內容的版本，變動時遞增，快取以此判斷是否過期
+        self._cache = {}  # symbol (None 表示全部) -> (版本, 陣列)
+
+    # === 寫入 === #
+    def upsert(self, rows):
+        """寫入 (或覆寫) 交易，rows 為 parse_history_position 的結果；返回寫入筆數"""
+        if not rows:
+            return 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO trades VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            for symbol in {row[1] for row in rows}:
+                last = max(row[10] for row in rows if row[1] == symbol)
+                self._conn.execute("INSERT INTO sync_cursor VALUES (?, ?) ON CONFLICT(symbol) DO UPDATE SET "
+                                   "last_close_time = MAX(last_close_time, excluded.last_close_time)", (symbol, last))
+            self._conn.execute("COMMIT")
+            self._version += 1
+        return len(rows)
+
+    def tag_entry_type(self, position_id, entry_type):
+        """記錄持倉的進場類型 (開倉時呼叫，平倉同步後用於分組統計)"""
+        if not position_id or not entry_type:
+            return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO entry_types VALUES (?, ?)", (str(position_id), entry_type))
+            self._version += 1
+
+    # === 同步 === #
+    def cursor(self, symbol):
+        with self._lock:
+            row = self._conn.execute("SELECT last_close_time FROM sync_cursor WHERE symbol = ?", (symbol,)).fetchone()
+        return row[0] if row else None
+
+    def sync(self, api_key, secret_key, symbol, page_size=LEDGER_SYNC_PAGE_SIZE):
+        """
+        從最後同步的平倉時間開始分頁請求歷史持倉 (首次同步回溯 LEDGER_SYNC_LOOKBACK_DAYS 天)，
+        返回新寫入的交易筆數；請求失敗時返回 None，已取得的頁面仍會寫入。
+        """
+        client = get_bitunix_client(api_key, secret_key)
+        start = self.cursor(symbol)
+        if start is None:
+            start = int((time.time() - LEDGER_SYNC_LOOKBACK_DAYS * 86400) * 1000)
+        rows, skip, ok = [], 0, True
+        while True:
+            params = {"symbol": symbol, "startTime": start, "skip": skip, "limit": page_size}
+            try:
+                response = client.get(HISTORY_POSITIONS_PATH, params)
+                data = response.json()
+            except Exception as e:
+                log.error("同步 %s 歷史持倉失敗: %s", symbol, e)
+                ok = False
+                break
+            if data.get("code") != 0:
+                log.error("同步 %s 歷史持倉失敗: %s (code=%s)", symbol, data.get("msg", "未知錯誤"), data.get("code"))
+                ok = False
+                break
+            page = (data.get("data") or {}).get("positionList") or []
+            rows.extend(parse_history_position(item) for item in page)
+            if len(page) < page_size:
+                break
+            skip += page_size
+        known = self._known_ids([row[0] for row in rows])
+        self.upsert(rows)
+        added = sum(1 for row in rows if row[0] not in known)
+        if added:
+            log.info("已同步 %s 筆 %s 已平倉交易", added, symbol)
+        return added if ok else None
+
+    def _known_ids(self, position_ids):
+        if not position_ids:
+            return set()
+        with self._lock:
+            placeholders = ",".join("?" * len(position_ids))
+            rows = self._conn.execute(f"SELECT position_id FROM trades WHERE position_id IN ({placeholders})", position_ids).fetchall()
+        return {row[0] for row in rows}
+
+    def trade(self, position_id):
+        """返回單筆交易的欄位字典 (尚未同步時返回 None)"""
+        with self._lock:
+            row = self._conn.execute("SELECT t.*, e.entry_type FROM trades t LEFT JOIN entry_types e USING (position_id) "
+                                     "WHERE position_id = ?", (str(position_id),)).fetchone()
+        if row is None:
+            return None
+        keys = ("position_id", "symbol", "side", "qty", "entry_price", "close_price", "realized_pnl", "fee", "funding",
+                "open_time", "close_time", "entry_type")
+        return dict(zip(keys, row))
+
+    # === 讀取與統計 === #
+    def load(self, symbol=None):
+        """以平倉時間排序的交易結構化陣列 (TRADE_DTYPE)；帳本未變動時直接返回快取"""
+        cached = self._cache.get(symbol)
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+        query = ("SELECT t.symbol, COALESCE(e.entry_type, 'unknown'), t.side, t.qty, t.entry_price, t.close_price, t.realized_pnl, "
+                 "t.open_time, t.close_time FROM trades t LEFT JOIN entry_types e USING (position_id)")
+        params = ()
+        if symbol:
+            query, params = query + " WHERE t.symbol = ?", (symbol,)
+        with self._lock:
+            version = self._version
+            rows = self._conn.execute(query + " ORDER BY t.close_time", params).fetchall()
+        trades = np.array(rows, dtype=TRADE_DTYPE) if rows else np.empty(0, dtype=TRADE_DTYPE)
+        self._cache[symbol] = (version, trades)
+        return trades
+
+    def analytics(self, symbol=None):
+        return compute_analytics(self.load(symbol))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _summary(pnl, returns, hold_ms):
+    count = len(pnl)
+    if count == 0:
+        return {"trades": 0}
+    wins = pnl > 0
+    gross_profit = pnl[wins].sum()
+    gross_loss = -pnl[~wins].sum()
+    equity = np.cumsum(pnl)
+    drawdown = np.maximum.accumulate(np.maximum(equity, 0.0)) - equity
+    std = returns.std(ddof=1) if count > 1 else 0.0
+    downside = np.minimum(returns, 0.0)
+    downside_dev = np.sqrt(np.mean(downside ** 2))
+    return {
+        "trades": count,
+        "wins": int(wins.sum()),
+        "losses": int(count - wins.sum()),
+        "win_rate": float(wins.mean()),
+        "total_pnl": float(equity[-1]),
+        "avg_pnl": float(pnl.mean()),
+        "profit_factor": float(gross_profit / gross_loss) if gross_loss > 0 else float("inf") if gross_profit > 0 else 0.0,
+        "max_drawdown": float(drawdown.max()),
+        "sharpe": float(returns.mean() / std) if std > 0 else 0.0,
+        "sortino": float(returns.mean() / downside_dev) if downside_dev > 0 else 0.0,
+        "avg_hold_hours": float(hold_ms.mean() / HOURS_MS),
+    }
+
+
+def compute_analytics(trades):
+    """
+    以 NumPy 計算績效統計 (trades 為 TradeLedger.load() 的結果)。
+
+    Sharpe/Sortino 以每筆交易的報酬率 (已實現盈虧 / 進場名目價值) 計算，不做年化；
+    最大回撤以累積已實現盈虧 (USDT) 計算。返回整體統計，另在 "by_entry_type" 中按進場類型分組。
+    """
+    pnl = trades["pnl"]
+    notional = trades["qty"] * trades["entry_price"]
+    returns = np.divide(pnl, notional, out=np.zeros_like(pnl), where=notional > 0)
+    hold_ms = (trades["close_time"] - trades["open_time"]).astype("f8")
+    stats = _summary(pnl, returns, hold_ms)
+    stats["by_entry_type"] = {}
+    for entry_type in np.unique(trades["entry_type"]):
+        mask = trades["entry_type"] == entry_type
+        stats["by_entry_type"][str(entry_type)] = _summary(pnl[mask], returns[mask], hold_ms[mask])
+    return stats
+
+
+def format_analytics(stats):
+    """Discord/日誌使用的單行摘要"""
+    if not stats.get("trades"):
+        return "N/A (尚無已完成交易)"
+    pf = stats["profit_factor"]
+    text = (f"{stats['win_rate'] * 100:.2f}% ({stats['wins']}勝/{stats['losses']}負), 盈虧 {stats['total_pnl']:.2f} USDT, "
+            f"PF {'∞' if pf == float('inf') else f'{pf:.2f}'}, 最大回撤 {stats['max_drawdown']:.2f}, "
+            f"Sharpe {stats['sharpe']:.2f}, 平均持倉 {stats['avg_hold_hours']:.1f}h")
+    groups = stats.get("by_entry_type", {})
+    if any(name != "unknown" for name in groups):
+        text += " | " + ", ".join(f"{name} {group['win_rate'] * 100:.0f}%/{group['trades']}筆" for name, group in groups.items())
+    return text
+
+
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_trade_ledger(path=LEDGER_PATH):
+    """取得 (或建立) 指定路徑的共用帳本"""
+    ledger = _ledgers.get(path)
+    if ledger is None:
+        with _ledgers_lock:
+            ledger = _ledgers.get(path)
+            if ledger is None:
+                ledger = _ledgers[path] = TradeLedger(path)
+    return ledger
+
+
+if __name__ == "__main__":
+    from config import BITUNIX_API_KEY, BITUNIX_SECRET_KEY, SYMBOL
+
+    ledger = get_trade_ledger()
+    ledger.sync(BITUNIX_API_KEY, BITUNIX_SECRET_KEY, SYMBOL)
+    stats = ledger.analytics(SYMBOL)
+    print(f"{SYMBOL}: {format_analytics(stats)}")
+    for entry_type, group in stats.get("by_entry_type", {}).items():
+        print(f"  {entry_type}: {format_analytics(group)}")
@@ -1,64 +1,29 @@
-import ccxt
+import argparse
 import numpy as np
 import requests
 import hashlib
-import uuid
 import time
-import json
 import random
-import discord
-from discord.ext import tasks
-import matplotlib.pyplot as plt
+import asyncio
+import functools
+import threading
+import datetime
+from concurrent.futures import ThreadPoolExecutor
 import os
+# ccxt、pandas、matplotlib 與 discord.py 只在第一次用到時載入 (candle_store、indicators、chart_renderer、
+# create_discord_bot)，匯入本模組不會載入它們，也不會讀寫狀態日誌；無介面模式 (--headless) 因此能快速啟動
 
-# 設定 matplotlib 支持中文和負號
-plt.rcParams['font.sans-serif'] = ['SimHei']
-plt.rcParams['axes.unicode_minus'] = False
-
-import mplfinance as mpf
-import pandas as pd
-from discord.ext import commands
-
-
-# === 全域變數與統計檔案設定 ===
-STATS_FILE = "stats.json"
-win_count = 0
-loss_count = 0
-
-# === 移動止損相關全域變數 ===
-current_pos_entry_type = None # 記錄持倉的進場信號類型 ('rsi' 或 'breakout')
-current_stop_loss_price = None # 記錄當前持倉的止損價格
-current_position_id_global = None # 記錄當前持倉的 positionId
-
-def load_stats():
-    global win_count, loss_count
-    if os.path.exists(STATS_FILE):
-        try:
-            with open(STATS_FILE, 'r') as f:
-                stats = json.load(f)
-                win_count = stats.get('win_count', 0)
-                loss_count = stats.get('loss_count', 0)
-            print(f"已載入統計數據: 勝場 {win_count}, 敗場 {loss_count}")
-        except (IOError, json.JSONDecodeError) as e:
-            print(f"讀取統計數據失敗: {e}, 初始化為 0")
-            win_count = 0
-            loss_count = 0
-    else:
-        print("未找到統計數據檔案，初始化為 0")
-        win_count = 0
-        loss_count = 0
-
-def save_stats():
-    global win_count, loss_count
-    try:
-        with open(STATS_FILE, 'w') as f:
-            json.dump({'win_count': win_count, 'loss_count': loss_count}, f)
-        print(f"已儲存統計數據: 勝場 {win_count}, 敗場 {loss_count}")
-    except IOError as e:
-        print(f"錯誤：無法儲存勝率統計數據: {e}")
 
+# === 交易對狀態與統計 ===
+# 持倉記憶 (進場類型、止損價、positionId) 與勝負統計按交易對保存在 SymbolState 中，
+# 單一交易對模式使用 config.py 的 SYMBOL 對應的狀態
+from symbol_state import get_symbol_state
 
+def load_stats(state=None):
+    (state or get_symbol_state()).load_stats()
 
+def save_stats(state=None):
+    (state or get_symbol_state()).save_stats()
 
 
 # === Bitunix API 函數 === #
@@ -66,75 +31,53 @@ def sha256_hex(s: str) -> str:
     return hashlib.sha256(s.encode('utf-8')).hexdigest()
 
 
-# 完全按照ccc.py中的get_signed_params函數實現
-
-from config import BITUNIX_API_KEY, BITUNIX_SECRET_KEY, DISCORD_WEBHOOK_URL, STOP_MULT, LIMIT_MULT, RSI_BUY, RSI_LEN, EXIT_RSI, BREAKOUT_LOOKBACK, ATR_LEN, ATR_MULT, TIMEFRAME, LEVERAGE, TRADING_PAIR, SYMBOL, MARGIN_COIN, LOOP_INTERVAL_SECONDS, QUANTITY_PRECISION
-print(f"[Config Check] SYMBOL from config: {SYMBOL}")
-print(f"[Config Check] TRADING_PAIR from config: {TRADING_PAIR}")
+from bot_logger import get_logger, setup_logging
+
+log = get_logger("trade")  # 策略與主迴圈
+order_log = get_logger("orders")  # 下單與止盈止損
+account_log = get_logger("account")  # 餘額與持倉查詢 (DEBUG 時輸出完整 API 響應)
+chart_log = get_logger("chart")
+notify_log = get_logger("discord")
+
+from config import BITUNIX_API_KEY, BITUNIX_SECRET_KEY, DISCORD_WEBHOOK_URL, STOP_MULT, LIMIT_MULT, RSI_BUY, RSI_LEN, EXIT_RSI, BREAKOUT_LOOKBACK, ATR_LEN, ATR_MULT, TIMEFRAME, LEVERAGE, TRADING_PAIR, SYMBOL, MARGIN_COIN, LOOP_INTERVAL_SECONDS, WALLET_PERCENTAGE, IO_THREAD_POOL_SIZE, DISCORD_FLUSH_TIMEOUT_SECONDS, DISCORD_DEDUPE_TYPES, MARKET_WS_ENABLED, MARKET_WS_STALE_SECONDS, MARKET_WS_MIN_WAKE_SECONDS, MARKET_WS_BASE_TIMEFRAME, RESAMPLE_TIMEFRAMES, BALANCE_CHECK_INTERVAL_SECONDS, LEDGER_SYNC_INTERVAL_SECONDS, ACCOUNT_WS_ENABLED, ACCOUNT_WS_RECONCILE_SECONDS, INSTRUMENT_SPEC_TTL_SECONDS
+
+# 簽名與連線池統一由 bitunix_client 提供
+from bitunix_client import get_bitunix_client
+from candle_store import get_candle_store, timeframe_to_ms, COLUMNS
+from indicators import get_indicator_engine
+from discord_notifier import DiscordDispatcher, NotificationJob
+from chart_renderer import get_chart_renderer
+from account_snapshot import get_account_snapshot, PositionDetails, FLAT_POSITION, UNKNOWN_POSITION
+from market_stream import MarketStream
+from candle_resampler import CandleResampler
+from scheduler import BarScheduler, PeriodicJob, TickLoop
+from metrics import timed, span, start_metrics_exporter
+from trade_ledger import get_trade_ledger, format_analytics
+from order_manager import get_order_manager
+from account_stream import get_account_stream, live_account_mirror
+from instrument_specs import get_instrument_specs
+
+def instrument_spec(api_key, secret_key, symbol):
+    """交易對的下單規格 (數量/價格精度、數量上下限、最大槓桿)；交易所未提供時以交易對設定的數量精度為準"""
+    return get_instrument_specs(api_key, secret_key).get(symbol, get_symbol_state(symbol).config.quantity_precision)
+
+def _post_account_write(api_key, secret_key, path, body):
+    """發送會改變帳戶狀態的請求 (下單、止盈止損)，發送後讓帳戶快照失效 (逾時也可能已成交)"""
+    try:
+        return get_bitunix_client(api_key, secret_key).post(path, body)
+    finally:
+        get_account_snapshot(api_key, secret_key).invalidate()
 
-def get_signed_params(api_key, secret_key, query_params: dict = None, body: dict = None, path: str = None, method: str = None):
+@timed("send_order")
+def send_order(api_key, secret_key, symbol, margin_coin, side, size, leverage=LEVERAGE, position_id=None, stop_price=None, limit_price=None):
     """
-    按照 Bitunix 官方雙重 SHA256 簽名方式對請求參數進行簽名。
-    
-    參數:
-        api_key (str): 用戶 API Key
-        secret_key (str): 用戶 Secret Key
-        query_params (dict): 查詢參數 (GET 方法)
-        body (dict or None): 請求 JSON 主體 (POST 方法)
-    
-    返回:
-        headers (dict): 包含簽名所需的請求頭（api-key, sign, nonce, timestamp 等）
-    """
-    nonce = uuid.uuid4().hex
-    timestamp = str(int(time.time() * 1000))
-
-    # 構造 query string: 將參數按鍵名 ASCII 升序排序後，鍵名與鍵值依次拼接
-    if query_params:
-        params_str = {k: str(v) for k, v in query_params.items()}
-        sorted_items = sorted(params_str.items(), key=lambda x: x[0])
-        query_str = "".join([f"{k}{v}" for k, v in sorted_items])
-    else:
-        query_str = ""
-
-    # 構造 body string: 將 JSON 體壓縮成字符串 (無空格)
-    if body is not None:
-        if isinstance(body, (dict, list)):
-            body_str = json.dumps(body, separators=(',', ':'), ensure_ascii=False)
-        else:
-            body_str = str(body)
-    else:
-        body_str = ""
-
-    # 根據 method 決定簽名內容
-    if method == "GET":
-        digest_input = nonce + timestamp + api_key + query_str
-    else:
-        digest_input = nonce + timestamp + api_key + body_str
-    # 第一次 SHA256
-    digest = hashlib.sha256(digest_input.encode('utf-8')).hexdigest()
-    # 第二次 SHA256
-    sign = hashlib.sha256((digest + secret_key).encode('utf-8')).hexdigest()
-
-  
-
-    # 構造標頭
-    headers = {
-        "api-key": api_key,
-        "sign": sign,
-        "nonce": nonce,
-        "timestamp": timestamp,
-        "language": "en-US",
-        "Content-Type": "application/json"
-    }
-    return nonce, timestamp, sign, headers
+    透過下單管理器送出市價單 (冪等 clientId，結果未知時先查詢再重送)。
 
-def send_order(api_key, secret_key, symbol, margin_coin, side, size, leverage=LEVERAGE, position_id=None):
+    開倉時 stop_price/limit_price 直接附帶在訂單上，持倉建立時即有止損；
+    止損未能確認時才另外呼叫 place_conditional_orders。
+    成功時返回交易所回應 (data.positionId 已補齊，protected 表示止損是否已確認)，失敗時返回 {"error": ...}。
+    """
     # 直接下單，不再自動設置槓桿/槓桿
-    # 正確的API端點路徑
-    path = "/api/v1/futures/trade/place_order"
-    url = f"https://fapi.bitunix.com{path}"
-    
-    # 根據cc.py中的格式調整請求參數
     # 將side轉換為適當的side和tradeSide參數
     if side == "open_long":
         api_side = "BUY"
@@ -149,13 +92,20 @@ def send_order(api_key, secret_key, symbol, margin_coin, side, size, leverage=LE
         api_side = "BUY"
         trade_side = "CLOSE"
     else:
-        print(f"錯誤：不支持的交易方向 {side}")
+        order_log.error("不支持的交易方向 %s", side)
         return {"error": f"不支持的交易方向: {side}"}
     
+    # 開倉數量與止損止盈價格依交易對規格格式化 (平倉直接使用持倉的數量)，第一次送出就是交易所接受的數值
+    spec = instrument_spec(api_key, secret_key, symbol)
+    if stop_price is not None:
+        stop_price = spec.format_price(stop_price)
+    if limit_price is not None:
+        limit_price = spec.format_price(limit_price)
+
     body = {
         "symbol": symbol,
         "marginCoin": margin_coin,  # 新增保證金幣種參數
-        "qty": str(size),  # API要求數量為字符串
+        "qty": spec.format_qty(size) if trade_side == "OPEN" else str(size),  # API要求數量為字符串
         "side": api_side,
         "tradeSide": trade_side,
         "orderType": "MARKET",  # 市價單
@@ -165,33 +115,24 @@ def send_order(api_key, secret_key, symbol, margin_coin, side, size, leverage=LE
     if position_id and (side == "close_long" or side == "close_short"):
         body["positionId"] = position_id
 
-    print(f"準備發送訂單: {body}")
-    
+    order_log.info("準備發送訂單: %s (止損: %s, 止盈: %s)", body, stop_price, limit_price)
+
+    if stop_price is not None or limit_price is not None:
+        def protect(new_position_id):
+            return place_conditional_orders(api_key, secret_key, symbol, margin_coin, new_position_id, stop_price=stop_price, limit_price=limit_price)
+    else:
+        protect = None
+
     try:
-        # 使用更新後的get_signed_params獲取完整的headers
-        _, _, _, headers = get_signed_params(BITUNIX_API_KEY, BITUNIX_SECRET_KEY, {}, body)
-        
-        response = requests.post(url, headers=headers, data=json.dumps(body, separators=(',', ':'), ensure_ascii=False))
-        response.raise_for_status()  # 檢查HTTP錯誤
-        result = response.json()
-        print(f"API響應: {result}")
-        return result
-    except requests.exceptions.HTTPError as e:
-        error_msg = f"HTTP錯誤: {e}, 響應: {response.text if 'response' in locals() else '無響應'}"
-        print(error_msg)
-        send_discord_message(f"🔴 **下單錯誤**: {error_msg} 🔴", api_key, secret_key)
-        return {"error": error_msg}
-    except requests.exceptions.RequestException as e:
-        error_msg = f"請求錯誤: {e}"
-        print(error_msg)
-        send_discord_message(f"🔴 **下單錯誤**: {error_msg} 🔴", api_key, secret_key)
-        return {"error": error_msg}
+        result = get_order_manager(api_key, secret_key).place(body, stop_price=stop_price, limit_price=limit_price, protect=protect)
     except Exception as e:
-        error_msg = f"未知錯誤: {e}"
-        print(error_msg)
-        send_discord_message(f"🔴 **下單錯誤**: {error_msg} 🔴", api_key, secret_key)
-        return {"error": error_msg}
+        result = {"error": f"未知錯誤: {e}"}
+    if "error" in result:
+        order_log.error("下單失敗 (clientId=%s): %s", result.get("clientId"), result["error"])
+        send_discord_message(f"🔴 **下單錯誤**: {result['error']} 🔴", api_key, secret_key, symbol=symbol)
+    return result
 
+@timed("tpsl_place")
 def place_conditional_orders(api_key, secret_key, symbol, margin_coin, position_id, stop_price=None, limit_price=None):
     """
     Place Stop Loss and Take Profit orders for a given position using Bitunix API.
@@ -199,39 +140,37 @@ def place_conditional_orders(api_key, secret_key, symbol, margin_coin, position_
     Trailing Stop orders are not explicitly supported by the provided API documentation for this endpoint.
     """
     path = "/api/v1/futures/tpsl/position/place_order"
-    url = f"https://fapi.bitunix.com{path}"
 
     body = {
         "symbol": symbol,
         "positionId": position_id,
     }
 
+    spec = instrument_spec(api_key, secret_key, symbol)
     if stop_price is not None:
-        body["slPrice"] = str(stop_price) # API requires price as string
+        body["slPrice"] = spec.format_price(stop_price) # API requires price as string (rounded to the price precision)
         body["slStopType"] = "LAST_PRICE" # Use LAST_PRICE as trigger type
 
     if limit_price is not None:
-        body["tpPrice"] = str(limit_price) # API requires price as string
+        body["tpPrice"] = spec.format_price(limit_price) # API requires price as string (rounded to the price precision)
         body["tpStopType"] = "LAST_PRICE" # Use LAST_PRICE as trigger type
 
     # Ensure at least one of TP or SL is provided
     if stop_price is None and limit_price is None:
-        print(f"[Conditional Orders] 警告: 未提供止損或止盈價格，不設置條件訂單 for position {position_id} on {symbol}")
+        order_log.warning("[Conditional Orders] 未提供止損或止盈價格，不設置條件訂單 for position %s on %s", position_id, symbol)
         return {"error": "未提供止損或止盈價格"}
 
-    print(f"[Conditional Orders] 準備為持倉 {position_id} 在 {symbol} 上設置條件訂單: {body}")
+    order_log.info("[Conditional Orders] 準備為持倉 %s 在 %s 上設置條件訂單: %s", position_id, symbol, body)
 
     try:
-        # 使用 get_signed_params 獲取完整的 headers
-        _, _, _, headers = get_signed_params(api_key, secret_key, {}, body, path, method="POST")
-
-        response = requests.post(url, headers=headers, data=json.dumps(body, separators=(',', ':'), ensure_ascii=False))
+        # 透過共用客戶端發送 (重用下單時已建立的連線)
+        response = _post_account_write(api_key, secret_key, path, body)
         response.raise_for_status()  # 檢查HTTP錯誤
         result = response.json()
-        print(f"[Conditional Orders] API 響應: {result}")
+        order_log.debug("[Conditional Orders] API 響應: %s", result)
 
         if result.get("code") == 0:
-            print(f"[Conditional Orders] 成功為持倉 {position_id} 設置條件訂單")
+            order_log.info("[Conditional Orders] 成功為持倉 %s 設置條件訂單", position_id)
             # 可以選擇發送 Discord 通知
             # send_discord_message(f"✅ **條件訂單設置成功** ✅", operation_details={
             #     "type": "status_update",
@@ -240,157 +179,158 @@ def place_conditional_orders(api_key, secret_key, symbol, margin_coin, position_
             return result
         else:
             error_msg = f"[Conditional Orders] API 返回錯誤: {result.get('msg', '未知錯誤')}"
-            print(error_msg)
+            order_log.error(error_msg)
             send_discord_message(f"🔴 **條件訂單設置失敗** 🔴", api_key, secret_key, operation_details={
                 "type": "error",
                 "details": error_msg,
                 "force_send": True
-            })
+            }, symbol=symbol)
             return {"error": error_msg}
 
     except requests.exceptions.HTTPError as e:
         error_msg = f"[Conditional Orders] HTTP 錯誤: {e}, 響應: {response.text if 'response' in locals() else '無響應'}"
-        print(error_msg)
+        order_log.error(error_msg)
         send_discord_message(f"🔴 **條件訂單設置失敗** 🔴", api_key, secret_key, operation_details={
             "type": "error",
             "details": error_msg,
             "force_send": True
-        })
+        }, symbol=symbol)
         return {"error": error_msg}
     except requests.exceptions.RequestException as e:
         error_msg = f"[Conditional Orders] 請求錯誤: {e}"
-        print(error_msg)
+        order_log.error(error_msg)
         send_discord_message(f"🔴 **條件訂單設置失敗** 🔴", api_key, secret_key, operation_details={
             "type": "error",
             "details": error_msg,
             "force_send": True
-        })
+        }, symbol=symbol)
         return {"error": error_msg}
     except Exception as e:
         error_msg = f"[Conditional Orders] 未知錯誤: {e}"
-        print(error_msg)
+        order_log.error(error_msg)
         send_discord_message(f"🔴 **條件訂單設置失敗** 🔴", api_key, secret_key, operation_details={
             "type": "error",
             "details": error_msg,
             "force_send": True
-        })
+        }, symbol=symbol)
         return {"error": error_msg}
 
 # Note: As of current information, automatic trailing stop placement for breakout entries is not implemented due to lack of specific API details.
 
+@timed("tpsl_modify")
 def modify_position_tpsl(api_key, secret_key, symbol, position_id, stop_price=None, limit_price=None):
     """
     Modify Stop Loss and/or Take Profit orders for a given position using Bitunix API.
     Endpoint: /api/v1/futures/tpsl/modify_position_tp_sl_order
     """
     path = "/api/v1/futures/tpsl/modify_position_tp_sl_order"
-    url = f"https://fapi.bitunix.com{path}"
 
     body = {
         "symbol": symbol,
         "positionId": position_id,
     }
 
+    spec = instrument_spec(api_key, secret_key, symbol)
     if stop_price is not None:
-        body["slPrice"] = str(stop_price) # API requires price as string
+        body["slPrice"] = spec.format_price(stop_price) # API requires price as string (rounded to the price precision)
         body["slStopType"] = "LAST_PRICE" # Use LAST_PRICE as trigger type
 
     if limit_price is not None:
-        body["tpPrice"] = str(limit_price) # API requires price as string
+        body["tpPrice"] = spec.format_price(limit_price) # API requires price as string (rounded to the price precision)
         body["tpStopType"] = "LAST_PRICE" # Use LAST_PRICE as trigger type
 
     # Ensure at least one of TP or SL is provided
     if stop_price is None and limit_price is None:
-        print(f"[Modify Conditional Orders] 警告: 未提供止損或止盈價格，不修改條件訂單 for position {position_id} on {symbol}")
+        order_log.warning("[Modify Conditional Orders] 未提供止損或止盈價格，不修改條件訂單 for position %s on %s", position_id, symbol)
         return {"error": "未提供止損或止盈價格"}
 
-    print(f"[Modify Conditional Orders] 準備為持倉 {position_id} 在 {symbol} 上修改條件訂單: {body}")
+    order_log.info("[Modify Conditional Orders] 準備為持倉 %s 在 %s 上修改條件訂單: %s", position_id, symbol, body)
 
     try:
-        # 使用 get_signed_params 獲取完整的 headers
-        _, _, _, headers = get_signed_params(api_key, secret_key, {}, body, path, method="POST")
-
-        response = requests.post(url, headers=headers, data=json.dumps(body, separators=(',', ':'), ensure_ascii=False))
+        # 透過共用客戶端發送 (重用下單時已建立的連線)
+        response = _post_account_write(api_key, secret_key, path, body)
         response.raise_for_status()  # 檢查HTTP錯誤
         result = response.json()
-        print(f"[Modify Conditional Orders] API 響應: {result}")
+        order_log.debug("[Modify Conditional Orders] API 響應: %s", result)
 
         if result.get("code") == 0:
-            print(f"[Modify Conditional Orders] 成功為持倉 {position_id} 修改條件訂單")
+            order_log.info("[Modify Conditional Orders] 成功為持倉 %s 修改條件訂單", position_id)
             return result
         else:
             error_msg = f"[Modify Conditional Orders] API 返回錯誤: {result.get('msg', '未知錯誤')}"
-            print(error_msg)
+            order_log.error(error_msg)
             send_discord_message(f"🔴 **修改條件訂單失敗** 🔴", api_key, secret_key, operation_details={
                 "type": "error",
                 "details": error_msg,
                 "force_send": True
-            })
+            }, symbol=symbol)
             return {"error": error_msg}
 
     except requests.exceptions.HTTPError as e:
         error_msg = f"[Modify Conditional Orders] HTTP 錯誤: {e}, 響應: {response.text if 'response' in locals() else '無響應'}"
-        print(error_msg)
+        order_log.error(error_msg)
         send_discord_message(f"🔴 **修改條件訂單失敗** 🔴", api_key, secret_key, operation_details={
             "type": "error",
             "details": error_msg,
             "force_send": True
-        })
+        }, symbol=symbol)
         return {"error": error_msg}
     except requests.exceptions.RequestException as e:
         error_msg = f"[Modify Conditional Orders] 請求錯誤: {e}"
-        print(error_msg)
+        order_log.error(error_msg)
         send_discord_message(f"🔴 **修改條件訂單失敗** 🔴", api_key, secret_key, operation_details={
             "type": "error",
             "details": error_msg,
             "force_send": True
-        })
+        }, symbol=symbol)
         return {"error": error_msg}
     except Exception as e:
         error_msg = f"[Modify Conditional Orders] 未知錯誤: {e}"
-        print(error_msg)
+        order_log.error(error_msg)
         send_discord_message(f"🔴 **修改條件訂單失敗** 🔴", api_key, secret_key, operation_details={
             "type": "error",
             "details": error_msg,
             "force_send": True
-        })
+        }, symbol=symbol)
         return {"error": error_msg}
 
 
 # === Discord 提醒設定 === #
 # DISCORD_WEBHOOK_URL = 'https://discordapp.com/api/webhooks/1366780723864010813/h_CPbJX3THcOElVVHYOeJPR4gTgZGHJ1ehSeXuOAceGTNz3abY0XlljPzzxkaimAcE77'
 
-# 消息緩衝區和計時器設置
-message_buffer = []
-last_send_time = 0
-BUFFER_TIME_LIMIT = 180  # 3分鐘 = 180秒
+# 通知由背景發送器處理: 交易路徑只負責排入佇列，合併、去重與 429 重試都在背景執行緒完成
+discord_dispatcher = DiscordDispatcher(DISCORD_WEBHOOK_URL)
 
 # 記錄上一次的餘額，用於比較變化
 last_balance = None
 
-# 修改函數簽名以包含 operation_details
-def send_discord_message(core_message, api_key=None, secret_key=None, operation_details=None):
-
-    global message_buffer, last_send_time, win_count, loss_count # 確保能訪問全域勝敗計數
-    current_time = time.time()
-
-    print(f"進入 send_discord_message 函數，核心訊息: {core_message[:50]}...") # 添加日誌
+EMBED_COLOR = 0x3498DB  # discord.Color.blue()
 
+def _build_discord_embed(context, core_message, operation_details, win_count_at_send, loss_count_at_send, api_key, secret_key, symbol=SYMBOL, margin_coin=MARGIN_COIN):
+    """在背景執行緒中組裝 Embed (持倉查詢在同一批次中共用)，返回 webhook 所需的字典"""
     # 獲取最新的實際持倉狀態和PNL (用於顯示"目前持倉"的盈虧)
     actual_pos_side, actual_pos_qty_str, _, actual_unrealized_pnl = None, None, None, 0.0
     current_pos_pnl_msg = ""
-    
-    if api_key and secret_key:
-        # 注意：這裡的 get_current_position_details 返回四個值
-        actual_pos_side, actual_pos_qty_str, _, actual_unrealized_pnl = get_current_position_details(api_key, secret_key, SYMBOL, MARGIN_COIN)
+    is_close_success = bool(operation_details and operation_details.get("type") == "close_success")
+
+    if api_key and secret_key and not is_close_success:
+        # 注意：這裡的 get_current_position_details 返回四個值；同批次的訊息只查詢一次
+        position_key = ("position", api_key, secret_key, symbol)
+        if position_key not in context:
+            context[position_key] = get_current_position_details(api_key, secret_key, symbol, margin_coin)
+        actual_pos_side, actual_pos_qty_str, _, actual_unrealized_pnl = context[position_key]
         if actual_pos_side in ["long", "short"] and actual_unrealized_pnl is not None:
             # 這裡可以加入收益率計算，如果 get_current_position_details 也返回保證金的話
-            current_pos_pnl_msg = f"\n💰 目前未實現盈虧: {actual_unrealized_pnl:.4f} USDT"
+            current_pos_pnl_msg = f"{actual_unrealized_pnl:.4f} USDT"
+
+    # 構造勝率字符串: 帳本有交易時使用帳本的績效統計 (記憶體中的 NumPy 計算)，否則使用訊息產生當下的勝負統計
+    ledger_stats = _ledger_analytics(symbol)
+    if ledger_stats.get("trades"):
+        win_rate_str = format_analytics(ledger_stats)
+    else:
+        total_trades = win_count_at_send + loss_count_at_send
+        win_rate_str = f"{win_count_at_send / total_trades * 100:.2f}% ({win_count_at_send}勝/{loss_count_at_send}負)" if total_trades > 0 else "N/A (尚無已完成交易)"
 
-    # 構造勝率字符串
-    total_trades = win_count + loss_count
-    win_rate_str = f"{win_count / total_trades * 100:.2f}% ({win_count}勝/{loss_count}負)" if total_trades > 0 else "N/A (尚無已完成交易)"
-    
     action_specific_msg = core_message
     current_pos_status_for_discord = ""
 
@@ -407,7 +347,6 @@ def send_discord_message(core_message, api_key=None, secret_key=None, operation_
             if signal_info:
                 action_specific_msg += f"\n📊 **平倉信號**: {signal_info}"
             current_pos_status_for_discord = "🔄 **目前持倉**：無持倉" # 平倉成功後，假設無持倉
-            current_pos_pnl_msg = "" # 平倉後，不顯示“目前未實現盈虧”
         elif op_type == "open_success":
             side_opened_display = "多單" if operation_details.get("side_opened") == "long" else "空單"
             opened_qty = operation_details.get("qty", "N/A")
@@ -424,18 +363,9 @@ def send_discord_message(core_message, api_key=None, secret_key=None, operation_
             signal_info = operation_details.get("signal")
             if signal_info:
                 action_specific_msg += f"\n📊 **相關信號**: {signal_info}"
-        # elif op_type == "balance_update": # 用於餘額更新
-        #     available = operation_details.get("available", 0)
-        #     margin = operation_details.get("margin", 0)
-        #     unrealized_pnl = operation_details.get("unrealized_pnl", 0)
-        #     total_asset = operation_details.get("total_asset", available + margin + unrealized_pnl) # 計算總資產
-        #     action_specific_msg = f"💰 **當前總資產**: {total_asset:.4f} USDT\n可用餘額: {available:.4f} USDT\n已用保證金: {margin:.4f} USDT\n未實現盈虧: {unrealized_pnl:.4f} USDT" # 構造詳細的餘額信息
-        # elif op_type == "status_update": # 用於通道指標等狀態更新
-        #     action_specific_msg = core_message
-        # 可以添加更多 op_type 的處理
 
     # 決定最終的持倉狀態顯示 (如果不是平倉成功，則根據實際查詢結果)
-    if not (operation_details and operation_details.get("type") == "close_success"):
+    if not is_close_success:
         if actual_pos_side == "long":
             current_pos_status_for_discord = f"📈 **目前持倉**：多單 (數量: {actual_pos_qty_str})"
         elif actual_pos_side == "short":
@@ -443,172 +373,110 @@ def send_discord_message(core_message, api_key=None, secret_key=None, operation_
         else:
             current_pos_status_for_discord = "🔄 **目前持倉**：無持倉"
 
-    # 構造 Discord Embed
-    print(f"[Discord Embed] 標題使用的交易對符號: {SYMBOL}") # 添加日誌
-    embed = discord.Embed(
-        title=f"{SYMBOL} 交易通知", # 使用 SYMBOL
-        description=action_specific_msg,
-        color=discord.Color.blue() # 可以根據訊息類型調整顏色
-    )
-
+    # 構造 Discord Embed (直接產生 Webhook 所需的字典，與 discord.Embed.to_dict() 的格式相同，發送通知不必載入 discord.py)
+    embed = {
+        "type": "rich",
+        "title": f"{symbol} 交易通知", # 使用通知所屬的交易對
+        "description": action_specific_msg,
+        "color": EMBED_COLOR, # 可以根據訊息類型調整顏色
+        "fields": [],
+    }
     # 添加統計數據欄位
-    embed.add_field(name="交易統計", value=win_rate_str, inline=True)
-
+    embed["fields"].append({"name": "交易統計", "value": win_rate_str, "inline": True})
     # 添加持倉狀態欄位
-    embed.add_field(name="目前持倉", value=current_pos_status_for_discord, inline=True)
-
+    embed["fields"].append({"name": "目前持倉", "value": current_pos_status_for_discord, "inline": True})
     # 添加未實現盈虧欄位 (如果存在)
     if current_pos_pnl_msg:
-        # 移除開頭的換行符和貨幣符號，只保留數字和單位
-        pnl_value = current_pos_pnl_msg.replace('\n💰 目前未實現盈虧: ', '').strip()
-        embed.add_field(name="目前未實現盈虧", value=pnl_value, inline=False)
-
-    # 添加時間戳欄位
-    embed.add_field(name="時間", value=time.strftime('%Y-%m-%d %H:%M:%S'), inline=False)
-
-    # 檢查是否有圖片需要發送 (來自 operation_details)
-    files_to_send = None
-    image_data = operation_details.get("image_data") if operation_details else None # 檢查 image_data
-    image_path = operation_details.get("image_path") if operation_details else None # 保留 image_path 作為備用或舊邏輯兼容
-
- 
-    print(f"[Discord Send] 提取到的 image_data (存在): {image_data is not None}") # 添加日誌
-    print(f"[Discord Send] 提取到的 image_path: {image_path}") # 添加日誌
+        embed["fields"].append({"name": "目前未實現盈虧", "value": current_pos_pnl_msg, "inline": False})
+    # 添加時間戳欄位 (訊息產生的時間，而非實際送出的時間)
+    embed["fields"].append({"name": "時間", "value": operation_details.get("_created_at") if operation_details else time.strftime('%Y-%m-%d %H:%M:%S'), "inline": False})
+    return embed
 
-    if image_data:
-        print("[Discord Send] 檢測到 image_data，準備從記憶體發送圖片。")
-        # 將圖片作為附件添加到 Embed 中
-        # 需要一個文件名，即使是從記憶體發送
-        image_filename = operation_details.get("image_filename", "chart.png") # 可以從 operation_details 獲取文件名，或使用預設值
-        files_to_send = {'file': (image_filename, image_data, 'image/png')}
-        embed.set_image(url=f"attachment://{image_filename}") # 設置 Embed 圖片為附件
-        print(f"[Discord Send] 準備將圖片數據 ({len(image_data)} bytes) 作為附件發送")
-
-    elif image_path and os.path.exists(image_path):
-        print(f"[Discord Send] 檢測到 image_path 且文件存在: {image_path}，從文件發送圖片。")
-        # 將圖片作為附件添加到 Embed 中
-        image_filename = os.path.basename(image_path)
-        # Read file content and close the file before sending
-        try:
-            with open(image_path, 'rb') as f:
-                image_data = f.read()
-            files_to_send = {'file': (image_filename, image_data, 'image/png')}
-            embed.set_image(url=f"attachment://{image_filename}") # 設置 Embed 圖片為附件
-            print(f"[Discord Send] 已讀取圖片文件 {image_path}，準備作為附件發送")
-        except IOError as e_read:
-            print(f"[Discord Send] 讀取圖片文件 {image_path} 失敗: {e_read}")
-            image_data = None # Ensure image_data is None if reading failed
-            files_to_send = None # 無法讀取文件，不發送圖片
-
-    # 將 Embed 轉換為 webhook payload 格式
-    embed_payload = embed.to_dict()
-    data_payload = {"embeds": [embed_payload]}
-
-    # 將訊息添加到緩衝區
-    # 注意：這裡緩衝區存儲的是 Embed 對象或其字典表示，而不是字符串
-    # 為了簡化，我們暫時不對 Embed 進行緩衝，直接發送
-    # 如果需要緩衝，需要更複雜的邏輯來合併 Embeds 或處理文件附件
-    # 這裡直接發送，忽略 BUFFER_TIME_LIMIT 邏輯
-    print("[Discord Send] 準備發送 Discord Embed 訊息")
+def _ledger_analytics(symbol):
     try:
-        if files_to_send:
-            # 發送帶圖片的 Embed
-            print(f"[Discord Send] 發送帶圖片的 Embed 到 {DISCORD_WEBHOOK_URL}")
-            # 將文件和 JSON payload 都作為 files 參數發送，使用列表格式並為 JSON payload 指定 content_type
-            files_list = [
-                ('file', (image_filename, image_data, 'image/png')), # Use image_data here
-                ('payload_json', (None, json.dumps(data_payload), 'application/json'))
-            ]
-            # 不傳遞任何自定義 headers，讓 requests 自動處理 multipart/form-data 的 headers
-            response = requests.post(DISCORD_WEBHOOK_URL, files=files_list)
-            print(f"[Discord Send] requests.post 狀態碼: {response.status_code}, 響應內容: {response.text[:200]}...")
-            response.raise_for_status() # 檢查 HTTP 錯誤
-            print(f"[Discord Send] Discord Embed (帶圖片) 發送請求成功，狀態碼: {response.status_code}")
-            # 如果是從文件發送的，嘗試刪除文件
-            if image_path and os.path.exists(image_path):
-                 # 嘗試刪除圖片文件，加入重試機制
-                 max_retries = 3
-                 initial_delay = 1 # 初始延遲1秒
-                 retry_delay = 2 # 每次重試延遲2秒
-                 for i in range(max_retries):
-                     try:
-                         # 在刪除前加入延遲，確保文件句柄已釋放
-                         if i == 0:
-                             time.sleep(initial_delay)
-                         else:
-                             time.sleep(retry_delay)
-                         print(f"[Discord Send] 嘗試刪除文件 (第 {i+1}/{max_retries} 次): {image_path}")
-                         os.remove(image_path)
-                         print(f"[Discord Send] 已發送圖片並成功刪除文件: {image_path}")
-                         break # 刪除成功，跳出循環
-                     except Exception as e_remove:
-                         if i < max_retries - 1:
-                             print(f"[Discord Send] 刪除失敗: {str(e_remove)[:100]}...，將在 {retry_delay} 秒後重試 ({i+1}/{max_retries})")
-                             time.sleep(retry_delay)
-                         else:
-                             print(f"[Discord Send] 最終刪除失敗: {str(e_remove)[:100]}...，保留文件: {image_path}")
-                             # 嘗試重命名文件，以便下次不會嘗試刪除同名文件
-                             try:
-                                 os.rename(image_path, image_path+".temp")
-                             except Exception as e_rename:
-                                 print(f"臨時文件重命名失敗: {str(e_rename)[:100]}")
-                             # 可以選擇記錄佔用文件的進程信息，但這需要 psutil 庫，且可能需要管理員權限
-                             # import psutil
-                             # for proc in psutil.process_iter(['pid', 'name', 'open_files']):
-                             #     try:
-                             #         files = proc.info['open_files']
-                             #         if any(f.path == image_path for f in files):
-                             #             print(f'發現進程佔用: PID={proc.pid} 名稱={proc.name()}')
-                             #     except (psutil.NoSuchProcess, psutil.AccessDenied):
-                             #         continue
-        else:
-            # 發送不帶圖片的 Embed
-            print(f"[Discord Send] 發送不帶圖片的 Embed 到 {DISCORD_WEBHOOK_URL}")
-            response = requests.post(DISCORD_WEBHOOK_URL, json=data_payload)
-            print(f"[Discord Send] requests.post 狀態碼: {response.status_code}, 響應內容: {response.text[:200]}...")
-            response.raise_for_status() # 檢查 HTTP 錯誤
-            print(f"[Discord Send] Discord Embed (無圖片) 發送請求成功，狀態碼: {response.status_code}")
-
-    except requests.exceptions.HTTPError as http_err:
-        print(f"[Discord Send] HTTP錯誤 - 發送 Discord Embed 失敗: {http_err}, 響應: {http_err.response.text if http_err.response else '無響應內容'}")
+        return get_trade_ledger().analytics(symbol)
     except Exception as e:
-        print(f"[Discord Send] 其他錯誤 - 發送 Discord Embed 失敗: {e}")
-        print(f"[Discord Send] 錯誤類型: {type(e)}")
+        log.error("讀取交易帳本統計失敗: %s", e)
+        return {}
+
+# 修改函數簽名以包含 operation_details
+def send_discord_message(core_message, api_key=None, secret_key=None, operation_details=None, symbol=None):
+    """將 Discord 通知排入背景發送器 (不阻塞呼叫端)；symbol 決定標題、持倉與勝率統計，預設為 config.py 的 SYMBOL"""
+    state = get_symbol_state(symbol)
+    operation_details = dict(operation_details or {})
+    operation_details["_created_at"] = time.strftime('%Y-%m-%d %H:%M:%S')
 
-    # 清空緩衝區 (如果實現了緩衝)
-    # message_buffer = []
-    # last_send_time = current_time
-    print(f"已嘗試發送 Discord Embed 消息 - 時間: {time.strftime('%Y-%m-%d %H:%M:%S')}")
+    # 檢查是否有圖片需要發送 (來自 operation_details)
+    attachment = None
+    image_data = operation_details.get("image_data") # 檢查 image_data
+    image_path = operation_details.get("image_path") # 保留 image_path 作為備用或舊邏輯兼容
+    if image_data:
+        attachment = (operation_details.get("image_filename", "chart.png"), image_data)
+    elif not (image_path and os.path.exists(image_path)):
+        image_path = None
+
+    # 只有錯誤/狀態類通知 (例如連續的下單錯誤) 在去重時間窗內合併；成交通知與 force_send 訊息一律照發
+    dedupe_key = None
+    if (operation_details.get("type") in DISCORD_DEDUPE_TYPES and not operation_details.get("force_send")
+            and not attachment and not image_path):
+        dedupe_key = f"{state.symbol}|{core_message}|{operation_details.get('type')}|{operation_details.get('details', '')}"
+
+    build = functools.partial(_build_discord_embed, core_message=core_message, operation_details=operation_details,
+                              win_count_at_send=state.win_count, loss_count_at_send=state.loss_count,
+                              api_key=api_key, secret_key=secret_key, symbol=state.symbol, margin_coin=state.config.margin_coin)
+    queued = discord_dispatcher.submit(NotificationJob(build, dedupe_key=dedupe_key, attachment=attachment, image_path=image_path))
+    if queued:
+        notify_log.debug("[Discord Send] 已排入通知佇列: %s...", core_message[:50])
+    else:
+        notify_log.debug("[Discord Send] 重複通知已合併: %s...", core_message[:50])
 
 # 強制發送緩衝區中的所有消息，不管時間限制
-def flush_discord_messages():
-    # 由於 send_discord_message 已改為直接發送 Embed，此函數暫時不需要實現複雜的緩衝區處理
-    # 如果未來需要緩衝多個 Embeds，需要重新設計此函數
-    print("flush_discord_messages 函數被呼叫，但目前不執行任何操作 (Embeds 直接發送)")
-    pass
+def flush_discord_messages(timeout=DISCORD_FLUSH_TIMEOUT_SECONDS):
+    """在 timeout 秒內送出佇列中的所有通知 (程序結束前呼叫)"""
+    return discord_dispatcher.flush(timeout)
 
 
 
 
 
 # === 策略邏輯 === #
-def fetch_ohlcv(api_key=None, secret_key=None): # 移除了未使用的 symbol 參數
-    """獲取指定交易對的K線數據，並添加錯誤處理"""
+# tick 路徑讀取K線用的預先配置緩衝區: (交易對, 時間框架, 用途) -> 陣列
+# 完整 tick、輕量檢查與串流回呼各用一個，同一交易對依序執行，不會同時寫入同一個緩衝區
+_ohlcv_buffers = {}
+
+
+def ohlcv_buffer(trading_pair, timeframe, purpose, limit=100):
+    """取得 (或建立) 至少 limit 列的K線緩衝區，供 fetch_ohlcv(out=...) 重複使用"""
+    key = (trading_pair, timeframe, purpose)
+    buf = _ohlcv_buffers.get(key)
+    if buf is None or len(buf) < limit:
+        buf = _ohlcv_buffers[key] = np.empty((limit, len(COLUMNS)), dtype=np.float64)
+    return buf
+
+
+@timed("fetch_ohlcv")
+def fetch_ohlcv(api_key=None, secret_key=None, limit=100, trading_pair=TRADING_PAIR, timeframe=TIMEFRAME, out=None):
+    """
+    獲取指定交易對的K線數據，並添加錯誤處理。
+    提供 out (ohlcv_buffer) 時複製到該緩衝區並返回其視圖，下一次以同一緩衝區讀取前有效。
+    """
     try:
-        # 使用ccxt庫連接到Binance交易所
-        exchange = ccxt.binance()
-        # 獲取指定交易對的4小時K線數據，限制為最近100根
-        # 這將確保我們總是獲取最新的市場數據
-        ohlcv = exchange.fetch_ohlcv(TRADING_PAIR, timeframe=TIMEFRAME, limit=100) # 使用 TRADING_PAIR
-        return np.array(ohlcv)
+        # K線由增量儲存維護: 只向 Binance 請求最後一根已存K線之後的數據，
+        # 形成中的K線原地更新，並持久化到磁碟供重啟時直接載入
+        store = get_candle_store(trading_pair, timeframe)
+        # WebSocket 串流正常推送時儲存已是最新，不必再發 REST 請求
+        if not (store.is_streaming(MARKET_WS_STALE_SECONDS) and len(store) >= limit):
+            store.update(warmup=limit)
+        return store.latest(limit, out=out)
     except Exception as e:
-        error_msg = f"獲取 {TRADING_PAIR} K線數據失敗: {e}"
-        print(f"錯誤：{error_msg}")
+        error_msg = f"獲取 {trading_pair} K線數據失敗: {e}"
+        log.error(error_msg)
         return None
 
 
 
 
+@timed("compute_indicators")
 def compute_indicators(df, rsi_len, atr_len, breakout_len, api_key=None, secret_key=None, symbol=None):
     """計算技術指標，並添加錯誤處理"""
     try:
@@ -617,7 +485,7 @@ def compute_indicators(df, rsi_len, atr_len, breakout_len, api_key=None, secret_
             import talib
         except ImportError:
             error_msg = "錯誤：TA-Lib 未正確安裝。請按照以下步驟操作：\n1. 確保虛擬環境已激活\n2. 檢查是否已安裝 TA-Lib C 函式庫\n3. 執行 'pip install TA_Lib‑*.whl' 安裝 Python 套件\n詳細安裝指引請參考 README.md"
-            print(error_msg)
+            log.error(error_msg)
             return None # 返回 None 表示計算失敗
 
         df["rsi"] = talib.RSI(df["close"], timeperiod=rsi_len)
@@ -627,16 +495,24 @@ def compute_indicators(df, rsi_len, atr_len, breakout_len, api_key=None, secret_
         return df
     except Exception as e:
         error_msg = f"計算指標失敗: {e}"
-        print(f"錯誤：{error_msg}")
+        log.error(error_msg)
         return None # 返回 None 表示計算失敗
 
-def calculate_trade_size(api_key, secret_key, symbol, wallet_percentage, leverage, current_price):
-    """根據錢包餘額、槓桿和當前價格計算下單數量"""
-    available_balance = check_wallet_balance(api_key, secret_key) # 確保這裡獲取的是最新的可用餘額
+@timed("calculate_trade_size")
+def calculate_trade_size(api_key, secret_key, symbol, wallet_percentage, leverage, current_price, available_balance=None, quantity_precision=None):
+    """根據錢包餘額、槓桿和當前價格計算下單數量 (available_balance 為本次 tick 已並行取得的餘額時不再重複查詢)"""
+    if available_balance is None:
+        available_balance = check_wallet_balance(api_key, secret_key) # 確保這裡獲取的是最新的可用餘額
     if available_balance is None or available_balance <= 0:
-        print("錯誤：無法獲取錢包餘額或餘額不足")
+        order_log.error("無法獲取錢包餘額或餘額不足")
         return 0
 
+    if quantity_precision is None:
+        quantity_precision = get_symbol_state(symbol).config.quantity_precision
+    spec = get_instrument_specs(api_key, secret_key).get(symbol, quantity_precision)
+    # 槓桿不能超過交易對允許的最大槓桿
+    leverage = spec.clamp_leverage(leverage)
+
     # 計算用於交易的資金量
     trade_capital = available_balance * wallet_percentage
 
@@ -649,75 +525,356 @@ def calculate_trade_size(api_key, secret_key, symbol, wallet_percentage, leverag
     # 這裡需要考慮 Bitunix 對於不同幣種的最小下單單位和數量精度
     if current_price > 0:
         quantity = contract_value / current_price
-        # 這裡需要根據實際交易對的精度進行調整
-        # 例如，如果 ETHUSDT 數量精度是 0.001，則需要 round(quantity, 3)
-        # 為了通用性，這裡暫時不進行精度處理，實際應用中需要根據交易所API獲取精度
-        # 或者從配置中讀取
-        # 假設精度為 N 位小數
-        # quantity = round(quantity, N)
-        # 這裡使用從 config 讀取的精度 N
-        quantity = round(quantity, QUANTITY_PRECISION)
-        print(f"計算下單數量: 可用餘額={available_balance:.4f}, 交易資金={trade_capital:.4f}, 合約價值={contract_value:.4f}, 當前價格={current_price:.2f}, 計算數量={quantity:.3f}")
+        # 依交易所的數量精度向下取整並限制在最大下單數量內 (規格來自 instrument_specs 快取，
+        # 交易所未提供時使用交易對設定的精度 N，預設為 config 的 QUANTITY_PRECISION)；低於最小下單數量時返回 0
+        raw_quantity = quantity
+        quantity = spec.round_qty(quantity)
+        order_log.info("計算下單數量: 可用餘額=%.4f, 交易資金=%.4f, 合約價值=%.4f, 當前價格=%.2f, 計算數量=%s", available_balance, trade_capital, contract_value, current_price, spec.format_qty(quantity))
+        if quantity <= 0:
+            order_log.warning("計算數量 %.8f 低於 %s 的最小下單數量 %s", raw_quantity, symbol, spec.min_qty)
         return quantity
     else:
-        print("錯誤：當前價格無效")
+        order_log.error("當前價格無效")
+        return 0
+
+# === 交易帳本 === #
+def sync_trade_ledger(api_key, secret_key, symbol):
+    """從 Bitunix 歷史持倉增量同步交易帳本，返回新增筆數 (失敗時返回 None)"""
+    try:
+        return get_trade_ledger().sync(api_key, secret_key, symbol)
+    except Exception as e:
+        log.error("同步 %s 交易帳本失敗: %s", symbol, e)
+        return None
+
+def closed_trade(api_key, secret_key, symbol, position_id):
+    """同步帳本後返回該持倉的平倉紀錄 (含交易所計算的已實現盈虧)；尚無紀錄時返回 None"""
+    if not position_id:
+        return None
+    sync_trade_ledger(api_key, secret_key, symbol)
+    return get_trade_ledger().trade(position_id)
+
+def notify_exchange_close(api_key, secret_key, symbol, trade):
+    send_discord_message("🟠 **持倉已由交易所平倉 (止損/止盈觸發)** 🟠", api_key, secret_key, symbol=symbol, operation_details={
+        "type": "close_success",
+        "side_closed": trade["side"],
+        "qty": trade["qty"],
+        "pnl": trade["realized_pnl"],
+        "force_send": True # 強制發送
+    })
+
+def settle_unsettled(api_key, secret_key, state):
+    """
+    增量同步交易帳本 (ledger_sync 定時任務)，並結算交易所已平倉、當時帳本尚無紀錄的持倉:
+    以平倉紀錄計入勝負，帳本仍無紀錄時改用帳戶串流推送的已實現盈虧，兩者皆無則留待下一次 tick 或 ledger_sync。
+    返回本次結算的筆數。
+    """
+    sync_trade_ledger(api_key, secret_key, state.symbol)
+    if not state.unsettled:
         return 0
+    ledger = get_trade_ledger()
+    settled = 0
+    for position_id in list(state.unsettled):
+        trade = ledger.trade(position_id) or state.stream_closes.get(position_id)
+        if trade is None:
+            continue
+        state.settle(position_id, trade["realized_pnl"])
+        notify_exchange_close(api_key, secret_key, state.symbol, trade)
+        settled += 1
+    if settled:
+        state.save_stats()
+        log.info("%s 已結算 %s 筆待結算持倉，剩餘 %s 筆", state.symbol, settled, len(state.unsettled))
+    return settled
+
+# === 每個 tick 的並行讀取 === #
+# 讀取類請求 (K線、持倉、餘額) 互不相依，以有界執行緒池並行發出；
+# 下單類請求則固定在單一執行緒上依序執行，確保開倉 -> 止損止盈的順序不會被打亂
+_io_executor = ThreadPoolExecutor(max_workers=IO_THREAD_POOL_SIZE, thread_name_prefix="tick-io")
+_order_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tick-order")
+
+
+class TickInputs:
+    """單次 tick 並行讀取的結果"""
+    __slots__ = ("ohlcv", "position", "available_balance")
+
+    def __init__(self, ohlcv, position, available_balance):
+        self.ohlcv = ohlcv
+        self.position = position # get_current_position_details 的 PositionDetails
+        self.available_balance = available_balance
+
+
+def report_request_counts(api_key, secret_key, reset=True):
+    """輸出本輪各 Bitunix 端點的請求次數、帳戶快照命中情況與各端點類別的速率預算使用率"""
+    client = get_bitunix_client(api_key, secret_key)
+    counts = client.call_count_report(reset=reset)
+    stats = get_account_snapshot(api_key, secret_key).stats()
+    summary = ", ".join(f"{endpoint}={count}" for endpoint, count in counts.items()) or "無"
+    log.info("[Request Stats] 端點請求次數: %s | 帳戶快照 (累計) 命中=%s 查詢=%s 失效=%s", summary, stats['hits'], stats['misses'], stats['invalidations'])
+    budget = client.governor.report(reset=reset)
+    usage = []
+    for name, item in budget.items():
+        text = f"{name}={item['utilization']:.0%}"
+        if item.get("waits") or item.get("throttled"):
+            text += f" (等待 {item['waits']} 次/{item['wait_seconds']:.1f}s, 429 {item['throttled']} 次, 速率 {item['rate']:.1f}/s)"
+        usage.append(text)
+    usage = ", ".join(usage)
+    log.info("[Request Stats] 速率預算使用率: %s", usage)
+    return counts
+
+@timed("tick_read")
+def fetch_tick_inputs(api_key, secret_key, symbol, margin_coin, symbol_config=None):
+    """並行讀取K線、持倉與餘額，耗時約等於其中最慢的一個請求"""
+    symbol_config = symbol_config or get_symbol_state(symbol).config
+    ohlcv_future = _io_executor.submit(fetch_ohlcv, api_key, secret_key, 100, symbol_config.trading_pair, symbol_config.timeframe,
+                                       out=ohlcv_buffer(symbol_config.trading_pair, symbol_config.timeframe, "tick"))
+    position_future = _io_executor.submit(get_current_position_details, api_key, secret_key, symbol, margin_coin)
+    balance_future = _io_executor.submit(check_wallet_balance, api_key, secret_key)
+    return TickInputs(ohlcv_future.result(), position_future.result(), balance_future.result())
+
+
+async def execute_trading_strategy_async(api_key, secret_key, symbol, margin_coin, wallet_percentage, leverage, rsi_buy_signal, breakout_lookback, atr_multiplier):
+    """
+    不阻塞事件迴圈的交易策略 tick (供 Discord 定時任務使用)。
+    讀取在 I/O 執行緒池並行完成，信號判斷與下單在下單執行緒依序執行。
+    """
+    loop = asyncio.get_running_loop()
+    symbol_config = get_symbol_state(symbol).config
+    ohlcv, position, balance = await asyncio.gather(
+        loop.run_in_executor(_io_executor, functools.partial(
+            fetch_ohlcv, api_key, secret_key, 100, symbol_config.trading_pair, symbol_config.timeframe,
+            out=ohlcv_buffer(symbol_config.trading_pair, symbol_config.timeframe, "tick"))),
+        loop.run_in_executor(_io_executor, get_current_position_details, api_key, secret_key, symbol, margin_coin),
+        loop.run_in_executor(_io_executor, check_wallet_balance, api_key, secret_key),
+    )
+    tick_inputs = TickInputs(ohlcv, position, balance)
+    await loop.run_in_executor(_order_executor, functools.partial(
+        execute_trading_strategy, api_key, secret_key, symbol, margin_coin, wallet_percentage, leverage,
+        rsi_buy_signal, breakout_lookback, atr_multiplier, tick_inputs=tick_inputs))
+
+
+# === WebSocket 行情 === #
+# K線與最新價由串流即時寫入 candle_store；每次更新只用本地指標預覽判斷是否出現可操作的條件
+# (開倉、平倉或移動止損)，出現時立即喚醒主迴圈執行完整 tick，其餘時間不產生任何 REST 請求
+_stream_wake = threading.Event()
+market_stream = None
+
+# Define time filter dates (using datetime objects for easier comparison)
+# Pine Script uses timestamp(YYYY, M, D, H, M), Python uses datetime
+# Note: Python datetime objects are timezone-aware or naive. Using naive for simplicity, assuming UTC or exchange time.
+LIVE_START_DATE = datetime.datetime(2025, 1, 1, 0, 0)
+LIVE_END_DATE = datetime.datetime(2025, 12, 31, 23, 59)
+
+
+def is_live_bar(timestamp_ms):
+    """K線時間 (ms) 是否在實盤交易期間內"""
+    return LIVE_START_DATE <= datetime.datetime.fromtimestamp(timestamp_ms / 1000) <= LIVE_END_DATE
+
+
+def closed_rows(ohlcv, timeframe, now_ms=None):
+    """去掉仍在形成中的最後一根K線 (返回視圖，不複製)"""
+    now_ms = time.time() * 1000 if now_ms is None else now_ms
+    if len(ohlcv) and ohlcv[-1, 0] + timeframe_to_ms(timeframe) > now_ms:
+        return ohlcv[:-1]
+    return ohlcv
+
+
+def _stream_action_candidate(state, latest):
+    """以指標預覽判斷目前是否可能需要交易操作 (與 execute_trading_strategy 的條件一致)"""
+    cfg = state.config
+    if state.pos_side is None:
+        if is_live_bar(latest.timestamp) and (latest.rsi > cfg.rsi_buy or latest.close > latest.highest_break):
+            return "entry"
+    elif state.pos_side == "long":
+        if latest.rsi < cfg.exit_rsi:
+            return "exit"
+        if state.entry_type == "breakout" and state.stop_loss_price is not None \
+                and latest.close - latest.atr * cfg.stop_mult > state.stop_loss_price:
+            return "trailing_stop"
+    return None
+
+
+def make_stream_candle_handler(state, wake):
+    """
+    建立交易對的K線串流回呼: 出現可操作的條件或K線收盤時標記 state.wake_requested 並呼叫 wake()。
+    同一交易對兩次喚醒至少間隔 MARKET_WS_MIN_WAKE_SECONDS。
+    """
+    cfg = state.config
+    last_wake = [0.0]
+    buf = ohlcv_buffer(cfg.trading_pair, cfg.timeframe, "stream")
+
+    def on_candle(timeframe, store, row, closed):
+        if timeframe != cfg.timeframe:
+            return
+        engine = get_indicator_engine((cfg.trading_pair, cfg.timeframe), cfg.rsi_len, cfg.atr_len, cfg.breakout_lookback)
+        with engine.lock:
+            latest = engine.sync(store.latest(100, out=buf))
+        candidate = "bar_close" if closed else _stream_action_candidate(state, latest)
+        now = time.time()
+        if candidate and now - last_wake[0] >= MARKET_WS_MIN_WAKE_SECONDS:
+            last_wake[0] = now
+            state.wake_requested = True
+            log.info("[Market Stream] %s 偵測到 %s 條件 (收盤價=%.2f, RSI=%.2f)，立即執行交易策略", cfg.symbol, candidate, latest.close, latest.rsi)
+            wake()
+
+    return on_candle
+
+
+def make_account_event_handler(states, wake):
+    """
+    建立帳戶串流的事件回呼: 交易對記憶中的持倉在交易所平倉 (止損/止盈觸發或手動平倉) 時，
+    標記 state.wake_requested 並呼叫 wake()，由下一次完整評估以帳本紀錄計入勝負 (與輪詢發現平倉的流程相同)。
+
+    參數:
+        states (dict): 交易對 -> SymbolState
+    """
+    def on_event(kind, symbol, data):
+        if kind != "position_close":
+            return
+        state = states.get(symbol)
+        if state is None or not state.position_id or data.get("positionId") != state.position_id:
+            return
+        if data.get("realizedPNL") is not None:
+            # 帳本尚未出現平倉紀錄時，以推送的已實現盈虧結算
+            state.stream_closes[state.position_id] = {"side": data.get("side"), "qty": data.get("qty"), "realized_pnl": float(data["realizedPNL"])}
+        state.wake_requested = True
+        log.info("[Account Stream] %s 持倉 %s 已在交易所平倉 (已實現盈虧 %s)，立即執行交易策略", symbol, state.position_id, data.get("realizedPNL"))
+        wake()
+
+    return on_event
+
+
+def start_account_stream(api_key, secret_key, states, wake):
+    """啟動帳戶串流並註冊平倉事件 (ACCOUNT_WS_ENABLED 為 False 時返回 None，持倉與餘額維持 REST 查詢)"""
+    if not ACCOUNT_WS_ENABLED:
+        return None
+    stream = get_account_stream(api_key, secret_key)
+    stream.on_event(make_account_event_handler(states, wake))
+    return stream.start()
+
+
+def create_market_stream(trading_pair, timeframes):
+    """
+    建立交易對的行情串流，返回 (stream, candles)，K線回呼註冊在 candles 上。
+    設定 MARKET_WS_BASE_TIMEFRAME 時只訂閱基礎時間框架，timeframes 與 RESAMPLE_TIMEFRAMES 由 CandleResampler 在本地產生；
+    否則直接訂閱所有時間框架 (candles 即為 stream)。
+    """
+    timeframes = list(dict.fromkeys(list(timeframes) + list(RESAMPLE_TIMEFRAMES)))
+    if not MARKET_WS_BASE_TIMEFRAME:
+        stream = MarketStream(trading_pair, timeframes)
+        return stream, stream
+    stream = MarketStream(trading_pair, [MARKET_WS_BASE_TIMEFRAME])
+    resampler = CandleResampler(trading_pair, MARKET_WS_BASE_TIMEFRAME, timeframes)
+    stream.on_candle(resampler.on_base_candle)
+    return stream, resampler
+
+
+def start_market_stream():
+    """啟動 WebSocket 行情串流 (MARKET_WS_ENABLED 為 False 時維持輪詢)"""
+    global market_stream
+    if MARKET_WS_ENABLED and market_stream is None:
+        market_stream, candles = create_market_stream(TRADING_PAIR, [TIMEFRAME])
+        candles.on_candle(make_stream_candle_handler(get_symbol_state(), _stream_wake.set))
+        market_stream.start()
+    return market_stream
+
+
+@timed("light_check")
+def light_check(api_key, secret_key, state=None):
+    """
+    K線收盤之間的輕量檢查: 只讀取K線 (串流推送中不發任何請求，否則只向 Binance 增量更新)，
+    以指標預覽判斷出場、移動止損或開倉條件，不查詢帳戶。返回條件名稱，無需操作時返回 None。
+    """
+    state = state or get_symbol_state()
+    cfg = state.config
+    ohlcv_data = fetch_ohlcv(api_key, secret_key, 100, cfg.trading_pair, cfg.timeframe,
+                             out=ohlcv_buffer(cfg.trading_pair, cfg.timeframe, "light"))
+    if ohlcv_data is None or len(ohlcv_data) == 0:
+        return None
+    engine = get_indicator_engine((cfg.trading_pair, cfg.timeframe), cfg.rsi_len, cfg.atr_len, cfg.breakout_lookback)
+    with engine.lock, span("indicators"):
+        latest = engine.sync(ohlcv_data)
+    return _stream_action_candidate(state, latest)
+
 
 # === 交易策略核心邏輯 === #
-def execute_trading_strategy(api_key, secret_key, symbol, margin_coin, wallet_percentage, leverage, rsi_buy_signal, breakout_lookback, atr_multiplier):
-    global win_count, loss_count, current_pos_entry_type, current_stop_loss_price, current_position_id_global
+@timed("tick")
+def execute_trading_strategy(api_key, secret_key, symbol, margin_coin, wallet_percentage, leverage, rsi_buy_signal, breakout_lookback, atr_multiplier, tick_inputs=None, state=None):
+    # 持倉記憶與勝負統計屬於該交易對 (state)，多個交易對並行執行時互不影響
+    state = state or get_symbol_state(symbol)
+    cfg = state.config
     buy_signal = False # 初始化买入信号
     close_long_signal = False # 初始化平多信号
-    print(f"執行交易策略: {symbol}")
+    close_bar = None # 本次以收盤K線評估時為該K線的開盤時間
+    evaluation_complete = False # 持倉已確認且信號判斷執行完畢
+    order_failed = False # 下單、平倉或移動止損請求失敗
+    log.info("執行交易策略: %s", symbol)
+
+    # 未提供預先並行讀取的數據時 (例如單獨呼叫)，在此一次並行讀取K線、持倉與餘額
+    if tick_inputs is None:
+        tick_inputs = fetch_tick_inputs(api_key, secret_key, symbol, margin_coin, cfg)
 
     try:
         # 1. 獲取最新的K線數據
-        # fetch_ohlcv 會直接使用從 config 導入的 SYMBOL
-        ohlcv_data = fetch_ohlcv(api_key, secret_key)
-
-
-        # 將數據轉換為 Pandas DataFrame
-        df = pd.DataFrame(ohlcv_data, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+        # K線依交易對設定的 TRADING_PAIR/TIMEFRAME 讀取
+        ohlcv_data = tick_inputs.ohlcv
+        if ohlcv_data is None or len(ohlcv_data) == 0:
+            log.error("沒有 %s 的K線數據，略過本次評估", cfg.trading_pair)
+            return
+        # 收盤後的第一次完整評估以剛收盤的K線判斷信號 (與 Pine Script 的收盤評估一致)；
+        # 同一根K線之後由串流或輕量檢查觸發的評估才使用形成中K線的預覽
+        closed = closed_rows(ohlcv_data, cfg.timeframe)
+        if len(closed) and closed[-1, 0] != state.last_close_bar:
+            close_bar = closed[-1, 0]
+            ohlcv_data = closed
+            log.info("以收盤K線 (%s) 評估信號", datetime.datetime.fromtimestamp(closed[-1, 0] / 1000))
 
         # 2. 計算技術指標
-        # 將 api_key, secret_key, symbol 傳遞給 compute_indicators
-        df = compute_indicators(df, RSI_LEN, ATR_LEN, BREAKOUT_LOOKBACK, api_key, secret_key, symbol)
-
+        # 增量指標引擎只提交新收盤的K線，形成中的K線以 O(1) 預覽，不再每次重算整段數據
+        engine = get_indicator_engine((cfg.trading_pair, cfg.timeframe), cfg.rsi_len, cfg.atr_len, cfg.breakout_lookback)
+        with engine.lock, span("indicators"): # 與 WebSocket 行情回呼共用同一個引擎
+            latest = engine.sync(ohlcv_data)
 
         # 獲取最新的指標值
-        latest_close = df['close'].iloc[-1]
-        latest_rsi = df['rsi'].iloc[-1]
-        latest_highest_break = df['highest_break'].iloc[-1]
-        latest_atr = df['atr'].iloc[-1]
+        latest_close = latest.close
+        latest_rsi = latest.rsi
+        latest_highest_break = latest.highest_break
+        latest_atr = latest.atr
 
-        print(f"最新數據: 收盤價={latest_close:.2f}, RSI={latest_rsi:.2f}, 突破高點={latest_highest_break:.2f}, ATR={latest_atr:.4f}")
+        log.info("最新數據: 收盤價=%.2f, RSI=%.2f, 突破高點=%.2f, ATR=%.4f", latest_close, latest_rsi, latest_highest_break, latest_atr)
 
         # 3. 檢查當前持倉狀態
         # 確保 get_current_position_details 也能處理錯誤並通知 Discord
-        current_pos_side, current_pos_qty_str, current_position_id, current_unrealized_pnl = get_current_position_details(api_key, secret_key, symbol, margin_coin)
+        current_pos_side, current_pos_qty_str, current_position_id, current_unrealized_pnl = tick_inputs.position
+        state.pos_side = current_pos_side
+        position_known = current_unrealized_pnl is not None # 持倉查詢失敗時 PNL 為 None，不可據此清除記憶
+        if position_known and state.position_id and (current_pos_side is None or (current_position_id and current_position_id != state.position_id)):
+            # 持倉已在交易所端結束 (止損/止盈觸發或手動平倉): 以帳本的平倉紀錄 (或帳戶串流推送的已實現盈虧) 計入勝負，
+            # 並清除記憶避免對新持倉沿用舊的移動止損
+            trade = closed_trade(api_key, secret_key, symbol, state.position_id) or state.stream_closes.get(state.position_id)
+            if trade is not None:
+                state.close_position(trade["realized_pnl"])
+                state.save_stats()
+                notify_exchange_close(api_key, secret_key, symbol, trade)
+            else:
+                # 帳本尚無紀錄: positionId 留待之後的 tick 或 ledger_sync 結算，不可直接丟棄
+                log.warning("%s 持倉 %s 已平倉但帳本尚無紀錄，留待之後結算", symbol, state.position_id)
+                state.defer_close()
+                state.save_stats()
+        elif state.unsettled:
+            settle_unsettled(api_key, secret_key, state)
         current_pos_qty = float(current_pos_qty_str) if current_pos_qty_str else 0.0
 
-        # Define time filter dates (using datetime objects for easier comparison)
-        # Pine Script uses timestamp(YYYY, M, D, H, M), Python uses datetime
-        # Note: Python datetime objects are timezone-aware or naive. Using naive for simplicity, assuming UTC or exchange time.
-        import datetime
-        START_DATE = datetime.datetime(2025, 1, 1, 0, 0)
-        END_DATE = datetime.datetime(2025, 12, 31, 23, 59)
-
-        # Get the timestamp of the latest K-line
-        latest_timestamp_ms = df['timestamp'].iloc[-1].timestamp() * 1000 # Convert datetime to timestamp in ms
-        latest_datetime = datetime.datetime.fromtimestamp(latest_timestamp_ms / 1000) # Convert ms timestamp back to datetime
-
-        # Check if current time is within the live trading period
-        is_live = START_DATE <= latest_datetime <= END_DATE
-        print(f"[Time Filter] Current time: {latest_datetime}, Is Live: {is_live}")
+        # Check if the latest K-line is within the live trading period (LIVE_START_DATE ~ LIVE_END_DATE)
+        latest_datetime = datetime.datetime.fromtimestamp(latest.timestamp / 1000) # Convert ms timestamp back to datetime
+        is_live = is_live_bar(latest.timestamp)
+        log.debug("[Time Filter] Current time: %s, Is Live: %s", latest_datetime, is_live)
 
         # 4. 判斷交易信號並執行操作
         # 計算止損和止盈價格 (基於 ATR)，與 Pine Script 一致
         # Pine Script: stop=close - atr * stopMult, limit=close + atr * limitMult
-        stop_loss_long = latest_close - latest_atr * STOP_MULT # 使用 STOP_MULT 參數
-        take_profit_long = latest_close + latest_atr * LIMIT_MULT # 使用 LIMIT_MULT 參數
+        # 價格取到交易對的價格刻度，記錄的止損價與交易所上的一致
+        spec = instrument_spec(api_key, secret_key, symbol)
+        stop_loss_long = spec.round_price(latest_close - latest_atr * cfg.stop_mult) # 使用 STOP_MULT 參數
+        take_profit_long = spec.round_price(latest_close + latest_atr * cfg.limit_mult) # 使用 LIMIT_MULT 參數
         # 暫時不實現空單策略的止損止盈
         # stop_loss_short = latest_close + latest_atr * STOP_MULT
         # take_profit_short = latest_close - latest_atr * LIMIT_MULT
@@ -748,8 +905,8 @@ def execute_trading_strategy(api_key, secret_key, symbol, margin_coin, wallet_pe
         sell_signal = False # 暫時不實現空單策略
 
         # 平多單條件：RSI 下穿 EXIT_RSI (Pine: rsiLongExit = rsi < exitRSI)
-        # EXIT_RSI is imported from config.py and should be accessible globally
-        close_long_signal = (current_pos_side == "long") and (latest_rsi < EXIT_RSI)
+        # EXIT_RSI comes from the symbol's config (config.py unless overridden)
+        close_long_signal = (current_pos_side == "long") and (latest_rsi < cfg.exit_rsi)
 
         # 平空單條件：暫時不實現
         close_short_signal = False # (current_pos_side == "short") and (latest_rsi > (100 - EXIT_RSI)) # 暫時不實現空單策略
@@ -764,14 +921,24 @@ def execute_trading_strategy(api_key, secret_key, symbol, margin_coin, wallet_pe
                 signal_details.append("Breakout Entry")
             open_signal_reason = " & ".join(signal_details) if signal_details else "Signal Triggered"
             
-            print(f"觸發開多信號 ({open_signal_reason})")
+            log.info("觸發開多信號 (%s)", open_signal_reason)
             # 確保 calculate_trade_size 也能處理錯誤並通知 Discord
-            trade_size = calculate_trade_size(api_key, secret_key, symbol, wallet_percentage, leverage, latest_close)
+            trade_size = calculate_trade_size(api_key, secret_key, symbol, wallet_percentage, leverage, latest_close, tick_inputs.available_balance, cfg.quantity_precision)
             if trade_size > 0:
-                print(f"準備開多單，數量: {trade_size}")
-                order_result = send_order(api_key, secret_key, symbol, margin_coin, "open_long", trade_size, leverage)
+                order_log.info("準備開多單，數量: %s", trade_size)
+                # 止損止盈隨開倉單一起送出，持倉建立時即受保護:
+                # RSI 進場設置 ATR 止損與止盈；突破進場只設初始止損，之後由本程式手動移動止損
+                # (Bitunix 的 Position TP/SL 不支持移動止損 (Trailing Stop)。<mcreference link="https://openapidoc.bitunix.com/doc/tp_sl/place_position_tp_sl_order.html" index="1">1</mcreference>)
+                entry_type = "rsi" if rsi_long_entry_condition else "breakout"
+                if entry_type == "rsi":
+                    order_log.info("RSI 進場觸發，隨開倉單設置止損止盈: SL=%.4f, TP=%.4f", stop_loss_long, take_profit_long)
+                else:
+                    log.info("突破進場觸發，隨開倉單設置初始止損 SL=%.4f，之後手動實現移動止損邏輯。", stop_loss_long)
+                order_result = send_order(api_key, secret_key, symbol, margin_coin, "open_long", trade_size, leverage,
+                                          stop_price=stop_loss_long, limit_price=take_profit_long if entry_type == "rsi" else None)
                 if order_result and "error" not in order_result:
-                    send_discord_message("🟢 **開多成功** 🟢", api_key, secret_key, operation_details={
+                    state.pos_side = "long"
+                    send_discord_message("🟢 **開多成功** 🟢", api_key, secret_key, symbol=symbol, operation_details={
                         "type": "open_success",
                         "side_opened": "long",
                         "qty": trade_size,
@@ -780,38 +947,28 @@ def execute_trading_strategy(api_key, secret_key, symbol, margin_coin, wallet_pe
                         "force_send": True # 強制發送
                     })
 
-                    # 獲取新開倉的 positionId (假設API響應中包含此信息)
-                    new_position_id = order_result.get("data", {}).get("positionId") # 需要根據實際API響應結構調整
+                    # positionId 由下單管理器補齊 (回應中沒有時輪詢持倉取得)
+                    new_position_id = order_result.get("data", {}).get("positionId")
 
                     if new_position_id:
-                        print(f"成功開多單，positionId: {new_position_id}")
-                        # 更新全域持倉變數
-                        current_position_id_global = new_position_id
-                        current_pos_entry_type = "rsi" if rsi_long_entry_condition else "breakout" # 記錄進場類型
-
-                        # 根據觸發信號設置 ATR 相關的出場訂單
-                        if rsi_long_entry_condition: # 如果是 RSI 觸發的進場
-                            print(f"RSI 進場觸發，設置止損止盈訂單: SL={stop_loss_long:.4f}, TP={take_profit_long:.4f}")
-                            # 呼叫函數設置止損止盈
-                            place_conditional_orders(api_key, secret_key, symbol, margin_coin, new_position_id, stop_price=stop_loss_long, limit_price=take_profit_long)
-                            current_stop_loss_price = stop_loss_long # 記錄初始止損價格
-
-                        # 注意：Bitunix API 的 Position TP/SL 端點 (/api/v1/futures/tpsl/place_order) 不支持設置移動止損 (Trailing Stop)。<mcreference link="https://openapidoc.bitunix.com/doc/tp_sl/place_position_tp_sl_order.html" index="1">1</mcreference>
-                        # 因此，對於突破進場，我們需要手動實現移動止損邏輯。
-                        if breakout_long_entry_condition: # 如果是突破觸發的進場
-                            print("突破進場觸發，將手動實現移動止損邏輯。")
-                            # 突破進場時，設置初始止損為 ATR 止損價
-                            place_conditional_orders(api_key, secret_key, symbol, margin_coin, new_position_id, stop_price=stop_loss_long)
-                            current_stop_loss_price = stop_loss_long # 記錄初始止損價格
-
+                        order_log.info("成功開多單，positionId: %s (止損%s)", new_position_id, "已確認" if order_result.get("protected") else "未確認")
+                        # 更新交易對的持倉記憶並寫入狀態日誌 (重啟後仍知道這筆持倉)
+                        state.open_position("long", new_position_id, entry_type, stop_loss_price=stop_loss_long)
+                        get_trade_ledger().tag_entry_type(new_position_id, entry_type) # 帳本按進場類型分組統計
                     else:
-                        print("警告：無法從訂單結果中獲取 positionId，無法設置條件訂單")
+                        order_log.error("開多單已成交但無法取得 positionId，持倉可能沒有止損保護")
+                        send_discord_message("🔴 **開倉後無法確認持倉** 🔴", api_key, secret_key, symbol=symbol, operation_details={
+                            "type": "error",
+                            "details": f"clientId={order_result.get('clientId')}，請手動檢查止損",
+                            "force_send": True
+                        })
 
                     # 勝負統計邏輯應在平倉時判斷，這裡暫時不修改
                     # win_count += 1
                     # save_stats()
                 else:
-                     send_discord_message("🔴 **開多失敗** 🔴", api_key, secret_key, operation_details={
+                     order_failed = True
+                     send_discord_message("🔴 **開多失敗** 🔴", api_key, secret_key, symbol=symbol, operation_details={
                         "type": "error",
                         "details": order_result.get("error", "未知錯誤"),
                         "signal": open_signal_reason, # Updated signal reason
@@ -821,84 +978,84 @@ def execute_trading_strategy(api_key, secret_key, symbol, margin_coin, wallet_pe
                      # loss_count += 1
                      # save_stats()
             else:
-                print("計算下單數量為 0，不執行開多操作")
+                order_log.warning("計算下單數量為 0，不執行開多操作")
+        evaluation_complete = position_known
 
     except Exception as e:
         error_msg = f"執行交易策略時發生未知錯誤: {e}"
-        print(f"錯誤：{error_msg}")
+        log.error(error_msg)
 
     # === 移動止損邏輯 (僅適用於突破進場的多單) ===
-    if current_pos_side == "long" and current_pos_entry_type == "breakout" and current_position_id_global:
-        print("檢查移動止損條件...")
+    if current_pos_side == "long" and state.entry_type == "breakout" and state.position_id:
+        log.debug("檢查移動止損條件...")
         # 計算潛在的新止損價格 (當前收盤價 - ATR * STOP_MULT)
-        potential_new_stop_loss = latest_close - latest_atr * STOP_MULT
+        # 取到價格刻度後再比較，不足一個刻度的變動不送出修改請求
+        potential_new_stop_loss = instrument_spec(api_key, secret_key, symbol).round_price(latest_close - latest_atr * cfg.stop_mult)
 
         # 如果潛在的新止損價格高於當前記錄的止損價格，則更新止損
-        if current_stop_loss_price is not None and potential_new_stop_loss > current_stop_loss_price:
-            print(f"觸發移動止損條件: 當前止損={current_stop_loss_price:.4f}, 潛在新止損={potential_new_stop_loss:.4f}")
+        if state.stop_loss_price is not None and potential_new_stop_loss > state.stop_loss_price:
+            log.info("觸發移動止損條件: 當前止損=%.4f, 潛在新止損=%.4f", state.stop_loss_price, potential_new_stop_loss)
             # 呼叫修改訂單函數更新止損價格
-            modify_result = modify_position_tpsl(api_key, secret_key, symbol, current_position_id_global, stop_price=potential_new_stop_loss)
+            modify_result = modify_position_tpsl(api_key, secret_key, symbol, state.position_id, stop_price=potential_new_stop_loss)
 
             if modify_result and "error" not in modify_result:
-                print(f"成功更新移動止損至 {potential_new_stop_loss:.4f}")
-                current_stop_loss_price = potential_new_stop_loss # 更新記錄的止損價格
-                send_discord_message(f"⬆️ **移動止損更新** ⬆️", api_key, secret_key, operation_details={
+                order_log.info("成功更新移動止損至 %.4f", potential_new_stop_loss)
+                state.update_stop(potential_new_stop_loss) # 更新記錄的止損價格
+                send_discord_message(f"⬆️ **移動止損更新** ⬆️", api_key, secret_key, symbol=symbol, operation_details={
                     "type": "status_update",
-                    "details": f"持倉 {current_position_id_global} 的新止損價格: {potential_new_stop_loss:.4f}",
+                    "details": f"持倉 {state.position_id} 的新止損價格: {potential_new_stop_loss:.4f}",
                     "force_send": True # 強制發送
                 })
             else:
-                print(f"更新移動止損失敗: {modify_result.get('error', '未知錯誤')}")
-                send_discord_message(f"🔴 **移動止損更新失敗** 🔴", api_key, secret_key, operation_details={
+                order_failed = True
+                order_log.error("更新移動止損失敗: %s", modify_result.get('error', '未知錯誤'))
+                send_discord_message(f"🔴 **移動止損更新失敗** 🔴", api_key, secret_key, symbol=symbol, operation_details={
                     "type": "error",
-                    "details": f"更新持倉 {current_position_id_global} 的移動止損失敗: {modify_result.get('error', '未知錯誤')}",
+                    "details": f"更新持倉 {state.position_id} 的移動止損失敗: {modify_result.get('error', '未知錯誤')}",
                     "force_send": True # 強制發送
                 })
         else:
-             print("移動止損條件未滿足或價格未朝有利方向移動")
+             log.debug("移動止損條件未滿足或價格未朝有利方向移動")
 
     # 檢查平多信號
     if close_long_signal and current_pos_side == "long":
-        print("觸發平多信號")
+        log.info("觸發平多信號")
         if current_pos_qty > 0 and current_position_id:
-            print(f"準備平多單，數量: {current_pos_qty}")
-            # 在平倉前獲取一次餘額，用於計算本次交易的已實現盈虧
+            order_log.info("準備平多單，數量: %s", current_pos_qty)
+            # 平倉前的餘額直接取自本輪快照；send_order 會使快照失效，平倉後的查詢必定是新的數據
             balance_before_close = check_wallet_balance(api_key, secret_key)
             order_result = send_order(api_key, secret_key, symbol, margin_coin, "close_long", current_pos_qty, position_id=current_position_id)
             if order_result and "error" not in order_result:
-                # 平倉成功後再次獲取餘額，計算已實現盈虧
-                balance_after_close = check_wallet_balance(api_key, secret_key)
-                realized_pnl = balance_after_close - balance_before_close if balance_before_close is not None else None
+                # 已實現盈虧以交易所的歷史持倉為準 (含手續費與資金費)；歷史紀錄尚未產生時退回平倉前後的餘額差
+                trade = closed_trade(api_key, secret_key, symbol, current_position_id)
+                if trade is not None:
+                    realized_pnl = trade["realized_pnl"]
+                else:
+                    # 帳戶鏡像的餘額推送可能稍晚於平倉回應，這裡直接向 REST 查詢
+                    balance_after_close = check_wallet_balance(api_key, secret_key, max_age=0)
+                    realized_pnl = balance_after_close - balance_before_close if balance_before_close is not None else None
 
-                send_discord_message("🟠 **平多成功** 🟠", api_key, secret_key, operation_details={
+                send_discord_message("🟠 **平多成功** 🟠", api_key, secret_key, symbol=symbol, operation_details={
                     "type": "close_success",
                     "side_closed": "long",
                     "qty": current_pos_qty,
                     "pnl": realized_pnl,
                     "force_send": True # 強制發送
                 })
-                # 勝負判斷邏輯：如果已實現盈虧 > 0 則為勝，否則為敗
-                if realized_pnl is not None:
-                    if realized_pnl > 0:
-                        win_count += 1
-                    else:
-                        loss_count += 1
-                    save_stats()
-
-                # 平倉成功後重置全域持倉變數
-                current_pos_entry_type = None
-                current_stop_loss_price = None
-                current_position_id_global = None
+                # 勝負判斷邏輯：如果已實現盈虧 > 0 則為勝，否則為敗；同時重置交易對的持倉記憶 (寫入狀態日誌)
+                state.close_position(realized_pnl)
+                state.save_stats()
 
             else:
-                 send_discord_message("🔴 **平多失敗** 🔴", api_key, secret_key, operation_details={
+                 order_failed = True
+                 send_discord_message("🔴 **平多失敗** 🔴", api_key, secret_key, symbol=symbol, operation_details={
                     "type": "error",
                     "details": order_result.get("error", "未知錯誤"),
                     "force_send": True # 強制發送
                 })
                  # 平倉失敗不計入勝敗統計
         else:
-            print("無多單持倉或 positionId 無效，不執行平多操作")
+            order_log.warning("無多單持倉或 positionId 無效，不執行平多操作")
 
 
     # 暫時不實現空單策略的開倉和平倉
@@ -910,7 +1067,11 @@ def execute_trading_strategy(api_key, secret_key, symbol, margin_coin, wallet_pe
     #     ...
 
     else:
-        print("無交易信號或已有持倉")
+        log.info("無交易信號或已有持倉")
+
+    # 收盤評估完整執行後才記錄該K線；途中出錯 (指標、持倉查詢或下單失敗) 時下一次 tick 仍以收盤K線重新評估
+    if close_bar is not None and evaluation_complete and not order_failed:
+        state.last_close_bar = close_bar
 
     # 5. 繪製圖表並發送 Discord 通知 (如果需要)
     # 這裡可以添加繪製K線圖、指標和交易信號的邏輯
@@ -920,45 +1081,59 @@ def execute_trading_strategy(api_key, secret_key, symbol, margin_coin, wallet_pe
 
 # === Discord Bot 設定與啟動 === #
 # 這裡保留 Discord Bot 的基本結構，但移除與舊通道策略圖表相關的邏輯
+# main() 不使用 Bot，因此只在呼叫 create_discord_bot() 時才載入 discord.py 並建立 Bot
 
-# 載入統計數據
-load_stats()
-
-# 創建 Discord Bot 實例
-intents = discord.Intents.default()
-intents.message_content = True # 需要這個權限來讀取訊息內容
-bot = commands.Bot(command_prefix='!', intents=intents)
-
-@bot.event
-async def on_ready():
-    print(f'Logged in as {bot.user.name}')
-    print('------')
-    # 啟動定時任務
-    trade_task.start()
-    balance_check_task.start() # 啟動餘額檢查任務
-    # 在啟動時發送一條通知 (此訊息已移至 main 函數，並包含啟動圖表)
-    # send_discord_message("🚀 交易機器人已啟動！🚀", BITUNIX_API_KEY, BITUNIX_SECRET_KEY, SYMBOL, operation_details={"force_send": True})
-
-@tasks.loop(minutes=1) # 每分鐘執行一次交易策略
-async def trade_task():
-    print("執行定時交易任務...")
-    try:
-        # 使用從 config 導入的正確參數名
-        execute_trading_strategy(BITUNIX_API_KEY, BITUNIX_SECRET_KEY, SYMBOL, MARGIN_COIN, WALLET_PERCENTAGE, LEVERAGE, RSI_BUY, BREAKOUT_LOOKBACK, ATR_MULT)
-        flush_discord_messages() # 每次任務結束後強制發送緩衝區消息
-    except Exception as e:
-        print(f"交易任務執行錯誤: {e}")
-        send_discord_message(f"🔴 **交易任務錯誤**: {e} 🔴", BITUNIX_API_KEY, BITUNIX_SECRET_KEY, operation_details={"type": "error", "details": str(e), "force_send": True})
-        flush_discord_messages()
+def create_discord_bot():
+    """建立 Discord Bot 與其定時任務 (交易任務，餘額檢查為其中的週期任務)，返回 commands.Bot"""
+    import discord
+    from discord.ext import commands, tasks
 
-@tasks.loop(minutes=5) # 每5分鐘檢查一次餘額
-async def balance_check_task():
-    print("執行定時餘額檢查任務...")
-    try:
-        check_wallet_balance(BITUNIX_API_KEY, BITUNIX_SECRET_KEY)
-        flush_discord_messages() # 每次任務結束後強制發送緩衝區消息
-    except Exception as e:
-        print(f"餘額檢查任務執行錯誤: {e}")
+    load_stats()
+    intents = discord.Intents.default()
+    intents.message_content = True # 需要這個權限來讀取訊息內容
+    bot = commands.Bot(command_prefix='!', intents=intents)
+    # Bot 定時任務的收盤排程: 完整策略只在K線收盤後執行，其餘分鐘只做輕量檢查
+    bot_scheduler = BarScheduler(TIMEFRAME)
+    # 餘額檢查與 main()/portfolio 相同，以 BALANCE_CHECK_INTERVAL_SECONDS 的週期任務在交易任務中執行
+    balance_job = PeriodicJob("balance_check", BALANCE_CHECK_INTERVAL_SECONDS,
+                              functools.partial(check_wallet_balance, BITUNIX_API_KEY, BITUNIX_SECRET_KEY))
+
+    @tasks.loop(seconds=LOOP_INTERVAL_SECONDS) # 每次只執行到期的工作 (收盤評估或輕量檢查)
+    async def trade_task():
+        loop = asyncio.get_running_loop()
+        try:
+            kind = bot_scheduler.poll()
+            if kind == "light":
+                reason = await loop.run_in_executor(_io_executor, light_check, BITUNIX_API_KEY, BITUNIX_SECRET_KEY)
+                if reason:
+                    log.info("[Scheduler] 輕量檢查偵測到 %s 條件，執行完整評估", reason)
+                    bot_scheduler.mark_full()
+                    kind = "full"
+            if kind == "full":
+                log.info("執行定時交易任務...")
+                # 使用從 config 導入的正確參數名 (所有 HTTP 請求都在執行緒池中完成，不阻塞 Bot 事件迴圈)
+                await execute_trading_strategy_async(BITUNIX_API_KEY, BITUNIX_SECRET_KEY, SYMBOL, MARGIN_COIN, WALLET_PERCENTAGE, LEVERAGE, RSI_BUY, BREAKOUT_LOOKBACK, ATR_MULT)
+                report_request_counts(BITUNIX_API_KEY, BITUNIX_SECRET_KEY)
+            # K線即將收盤時預熱連線池
+            if bot_scheduler.prewarm_due():
+                await loop.run_in_executor(_io_executor, get_bitunix_client(BITUNIX_API_KEY, BITUNIX_SECRET_KEY).prewarm, SYMBOL)
+            if time.time() >= balance_job.next_run:
+                await loop.run_in_executor(_io_executor, balance_job.run_if_due, time.time())
+        except Exception as e:
+            log.exception("交易任務執行錯誤: %s", e)
+            await loop.run_in_executor(_io_executor, functools.partial(
+                send_discord_message, f"🔴 **交易任務錯誤**: {e} 🔴", BITUNIX_API_KEY, BITUNIX_SECRET_KEY,
+                operation_details={"type": "error", "details": str(e), "force_send": True}))
+
+    @bot.event
+    async def on_ready():
+        log.info("Logged in as %s", bot.user.name)
+        # 啟動定時任務
+        trade_task.start()
+        # 在啟動時發送一條通知 (此訊息已移至 main 函數，並包含啟動圖表)
+        # send_discord_message("🚀 交易機器人已啟動！🚀", BITUNIX_API_KEY, BITUNIX_SECRET_KEY, SYMBOL, operation_details={"force_send": True})
+
+    return bot
 
 # 移除舊的繪圖命令
 # @bot.command(name='plot')
@@ -971,157 +1146,15 @@ async def balance_check_task():
 
 def plot_strategy_and_send_to_discord(df, latest_close, latest_rsi, latest_highest_break, latest_atr, buy_signal, close_long_signal, api_key, secret_key, custom_message=None, force_send_message=False):
 
-    """繪製K線圖、指標和交易信號，並發送到Discord"""
+    """繪製K線圖、指標和交易信號，並發送到Discord (渲染在圖表工作進程中進行，本函數不等待)"""
     try:
-        # 設定中文字體，解決標題亂碼問題
-        # 嘗試使用多種常見中文字體
-        chinese_fonts = ['SimHei', 'Microsoft YaHei', 'STSong', 'FangSong']
-        font_set = False
-        for font in chinese_fonts:
-            try:
-                plt.rcParams['font.sans-serif'] = [font]
-                plt.rcParams['axes.unicode_minus'] = False  # 解決座標軸負號顯示問題
-                print(f"成功設定字體為: {font}")
-                font_set = True
-                break # 成功設定後跳出迴圈
-            except Exception as e_font:
-                print(f"設定字體 {font} 失敗: {e_font}")
-                continue # 嘗試下一個字體
-        
-        if not font_set:
-            print("警告: 未找到支援中文的字體，圖表標題和標籤可能顯示亂碼。")
-
-        print(f"開始繪製圖表函數: {SYMBOL}") # 添加日誌
+        chart_log.debug("開始繪製圖表函數: %s", SYMBOL)
         # 確保有足夠的數據繪圖
-        print(f"[Plotting] 繪製圖表使用的交易對符號: {SYMBOL}") # 添加日誌
+        chart_log.debug("[Plotting] 繪製圖表使用的交易對符號: %s", SYMBOL)
         if len(df) < max(BREAKOUT_LOOKBACK, ATR_LEN, RSI_LEN) + 2:
-            print("數據不足，無法繪製圖表")
+            chart_log.warning("數據不足，無法繪製圖表")
             return
 
-        # 準備 mplfinance 需要的數據
-        # mplfinance 需要 datetime index
-        df_plot = df.copy()
-        df_plot = df_plot.set_index('timestamp')
-
-        # 創建 addplots 列表
-        apds = [
-            # RSI 主線 (藍色)
-            mpf.make_addplot(df_plot['rsi'], panel=1, color='blue', width=1.2, ylabel='RSI'),
-            # RSI Buy 水平線 (綠色虛線)
-            mpf.make_addplot(pd.Series(RSI_BUY, index=df_plot.index), panel=1, color='green', linestyle='dashed', width=1.2),
-            # RSI Sell 水平線 (紅色虛線) - 使用 EXIT_RSI
-            mpf.make_addplot(pd.Series(EXIT_RSI, index=df_plot.index), panel=1, color='red', linestyle='dashed', width=1.2),
-            # ATR 指標 (紫色)
-            mpf.make_addplot(df_plot['atr'], panel=2, color='purple', width=1.2, ylabel='ATR'),
-            # 突破高點線 (紫色虛線) - 範例圖未顯示，故註釋掉
-            # mpf.make_addplot(df_plot['highest_break'], color='purple', linestyle='--', panel=0, width=1.2)
-        ]
-
-        # 標記交易信號 - 為了與範例圖一致，範例圖中沒有在主圖上用大箭頭標註買賣點，故註釋掉
-        # buy_points = []
-        # sell_points = [] 
-        # close_long_points = []
-        # if buy_signal:
-        #      buy_points.append(df_plot.index[-1])
-        # if close_long_signal:
-        #      close_long_points.append(df_plot.index[-1])
-        # if buy_points:
-        #     apds.append(mpf.make_addplot(df_plot['close'], type='scatter', marker='^', markersize=100, color='green', panel=0))
-        # if close_long_points:
-        #      apds.append(mpf.make_addplot(df_plot['close'], type='scatter', marker='v', markersize=100, color='red', panel=0))
-
-        # 定義一個類似幣安深色模式的自訂樣式
-        # 參考: https://github.com/matplotlib/mplfinance/issues/614
-        binance_dark_style = {
-            "base_mpl_style": "dark_background",
-            "marketcolors": {
-                "candle": {"up": "#3dc985", "down": "#ef4f60"},  
-                "edge": {"up": "#3dc985", "down": "#ef4f60"},  
-                "wick": {"up": "#3dc985", "down": "#ef4f60"},  
-                "ohlc": {"up": "green", "down": "red"},
-                "volume": {"up": "#247252", "down": "#82333f"},  
-                "vcedge": {"up": "green", "down": "red"},  
-                "vcdopcod": False,
-                "alpha": 1,
-            },
-            "mavcolors": ("#ad7739", "#a63ab2", "#62b8ba"),
-            "facecolor": "#1b1f24",
-            "gridcolor": "#2c2e31",
-            "gridstyle": "--",
-            "y_on_right": True,
-            "rc": {
-                "axes.grid": True,
-                "axes.grid.axis": "y",
-                "axes.edgecolor": "#474d56",
-                "axes.titlecolor": "red",
-                "figure.facecolor": "#161a1e",
-                "figure.titlesize": "x-large",
-                "figure.titleweight": "semibold",
-            },
-            "base_mpf_style": "binance-dark",
-        }
-
-        # 繪製圖表
-        fig, axes = mpf.plot(df_plot, 
-                             type='candle', 
-                             style=binance_dark_style,  # 使用自訂的深色樣式
-                             title=f'{SYMBOL} {TIMEFRAME} K線圖與指標',  # 更新圖表標題以匹配 config.py 中的 TIMEFRAME
-                             ylabel='Price',  # 主圖 Y 軸標籤
-                             volume=False,  # 範例圖中沒有成交量
-                             addplot=apds, 
-                             panel_ratios=(6, 2, 2),  # 調整面板比例 (主圖:RSI:ATR)
-                             figscale=1.5, 
-                             returnfig=True,
-                             tight_layout=True) # 使用 tight_layout 使圖表更緊湊
-
-        # 添加圖例到指標面板
-        from matplotlib.lines import Line2D # 確保 Line2D 已導入
-
-        # RSI Panel Legend
-        if len(axes) > 1 and axes[1] is not None: # axes[1] 對應 panel=1 (RSI)
-            legend_elements_rsi = [
-                Line2D([0], [0], color='blue', lw=1.2, label=f'RSI ({RSI_LEN})'),
-                Line2D([0], [0], color='green', linestyle='dashed', lw=1.2, label=f'RSI Buy ({RSI_BUY})'),
-                Line2D([0], [0], color='red', linestyle='dashed', lw=1.2, label=f'RSI Sell ({EXIT_RSI})')
-            ]
-            axes[1].legend(handles=legend_elements_rsi, loc='best', fontsize='small')
-            # axes[1].set_ylabel('RSI') # ylabel 已經在 make_addplot 中設定
-
-        # ATR Panel Legend
-        if len(axes) > 2 and axes[2] is not None: # axes[2] 對應 panel=2 (ATR)
-            legend_elements_atr = [
-                Line2D([0], [0], color='purple', lw=1.2, label=f'ATR ({ATR_LEN})')
-            ]
-            axes[2].legend(handles=legend_elements_atr, loc='best', fontsize='small')
-            # axes[2].set_ylabel('ATR') # ylabel 已經在 make_addplot 中設定
-        
-        # 主圖表的 K 線圖例 (Close, High, Low) 通常由 style='charles' 提供。
-        # 如果 style 未能正確顯示，可能需要額外處理，但通常 'charles' 風格會包含。
-
-        # 保存圖表到臨時文件
-        # 使用絕對路徑確保文件位置的明確性
-        image_filename = f'{SYMBOL}_strategy_plot_{int(time.time())}.png' # 添加時間戳以避免文件名衝突
-        image_path = os.path.abspath(image_filename) # 獲取絕對路徑
-        print(f"[Plotting] 準備保存圖表到絕對路徑: {image_path}") # 修改日誌
-        # 儲存圖表到記憶體中的 BytesIO 物件
-        import io
-        buffer = io.BytesIO()
-        print("[Plotting] 準備儲存圖表到記憶體緩衝區...")
-        try:
-            fig.savefig(buffer, format='png', dpi=100, bbox_inches='tight') # bbox_inches='tight' 嘗試裁剪空白邊緣
-            plt.close(fig) # 關閉圖形以釋放記憶體
-            buffer.seek(0) # 將緩衝區位置重置到開頭
-            image_data = buffer.getvalue()
-            buffer.close() # 關閉緩衝區
-            print("[Plotting] 圖表已儲存到記憶體緩衝區。")
-        except Exception as e_save:
-            print(f"[Plotting] 儲存圖表到記憶體失敗: {e_save}")
-            plt.close(fig) # 確保關閉圖形
-            return # 儲存失敗則不繼續發送
-
-        # 準備 Discord 消息內容
-        # 根據需求，繪圖函數不再主動發送通知，只在被需要時返回圖片數據
-
         # Determine message content and force send status based on context
         message_core = None
         operation_type = None
@@ -1153,55 +1186,66 @@ def plot_strategy_and_send_to_discord(df, latest_close, latest_rsi, latest_highe
                 operation_type = "status_update_chart_forced"
             else:
                 # If force_send_message was False and no specific signal/custom message
-                print(f"[Plotting] 非啟動/交易信號，且未強制發送 (force_send_message={force_send_message})，將不發送此圖表更新。")
-                return # Do not send
-
-        # Only send if message_core is not None (meaning a message was constructed)
-        if message_core:
-            print(f"[Plotting] 準備發送 Discord 訊息。核心內容: '{message_core[:100]}...'，圖片數據長度: {len(image_data) if image_data else 0}, 強制發送標記: {current_should_send_forced}")
-        send_discord_message(message_core, api_key, secret_key, operation_details={
-            "type": operation_type,
-            "image_data": image_data, # 傳遞圖片數據
-            "image_filename": f'{SYMBOL}_strategy_plot_{int(time.time())}.png', # 提供一個文件名
-            "force_send": current_should_send_forced
-        })
-        print(f"[Plotting] Discord 訊息 (含圖表) 已請求發送。類型: {operation_type}, 強制: {current_should_send_forced}")
+                chart_log.debug("[Plotting] 非啟動/交易信號，且未強制發送 (force_send_message=%s)，將不發送此圖表更新。", force_send_message)
+                return # 不發送時也不渲染
+
+        # 準備渲染數據: 時間戳轉回毫秒，與 fetch_ohlcv 的欄位一致
+        timestamps = df['timestamp']
+        if not np.issubdtype(timestamps.dtype, np.number):
+            timestamps = timestamps.to_numpy(dtype='datetime64[ms]').astype(np.int64)
+        ohlcv = np.column_stack([np.asarray(timestamps, dtype=np.float64), df[['open', 'high', 'low', 'close']].to_numpy(dtype=np.float64)])
+        image_filename = f'{SYMBOL}_strategy_plot_{int(time.time())}.png' # 提供一個文件名
+
+        def on_rendered(image_data):
+            chart_log.debug("[Plotting] 準備發送 Discord 訊息。核心內容: '%s...'，圖片數據長度: %s, 強制發送標記: %s", message_core[:100], len(image_data), current_should_send_forced)
+            send_discord_message(message_core, api_key, secret_key, operation_details={
+                "type": operation_type,
+                "image_data": image_data, # 傳遞圖片數據
+                "image_filename": image_filename,
+                "force_send": current_should_send_forced
+            })
 
-    except Exception as e:
-        print(f"錯誤：繪製或發送圖表時發生錯誤: {e}")
-        # 如果在儲存到記憶體後但在發送前發生錯誤，不需要刪除文件
-        pass # 不再需要文件清理邏輯
+        get_chart_renderer().render_strategy(ohlcv, df['rsi'].to_numpy(dtype=np.float64), df['atr'].to_numpy(dtype=np.float64), callback=on_rendered)
+        chart_log.debug("[Plotting] 圖表已提交渲染，完成後發送 Discord 訊息。類型: %s, 強制: %s", operation_type, current_should_send_forced)
 
-if __name__ == "__main__":
-    load_stats()
-
-    pass # 如果依賴 Discord Bot 的 tasks.loop，則在此處等待 Bot 啟動
+    except Exception as e:
+        chart_log.exception("繪製或發送圖表時發生錯誤: %s", e)
 
 current_wallet_balance = 0.0
 
-def check_wallet_balance(api_key, secret_key):
+def check_wallet_balance(api_key, secret_key, max_age=None):
+    """
+    查詢可用餘額: 帳戶串流正常時直接讀取鏡像；否則快照未過期時直接共用 (同一 tick 內只查詢一次)，
+    查詢失敗時返回上一次的餘額。max_age=0 時一律向 REST 查詢。
+    """
+    mirror = live_account_mirror(api_key, secret_key) if max_age != 0 else None
+    balance = mirror.available_balance() if mirror is not None else None
+    if balance is not None:
+        return balance
+    balance = get_account_snapshot(api_key, secret_key).get("balance", functools.partial(_fetch_wallet_balance, api_key, secret_key), max_age)
+    return current_wallet_balance if balance is None else balance
+
+@timed("balance_query")
+def _fetch_wallet_balance(api_key, secret_key):
+    """向 Bitunix 查詢可用餘額，失敗時返回 None"""
     global last_balance, current_wallet_balance
     margin_coin = MARGIN_COIN # 從 config 導入
     query_params = {"marginCoin": margin_coin}
     path = "/api/v1/futures/account"
-    url = f"https://fapi.bitunix.com{path}?marginCoin={margin_coin}"
-    
-    # 使用更新後的get_signed_params獲取完整的headers，指定method為GET
-    _, _, _, headers = get_signed_params(api_key, secret_key, query_params, method="GET")
 
     try:
-        response = requests.get(url, headers=headers)
+        response = get_bitunix_client(api_key, secret_key).get(path, query_params)
         response.raise_for_status()  # Check if request was successful
 
         # Log the full response for debugging
-        print(f"Response from API: {response.text}")
+        account_log.debug("Response from API: %s", response.text)
 
         balance_info = response.json()
         current_balance = None
 
         # Check if 'data' is in the response
         if "data" in balance_info and balance_info["data"] is not None:
-            print(f"完整的數據結構: {balance_info['data']}")
+            account_log.debug("完整的數據結構: %s", balance_info['data'])
             if isinstance(balance_info["data"], dict):
                 account_data = balance_info["data"]
                 available_balance = float(account_data.get("available", 0))
@@ -1213,7 +1257,7 @@ def check_wallet_balance(api_key, secret_key):
 
                 # 檢查總資產是否發生變化，或者根據需要調整觸發邏輯
                 # 暫時修改為只要獲取到有效數據就發送更新
-                print(f"已獲取並發送餘額信息: 可用 {available_balance}, 保證金 {margin_balance}, 未實現盈虧 {total_unrealized_pnl}, 總資產 {total_asset}")
+                account_log.debug("已獲取並發送餘額信息: 可用 %s, 保證金 %s, 未實現盈虧 %s, 總資產 %s", available_balance, margin_balance, total_unrealized_pnl, total_asset)
 
                 # 更新 last_balance 和 current_wallet_balance (這裡可能需要重新考慮這些變數的用途)
                 # 如果 last_balance 僅用於觸發餘額更新消息，現在邏輯已改變，可以移除或修改其用途
@@ -1222,44 +1266,39 @@ def check_wallet_balance(api_key, secret_key):
                 return available_balance # 返回可用餘額
             else:
                 error_message = "餘額數據格式不正確"
-                print(f"餘額查詢錯誤: {error_message}, 原始數據: {balance_info['data']}")
-                return current_wallet_balance # 返回上一次的餘額或初始值
+                account_log.error("餘額查詢錯誤: %s, 原始數據: %s", error_message, balance_info['data'])
+                return None # 由 check_wallet_balance 返回上一次的餘額或初始值
         else:
             error_message = balance_info.get("message", "無法獲取餘額信息")
-            return current_wallet_balance # 返回上一次的餘額或初始值
+            return None # 由 check_wallet_balance 返回上一次的餘額或初始值
     except requests.exceptions.HTTPError as err:
-        print(f"HTTP Error: {err}")
-        return current_wallet_balance
+        account_log.error("HTTP Error: %s", err)
+        return None
     except requests.exceptions.RequestException as err:
-        print(f"Request Exception: {err}")
-        return current_wallet_balance
+        account_log.error("Request Exception: %s", err)
+        return None
 
 # === 查詢持倉狀態 === #
-def get_current_position_details(api_key, secret_key, symbol, margin_coin=MARGIN_COIN): # 使用 MARGIN_COIN from config as default
-    """查詢目前持倉的詳細信息，包括方向、數量、positionId 和未實現盈虧。"""
-    import hashlib, uuid, time, requests
-
-    url = "https://fapi.bitunix.com/api/v1/futures/position/get_pending_positions"
+def get_current_position_details(api_key, secret_key, symbol, margin_coin=MARGIN_COIN, max_age=None): # 使用 MARGIN_COIN from config as default
+    """
+    查詢目前持倉的詳細信息，包括方向、數量、positionId 和未實現盈虧 (快照未過期時直接共用)。
+    返回 PositionDetails (可解包為四個值)；查詢失敗時為 UNKNOWN_POSITION (PNL 為 None)，與確定無持倉的 FLAT_POSITION (PNL 為 0.0) 區分。
+    帳戶串流正常時直接讀取鏡像 (max_age=0 時一律向 REST 查詢)。
+    """
+    mirror = live_account_mirror(api_key, secret_key) if max_age != 0 else None
+    details = mirror.position_details(symbol) if mirror is not None else None
+    if details is not None:
+        return details
+    details = get_account_snapshot(api_key, secret_key).get(("position", symbol), functools.partial(_fetch_position_details, api_key, secret_key, symbol), max_age)
+    return UNKNOWN_POSITION if details is None else details
+
+@timed("position_query")
+def _fetch_position_details(api_key, secret_key, symbol):
+    """向 Bitunix 查詢持倉，失敗時返回 None"""
+    path = "/api/v1/futures/position/get_pending_positions"
     params = {"symbol": symbol}
-    nonce = uuid.uuid4().hex
-    timestamp = str(int(time.time() * 1000))
-    
-    sorted_items = sorted((k, str(v)) for k, v in params.items())
-    query_string = "".join(f"{k}{v}" for k, v in sorted_items)
-
-    digest_input = nonce + timestamp + api_key + query_string
-    digest = hashlib.sha256(digest_input.encode('utf-8')).hexdigest()
-    sign = hashlib.sha256((digest + secret_key).encode('utf-8')).hexdigest()
-
-    headers = {
-        "api-key": api_key,
-        "sign": sign,
-        "nonce": nonce,
-        "timestamp": timestamp,
-        "Content-Type": "application/json"
-    }
     try:
-        res = requests.get(url, headers=headers, params=params)
+        res = get_bitunix_client(api_key, secret_key).get(path, params)
         data = res.json()
         if data.get("code") == 0 and data.get("data"):
             for pos_detail in data["data"]:
@@ -1269,106 +1308,39 @@ def get_current_position_details(api_key, secret_key, symbol, margin_coin=MARGIN
                 
                 if float(pos_qty_str) > 0: # 只處理有實際數量的倉位
                     if pos_detail.get("side") == "BUY":
-                        print(f"API偵測到多單持倉: qty={pos_qty_str}, positionId={position_id}, PNL={unrealized_pnl}")
-                        return "long", pos_qty_str, position_id, unrealized_pnl
+                        account_log.debug("API偵測到多單持倉: qty=%s, positionId=%s, PNL=%s", pos_qty_str, position_id, unrealized_pnl)
+                        return PositionDetails("long", pos_qty_str, position_id, unrealized_pnl)
                     if pos_detail.get("side") == "SELL":
-                        print(f"API偵測到空單持倉: qty={pos_qty_str}, positionId={position_id}, PNL={unrealized_pnl}")
-                        return "short", pos_qty_str, position_id, unrealized_pnl
+                        account_log.debug("API偵測到空單持倉: qty=%s, positionId=%s, PNL=%s", pos_qty_str, position_id, unrealized_pnl)
+                        return PositionDetails("short", pos_qty_str, position_id, unrealized_pnl)
+        if data.get("code") != 0:
+            account_log.error("查詢持倉詳細失敗: %s", data.get('msg', '未知錯誤'))
+            return None # API 錯誤不寫入快照
         # print("API未偵測到有效持倉或回傳數據格式問題。") # 可以根據需要取消註釋
-        return None, None, None, 0.0  # 無持倉或錯誤，PNL返回0.0
+        return FLAT_POSITION  # 無持倉，PNL返回0.0
     except Exception as e:
-        print(f"查詢持倉詳細失敗: {e}")
-        return None, None, None, 0.0
+        account_log.error("查詢持倉詳細失敗: %s", e)
+        return None # 由 get_current_position_details 返回無持倉
 
 order_points = []  # 全域下單點記錄
 
 def plot_channel_and_send_to_discord(ohlcv, upperBand, lowerBand, middleBand, last, message, order_points=None):
-    import mplfinance as mpf
-    import pandas as pd
-    import numpy as np
-    import os
-
-    print("DEBUG: order_points 傳入內容：", order_points)
-    df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-    df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
-    df.set_index('datetime', inplace=True)
-    df = df[['open', 'high', 'low', 'close', 'volume']]
-
-    apds = [
-        mpf.make_addplot(upperBand, color='#00FFFF', width=1.2),
-        mpf.make_addplot(lowerBand, color='#FFFF00', width=1.2),
-        mpf.make_addplot(middleBand, color='#FF00FF', width=1.0, linestyle='dashed')
-    ]
-
-    def mark_orders(ax):
-        if order_points:
-            for pt in order_points:
-                print("DEBUG: 標註點", pt)
-                if 0 <= pt['idx'] < len(df):
-                    dt = df.index[pt['idx']]
-                    price = pt['price']
-                    color = '#39FF14' if pt['side'] == 'long' else '#FF1744'  # 螢光綠/亮紅
-                    marker = '^' if pt['side'] == 'long' else 'v'
-                    offset = -40 if pt['side'] == 'long' else 40
-                    ax.scatter(dt, price, color=color, marker=marker, s=400, zorder=10, edgecolors='black', linewidths=2)
-                    ax.annotate(
-                        f"{pt['side'].upper()}",
-                        (dt, price),
-                        textcoords="offset points",
-                        xytext=(0, offset),
-                        ha='center',
-                        color=color,
-                        fontsize=16,
-                        fontweight='bold',
-                        bbox=dict(boxstyle='round,pad=0.4', fc='black', ec=color, lw=3, alpha=0.95),
-                        arrowprops=dict(arrowstyle='->', color=color, lw=3, alpha=0.8)
-                    )
-
-    img_path = 'channel_candle.png'
-    fig, axlist = mpf.plot(
-        df,
-        type='candle',
-        style='charles',
-        addplot=apds,
-        figsize=(16, 8),
-        title='通道指標蠟燭圖',
-        ylabel='價格',
-        returnfig=True,
-        tight_layout=True,
-        update_width_config=dict(candle_linewidth=1.2, candle_width=0.6)
-    )
-    mark_orders(axlist[0])
-    fig.savefig(img_path, facecolor='black')
-    
-    # 呼叫更新後的 send_discord_message 函數，並傳遞圖片路徑
-    send_discord_message(message, BITUNIX_API_KEY, BITUNIX_SECRET_KEY, operation_details={"image_path": img_path, "force_send": True}) # force_send 確保圖片立即發送
-    # 注意：send_discord_message 內部會負責刪除圖片文件
+    """繪製通道指標蠟燭圖並發送到 Discord (在圖表工作進程中渲染，圖片直接以記憶體數據傳遞)"""
+    chart_log.debug("order_points 傳入內容: %s", order_points)
 
+    def on_rendered(image_data):
+        send_discord_message(message, BITUNIX_API_KEY, BITUNIX_SECRET_KEY, operation_details={
+            "image_data": image_data,
+            "image_filename": "channel_candle.png",
+            "force_send": True
+        })
 
-def main():
-    global win_count, loss_count # 宣告使用全域變數
-    load_stats() # 啟動時載入統計數據
+    get_chart_renderer().render_channel(ohlcv, upperBand, lowerBand, middleBand, order_points=order_points, callback=on_rendered)
 
-    # 用戶參數
-    from config import TRADING_PAIR, SYMBOL, MARGIN_COIN, LEVERAGE, WALLET_PERCENTAGE, RSI_LEN, ATR_LEN, BREAKOUT_LOOKBACK, STOP_MULT, LIMIT_MULT, RSI_BUY, EXIT_RSI, ATR_MULT, TIMEFRAME
-    api_key = BITUNIX_API_KEY # 從 config 導入
-    secret_key = BITUNIX_SECRET_KEY # 從 config 導入
-    # trading_pair 變數不再需要在 main 中單獨定義，直接使用導入的 TRADING_PAIR 或 SYMBOL
-    symbol = SYMBOL # SYMBOL 已經從 config 導入
-    margin_coin = MARGIN_COIN # 從 config 導入
-    leverage = LEVERAGE
-    wallet_percentage = WALLET_PERCENTAGE
 
-    current_pos_side = None
-    current_pos_qty = None
-    # win_count 和 loss_count 由 load_stats() 初始化，此處無需重置為0
-    # win_count = 0
-    # loss_count = 0
-    last_upper_band = None
-    last_lower_band = None
-    last_middle_band = None
-    
-    print("交易機器人啟動，開始載入初始K線數據並準備生成啟動圖表...")
+def send_startup_chart(api_key, secret_key, symbol):
+    """載入初始K線並發送附帶策略參數的啟動圖表 (會載入 pandas 與圖表渲染)，數據不足時返回 False"""
+    log.info("交易機器人啟動，開始載入初始K線數據並準備生成啟動圖表...")
     # 原啟動訊息已移除，將由包含圖表的訊息替代
 
     # 獲取初始K線數據用於繪圖
@@ -1379,8 +1351,9 @@ def main():
     if ohlcv_data is None or len(ohlcv_data) < min_data_len:
         error_detail_msg = f"需要至少 {min_data_len} 條數據，實際獲取 {len(ohlcv_data) if ohlcv_data is not None else 0} 條。"
         send_discord_message(f"🔴 啟動失敗：無法獲取足夠的初始K線數據繪製圖表。{error_detail_msg}", api_key, secret_key, operation_details={"type": "error", "details": f"Insufficient initial K-line data for chart. {error_detail_msg}", "force_send": True})
-        return
+        return False
 
+    import pandas as pd  # 只有啟動圖表需要 DataFrame，延遲到這裡才載入
     df = pd.DataFrame(ohlcv_data, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
     df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
     # 可選擇截取最近一部分數據進行繪圖，避免過長的歷史數據影響圖表可讀性
@@ -1389,11 +1362,11 @@ def main():
     df_for_plot = compute_indicators(df.copy(), RSI_LEN, ATR_LEN, BREAKOUT_LOOKBACK, api_key, secret_key, symbol)
     if df_for_plot is None or df_for_plot.empty:
         send_discord_message("🔴 啟動失敗：計算初始指標失敗，無法繪製圖表。", api_key, secret_key, operation_details={"type": "error", "details": "Failed to compute initial indicators for chart", "force_send": True})
-        return
+        return False
 
     if df_for_plot['rsi'].isnull().all() or df_for_plot['atr'].isnull().all():
         send_discord_message("🔴 啟動失敗：計算出的初始指標包含過多無效值 (NaN)，無法繪製圖表。", api_key, secret_key, operation_details={"type": "error", "details": "Computed initial indicators are mostly NaN, cannot plot chart.", "force_send": True})
-        return
+        return False
 
     latest_close = df_for_plot['close'].iloc[-1]
     latest_rsi = df_for_plot['rsi'].iloc[-1]
@@ -1402,9 +1375,9 @@ def main():
     
     if pd.isna(latest_close) or pd.isna(latest_rsi) or pd.isna(latest_atr):
         send_discord_message("🔴 啟動失敗：獲取的最新指標數據包含無效值 (NaN)，無法繪製圖表。", api_key, secret_key, operation_details={"type": "error", "details": "Latest indicator data contains NaN, cannot plot chart.", "force_send": True})
-        return
+        return False
 
-    print(f"[Main Startup] 準備繪製啟動圖表... 最新收盤價: {latest_close:.2f}, RSI: {latest_rsi:.2f}, ATR: {latest_atr:.4f}")
+    log.info("[Main Startup] 準備繪製啟動圖表... 最新收盤價: %.2f, RSI: %.2f, ATR: %.4f", latest_close, latest_rsi, latest_atr)
     # 使用 df_for_plot 進行繪圖
     plot_strategy_and_send_to_discord(
         df_for_plot, latest_close, latest_rsi,
@@ -1427,38 +1400,15 @@ TIMEFRAME: {TIMEFRAME}
 
         force_send_message=True
     )
-    print(f"[Main Startup] 啟動圖表及訊息已請求發送。")
+    log.info("[Main Startup] 啟動圖表及訊息已請求發送。")
 
-    last_kline_len = len(ohlcv_data)
-
-    # 在主循環開始前，獲取一次當前持倉狀態 (返回四個值)
-    current_pos_side, current_pos_qty_str, current_pos_id, current_unrealized_pnl = get_current_position_details(api_key, secret_key, SYMBOL, MARGIN_COIN)
-    print(f"啟動時持倉狀態: side={current_pos_side}, qty={current_pos_qty_str}, positionId={current_pos_id}, PNL={current_unrealized_pnl}")
-    
     # 啟動時自動補上現有持倉點 (這部分邏輯如果存在，需要確保 order_points 的更新)
-    import numpy as np
     from typing import Any
     def get_entry_price_and_side(api_key: str, secret_key: str, symbol: str) -> Any:
-        url = "https://fapi.bitunix.com/api/v1/futures/position/get_pending_positions"
+        path = "/api/v1/futures/position/get_pending_positions"
         params = {"symbol": symbol}
-        nonce = uuid.uuid4().hex
-        timestamp = str(int(time.time() * 1000))
-        api_key_ = api_key
-        secret_key_ = secret_key
-        sorted_items = sorted((k, str(v)) for k, v in params.items())
-        query_string = "".join(f"{k}{v}" for k, v in sorted_items)
-        digest_input = nonce + timestamp + api_key_ + query_string
-        digest = hashlib.sha256(digest_input.encode('utf-8')).hexdigest()
-        sign = hashlib.sha256((digest + secret_key_).encode('utf-8')).hexdigest()
-        headers = {
-            "api-key": api_key_,
-            "sign": sign,
-            "nonce": nonce,
-            "timestamp": timestamp,
-            "Content-Type": "application/json"
-        }
         try:
-            res = requests.get(url, headers=headers, params=params)
+            res = get_bitunix_client(api_key, secret_key).get(path, params)
             data = res.json()
             if data.get("code") == 0 and data.get("data"):
                 for pos in data["data"]:
@@ -1472,7 +1422,7 @@ TIMEFRAME: {TIMEFRAME}
                         return entry_price, side
             return None
         except Exception as e:
-            print(f"查詢持倉失敗: {e}")
+            account_log.error("查詢持倉失敗: %s", e)
             return None
 
     entry = get_entry_price_and_side(api_key, secret_key, symbol)
@@ -1482,38 +1432,96 @@ TIMEFRAME: {TIMEFRAME}
         close_prices = df_for_plot['close'].values
         idx = int(np.argmin(np.abs(close_prices - entry_price)))
         order_points.append({'idx': idx, 'price': close_prices[idx], 'side': side})
-        print(f"DEBUG: 啟動自動補標註現有持倉點: {order_points[-1]}")
+        chart_log.debug("啟動自動補標註現有持倉點: %s", order_points[-1])
 
-    while True:
-        # 檢查錢包餘額並獲取當前餘額
-        balance = check_wallet_balance(api_key, secret_key)
-        # 計算下單數量 (錢包餘額的30%*槓桿/當前BTC價格)
-        btc_price = None
+    return True
+
+
+def main(headless=False):
+    """
+    單一交易對的主迴圈。
+    headless=True 時略過啟動圖表 (不載入 pandas 與 matplotlib)，載入狀態後直接進入交易迴圈。
+    """
+    setup_logging() # 日誌改由背景執行緒寫入主控台與輪替檔案
+    load_stats() # 啟動時載入統計數據
+
+    # 用戶參數
+    from config import TRADING_PAIR, SYMBOL, MARGIN_COIN, LEVERAGE, WALLET_PERCENTAGE, BREAKOUT_LOOKBACK, RSI_BUY, ATR_MULT, TIMEFRAME
+    api_key = BITUNIX_API_KEY # 從 config 導入
+    secret_key = BITUNIX_SECRET_KEY # 從 config 導入
+    # trading_pair 變數不再需要在 main 中單獨定義，直接使用導入的 TRADING_PAIR 或 SYMBOL
+    symbol = SYMBOL # SYMBOL 已經從 config 導入
+    margin_coin = MARGIN_COIN # 從 config 導入
+    leverage = LEVERAGE
+    wallet_percentage = WALLET_PERCENTAGE
+    log.debug("[Config Check] SYMBOL from config: %s", SYMBOL)
+    log.debug("[Config Check] TRADING_PAIR from config: %s", TRADING_PAIR)
+
+    current_pos_side = None
+    current_pos_qty = None
+    # win_count 和 loss_count 由 load_stats() 初始化，此處無需重置為0
+    # win_count = 0
+    # loss_count = 0
+    last_upper_band = None
+    last_lower_band = None
+    last_middle_band = None
+    
+    if not headless and not send_startup_chart(api_key, secret_key, symbol):
+        return
+
+    # 在主循環開始前，獲取一次當前持倉狀態 (返回四個值)
+    current_pos_side, current_pos_qty_str, current_pos_id, current_unrealized_pnl = get_current_position_details(api_key, secret_key, SYMBOL, MARGIN_COIN)
+    log.info("啟動時持倉狀態: side=%s, qty=%s, positionId=%s, PNL=%s", current_pos_side, current_pos_qty_str, current_pos_id, current_unrealized_pnl)
+    
+    # 開始交易前載入交易對規格 (下單路徑不必再查詢)，之後定期更新
+    instrument_specs = get_instrument_specs(api_key, secret_key)
+    instrument_specs.preload([symbol])
+    start_market_stream()
+    account_stream = start_account_stream(api_key, secret_key, {symbol: get_symbol_state()}, _stream_wake.set)
+    start_metrics_exporter()
+
+    def full_tick():
+        # 並行讀取K線、持倉與錢包餘額
+        tick_inputs = fetch_tick_inputs(api_key, secret_key, symbol, margin_coin)
         # 執行交易策略
-        execute_trading_strategy(api_key, secret_key, symbol, margin_coin, wallet_percentage, leverage, RSI_BUY, BREAKOUT_LOOKBACK, ATR_MULT)
+        execute_trading_strategy(api_key, secret_key, symbol, margin_coin, wallet_percentage, leverage, RSI_BUY, BREAKOUT_LOOKBACK, ATR_MULT, tick_inputs=tick_inputs)
+        # 未下單時直接使用本輪快照，下單後快照已失效會重新查詢
+        check_balance_or_stop()
+        report_request_counts(api_key, secret_key)
+        log.info("完整策略評估完成，下一次將在K線收盤後執行 (%s)", time.strftime('%H:%M:%S', time.localtime(scheduler.next_close() + scheduler.close_delay)))
 
-        # 檢查錢包餘額並獲取當前餘額 (用於下一次循環的數量計算)
+    def check_balance_or_stop():
         balance = check_wallet_balance(api_key, secret_key)
         if balance is None or balance <= 0:
-            print("餘額為0或無法獲取餘額，退出程序")
-            send_discord_message("🛑 **程序終止**: 餘額為0或無法獲取餘額，交易機器人已停止運行 🛑", SYMBOL, api_key, secret_key)
+            log.critical("餘額為0或無法獲取餘額，退出程序")
+            send_discord_message("🛑 **程序終止**: 餘額為0或無法獲取餘額，交易機器人已停止運行 🛑", api_key, secret_key)
             # 在退出前強制發送所有緩衝區中的消息
             flush_discord_messages()
-            print("程序已終止運行")
-            return # 直接退出main函數而不是繼續循環
-
-        # 休眠1分鐘後再次執行策略
-        # 休眠指定時間後再次執行策略
-        next_strategy_time = time.strftime('%H:%M:%S', time.localtime(time.time() + LOOP_INTERVAL_SECONDS))
-        print(f"休眠中，將在 {next_strategy_time} 再次執行交易策略 (間隔 {LOOP_INTERVAL_SECONDS} 秒)...")
-        # 在休眠前強制發送所有緩衝區中的消息
-        flush_discord_messages()
-        time.sleep(LOOP_INTERVAL_SECONDS) # 休眠1分鐘  # 每 1 分鐘檢查一次
+            log.critical("程序已終止運行")
+            tick_loop.stop()
+
+    # 完整策略只在每根K線收盤後執行一次；收盤之間每 LOOP_INTERVAL_SECONDS 秒做一次不查詢帳戶的輕量檢查，
+    # 串流偵測到開倉/平倉/移動止損條件或K線收盤時立即執行完整評估
+    scheduler = BarScheduler(TIMEFRAME)
+    tick_loop = TickLoop(
+        scheduler, full_tick,
+        light_tick=functools.partial(light_check, api_key, secret_key),
+        jobs=[PeriodicJob("balance_check", BALANCE_CHECK_INTERVAL_SECONDS, check_balance_or_stop),
+              PeriodicJob("ledger_sync", LEDGER_SYNC_INTERVAL_SECONDS, functools.partial(settle_unsettled, api_key, secret_key, get_symbol_state(symbol))),
+              PeriodicJob("instrument_specs", INSTRUMENT_SPEC_TTL_SECONDS / 2, instrument_specs.refresh)]
+             + ([PeriodicJob("account_reconcile", ACCOUNT_WS_RECONCILE_SECONDS, account_stream.reconcile)] if account_stream else []),
+        # K線即將收盤時預熱連線池，收盤後的開倉與止損請求不必再做 TCP+TLS 握手
+        prewarm=functools.partial(get_bitunix_client(api_key, secret_key).prewarm, symbol),
+        wake_event=_stream_wake)
+    tick_loop.run_forever()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bitunix 單一交易對交易機器人")
+    parser.add_argument("--headless", action="store_true", help="無介面模式: 略過啟動圖表，匯入與啟動只載入交易路徑需要的模組")
+    args = parser.parse_args()
     try:
-        main()
+        main(headless=args.headless)
     finally:
         # 確保程序結束時發送所有緩衝區中的消息
         flush_discord_messages()
@@ -1522,22 +1530,10 @@ if __name__ == "__main__":
 def send_profit_loss_to_discord(api_key, secret_key, symbol_param, message): # Renamed symbol to symbol_param
     position = get_current_position(api_key, secret_key, symbol_param)
     if position in ['long', 'short']:
-        url = "https://fapi.bitunix.com/api/v1/futures/position/get_pending_positions"
+        path = "/api/v1/futures/position/get_pending_positions"
         params = {"symbol": symbol_param} # Use symbol_param
-        nonce = uuid.uuid4().hex
-        timestamp = str(int(time.time() * 1000))
-        digest_input = nonce + timestamp + api_key + "symbol" + symbol_param # Use symbol_param
-        digest = hashlib.sha256(digest_input.encode('utf-8')).hexdigest()
-        sign = hashlib.sha256((digest + secret_key).encode('utf-8')).hexdigest()
-        headers = {
-            "api-key": api_key,
-            "sign": sign,
-            "nonce": nonce,
-            "timestamp": timestamp,
-            "Content-Type": "application/json"
-        }
         try:
-            res = requests.get(url, headers=headers, params=params)
+            res = get_bitunix_client(api_key, secret_key).get(path, params)
             data = res.json()
             if data.get("code") == 0 and data.get("data"):
                 for pos in data["data"]: